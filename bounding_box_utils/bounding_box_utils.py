@@ -49,6 +49,7 @@ def convert_coordinates(tensor, start_index, conversion, border_pixels='half'):
     Returns:
         A Numpy nD array, a copy of the input tensor with the converted coordinates
         in place of the original coordinates and the unaltered elements of the original tensor elsewhere.
+        It has the same dtype as the input tensor if that is a floating point type, and float64 otherwise.
     """
     if border_pixels == 'half':
         d = 0
@@ -60,7 +61,10 @@ def convert_coordinates(tensor, start_index, conversion, border_pixels='half'):
         raise ValueError('`border_pixels` must be one of half, include, exclude')
 
     ind = start_index
-    tensor1 = np.copy(tensor).astype(np.float)
+    # Floating point tensors keep their dtype, e.g. float32, all others are converted to float64.
+    tensor1 = np.copy(tensor)
+    if not np.issubdtype(tensor1.dtype, np.floating):
+        tensor1 = tensor1.astype(np.float)
     if conversion == 'minmax2centroids':
         # Set cx
         tensor1[..., ind] = (tensor[..., ind] + tensor[..., ind + 1]) / 2.0
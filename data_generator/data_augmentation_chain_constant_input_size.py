@@ -23,6 +23,7 @@ from data_generator.object_detection_2d_photometric_ops import ConvertColor, Con
     RandomBrightness, RandomContrast, RandomHue, RandomSaturation
 from data_generator.object_detection_2d_geometric_ops import RandomFlip, RandomTranslate, RandomScale
 from data_generator.object_detection_2d_image_boxes_validation_utils import BoxFilter, ImageValidator
+from data_generator.object_detection_2d_augmentation_log import record_or_replay
 
 
 class DataAugmentationConstantInputSize:
@@ -138,15 +139,11 @@ class DataAugmentationConstantInputSize:
 
         # If we zoom in, do translation before scaling.
         self.sequence1 = [self.convert_to_3_channels,
-                          self.convert_to_float32,
                           self.random_brightness,
                           self.random_contrast,
-                          self.convert_to_uint8,
                           self.convert_RGB_to_HSV,
-                          self.convert_to_float32,
                           self.random_saturation,
                           self.random_hue,
-                          self.convert_to_uint8,
                           self.convert_HSV_to_RGB,
                           self.random_translate,
                           self.random_zoom_in,
@@ -154,21 +151,20 @@ class DataAugmentationConstantInputSize:
 
         # If we zoom out, do scaling before translation.
         self.sequence2 = [self.convert_to_3_channels,
-                          self.convert_to_float32,
                           self.random_brightness,
                           self.random_contrast,
-                          self.convert_to_uint8,
                           self.convert_RGB_to_HSV,
-                          self.convert_to_float32,
                           self.random_saturation,
                           self.random_hue,
-                          self.convert_to_uint8,
                           self.convert_HSV_to_RGB,
                           self.convert_to_float32,
                           self.random_zoom_out,
                           self.random_translate,
                           self.random_flip]
 
+        # An optional `TransformProfiler` that records the individual steps. Set by `DataGenerator.generate()`.
+        self.profiler = None
+
     def __call__(self, image, labels=None):
         self.random_translate.labels_format = self.labels_format
         self.random_zoom_in.labels_format = self.labels_format
@@ -176,12 +172,15 @@ class DataAugmentationConstantInputSize:
         self.random_flip.labels_format = self.labels_format
 
         # Choose sequence 1 with probability 0.5.
-        if np.random.choice(2):
-            for transform in self.sequence1:
-                image, labels = transform(image, labels)
-            return image, labels
+        if record_or_replay(lambda: (np.random.choice(2),))[0]:
+            sequence = self.sequence1
         # Choose sequence 2 with probability 0.5.
         else:
-            for transform in self.sequence2:
+            sequence = self.sequence2
+        if self.profiler is None:
+            for transform in sequence:
                 image, labels = transform(image, labels)
-            return image, labels
+        else:
+            for transform in sequence:
+                image, labels = self.profiler(transform, image, labels)
+        return image, labels
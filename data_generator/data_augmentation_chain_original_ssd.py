@@ -20,12 +20,14 @@ from __future__ import division
 import numpy as np
 import cv2
 import inspect
+from functools import partial
 
 from data_generator.object_detection_2d_photometric_ops import ConvertColor, ConvertDataType, ConvertTo3Channels, \
     RandomBrightness, RandomContrast, RandomHue, RandomSaturation, RandomChannelSwap
 from data_generator.object_detection_2d_patch_sampling_ops import PatchCoordinateGenerator, RandomPatch, RandomPatchInf
 from data_generator.object_detection_2d_geometric_ops import ResizeRandomInterpolation, RandomFlip
 from data_generator.object_detection_2d_image_boxes_validation_utils import BoundGenerator, BoxFilter, ImageValidator
+from data_generator.object_detection_2d_augmentation_log import record_or_replay
 
 
 class SSDRandomCrop:
@@ -160,44 +162,40 @@ class SSDPhotometricDistortions:
         self.random_channel_swap = RandomChannelSwap(prob=0.0)
 
         self.sequence1 = [self.convert_to_3_channels,
-                          self.convert_to_float32,
                           self.random_brightness,
                           self.random_contrast,
-                          self.convert_to_uint8,
                           self.convert_RGB_to_HSV,
-                          self.convert_to_float32,
                           self.random_saturation,
                           self.random_hue,
-                          self.convert_to_uint8,
                           self.convert_HSV_to_RGB,
                           self.random_channel_swap]
 
         self.sequence2 = [self.convert_to_3_channels,
-                          self.convert_to_float32,
                           self.random_brightness,
-                          self.convert_to_uint8,
                           self.convert_RGB_to_HSV,
-                          self.convert_to_float32,
                           self.random_saturation,
                           self.random_hue,
-                          self.convert_to_uint8,
                           self.convert_HSV_to_RGB,
-                          self.convert_to_float32,
                           self.random_contrast,
-                          self.convert_to_uint8,
                           self.random_channel_swap]
 
+        # An optional `TransformProfiler` that records the individual steps. Set by `DataGenerator.generate()`.
+        self.profiler = None
+
     def __call__(self, image, labels):
         # Choose sequence 1 with probability 0.5.
-        if np.random.choice(2):
-            for transform in self.sequence1:
-                image, labels = transform(image, labels)
-            return image, labels
+        if record_or_replay(lambda: (np.random.choice(2),))[0]:
+            sequence = self.sequence1
         # Choose sequence 2 with probability 0.5.
         else:
-            for transform in self.sequence2:
+            sequence = self.sequence2
+        if self.profiler is None:
+            for transform in sequence:
                 image, labels = transform(image, labels)
-            return image, labels
+        else:
+            for transform in sequence:
+                image, labels = self.profiler(transform, image, labels)
+        return image, labels
 
 
 class SSDDataAugmentation:
@@ -251,19 +249,24 @@ class SSDDataAugmentation:
                          self.random_flip,
                          self.resize]
 
+        # An optional `TransformProfiler` that records the individual steps. Set by `DataGenerator.generate()`.
+        self.profiler = None
+
     def __call__(self, image, labels, return_inverter=False):
         self.expand.labels_format = self.labels_format
         self.random_crop.labels_format = self.labels_format
         self.random_flip.labels_format = self.labels_format
         self.resize.labels_format = self.labels_format
+        self.photometric_distortions.profiler = self.profiler
 
         inverters = []
         for transform in self.sequence:
+            call_transform = transform if self.profiler is None else partial(self.profiler, transform)
             if return_inverter and ('return_inverter' in inspect.signature(transform).parameters):
-                image, labels, inverter = transform(image, labels, return_inverter=True)
+                image, labels, inverter = call_transform(image, labels, return_inverter=True)
                 inverters.append(inverter)
             else:
-                image, labels = transform(image, labels)
+                image, labels = call_transform(image, labels)
         if return_inverter:
             return image, labels, inverters[::-1]
         else:
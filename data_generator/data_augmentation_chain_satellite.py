@@ -21,7 +21,7 @@ from __future__ import division
 import numpy as np
 
 from data_generator.object_detection_2d_photometric_ops import ConvertColor, ConvertDataType, ConvertTo3Channels, RandomBrightness, RandomContrast, RandomHue, RandomSaturation
-from data_generator.object_detection_2d_geometric_ops import Resize, RandomFlip, RandomRotate
+from data_generator.object_detection_2d_geometric_ops import Resize, RandomFlip, RandomRotate, RandomAffine
 from data_generator.object_detection_2d_patch_sampling_ops import PatchCoordinateGenerator, RandomPatch
 from data_generator.object_detection_2d_image_boxes_validation_utils import BoxFilter, ImageValidator
 
@@ -43,6 +43,7 @@ class DataAugmentationSatellite:
                  random_hue=(18, 0.5),
                  random_flip=0.5,
                  random_rotate=([90, 180, 270], 0.5),
+                 random_affine=None,
                  min_scale=0.3,
                  max_scale=2.0,
                  min_aspect_ratio = 0.8,
@@ -54,7 +55,12 @@ class DataAugmentationSatellite:
                  bounds_validator=(0.5, 1.0),
                  n_boxes_min=1,
                  background=(0,0,0),
-                 labels_format={'class_id': 0, 'xmin': 1, 'ymin': 2, 'xmax': 3, 'ymax': 4}):
+                 labels_format=('class_id', 'xmin', 'ymin', 'xmax', 'ymax')):
+        '''
+        `random_affine` is either `None` or a 4-tuple `(angle_range, shear_range, scale_range, prob)` that enables
+        rotations by arbitrary angles, shearing and scaling with `RandomAffine` after the rotations by multiples of
+        90 degrees. The other arguments are passed on to the respective transformations.
+        '''
 
         self.n_trials_max = n_trials_max
         self.clip_boxes = clip_boxes
@@ -81,7 +87,7 @@ class DataAugmentationSatellite:
 
         # Determines whether the result of the transformations is a valid training image.
         self.image_validator = ImageValidator(overlap_criterion=self.overlap_criterion,
-                                              bounds=self.bounds_validator,
+                                              overlap_bounds=self.bounds_validator,
                                               n_boxes_min=self.n_boxes_min,
                                               labels_format=self.labels_format)
 
@@ -106,6 +112,19 @@ class DataAugmentationSatellite:
         self.random_horizontal_flip = RandomFlip(dim='horizontal', prob=random_flip, labels_format=self.labels_format)
         self.random_vertical_flip   = RandomFlip(dim='vertical', prob=random_flip, labels_format=self.labels_format)
         self.random_rotate          = RandomRotate(angles=random_rotate[0], prob=random_rotate[1], labels_format=self.labels_format)
+        if random_affine is None:
+            self.random_affine      = None
+        else:
+            self.random_affine      = RandomAffine(angle_range=random_affine[0],
+                                                   shear_range=random_affine[1],
+                                                   scale_range=random_affine[2],
+                                                   prob=random_affine[3],
+                                                   clip_boxes=self.clip_boxes,
+                                                   box_filter=self.box_filter_patch,
+                                                   image_validator=self.image_validator,
+                                                   n_trials_max=self.n_trials_max,
+                                                   background=self.background,
+                                                   labels_format=self.labels_format)
         self.patch_coord_generator  = PatchCoordinateGenerator(must_match='w_ar',
                                                                min_scale=min_scale,
                                                                max_scale=max_scale,
@@ -123,21 +142,19 @@ class DataAugmentationSatellite:
 
         # Define the processing chain.
         self.transformations = [self.convert_to_3_channels,
-                                self.convert_to_float32,
                                 self.random_brightness,
                                 self.random_contrast,
-                                self.convert_to_uint8,
                                 self.convert_RGB_to_HSV,
-                                self.convert_to_float32,
                                 self.random_saturation,
                                 self.random_hue,
-                                self.convert_to_uint8,
                                 self.convert_HSV_to_RGB,
                                 self.random_horizontal_flip,
                                 self.random_vertical_flip,
                                 self.random_rotate,
                                 self.random_patch,
                                 self.resize]
+        if self.random_affine is not None:
+            self.transformations.insert(self.transformations.index(self.random_rotate) + 1, self.random_affine)
 
     def __call__(self, image, labels=None):
 
@@ -145,6 +162,8 @@ class DataAugmentationSatellite:
         self.random_horizontal_flip.labels_format = self.labels_format
         self.random_vertical_flip.labels_format = self.labels_format
         self.random_rotate.labels_format = self.labels_format
+        if self.random_affine is not None:
+            self.random_affine.labels_format = self.labels_format
         self.resize.labels_format = self.labels_format
 
         if not (labels is None):
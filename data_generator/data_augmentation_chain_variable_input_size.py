@@ -122,15 +122,11 @@ class DataAugmentationVariableInputSize:
 
         # Define the processing chain
         self.transformations = [self.convert_to_3_channels,
-                                self.convert_to_float32,
                                 self.random_brightness,
                                 self.random_contrast,
-                                self.convert_to_uint8,
                                 self.convert_RGB_to_HSV,
-                                self.convert_to_float32,
                                 self.random_saturation,
                                 self.random_hue,
-                                self.convert_to_uint8,
                                 self.convert_HSV_to_RGB,
                                 self.random_patch,
                                 self.random_flip,
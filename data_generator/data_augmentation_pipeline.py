@@ -0,0 +1,580 @@
+"""
+Declarative descriptions of data augmentation chains and a compiler that turns them into optimized execution plans.
+
+A pipeline is described as a list of steps, where each step is a dictionary with a `type` key that names one of the
+transformations in the `object_detection_2d_*_ops` modules and the keyword arguments for its constructor, for example:
+
+    [{'type': 'ConvertTo3Channels'},
+     {'type': 'ConvertDataType', 'to': 'float32'},
+     {'type': 'RandomBrightness', 'lower': -32, 'upper': 32, 'prob': 0.5},
+     {'type': 'RandomContrast', 'lower': 0.5, 'upper': 1.5, 'prob': 0.5},
+     {'type': 'ConvertDataType', 'to': 'uint8'},
+     {'type': 'RandomFlip', 'dim': 'horizontal', 'prob': 0.5},
+     {'type': 'Resize', 'height': 300, 'width': 300, 'interpolation_mode': 'cv2.INTER_LINEAR',
+      'box_filter': {'type': 'BoxFilter', 'check_overlap': False, 'check_min_area': False, 'check_degenerate': True}}]
+
+The same description can be given as a dictionary with a `transformations` key (and optionally a `labels_format` key),
+as a JSON or YAML string, or as the path to a JSON or YAML file. Constructor arguments that are themselves
+dictionaries with a `type` key are instantiated recursively, and strings of the form 'cv2.NAME' are resolved to the
+respective OpenCV constants. A step of type 'OneOf' randomly picks one of several sub-pipelines per image.
+
+`compile_pipeline()` drops no-op conversions and fuses point-wise photometric transformations, see
+`AugmentationPipeline`. Geometric transformations are executed as written: apart from cancelling pairs of identical
+deterministic flips, they are neither reordered nor merged, so boxes go through every geometric step of the
+description. Merging e.g. two resizes would skip the resampling and the box filter of the first one and change the
+outputs.
+
+Copyright (C) 2018 Pierluigi Ferrari
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from __future__ import division
+import numpy as np
+import cv2
+import inspect
+import json
+import os
+from copy import deepcopy
+from functools import partial
+
+from data_generator import object_detection_2d_photometric_ops as photometric_ops
+from data_generator import object_detection_2d_geometric_ops as geometric_ops
+from data_generator import object_detection_2d_patch_sampling_ops as patch_sampling_ops
+from data_generator import object_detection_2d_image_boxes_validation_utils as validation_utils
+from data_generator.object_detection_2d_augmentation_log import record_or_replay
+
+
+def _collect_classes(*modules):
+    classes = {}
+    for module in modules:
+        for name, cls in inspect.getmembers(module, inspect.isclass):
+            if cls.__module__ == module.__name__:
+                classes[name] = cls
+    return classes
+
+
+# All transformations (and their helper objects) that can be referenced by name in a pipeline description.
+TRANSFORMATIONS = _collect_classes(photometric_ops, geometric_ops, patch_sampling_ops, validation_utils)
+PHOTOMETRIC_TRANSFORMATIONS = frozenset(_collect_classes(photometric_ops))
+
+# Photometric transformations that apply the same scalar function to every channel of every pixel of an RGB image.
+# Any sequence of them can be evaluated once on the 256 possible pixel values and then applied as a lookup table.
+POINTWISE_TRANSFORMATIONS = frozenset(['Brightness', 'RandomBrightness', 'Contrast', 'RandomContrast'])
+# Point-wise transformations that map `uint8` images to `uint8` images.
+UINT8_POINTWISE_TRANSFORMATIONS = POINTWISE_TRANSFORMATIONS | {'Gamma', 'RandomGamma'}
+
+
+def load_pipeline_spec(spec):
+    """
+    Normalizes a pipeline description into a dictionary with the keys `transformations` and `labels_format`.
+
+    Arguments:
+        spec (list/dict/str): Either a list of step dictionaries, a dictionary with a `transformations` key,
+            a JSON or YAML string, or the path to a JSON or YAML file. Loading YAML requires PyYAML.
+
+    Returns:
+        A dictionary with the keys `transformations` (a list of step dictionaries) and `labels_format`
+        (a tuple or `None`).
+    """
+    if isinstance(spec, str):
+        if os.path.isfile(spec):
+            with open(spec, 'r') as f:
+                text = f.read()
+            is_json = spec.endswith('.json')
+        else:
+            text = spec
+            is_json = text.lstrip().startswith(('[', '{'))
+        if is_json:
+            spec = json.loads(text)
+        else:
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("Loading YAML pipeline descriptions requires PyYAML. "
+                                  "Either install it or describe the pipeline as a list/dict or as JSON.")
+            spec = yaml.safe_load(text)
+
+    if isinstance(spec, (list, tuple)):
+        spec = {'transformations': list(spec)}
+    if not (isinstance(spec, dict) and 'transformations' in spec):
+        raise ValueError("A pipeline description must be a list of steps or a dictionary with a `transformations` key.")
+    labels_format = spec.get('labels_format', None)
+    return {'transformations': list(spec['transformations']),
+            'labels_format': None if labels_format is None else tuple(labels_format)}
+
+
+def _build_value(value):
+    """
+    Recursively instantiates nested objects in the constructor arguments of a pipeline step.
+    """
+    if isinstance(value, dict) and 'type' in value:
+        return _build_object(value)
+    elif isinstance(value, (list, tuple)):
+        return type(value)(_build_value(v) for v in value)
+    elif isinstance(value, str) and value.startswith('cv2.'):
+        if not hasattr(cv2, value[4:]):
+            raise ValueError("Unknown OpenCV constant '{}'.".format(value))
+        return getattr(cv2, value[4:])
+    else:
+        return value
+
+
+def _build_object(step):
+    kwargs = dict(step)
+    name = kwargs.pop('type')
+    if name not in TRANSFORMATIONS:
+        raise ValueError("Unknown transformation type '{}'. Valid types are: {}.".format(name,
+                                                                                       sorted(TRANSFORMATIONS)))
+    kwargs = {key: _build_value(value) for key, value in kwargs.items()}
+    if 'labels_format' in kwargs and kwargs['labels_format'] is not None:
+        kwargs['labels_format'] = tuple(kwargs['labels_format'])
+    return TRANSFORMATIONS[name](**kwargs)
+
+
+def _build_steps(steps, labels_format):
+    built = []
+    for step in steps:
+        if not (isinstance(step, dict) and 'type' in step):
+            raise ValueError("Every pipeline step must be a dictionary with a `type` key, but received {}.".format(step))
+        if step['type'] == 'OneOf':
+            branches = [_build_steps(branch, labels_format) for branch in step['branches']]
+            built.append(OneOf(branches=branches, weights=step.get('weights', None), labels_format=labels_format))
+        else:
+            step = dict(step)
+            if (labels_format is not None) and ('labels_format' not in step) and \
+                    ('labels_format' in inspect.signature(TRANSFORMATIONS[step['type']]).parameters):
+                step['labels_format'] = labels_format
+            built.append(_build_object(step))
+    return built
+
+
+class FusedPointwiseOps:
+    """
+    Applies a sequence of point-wise photometric transformations to `uint8` images through a single lookup table.
+
+    If `float_intermediate` is `True`, the wrapped transformations (see `POINTWISE_TRANSFORMATIONS`) are evaluated once
+    on the 256 possible pixel values as `float32`, exactly like a `ConvertDataType('float32')` -> transformations ->
+    `ConvertDataType('uint8')` sequence would evaluate them per pixel. Otherwise the wrapped transformations (see
+    `UINT8_POINTWISE_TRANSFORMATIONS`) are applied to the 256 possible `uint8` pixel values one after the other, which
+    composes their lookup tables. Either way, the resulting table is applied with `cv2.LUT()`. The random
+    transformations sample their parameters once per call, so the result is identical to the unfused sequence.
+    Input of any other data type falls back to the unfused sequence.
+    """
+
+    def __init__(self, transformations, float_intermediate=True):
+        """
+        Arguments:
+            transformations (list): The point-wise transformations in the order in which they are to be applied.
+            float_intermediate (bool, optional): Whether the unfused sequence converts the images to `float32` before
+                and back to `uint8` after the transformations.
+        """
+        self.transformations = list(transformations)
+        self.float_intermediate = float_intermediate
+        self.convert_to_float32 = photometric_ops.ConvertDataType(to='float32')
+        self.convert_to_uint8 = photometric_ops.ConvertDataType(to='uint8')
+        self.values = np.arange(256, dtype=np.float32 if float_intermediate else np.uint8)
+
+    def __call__(self, image, labels=None):
+        if image.dtype == np.uint8:
+            table = self.values
+            for transform in self.transformations:
+                table, _ = transform(table)
+            if self.float_intermediate:
+                table = np.round(table, decimals=0).astype(np.uint8)
+            return cv2.LUT(image, table), labels
+        if self.float_intermediate:
+            image, labels = self.convert_to_float32(image, labels)
+        for transform in self.transformations:
+            image, labels = transform(image, labels)
+        if self.float_intermediate:
+            return self.convert_to_uint8(image, labels)
+        return image, labels
+
+
+class OneOf:
+    """
+    Randomly applies one of several compiled sub-pipelines.
+    """
+
+    def __init__(self,
+                 branches,
+                 weights=None,
+                 labels_format=None):
+        """
+        Arguments:
+            branches (list): A list of lists of transformations.
+            weights (list/tuple, optional): The probabilities with which the respective branches are chosen.
+                If `None`, all branches are equally likely.
+            labels_format (list/tuple, optional): If not `None`, overrides the `labels_format` of all transformations
+                in the branches before they are called.
+        """
+        if weights is not None and len(weights) != len(branches):
+            raise ValueError("`weights` must contain one weight per branch.")
+        self.branches = [_Plan(branch) for branch in branches]
+        self.weights = None if weights is None else np.asarray(weights, dtype=np.float64) / np.sum(weights)
+        self.labels_format = labels_format
+        self.profiler = None
+
+    def __call__(self, image, labels=None, return_inverter=False):
+        index = record_or_replay(lambda: (np.random.choice(len(self.branches), p=self.weights),))[0]
+        branch = self.branches[int(index)]
+        return branch.run(image, labels, self.labels_format, return_inverter, self.profiler)
+
+
+class _Plan:
+    """
+    A flat list of transformations together with the precomputed knowledge of which of them support
+    `return_inverter`.
+    """
+
+    def __init__(self, steps):
+        self.steps = list(steps)
+        self.invertible = [('return_inverter' in inspect.signature(step).parameters) for step in self.steps]
+        self.has_labels_format = [hasattr(step, 'labels_format') for step in self.steps]
+
+    def run(self, image, labels, labels_format, return_inverter, profiler=None):
+        inverters = []
+        for step, invertible, has_labels_format in zip(self.steps, self.invertible, self.has_labels_format):
+            if has_labels_format and labels_format is not None:
+                step.labels_format = labels_format
+            if isinstance(step, OneOf):
+                step.profiler = profiler
+            if profiler is not None:
+                step = partial(profiler, step)
+            if return_inverter and invertible:
+                result = step(image, labels, return_inverter=True)
+                image, labels = result[0], result[1]
+                if len(result) == 3:
+                    if isinstance(result[2], list):
+                        inverters.extend(result[2][::-1])
+                    else:
+                        inverters.append(result[2])
+            else:
+                image, labels = step(image, labels)
+        if return_inverter:
+            return image, labels, inverters[::-1]
+        return image, labels
+
+
+def _step_name(step):
+    if isinstance(step, FusedPointwiseOps):
+        return 'FusedPointwiseOps({})'.format(', '.join(type(t).__name__ for t in step.transformations))
+    elif isinstance(step, OneOf):
+        return 'OneOf({} branches)'.format(len(step.branches))
+    return type(step).__name__
+
+
+def _is_noop(step):
+    # Random transformations that are never applied.
+    return type(step).__name__.startswith('Random') and getattr(step, 'prob', None) is not None and step.prob <= 0
+
+
+def _optimize(steps, input_dtype, notes):
+    """
+    Runs the optimization passes over a flat list of steps. `input_dtype` is the data type of the images that enter
+    the steps ('uint8', 'float32' or `None` if unknown). Returns the optimized steps and the output data type.
+    """
+    for step in steps:
+        if isinstance(step, OneOf):
+            step.branches = [_Plan(_optimize(branch.steps, input_dtype, notes)[0]) for branch in step.branches]
+    steps = _drop_noops(steps, input_dtype, notes)
+    steps = _fuse_pointwise(steps, input_dtype, notes)
+    steps = _order_geometric(steps, notes)
+    return steps, _propagate_dtype(steps, input_dtype)
+
+
+def _next_dtype(step, dtype):
+    name = type(step).__name__
+    if name == 'ConvertDataType':
+        return step.to
+    elif isinstance(step, OneOf):
+        return None
+    return dtype
+
+
+def _propagate_dtype(steps, dtype):
+    for step in steps:
+        dtype = _next_dtype(step, dtype)
+    return dtype
+
+
+def _drop_noops(steps, dtype, notes):
+    result = []
+    # `dtypes[k]` is the data type of the images after the first `k` kept steps.
+    dtypes = [dtype]
+    three_channels = False
+    for step in steps:
+        name = type(step).__name__
+        if _is_noop(step):
+            notes.append("dropped {} (prob <= 0)".format(name))
+            continue
+        if name == 'ConvertTo3Channels':
+            if three_channels:
+                notes.append("dropped repeated ConvertTo3Channels")
+                continue
+            three_channels = True
+        elif (name == 'ConvertColor' and step.to == 'GRAY' and not step.keep_3ch) or isinstance(step, OneOf):
+            three_channels = False
+        elif name == 'ConvertDataType':
+            if step.to == dtypes[-1]:
+                notes.append("dropped ConvertDataType to '{}' (already '{}')".format(step.to, dtypes[-1]))
+                continue
+            # A uint8 -> float32 -> uint8 round trip without anything in between is the identity.
+            if step.to == 'uint8' and result and type(result[-1]).__name__ == 'ConvertDataType' and \
+                    result[-1].to == 'float32' and dtypes[-2] == 'uint8':
+                result.pop()
+                dtypes.pop()
+                notes.append("dropped ConvertDataType round trip 'uint8' -> 'float32' -> 'uint8'")
+                continue
+        result.append(step)
+        dtypes.append(_next_dtype(step, dtypes[-1]))
+    return result
+
+
+def _fuse_pointwise(steps, dtype, notes):
+    result = []
+    i = 0
+    while i < len(steps):
+        step = steps[i]
+        name = type(step).__name__
+        if dtype == 'uint8' and name == 'ConvertDataType' and step.to == 'float32':
+            j = i + 1
+            while j < len(steps) and type(steps[j]).__name__ in POINTWISE_TRANSFORMATIONS:
+                j += 1
+            if j > i + 1 and j < len(steps) and type(steps[j]).__name__ == 'ConvertDataType' and steps[j].to == 'uint8':
+                fused = FusedPointwiseOps(steps[i + 1:j], float_intermediate=True)
+                result.append(fused)
+                notes.append("fused {} into a single lookup table".format(
+                    ', '.join(type(t).__name__ for t in fused.transformations)))
+                i = j + 1
+                continue
+        elif dtype == 'uint8' and name in UINT8_POINTWISE_TRANSFORMATIONS:
+            j = i + 1
+            while j < len(steps) and type(steps[j]).__name__ in UINT8_POINTWISE_TRANSFORMATIONS:
+                j += 1
+            if j > i + 1:
+                fused = FusedPointwiseOps(steps[i:j], float_intermediate=False)
+                result.append(fused)
+                notes.append("composed the lookup tables of {}".format(
+                    ', '.join(type(t).__name__ for t in fused.transformations)))
+                i = j
+                continue
+        result.append(step)
+        dtype = _next_dtype(step, dtype)
+        i += 1
+    return result
+
+
+def _order_geometric(steps, notes):
+    # Photometric transformations commute with flips, since flips only permute pixels. Moving them in front of
+    # the flips brings flips next to each other so that pairs of them can cancel out below.
+    steps = list(steps)
+    moved = True
+    while moved:
+        moved = False
+        for i in range(len(steps) - 1):
+            if type(steps[i]).__name__ in ('Flip', 'RandomFlip') and \
+                    type(steps[i + 1]).__name__ in PHOTOMETRIC_TRANSFORMATIONS | {'FusedPointwiseOps'}:
+                steps[i], steps[i + 1] = steps[i + 1], steps[i]
+                moved = True
+
+    result = []
+    for step in steps:
+        name = type(step).__name__
+        previous = type(result[-1]).__name__ if result else None
+        if name == 'Flip' and previous == 'Flip' and result[-1].dim == step.dim:
+            # Two identical deterministic flips cancel out.
+            result.pop()
+            notes.append("removed a pair of '{}' flips that cancel out".format(step.dim))
+            continue
+        # Consecutive resizes are deliberately not merged: the first one determines the resampled pixels and may
+        # filter boxes with its `box_filter`, so dropping it would change the outputs.
+        result.append(step)
+    return result
+
+
+# Rough number of full passes over the input and output images that a transformation makes, used by the
+# cost estimate. Transformations that are not listed are assumed to read their input and write their output once.
+_PASSES = {'ConvertDataType': (1, 2),
+           'ConvertColor': (1, 1),
+           'Brightness': (2, 2),
+           'RandomBrightness': (2, 2),
+           'Contrast': (3, 3),
+           'RandomContrast': (3, 3),
+           'Hue': (1 / 3, 2 / 3),
+           'RandomHue': (1 / 3, 2 / 3),
+           'Saturation': (2 / 3, 2 / 3),
+           'RandomSaturation': (2 / 3, 2 / 3),
+           'FusedPointwiseOps': (1, 1),
+           'Gamma': (1, 1),
+           'RandomGamma': (1, 1)}
+
+_ITEMSIZE = {'uint8': 1, 'float32': 4, 'float64': 8}
+
+
+class AugmentationPipeline:
+    """
+    An execution plan compiled from a declarative pipeline description. See the module documentation for the
+    description format.
+
+    The compiler applies the following optimizations, all of which leave the distribution of the outputs unchanged:
+
+    1. Random transformations with `prob <= 0`, repeated `ConvertTo3Channels`, conversions to the data type that the
+       images already have, and `uint8` -> `float32` -> `uint8` round trips are dropped.
+    2. Adjacent point-wise photometric transformations that are wrapped in a `uint8` -> `float32` -> `uint8` round trip
+       are fused into a single lookup table (see `FusedPointwiseOps`), which also removes the round trip. Adjacent
+       point-wise transformations on `uint8` images get their lookup tables composed.
+    3. Photometric transformations are moved in front of adjacent flips, and pairs of identical deterministic flips
+       cancel out. All other geometric transformations stay as written and are not merged, since each of them
+       resamples the image and may filter boxes.
+
+    Note that dropping random transformations that are never applied changes the sequence of random numbers that is
+    consumed, so a compiled pipeline does not reproduce the outputs of the uncompiled one for a given seed.
+    """
+
+    def __init__(self,
+                 spec,
+                 optimize=True,
+                 input_dtype='uint8',
+                 labels_format=None):
+        """
+        Arguments:
+            spec (list/dict/str): The pipeline description. See `load_pipeline_spec()`.
+            optimize (bool, optional): If `False`, the transformations are executed exactly as described.
+            input_dtype (str, optional): The data type of the input images, either 'uint8', 'float32' or `None` if
+                unknown. Images produced by `DataGenerator` are 'uint8'. Optimizations that depend on the data type are
+                only applied if it is known.
+            labels_format (list/tuple, optional): If not `None`, overrides the labels format of the description. Like
+                for the other transformations, `DataGenerator.generate()` overwrites this attribute.
+        """
+        if input_dtype not in {'uint8', 'float32', None}:
+            raise ValueError("`input_dtype` must be one of 'uint8', 'float32' or `None`.")
+        spec = load_pipeline_spec(spec)
+        self.spec = deepcopy(spec)
+        self.labels_format = labels_format if labels_format is not None else spec['labels_format']
+        self.input_dtype = input_dtype
+        self.notes = []
+
+        steps = _build_steps(spec['transformations'], self.labels_format)
+        self.output_dtype = _propagate_dtype(steps, input_dtype)
+        if optimize:
+            steps, self.output_dtype = _optimize(steps, input_dtype, self.notes)
+        self.plan = _Plan(steps)
+        # An optional `TransformProfiler` that records the individual steps. Set by `DataGenerator.generate()`.
+        self.profiler = None
+
+    @property
+    def steps(self):
+        return self.plan.steps
+
+    def __call__(self, image, labels=None, return_inverter=False):
+        return self.plan.run(image, labels, self.labels_format, return_inverter, self.profiler)
+
+    def describe(self):
+        """
+        Returns a human-readable description of the compiled plan and the optimizations that were applied.
+        """
+        lines = ['{:>3}  {}'.format(i, _step_name(step)) for i, step in enumerate(self.steps)]
+        if self.notes:
+            lines.append('Optimizations:')
+            lines.extend('  - ' + note for note in self.notes)
+        return '\n'.join(lines)
+
+    def estimate_cost(self, image_height, image_width, n_channels=3):
+        """
+        Estimates the memory traffic of every step of the plan for an input image of the given size.
+
+        The estimate is based on the number of passes over the image data that each transformation makes and on the
+        data types flowing through the plan. For random transformations, the expected cost is the cost of applying
+        the transformation weighted by its probability. Geometric transformations are assumed to preserve the image
+        size, except for resizes.
+
+        Arguments:
+            image_height (int): The height of the input images.
+            image_width (int): The width of the input images.
+            n_channels (int, optional): The number of channels of the input images.
+
+        Returns:
+            A list that contains one dictionary per step with the keys 'step', 'dtype', 'output_shape', 'bytes' (the
+            estimated number of bytes read and written if the step is applied) and 'expected_bytes'.
+        """
+        return self._estimate_cost(self.steps, (image_height, image_width, n_channels), self.input_dtype or 'uint8')[0]
+
+    def _estimate_cost(self, steps, shape, dtype):
+        report = []
+        for step in steps:
+            name = type(step).__name__
+            if isinstance(step, OneOf):
+                branch_costs = [self._estimate_cost(branch.steps, shape, dtype) for branch in step.branches]
+                weights = step.weights if step.weights is not None else np.full(len(branch_costs), 1 / len(branch_costs))
+                expected = sum(w * sum(row['expected_bytes'] for row in cost[0]) for w, cost in zip(weights, branch_costs))
+                total = max(sum(row['bytes'] for row in cost[0]) for cost in branch_costs)
+                shape, dtype = branch_costs[0][1], branch_costs[0][2]
+                report.append({'step': _step_name(step), 'dtype': dtype, 'output_shape': shape,
+                               'bytes': int(total), 'expected_bytes': int(expected)})
+                continue
+            out_dtype = _next_dtype(step, dtype) or dtype
+            out_shape = shape
+            if name == 'Resize':
+                out_shape = (step.out_height, step.out_width, shape[2])
+            elif name == 'ResizeRandomInterpolation':
+                out_shape = (step.height, step.width, shape[2])
+            elif name == 'ConvertTo3Channels':
+                out_shape = shape[:2] + (3,)
+            n_in = shape[0] * shape[1] * shape[2] * _ITEMSIZE.get(dtype, 8)
+            n_out = out_shape[0] * out_shape[1] * out_shape[2] * _ITEMSIZE.get(out_dtype, 8)
+            passes_in, passes_out = _PASSES.get(name, (1, 1))
+            if dtype == 'uint8' and name in UINT8_POINTWISE_TRANSFORMATIONS:
+                # Applied through a lookup table.
+                passes_in, passes_out = 1, 1
+            if name == 'ConvertTo3Channels' and shape[2] == 3:
+                passes_in, passes_out = 0, 0
+            cost = passes_in * n_in + passes_out * n_out
+            prob = getattr(step, 'prob', None)
+            expected = cost if (prob is None or not name.startswith('Random')) else prob * cost
+            report.append({'step': _step_name(step), 'dtype': out_dtype, 'output_shape': out_shape,
+                           'bytes': int(cost), 'expected_bytes': int(expected)})
+            shape, dtype = out_shape, out_dtype
+        return report, shape, dtype
+
+    def cost_summary(self, image_height, image_width, n_channels=3):
+        """
+        Returns the result of `estimate_cost()` formatted as a table.
+        """
+        report = self.estimate_cost(image_height, image_width, n_channels)
+        width = max([len(row['step']) for row in report] + [4])
+        lines = ['{:<{w}}  {:>8}  {:>16}  {:>12}  {:>14}'.format('step', 'dtype', 'output shape', 'MB', 'expected MB',
+                                                                  w=width)]
+        for row in report:
+            lines.append('{:<{w}}  {:>8}  {:>16}  {:>12.2f}  {:>14.2f}'.format(row['step'], str(row['dtype']),
+                                                                                str(row['output_shape']),
+                                                                                row['bytes'] / 1e6,
+                                                                                row['expected_bytes'] / 1e6,
+                                                                                w=width))
+        lines.append('{:<{w}}  {:>8}  {:>16}  {:>12.2f}  {:>14.2f}'.format(
+            'total', '', '', sum(row['bytes'] for row in report) / 1e6,
+            sum(row['expected_bytes'] for row in report) / 1e6, w=width))
+        return '\n'.join(lines)
+
+
+def compile_pipeline(spec, optimize=True, input_dtype='uint8', labels_format=None):
+    """
+    Compiles a pipeline description into an `AugmentationPipeline`. The result can be passed to
+    `DataGenerator.generate()` like any other transformation.
+
+    The optimizations only concern conversions, photometric transformations and flips. Geometric steps such as
+    resizes, crops or affine transformations are kept as written and are not merged, so their boxes are transformed
+    once per step, exactly like in the uncompiled chain.
+    """
+    return AugmentationPipeline(spec, optimize=optimize, input_dtype=input_dtype, labels_format=labels_format)
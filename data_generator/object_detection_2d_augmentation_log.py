@@ -0,0 +1,151 @@
+"""
+Recording and replaying the random parameters of data augmentation.
+
+While an `AugmentationLog` is recording, every random transformation stores the parameters it sampled for a sample,
+e.g. whether it was applied at all, the brightness delta or the coordinates of the accepted patch. While the log is
+replaying, the transformations apply the stored parameters instead of sampling new ones, which also skips any
+rejection sampling. Pass the log as the `augmentation_log` argument of `DataGenerator.generate()`.
+
+Copyright (C) 2018 Pierluigi Ferrari
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from __future__ import division
+import numpy as np
+
+# The log that the random transformations currently record to or replay from, if any.
+_active_log = None
+
+
+def record_or_replay(sample):
+    """
+    Returns the parameters of a random transformation for the current sample.
+
+    Random transformations call this function with a function that samples their parameters and returns them as a
+    tuple of numbers, or `None` if the transformation is not applied. If no log is active, `sample()` is returned.
+    If a log is recording, the result of `sample()` is recorded before it is returned. If a log is replaying, the next
+    recorded parameters of the current sample are returned as a tuple of floats without calling `sample()`, so the
+    transformations have to convert integer parameters back themselves.
+    """
+    if _active_log is None:
+        return sample()
+    return _active_log.next_parameters(sample)
+
+
+class AugmentationLog:
+    """
+    Stores the sampled parameters of all random transformations per epoch and sample in a compact binary file.
+
+    The parameters of a sample are looked up by the epoch and the index of the sample in the dataset, so replaying
+    does not depend on the order of the samples. A replayed run must use the same transformations in the same order as
+    the recorded run, since the parameters are consumed in the order in which the transformations ask for them.
+
+    Only the per-sample `transformations` of `DataGenerator.generate()` are recorded. Batch transformations and the
+    additional samples they load are sampled anew in either mode.
+    """
+
+    def __init__(self, mode='record'):
+        """
+        Arguments:
+            mode (str, optional): Either 'record' or 'replay'. Use `load()` to get a log to replay.
+        """
+        if mode not in {'record', 'replay'}:
+            raise ValueError("`mode` must be either 'record' or 'replay'.")
+        self.mode = mode
+        # Maps `(epoch, index)` to a list of parameter tuples, where `None` means that a transformation was not applied.
+        self.records = {}
+        self._current = None
+        self._position = 0
+
+    def begin(self, epoch, index):
+        """
+        Makes this the active log for the given sample, so the random transformations that are called until `end()`
+        record or replay the parameters of this sample.
+
+        Arguments:
+            epoch (int): The number of complete passes over the dataset before this one.
+            index (int): The index of the sample in the dataset, independent of any shuffling.
+        """
+        global _active_log
+        key = (int(epoch), int(index))
+        if self.mode == 'record':
+            self._current = []
+            self.records[key] = self._current
+        else:
+            if key not in self.records:
+                raise ValueError("The log contains no parameters for epoch {} and sample {}.".format(*key))
+            self._current = self.records[key]
+        self._position = 0
+        _active_log = self
+
+    def end(self):
+        """
+        Deactivates the log.
+        """
+        global _active_log
+        _active_log = None
+        self._current = None
+
+    def next_parameters(self, sample):
+        if self.mode == 'record':
+            parameters = sample()
+            self._current.append(None if parameters is None else tuple(parameters))
+            return parameters
+        if self._position >= len(self._current):
+            raise ValueError("The transformations ask for more parameters than were recorded for this sample. "
+                             "Use the same transformations as in the recorded run.")
+        parameters = self._current[self._position]
+        self._position += 1
+        return parameters
+
+    def save(self, filepath):
+        """
+        Writes the log to a compressed `.npz` file. The parameters of all samples are stored as one flat `float64`
+        array along with the number of parameters of every record (-1 for a transformation that was not applied) and
+        the number of records of every sample.
+        """
+        keys = sorted(self.records)
+        records = [self.records[key] for key in keys]
+        lengths = [-1 if parameters is None else len(parameters) for sample in records for parameters in sample]
+        values = [value for sample in records for parameters in sample if parameters is not None for value in parameters]
+        np.savez_compressed(filepath,
+                            keys=np.array(keys, dtype=np.int64).reshape(-1, 2),
+                            n_records=np.array([len(sample) for sample in records], dtype=np.int64),
+                            lengths=np.array(lengths, dtype=np.int64),
+                            values=np.array(values, dtype=np.float64))
+
+    @classmethod
+    def load(cls, filepath, mode='replay'):
+        """
+        Reads a log that was written by `save()`.
+        """
+        log = cls(mode=mode)
+        with np.load(filepath) as data:
+            keys = data['keys']
+            n_records = data['n_records']
+            lengths = data['lengths'].tolist()
+            values = data['values'].tolist()
+        record_index = 0
+        value_index = 0
+        for (epoch, index), n in zip(keys.tolist(), n_records.tolist()):
+            sample = []
+            for length in lengths[record_index:record_index + n]:
+                if length < 0:
+                    sample.append(None)
+                else:
+                    sample.append(tuple(values[value_index:value_index + length]))
+                    value_index += length
+            record_index += n
+            log.records[(epoch, index)] = sample
+        return log
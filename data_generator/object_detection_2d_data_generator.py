@@ -19,7 +19,9 @@ limitations under the License.
 from __future__ import division
 import numpy as np
 import inspect
+import multiprocessing
 from collections import defaultdict
+from functools import partial
 import warnings
 import sklearn.utils
 from copy import deepcopy
@@ -54,6 +56,76 @@ class DatasetError(Exception):
     pass
 
 
+# The state of the worker processes of `DataGenerator.generate()`. It is set once per worker process by
+# `_init_generate_worker()`.
+_generate_worker_state = None
+
+
+def _init_generate_worker(generator, transformations, label_encoder, keep_images_without_gt, degenerate_box_handling,
+                          encoded_buffer, encoded_shape, encoded_dtype):
+    global _generate_worker_state
+    # Forked workers inherit the random state of the main process, so they would all draw the same augmentations.
+    np.random.seed()
+    if encoded_buffer is not None:
+        encoded_buffer = np.frombuffer(encoded_buffer, dtype=encoded_dtype).reshape(encoded_shape)
+    _generate_worker_state = (generator, transformations, label_encoder, keep_images_without_gt,
+                              degenerate_box_handling, encoded_buffer)
+
+
+def _process_sample(task):
+    """
+    Loads, transforms and (maybe) encodes one sample in a worker process of `DataGenerator.generate()`. The encoded
+    labels are written into the given slot of the shared buffer.
+
+    Returns `None` if the sample is removed, otherwise the processed image and labels and, if requested, the original
+    image and labels.
+    """
+    (generator, transformations, label_encoder, keep_images_without_gt,
+     degenerate_box_handling, encoded_buffer) = _generate_worker_state
+    batch_item, dataset_index, filename, labels, slot, return_originals = task
+
+    image = generator._load_image_at(dataset_index, filename)
+    if labels is not None and (labels.size == 0) and not keep_images_without_gt:
+        return None
+    if return_originals:
+        original_image, original_labels = deepcopy(image), deepcopy(labels)
+    else:
+        original_image, original_labels = None, None
+
+    for transform in transformations:
+        if labels is not None:
+            image, labels = transform(image, labels)
+        else:
+            image = transform(image)
+        if image is None:
+            return None
+
+    if labels is not None and len(labels) > 0:
+        degenerate_box_filter = BoxFilter(check_overlap=False,
+                                          check_min_area=False,
+                                          check_degenerate=True,
+                                          labels_format=generator.labels_output_format)
+        valid = degenerate_box_filter.mask(labels)
+        if not np.all(valid):
+            if degenerate_box_handling == 'warn':
+                warnings.warn(
+                    "Detected degenerate gt bounding boxes for batch item {} with bounding boxes {}, "
+                    .format(batch_item, labels) +
+                    "i.e. bounding boxes where x_max <= x_min and/or y_max <= y_min. " +
+                    "This could mean that your dataset contains degenerate ground truth boxes, "
+                    "or that any image transformations you may apply might result in degenerate gt boxes, "
+                    "or that you are parsing the ground truth in the wrong coordinate format."
+                    "Degenerate ground truth bounding boxes may lead to NaN errors during the training.")
+            else:
+                labels = labels[valid]
+                if (labels.size == 0) and not keep_images_without_gt:
+                    return None
+
+    if labels is not None and encoded_buffer is not None:
+        label_encoder.encode_sample(labels, out=encoded_buffer[slot])
+    return image, labels, original_image, original_labels
+
+
 class DataGenerator:
     """
     A generator to generate batches of samples and corresponding labels indefinitely.
@@ -899,6 +971,79 @@ class DataGenerator:
         # Instead of shuffling the HDF5 dataset, we will shuffle this index list.
         self.dataset_indices = np.arange(self.dataset_size, dtype=np.int32)
 
+    def _load_image(self, position):
+        """
+        Returns the image at the given position of the current, possibly shuffled, order of the dataset.
+        """
+        return self._load_image_at(self.dataset_indices[position], self.filenames[position] if self.filenames else None)
+
+    def _load_image_at(self, dataset_index, filename):
+        """
+        Returns the image with the given index in the original order of the dataset, whose file name is `filename`.
+
+        We prioritize our options in the following order:
+        1) If we have the images already loaded in memory, get them from there.
+        2) Else, if we have an HDF5 dataset, get the images from there.
+        3) Else, if we have neither of the above, we'll have to load the individual image files from disk.
+        """
+        if self.images:
+            return self.images[dataset_index]
+        elif self.hdf5_dataset is not None:
+            return self.hdf5_dataset['images'][dataset_index].reshape(self.hdf5_dataset['image_shapes'][dataset_index])
+        else:
+            with Image.open(filename) as image:
+                return np.array(image, dtype=np.uint8)
+
+    def _shuffle_dataset(self):
+        """
+        Shuffles the dataset indices and all per-sample lists of the dataset consistently.
+        """
+        objects_to_shuffle = [self.dataset_indices]
+        if self.filenames:
+            objects_to_shuffle.append(self.filenames)
+        if self.labels:
+            objects_to_shuffle.append(self.labels)
+        if self.image_ids:
+            objects_to_shuffle.append(self.image_ids)
+        if self.eval_neutral:
+            objects_to_shuffle.append(self.eval_neutral)
+        # 同时按相同的顺序 shuffle objects_to_shuffle 的所有元素, Note datasets_indices 是 np.array 其他都是 list
+        shuffled_objects = sklearn.utils.shuffle(*objects_to_shuffle)
+        for i in range(len(objects_to_shuffle)):
+            # 与 objects_to_shuffle[i] = shuffled_objects[i], 区别是 [:] 直接在原数组上修改值, 而不是把整个数组重新赋值
+            objects_to_shuffle[i][:] = shuffled_objects[i]
+
+    def _sample_loader(self, transform_callers, keep_images_without_gt, max_attempts=100):
+        """
+        Returns a function that loads a given number of randomly chosen samples from the dataset and applies the
+        per-image transformations to them. Batch transformations like `Mosaic` use it to get additional samples.
+        """
+        def load_samples(n_samples):
+            images = []
+            labels = []
+            for _ in range(max_attempts * max(1, n_samples)):
+                if len(images) == n_samples:
+                    break
+                position = np.random.randint(self.dataset_size)
+                image = self._load_image(position)
+                image_labels = np.array(self.labels[position]) if self.labels else None
+                if self.labels and (image_labels.size == 0) and not keep_images_without_gt:
+                    continue
+                for call_transform in transform_callers:
+                    image, image_labels = call_transform(image, image_labels)
+                    if image is None:
+                        break
+                if image is not None:
+                    images.append(image)
+                    labels.append(image_labels)
+            else:
+                if len(images) < n_samples:
+                    raise DegenerateBatchError("Could not load {} additional samples in {} attempts.".format(
+                        n_samples, max_attempts * max(1, n_samples)))
+            return images, (labels if self.labels else None)
+
+        return load_samples
+
     def generate(self,
                  batch_size=32,
                  shuffle=True,
@@ -906,7 +1051,11 @@ class DataGenerator:
                  label_encoder=None,
                  returns=('processed_images', 'encoded_labels'),
                  keep_images_without_gt=False,
-                 degenerate_box_handling='remove'):
+                 degenerate_box_handling='remove',
+                 profiler=None,
+                 batch_transformations=(),
+                 augmentation_log=None,
+                 workers=0):
         """
         Generates batches of samples and (optionally) corresponding labels indefinitely.
         Can shuffle the samples consistently after each complete pass.
@@ -983,6 +1132,35 @@ class DataGenerator:
                 If 'warn', the generator will merely print a warning to let you know that there are degenerate boxes in
                 a batch.
                 If 'remove', the generator will remove degenerate boxes from the batch silently.
+            profiler (TransformProfiler, optional): If not `None`, all transformations and the label encoder are called
+                through this profiler, which records their wall time, calls, output sizes and allocated memory.
+                The profiler is also handed to all transformations that have a `profiler` attribute, so that composite
+                transformations like `SSDDataAugmentation` report their individual steps. If `None`, profiling causes
+                no overhead at all, and a profiler that an earlier call handed to the transformations is taken away.
+            batch_transformations (tuple, optional): A tuple of transformations that will be applied to the whole batch
+                in the given order after `transformations` have been applied to the individual images and after images
+                without ground truth have been removed. Each batch transformation is a callable that takes as input the
+                list of images and the list of labels (or `None`) of the batch and returns both in the same format,
+                e.g. a `TFAugmentationPipeline`, which runs the augmentation as TensorFlow operations. Batch
+                transformations don't provide inverters, and the generator doesn't check their output boxes for
+                degeneracy, so they have to filter the boxes they alter themselves.
+                If a batch transformation has a `sample_loader` attribute, the generator sets it to a function that
+                takes a number `n` and returns the images and labels of `n` randomly chosen samples of the dataset
+                after `transformations` have been applied to them. This allows batch transformations like `Mosaic`
+                to compose several samples into one image.
+            augmentation_log (AugmentationLog, optional): If not `None`, the random transformations among
+                `transformations` record the parameters they sample for every sample and epoch in this log if it is in
+                'record' mode, or apply the recorded parameters instead of sampling new ones if it is in 'replay' mode.
+                Replaying skips rejection sampling, and several experiments can share one recorded augmentation stream.
+                The parameters are looked up by epoch and sample, so the order of the samples may differ between runs.
+            workers (int, optional): The number of worker processes that load, transform and encode the samples. If 0,
+                everything happens in the calling process. Otherwise the workers encode the labels of every sample
+                right after its transformations if `label_encoder` is an `SSDInputEncoder` object, and write them into a
+                buffer in shared memory, so the calling process only assembles the batches. One batch is processed
+                while the previous one is consumed. Each worker draws its own random augmentations, and the worker
+                processes receive the generator, the transformations and the encoder when they start, so on platforms
+                that don't fork processes all of them must be picklable. Can't be combined with `profiler`,
+                `batch_transformations`, `augmentation_log`, or the returns 'matched_anchors' and 'inverse_transform'.
         Yields:
             The next batch as a tuple of items as defined by the `returns` argument.
         """
@@ -992,6 +1170,13 @@ class DataGenerator:
         if degenerate_box_handling not in ['remove', 'warn']:
             raise ValueError("`degenerate_box_handling` must be either 'remove' or 'warn'")
 
+        if workers < 0:
+            raise ValueError("`workers` must be a non-negative integer.")
+        if workers > 0 and (profiler is not None or batch_transformations or augmentation_log is not None):
+            raise ValueError("`profiler`, `batch_transformations` and `augmentation_log` can't be used with `workers > 0`.")
+        if workers > 0 and any([ret in returns for ret in ['matched_anchors', 'inverse_transform']]):
+            raise ValueError("'matched_anchors' and 'inverse_transform' aren't possible returns with `workers > 0`.")
+
         #############################################################################################
         # Warn if any of the set returns aren't possible.
         #############################################################################################
@@ -1028,51 +1213,66 @@ class DataGenerator:
         #############################################################################################
 
         if shuffle:
-            objects_to_shuffle = [self.dataset_indices]
-            if self.filenames:
-                objects_to_shuffle.append(self.filenames)
-            if self.labels:
-                objects_to_shuffle.append(self.labels)
-            if self.image_ids:
-                objects_to_shuffle.append(self.image_ids)
-            if self.eval_neutral:
-                objects_to_shuffle.append(self.eval_neutral)
-            # 同时按相同的顺序 shuffle objects_to_shuffle 的所有元素, Note datasets_indices 是 np.array 其他都是 list
-            shuffled_objects = sklearn.utils.shuffle(*objects_to_shuffle)
-            for i in range(len(objects_to_shuffle)):
-                # 与 objects_to_shuffle[i] = shuffled_objects[i], 区别是 [:] 直接在原数组上修改值, 而不是把整个数组重新赋值
-                objects_to_shuffle[i][:] = shuffled_objects[i]
+            self._shuffle_dataset()
 
         # Override the labels formats of all the transformations to make sure they are set correctly.
         if self.labels:
             for transform in transformations:
                 transform.labels_format = self.labels_output_format
+            for transform in batch_transformations:
+                transform.labels_format = self.labels_output_format
+
+        # Hand the profiler to the composite transformations, or take away the profiler of an earlier call, so that
+        # they don't keep profiling their individual steps.
+        for transform in transformations:
+            if hasattr(transform, 'profiler'):
+                transform.profiler = profiler
+
+        if workers > 0:
+            for batch in self._generate_in_workers(batch_size, shuffle, transformations, label_encoder, returns,
+                                                   keep_images_without_gt, degenerate_box_handling, workers):
+                yield batch
+            return
+
+        # If a profiler is given, call the transformations and the label encoder through it. Otherwise call them
+        # directly so that profiling doesn't cost anything.
+        if profiler is None:
+            transform_callers = list(transformations)
+            batch_transform_callers = list(batch_transformations)
+            encode = label_encoder
+        else:
+            transform_callers = [partial(profiler, transform) for transform in transformations]
+            batch_transform_callers = [partial(profiler, transform) for transform in batch_transformations]
+            encode = None if label_encoder is None else partial(profiler, label_encoder)
+
+        degenerate_box_filter = BoxFilter(check_overlap=False,
+                                          check_min_area=False,
+                                          check_degenerate=True,
+                                          labels_format=self.labels_output_format)
+
+        # Give batch transformations that compose several samples access to more samples.
+        for transform in batch_transformations:
+            if hasattr(transform, 'sample_loader'):
+                transform.sample_loader = self._sample_loader(transform_callers, keep_images_without_gt)
 
         #############################################################################################
         # Generate mini batches.
         #############################################################################################
 
         current = 0
+        # The number of complete passes over the dataset, which identifies the augmentation of a sample together with
+        # the sample's index.
+        epoch = 0
         while True:
             batch_x, batch_y = [], []
             if current >= self.dataset_size:
                 current = 0
+                epoch += 1
                 #########################################################################################
                 # Maybe shuffle the dataset if a full pass over the dataset has finished.
                 #########################################################################################
                 if shuffle:
-                    objects_to_shuffle = [self.dataset_indices]
-                    if self.filenames:
-                        objects_to_shuffle.append(self.filenames)
-                    if self.labels:
-                        objects_to_shuffle.append(self.labels)
-                    if self.image_ids:
-                        objects_to_shuffle.append(self.image_ids)
-                    if self.eval_neutral:
-                        objects_to_shuffle.append(self.eval_neutral)
-                    shuffled_objects = sklearn.utils.shuffle(*objects_to_shuffle)
-                    for i in range(len(objects_to_shuffle)):
-                        objects_to_shuffle[i][:] = shuffled_objects[i]
+                    self._shuffle_dataset()
 
             #########################################################################################
             # Get the images, (maybe) image IDs, (maybe) labels, etc. for this batch.
@@ -1082,29 +1282,14 @@ class DataGenerator:
             # 1) If we have the images already loaded in memory, get them from there.
             # 2) Else, if we have an HDF5 dataset, get the images from there.
             # 3) Else, if we have neither of the above, we'll have to load the individual image files from disk.
-            batch_indices = self.dataset_indices[current:current + batch_size]
-            if self.images:
-                for i in batch_indices:
-                    batch_x.append(self.images[i])
-                if self.filenames:
-                    batch_filenames = self.filenames[current:current + batch_size]
-                else:
-                    batch_filenames = None
-            elif self.hdf5_dataset is not None:
-                for i in batch_indices:
-                    batch_x.append(self.hdf5_dataset['images'][i].reshape(self.hdf5_dataset['image_shapes'][i]))
-                if self.filenames:
-                    batch_filenames = self.filenames[current:current + batch_size]
-                else:
-                    batch_filenames = None
+            if not (self.images or self.hdf5_dataset is not None or self.filenames):
+                raise ValueError('`self.filenames` must not be None or []')
+            for position in range(current, min(current + batch_size, self.dataset_size)):
+                batch_x.append(self._load_image(position))
+            if self.filenames:
+                batch_filenames = self.filenames[current:current + batch_size]
             else:
-                if not self.filenames:
-                    raise ValueError('`self.filenames` must not be None or []')
-                else:
-                    batch_filenames = self.filenames[current:current + batch_size]
-                    for filename in batch_filenames:
-                        with Image.open(filename) as image:
-                            batch_x.append(np.array(image, dtype=np.uint8))
+                batch_filenames = None
 
             # Get the labels for this batch (if there are any).
             if self.labels:
@@ -1134,6 +1319,7 @@ class DataGenerator:
             else:
                 batch_original_labels = None
 
+            batch_start = current
             current += batch_size
 
             #########################################################################################
@@ -1162,59 +1348,68 @@ class DataGenerator:
                 # Apply any image transformations we may have received.
                 if transformations:
                     inverse_transforms = []
-                    for transform in transformations:
-                        if self.labels:
-                            if ('inverse_transform' in returns) and (
-                                    'return_inverter' in inspect.signature(transform).parameters):
-                                batch_x[i], batch_y[i], inverse_transform = transform(batch_x[i], batch_y[i],
-                                                                                      return_inverter=True)
-                                inverse_transforms.append(inverse_transform)
+                    if augmentation_log is not None:
+                        augmentation_log.begin(epoch, self.dataset_indices[batch_start + i])
+                    # End the log even if a transformation raises, so that no stale log stays active.
+                    try:
+                        for transform, call_transform in zip(transformations, transform_callers):
+                            if self.labels:
+                                if ('inverse_transform' in returns) and (
+                                        'return_inverter' in inspect.signature(transform).parameters):
+                                    batch_x[i], batch_y[i], inverse_transform = call_transform(batch_x[i], batch_y[i],
+                                                                                               return_inverter=True)
+                                    inverse_transforms.append(inverse_transform)
+                                else:
+                                    batch_x[i], batch_y[i] = call_transform(batch_x[i], batch_y[i])
                             else:
-                                batch_x[i], batch_y[i] = transform(batch_x[i], batch_y[i])
-                        else:
-                            if ('inverse_transform' in returns) and (
-                                    'return_inverter' in inspect.signature(transform).parameters):
-                                batch_x[i], inverse_transform = transform(batch_x[i], return_inverter=True)
-                                inverse_transforms.append(inverse_transform)
-                            else:
-                                batch_x[i] = transform(batch_x[i])
-
-                        # In case the transform failed to produce an output image, which is possible for some random
-                        # transforms. 究竟什么情况下才会发生这种情况?
-                        if batch_x[i] is None:
-                            batch_items_to_remove.append(i)
-                            batch_inverse_transforms.append([])
-                            # continue
-                            # Adam
-                            break
+                                if ('inverse_transform' in returns) and (
+                                        'return_inverter' in inspect.signature(transform).parameters):
+                                    batch_x[i], inverse_transform = call_transform(batch_x[i], return_inverter=True)
+                                    inverse_transforms.append(inverse_transform)
+                                else:
+                                    batch_x[i] = call_transform(batch_x[i])
+
+                            # In case the transform failed to produce an output image, which is possible for some random
+                            # transforms. 究竟什么情况下才会发生这种情况?
+                            if batch_x[i] is None:
+                                batch_items_to_remove.append(i)
+                                batch_inverse_transforms.append([])
+                                # continue
+                                # Adam
+                                break
+                    finally:
+                        if augmentation_log is not None:
+                            augmentation_log.end()
                     # transform 需要按照与原来相反的顺序存放
                     batch_inverse_transforms.append(inverse_transforms[::-1])
 
                 #########################################################################################
-                # Check for degenerate boxes in this batch item.
+                # Check for degenerate boxes in this batch item. If they are to be removed, this happens for the
+                # whole batch at once below.
                 #########################################################################################
-                if self.labels:
-                    xmin = self.labels_output_format.index('xmin')
-                    ymin = self.labels_output_format.index('ymin')
-                    xmax = self.labels_output_format.index('xmax')
-                    ymax = self.labels_output_format.index('ymax')
-                    if np.any(batch_y[i][:, xmax] - batch_y[i][:, xmin] <= 0) or np.any(
-                            batch_y[i][:, ymax] - batch_y[i][:, ymin] <= 0):
-                        if degenerate_box_handling == 'warn':
-                            warnings.warn(
-                                "Detected degenerate gt bounding boxes for batch item {} with bounding boxes {}, "
-                                .format(i, batch_y[i]) +
-                                "i.e. bounding boxes where x_max <= x_min and/or y_max <= y_min. " +
-                                "This could mean that your dataset contains degenerate ground truth boxes, "
-                                "or that any image transformations you may apply might result in degenerate gt boxes, "
-                                "or that you are parsing the ground truth in the wrong coordinate format." 
-                                "Degenerate ground truth bounding boxes may lead to NaN errors during the training.")
-                        elif degenerate_box_handling == 'remove':
-                            box_filter = BoxFilter(check_overlap=False,
-                                                   check_min_area=False,
-                                                   check_degenerate=True,
-                                                   labels_format=self.labels_output_format)
-                            batch_y[i] = box_filter(batch_y[i])
+                if self.labels and degenerate_box_handling == 'warn':
+                    if not np.all(degenerate_box_filter.mask(batch_y[i])):
+                        warnings.warn(
+                            "Detected degenerate gt bounding boxes for batch item {} with bounding boxes {}, "
+                            .format(i, batch_y[i]) +
+                            "i.e. bounding boxes where x_max <= x_min and/or y_max <= y_min. " +
+                            "This could mean that your dataset contains degenerate ground truth boxes, "
+                            "or that any image transformations you may apply might result in degenerate gt boxes, "
+                            "or that you are parsing the ground truth in the wrong coordinate format." 
+                            "Degenerate ground truth bounding boxes may lead to NaN errors during the training.")
+
+            #########################################################################################
+            # Remove degenerate boxes from all remaining batch items in one pass.
+            #########################################################################################
+            if self.labels and degenerate_box_handling == 'remove':
+                items = [i for i in range(len(batch_x)) if (i not in batch_items_to_remove) and len(batch_y[i]) > 0]
+                if items:
+                    offsets = np.cumsum([0] + [len(batch_y[i]) for i in items])
+                    valid_labels, valid_offsets = degenerate_box_filter.filter_batch(
+                        np.concatenate([batch_y[i] for i in items], axis=0), offsets)
+                    for k, i in enumerate(items):
+                        if valid_offsets[k + 1] - valid_offsets[k] < offsets[k + 1] - offsets[k]:
+                            batch_y[i] = valid_labels[valid_offsets[k]:valid_offsets[k + 1]].astype(batch_y[i].dtype)
                             # 如果这个 image 的所有 gt_box 都被过滤掉, batch_y[i] 的 shape 为 (0, 5)
                             if (batch_y[i].size == 0) and not keep_images_without_gt:
                                 batch_items_to_remove.append(i)
@@ -1241,6 +1436,13 @@ class DataGenerator:
                     if batch_original_labels:
                         batch_original_labels.pop(j)
 
+            #########################################################################################
+            # Maybe perform batch transformations.
+            #########################################################################################
+            if batch_x:
+                for call_batch_transform in batch_transform_callers:
+                    batch_x, batch_y = call_batch_transform(batch_x, batch_y)
+
             #########################################################################################
             # CAUTION: Converting `batch_x` into an array will result in an empty batch if the images have varying sizes
             #          or varying numbers of channels. At this point, all images must have the same size and the same
@@ -1258,10 +1460,10 @@ class DataGenerator:
             #########################################################################################
             if (label_encoder is not None) and batch_y:
                 if ('matched_anchors' in returns) and isinstance(label_encoder, SSDInputEncoder):
-                    batch_y_encoded, batch_matched_anchors, avg_iou = label_encoder(batch_y, diagnostics=True)
+                    batch_y_encoded, batch_matched_anchors, avg_iou = encode(batch_y, diagnostics=True)
                     pass
                 else:
-                    batch_y_encoded = label_encoder(batch_y, diagnostics=False)
+                    batch_y_encoded = encode(batch_y, diagnostics=False)
                     batch_matched_anchors = None
             else:
                 batch_y_encoded = None
@@ -1303,6 +1505,114 @@ class DataGenerator:
                 ret.append(batch_original_labels)
             yield ret
 
+    def _generate_in_workers(self,
+                             batch_size,
+                             shuffle,
+                             transformations,
+                             label_encoder,
+                             returns,
+                             keep_images_without_gt,
+                             degenerate_box_handling,
+                             workers):
+        """
+        The part of `generate()` that generates the batches with `workers` worker processes. The arguments are the same
+        as for `generate()`.
+        """
+        if not (self.images or self.hdf5_dataset is not None or self.filenames):
+            raise ValueError('`self.filenames` must not be None or []')
+
+        # The workers encode the labels into two halves of a shared buffer, one for the batch that is being processed
+        # and one for the batch that is being assembled.
+        encode_in_workers = bool(self.labels) and isinstance(label_encoder, SSDInputEncoder)
+        if encode_in_workers:
+            encoded_shape = (2 * batch_size,) + label_encoder.encoded_shape
+            encoded_dtype = np.dtype(label_encoder.dtype)
+            encoded_buffer = multiprocessing.RawArray('b', int(np.prod(encoded_shape)) * encoded_dtype.itemsize)
+            batch_encoded = np.frombuffer(encoded_buffer, dtype=encoded_dtype).reshape(encoded_shape)
+        else:
+            encoded_shape, encoded_dtype, encoded_buffer = None, None, None
+        return_originals = 'original_images' in returns or 'original_labels' in returns
+
+        initargs = (self, transformations, label_encoder if encode_in_workers else None, keep_images_without_gt,
+                    degenerate_box_handling, encoded_buffer, encoded_shape, encoded_dtype)
+        pool = multiprocessing.Pool(processes=workers, initializer=_init_generate_worker, initargs=initargs)
+
+        def submit(current, half):
+            """
+            Hands the batch that starts at position `current` to the workers and returns its pending result together
+            with the file names, image IDs and evaluation-neutral flags of the batch.
+            """
+            positions = range(current, min(current + batch_size, self.dataset_size))
+            tasks = [(i,
+                      int(self.dataset_indices[position]),
+                      self.filenames[position] if self.filenames else None,
+                      np.array(self.labels[position]) if self.labels else None,
+                      half * batch_size + i,
+                      return_originals)
+                     for i, position in enumerate(positions)]
+            return (pool.map_async(_process_sample, tasks),
+                    self.filenames[current:current + batch_size] if self.filenames else None,
+                    self.image_ids[current:current + batch_size] if self.image_ids else None,
+                    self.eval_neutral[current:current + batch_size] if self.eval_neutral else None)
+
+        try:
+            current = 0
+            half = 0
+            pending = submit(current, half)
+            while True:
+                results, batch_filenames, batch_image_ids, batch_eval_neutral = pending
+                results = results.get()
+                kept = [i for i in range(len(results)) if results[i] is not None]
+
+                # Hand the next batch to the workers before assembling this one.
+                current += batch_size
+                if current >= self.dataset_size:
+                    current = 0
+                    if shuffle:
+                        self._shuffle_dataset()
+                pending = submit(current, 1 - half)
+
+                batch_x = np.array([results[i][0] for i in kept])
+                if batch_x.size == 0:
+                    raise DegenerateBatchError(
+                        "You produced an empty batch. This might be because the images in the batch vary "
+                        "in their size and/or number of channels. Note that after all transformations "
+                        "(if any were given) have been applied to all images in the batch, all images "
+                        "must be homogeneous in size along all axes.")
+                batch_y = [results[i][1] for i in kept] if self.labels else None
+                if encode_in_workers:
+                    # Copy the encoded labels out of the shared buffer, which the workers will overwrite two batches on.
+                    batch_y_encoded = batch_encoded[[half * batch_size + i for i in kept]]
+                elif (label_encoder is not None) and batch_y:
+                    batch_y_encoded = label_encoder(batch_y)
+                else:
+                    batch_y_encoded = None
+                half = 1 - half
+
+                ret = []
+                if 'processed_images' in returns:
+                    ret.append(batch_x)
+                if 'encoded_labels' in returns:
+                    ret.append(batch_y_encoded)
+                if 'processed_labels' in returns:
+                    ret.append(batch_y)
+                if 'filenames' in returns:
+                    ret.append([batch_filenames[i] for i in kept] if batch_filenames else None)
+                if 'image_ids' in returns:
+                    ret.append([batch_image_ids[i] for i in kept] if batch_image_ids else None)
+                if 'evaluation_neutral' in returns:
+                    ret.append([batch_eval_neutral[i] for i in kept] if batch_eval_neutral else None)
+                if 'original_images' in returns:
+                    ret.append([results[i][2] for i in kept])
+                if 'original_labels' in returns:
+                    ret.append([results[i][3] for i in kept] if self.labels else None)
+                yield ret
+        finally:
+            # Let the workers finish the pending batch, terminating them while they hold a lock of the task queue can
+            # block forever.
+            pool.close()
+            pool.join()
+
     def save_dataset(self,
                      filenames_path='filenames.pkl',
                      labels_path=None,
@@ -0,0 +1,304 @@
+"""
+Pre-rendering augmented epochs to disk and streaming them during training.
+
+`materialize_epochs()` runs `DataGenerator.generate()` with a transformation chain and an `SSDInputEncoder` for a number
+of epochs in a process pool and writes the final images and encoded labels to a directory. `MaterializedEpochs` reads
+such a directory back and yields batches that can be fed to the model directly, so that training doesn't spend any CPU
+time on loading, augmenting, or encoding.
+
+Copyright (C) 2018 Pierluigi Ferrari
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from __future__ import division
+import numpy as np
+import multiprocessing
+import os
+import random
+import sys
+from tqdm import tqdm
+
+from ssd_encoder_decoder.ssd_input_encoder import SSDInputEncoder
+
+# The arguments of the rendering workers. They are set once per worker process by `_init_worker()`.
+_worker_args = None
+
+
+def _epoch_paths(directory, epoch):
+    prefix = os.path.join(directory, 'epoch_{:05d}'.format(epoch))
+    return prefix + '_images.npy', prefix + '_labels.npz'
+
+
+def sparsify_encoded_labels(y_encoded, background):
+    """
+    Converts the encoded labels of one image into the sparse format in which `materialize_epochs()` stores them.
+
+    Only the anchor boxes whose encoding differs from the encoding of an image without any ground truth, i.e. the
+    positive and the neutral anchor boxes, are stored. The anchor box coordinates and the variances are the same for
+    all images, so they aren't stored either.
+
+    Arguments:
+        y_encoded (array): The encoded labels of one image as returned by `SSDInputEncoder`, i.e. an array of shape
+            `(#boxes, #classes + 12)`.
+        background (array): The encoded labels of an image without any ground truth, of the same shape.
+
+    Returns:
+        A tuple `(anchor_indices, class_ids, offsets)`, where `anchor_indices` contains the indices of the stored
+        anchor boxes, `class_ids` contains their class IDs or -1 for neutral anchor boxes, and `offsets` contains the
+        four encoded box offsets of every stored anchor box.
+    """
+    n_classes = background.shape[1] - 12
+    anchor_indices = np.nonzero(np.any(y_encoded[:, :-8] != background[:, :-8], axis=1))[0]
+    classes = y_encoded[anchor_indices, :n_classes]
+    class_ids = np.where(np.any(classes > 0, axis=1), np.argmax(classes, axis=1), -1)
+    return (anchor_indices.astype(np.int32),
+            class_ids.astype(np.int16),
+            y_encoded[anchor_indices, -12:-8].astype(np.float32))
+
+
+def _init_worker(generator, label_encoder, transformations, batch_transformations, batch_size,
+                 keep_images_without_gt, degenerate_box_handling, background, directory, seed):
+    global _worker_args
+    _worker_args = (generator, label_encoder, transformations, batch_transformations, batch_size,
+                    keep_images_without_gt, degenerate_box_handling, background, directory, seed)
+
+
+def _render_epoch(epoch):
+    """
+    Renders one epoch into the files of that epoch and returns the number of samples that were written.
+    """
+    (generator, label_encoder, transformations, batch_transformations, batch_size,
+     keep_images_without_gt, degenerate_box_handling, background, directory, seed) = _worker_args
+
+    # Every epoch gets its own random state, so the output doesn't depend on which worker renders which epoch.
+    # Both NumPy's and Python's random number generators are seeded, since some transformations (e.g. `RandomRotate`)
+    # draw from the latter.
+    epoch_seed = None if seed is None else (seed + epoch) % 2**32
+    np.random.seed(epoch_seed)
+    random.seed(epoch_seed)
+
+    images_path, labels_path = _epoch_paths(directory, epoch)
+    generator_ = generator.generate(batch_size=batch_size,
+                                    shuffle=False,
+                                    transformations=transformations,
+                                    label_encoder=label_encoder,
+                                    returns=('processed_images', 'encoded_labels'),
+                                    keep_images_without_gt=keep_images_without_gt,
+                                    degenerate_box_handling=degenerate_box_handling,
+                                    batch_transformations=batch_transformations)
+    n_batches = int(np.ceil(generator.get_dataset_size() / batch_size))
+
+    images = None
+    n_samples = 0
+    anchor_indices = [np.zeros((0,), dtype=np.int32)]
+    class_ids = [np.zeros((0,), dtype=np.int16)]
+    offsets = [np.zeros((0, 4), dtype=np.float32)]
+    n_rows = []
+    for _ in range(n_batches):
+        batch_x, batch_y_encoded = next(generator_)
+        if images is None:
+            # Samples can be removed from a batch, but there can never be more samples than in the dataset.
+            images = np.lib.format.open_memmap(images_path,
+                                               mode='w+',
+                                               dtype=np.uint8,
+                                               shape=(generator.get_dataset_size(),) + batch_x.shape[1:])
+        images[n_samples:n_samples + len(batch_x)] = batch_x
+        n_samples += len(batch_x)
+        for y_encoded in batch_y_encoded:
+            sample_anchor_indices, sample_class_ids, sample_offsets = sparsify_encoded_labels(y_encoded, background)
+            anchor_indices.append(sample_anchor_indices)
+            class_ids.append(sample_class_ids)
+            offsets.append(sample_offsets)
+            n_rows.append(len(sample_anchor_indices))
+    if images is None:
+        raise ValueError("Epoch {} contains no samples.".format(epoch))
+    images.flush()
+    del images
+
+    np.savez(labels_path,
+             n_samples=np.array(n_samples, dtype=np.int64),
+             row_offsets=np.concatenate([[0], np.cumsum(n_rows)]).astype(np.int64),
+             anchor_indices=np.concatenate(anchor_indices),
+             class_ids=np.concatenate(class_ids),
+             offsets=np.concatenate(offsets))
+    return n_samples
+
+
+def materialize_epochs(generator,
+                       label_encoder,
+                       directory,
+                       n_epochs,
+                       transformations=(),
+                       batch_transformations=(),
+                       batch_size=32,
+                       keep_images_without_gt=False,
+                       degenerate_box_handling='remove',
+                       processes=None,
+                       seed=None,
+                       verbose=True):
+    """
+    Renders `n_epochs` augmented epochs of a dataset into `directory` in a process pool.
+
+    Every epoch is one pass over the dataset through `generator.generate()` with the given transformations and label
+    encoder. The images of an epoch are packed into one uint8 `.npy` file that the reader maps into memory, and the
+    encoded labels are stored sparsely (see `sparsify_encoded_labels()`), which typically takes less than one percent
+    of the space of the dense label tensor. The encoded box offsets are stored as float32.
+
+    The samples of an epoch are written in the order of the dataset; `MaterializedEpochs` shuffles them when reading.
+    The transformations have to produce images of the input size of `label_encoder`, as for training.
+
+    The worker processes receive the generator, the encoder and the transformations when they start. On platforms
+    that don't fork processes, all of them must therefore be picklable, which rules out generators that read from an
+    HDF5 dataset.
+
+    Arguments:
+        generator (DataGenerator): The generator with the dataset to render.
+        label_encoder (SSDInputEncoder): The encoder for the labels of the model that will be trained on the rendered
+            epochs.
+        directory (str): The directory to write to. It is created if it doesn't exist.
+        n_epochs (int): The number of epochs to render.
+        transformations (tuple, optional): The per-image transformations, as for `DataGenerator.generate()`.
+        batch_transformations (tuple, optional): The batch transformations, as for `DataGenerator.generate()`.
+        batch_size (int, optional): The number of samples that the workers process at once. This doesn't affect the
+            batch size of training, except for batch transformations that mix the samples of a batch.
+        keep_images_without_gt (bool, optional): As for `DataGenerator.generate()`.
+        degenerate_box_handling (str, optional): As for `DataGenerator.generate()`.
+        processes (int, optional): The number of worker processes. If `None`, one per CPU is used.
+        seed (int, optional): If not `None`, epoch `k` is rendered with the random seed `seed + k` for both NumPy's
+            and Python's `random` module, which makes the output reproducible.
+        verbose (bool, optional): If `True`, shows the progress.
+
+    Returns:
+        A `MaterializedEpochs` object that reads the rendered epochs.
+    """
+    if not isinstance(label_encoder, SSDInputEncoder):
+        raise ValueError("`label_encoder` must be an `SSDInputEncoder` object.")
+    if label_encoder.output_mode != 'dense':
+        raise ValueError("`label_encoder` must have `output_mode='dense'`, the labels are stored sparsely anyway.")
+    if not generator.labels:
+        raise ValueError("The generator must have ground truth labels to render training data.")
+    if n_epochs < 1:
+        raise ValueError("`n_epochs` must be at least 1.")
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    # The encoding of an image without any ground truth, from which the sparse labels are stored as differences.
+    background = label_encoder([np.zeros((0, 5))])[0].astype(np.float32)
+    np.savez(os.path.join(directory, 'materialization.npz'),
+             n_epochs=np.array(n_epochs, dtype=np.int64),
+             background=background)
+
+    initargs = (generator, label_encoder, transformations, batch_transformations, batch_size,
+                keep_images_without_gt, degenerate_box_handling, background, directory, seed)
+    pool = multiprocessing.Pool(processes=processes, initializer=_init_worker, initargs=initargs)
+    try:
+        results = pool.imap_unordered(_render_epoch, range(n_epochs))
+        if verbose:
+            results = tqdm(results, total=n_epochs, desc='Rendering epochs', file=sys.stdout)
+        for _ in results:
+            pass
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return MaterializedEpochs(directory)
+
+
+class MaterializedEpochs:
+    """
+    Reads the epochs that `materialize_epochs()` rendered and yields training batches from them.
+
+    The images are memory-mapped, so only the images of the current batch are read from disk, and the encoded labels
+    are restored from their sparse format by writing a few hundred rows per image into a copy of the encoding of an
+    image without ground truth.
+    """
+
+    def __init__(self, directory):
+        """
+        Arguments:
+            directory (str): The directory that `materialize_epochs()` wrote to.
+        """
+        with np.load(os.path.join(directory, 'materialization.npz')) as data:
+            self.n_epochs = int(data['n_epochs'])
+            self.background = data['background']
+        self.n_classes = self.background.shape[1] - 12
+        self.directory = directory
+        self.images = []
+        self.labels = []
+        for epoch in range(self.n_epochs):
+            images_path, labels_path = _epoch_paths(directory, epoch)
+            with np.load(labels_path) as data:
+                labels = {key: data[key] for key in data.files}
+            n_samples = int(labels.pop('n_samples'))
+            # The image file may have room for more samples than were written.
+            self.images.append(np.load(images_path, mmap_mode='r')[:n_samples])
+            self.labels.append(labels)
+
+    def get_epoch_size(self, epoch):
+        """
+        Returns the number of samples of the given rendered epoch.
+        """
+        return len(self.images[epoch])
+
+    def decode_labels(self, epoch, indices):
+        """
+        Restores the dense encoded labels of the given samples of an epoch.
+
+        Arguments:
+            epoch (int): The rendered epoch.
+            indices (array): The indices of the samples within the epoch.
+
+        Returns:
+            A float32 array of shape `(len(indices), #boxes, #classes + 12)` in the format of `SSDInputEncoder`.
+        """
+        labels = self.labels[epoch]
+        row_offsets = labels['row_offsets']
+        y_encoded = np.repeat(self.background[np.newaxis], len(indices), axis=0)
+        for i, index in enumerate(indices):
+            rows = slice(row_offsets[index], row_offsets[index + 1])
+            anchor_indices = labels['anchor_indices'][rows]
+            class_ids = labels['class_ids'][rows]
+            y_encoded[i, anchor_indices, :self.n_classes] = 0
+            positives = class_ids >= 0
+            y_encoded[i, anchor_indices[positives], class_ids[positives]] = 1
+            y_encoded[i, anchor_indices, -12:-8] = labels['offsets'][rows]
+        return y_encoded
+
+    def generate(self, batch_size=32, shuffle=True):
+        """
+        Generates batches of images and encoded labels indefinitely.
+
+        The rendered epochs are read one after the other and start over after the last one. A batch never contains
+        samples of two different epochs, so the last batch of an epoch may be smaller than `batch_size`.
+
+        Arguments:
+            batch_size (int, optional): The size of the batches to be generated.
+            shuffle (bool, optional): Whether or not to shuffle the samples of every epoch before it is read.
+
+        Yields:
+            A tuple `(images, y_encoded)` of a uint8 array of images and a float32 array of encoded labels.
+        """
+        epoch = 0
+        while True:
+            n_samples = self.get_epoch_size(epoch)
+            order = np.random.permutation(n_samples) if shuffle else np.arange(n_samples)
+            for start in range(0, n_samples, batch_size):
+                # Reading the rows of the memory map in ascending order is faster.
+                indices = np.sort(order[start:start + batch_size])
+                yield self.images[epoch][indices], self.decode_labels(epoch, indices)
+            epoch = (epoch + 1) % self.n_epochs
@@ -23,6 +23,7 @@ import cv2
 import random
 
 from data_generator.object_detection_2d_image_boxes_validation_utils import BoxFilter, ImageValidator
+from data_generator.object_detection_2d_augmentation_log import record_or_replay
 
 
 class Resize:
@@ -35,6 +36,7 @@ class Resize:
                  width,
                  interpolation_mode=cv2.INTER_LINEAR,
                  box_filter=None,
+                 color_conversion=None,
                  labels_format=('class_id', 'xmin', 'ymin', 'xmax', 'ymax')):
         """
         Arguments:
@@ -46,6 +48,9 @@ class Resize:
                 A `BoxFilter` object to filter out bounding boxes that don't meet the given criteria after the
                 transformation. Refer to the `BoxFilter` documentation for details. If `None`, the validity of the
                 bounding boxes is not checked.
+            color_conversion (int, optional): An OpenCV color conversion code, e.g. `cv2.COLOR_BGR2RGB`. If given, the
+                resized images are converted with it, which is cheaper than converting the input images if they are
+                larger than the output images. If `None`, the channels are left unchanged.
             labels_format (list or tuple, optional): A list or tuple that defines what in the last axis of the labels
                 of an image. The list or tuple contains at least the keywords 'xmin', 'ymin', 'xmax', and 'ymax'.
         """
@@ -55,27 +60,38 @@ class Resize:
         self.out_width = width
         self.interpolation_mode = interpolation_mode
         self.box_filter = box_filter
+        self.color_conversion = color_conversion
         self.labels_format = labels_format
+        # Maps the input and output sizes and the labels format to the box coordinate columns and their scaling
+        # factors, since the same input size usually occurs over and over again.
+        self._geometry = {}
+
+    def _get_geometry(self, img_height, img_width):
+        key = (img_height, img_width, self.out_height, self.out_width, tuple(self.labels_format))
+        geometry = self._geometry.get(key)
+        if geometry is None:
+            columns = np.array([self.labels_format.index(name) for name in ('xmin', 'ymin', 'xmax', 'ymax')])
+            factors = np.array([self.out_width / img_width, self.out_height / img_height] * 2)
+            inverse_factors = np.array([img_width / self.out_width, img_height / self.out_height] * 2)
+            geometry = (columns, factors, inverse_factors)
+            self._geometry[key] = geometry
+        return geometry
 
     def __call__(self, image, labels=None, return_inverter=False):
         img_height, img_width = image.shape[:2]
-        xmin = self.labels_format.index('xmin')
-        ymin = self.labels_format.index('ymin')
-        xmax = self.labels_format.index('xmax')
-        ymax = self.labels_format.index('ymax')
+        columns, factors, inverse_factors = self._get_geometry(img_height, img_width)
         image = cv2.resize(image,
                            dsize=(self.out_width, self.out_height),
                            interpolation=self.interpolation_mode)
+        if self.color_conversion is not None:
+            image = cv2.cvtColor(image, self.color_conversion)
         if return_inverter:
             # Adam
             def inverter(new_labels):
                 old_labels = np.copy(new_labels)
                 # 此时 old_labels 的 shape 为 (num_prediction_boxes, 6), (class_id, confidence, xmin, ymin, xmax, ymax)
                 # +1 是因为相比原来的 label 多了一个 confidence
-                old_labels[:, [ymin + 1, ymax + 1]] = np.round(
-                    old_labels[:, [ymin + 1, ymax + 1]] * (img_height / self.out_height), decimals=0)
-                old_labels[:, [xmin + 1, xmax + 1]] = np.round(
-                    old_labels[:, [xmin + 1, xmax + 1]] * (img_width / self.out_width), decimals=0)
+                old_labels[:, columns + 1] = np.round(old_labels[:, columns + 1] * inverse_factors, decimals=0)
                 return old_labels
         else:
             inverter = None
@@ -87,8 +103,7 @@ class Resize:
                 return image, labels
         else:
             labels = np.copy(labels)
-            labels[:, [ymin, ymax]] = np.round(labels[:, [ymin, ymax]] * (self.out_height / img_height), decimals=0)
-            labels[:, [xmin, xmax]] = np.round(labels[:, [xmin, xmax]] * (self.out_width / img_width), decimals=0)
+            labels[:, columns] = np.round(labels[:, columns] * factors, decimals=0)
 
             if self.box_filter is not None:
                 self.box_filter.labels_format = self.labels_format
@@ -141,8 +156,11 @@ class ResizeRandomInterpolation:
                              box_filter=self.box_filter,
                              labels_format=self.labels_format)
 
+    def _sample(self):
+        return (np.random.choice(self.interpolation_modes),)
+
     def __call__(self, image, labels=None, return_inverter=False):
-        self.resize.interpolation_mode = np.random.choice(self.interpolation_modes)
+        self.resize.interpolation_mode = int(record_or_replay(self._sample)[0])
         self.resize.labels_format = self.labels_format
         return self.resize(image, labels, return_inverter)
 
@@ -222,9 +240,14 @@ class RandomFlip:
         self.labels_format = labels_format
         self.flip = Flip(dim=self.dim, labels_format=self.labels_format)
 
-    def __call__(self, image, labels=None):
+    def _sample(self):
         p = np.random.uniform(0, 1)
         if p < self.prob:
+            return ()
+        return None
+
+    def __call__(self, image, labels=None):
+        if record_or_replay(self._sample) is not None:
             self.flip.labels_format = self.labels_format
             return self.flip(image, labels)
         else:
@@ -386,7 +409,10 @@ class RandomTranslate:
                                    background=self.background,
                                    labels_format=self.labels_format)
 
-    def __call__(self, image, labels=None):
+    def _sample(self, image, labels):
+        """
+        Returns the relative translation `(dy_rel, dx_rel)` to apply, or `None` if the image is to be left unaltered.
+        """
         p = np.random.uniform(0, 1)
         if p < self.prob:
             img_height, img_width = image.shape[:2]
@@ -398,7 +424,6 @@ class RandomTranslate:
             # Override the preset labels format.
             if self.image_validator is not None:
                 self.image_validator.labels_format = self.labels_format
-            self.translate.labels_format = self.labels_format
 
             for _ in range(max(1, self.n_trials_max)):
                 # Pick the relative amount by which to translate.
@@ -407,13 +432,11 @@ class RandomTranslate:
                 # Pick the direction in which to translate.
                 dy_rel = np.random.choice([-dy_rel, dy_rel])
                 dx_rel = np.random.choice([-dx_rel, dx_rel])
-                self.translate.dy_rel = dy_rel
-                self.translate.dx_rel = dx_rel
 
                 if (labels is None) or (self.image_validator is None):
                     # We either don't have any boxes or we do but we have no image_validator,
                     # we will accept any outcome as valid.
-                    return self.translate(image, labels)
+                    return dy_rel, dx_rel
                 else:
                     # Translate the box coordinates to the translated image's coordinate system.
                     new_labels = labels.copy()
@@ -424,9 +447,16 @@ class RandomTranslate:
                     if self.image_validator(labels=new_labels,
                                             image_height=img_height,
                                             image_width=img_width):
-                        return self.translate(image, labels)
-            # If all attempts failed, return the unaltered input image.
-            return image, labels
+                        return dy_rel, dx_rel
+        # If all attempts failed, the input image remains unaltered.
+        return None
+
+    def __call__(self, image, labels=None):
+        parameters = record_or_replay(lambda: self._sample(image, labels))
+        if parameters is not None:
+            self.translate.dy_rel, self.translate.dx_rel = parameters
+            self.translate.labels_format = self.labels_format
+            return self.translate(image, labels)
         return image, labels
 
 
@@ -574,13 +604,9 @@ class RandomScale:
                            background=self.background,
                            labels_format=self.labels_format)
 
-    def __call__(self, image, labels=None):
+    def _sample(self, image, labels):
         """
-
-        Arguments:
-            image:
-            labels: (np.array, optional)
-        Returns:
+        Returns the scaling factor `(factor,)` to apply, or `None` if the image is to be left unaltered.
         """
         p = np.random.uniform(0, 1)
         if p < self.prob:
@@ -593,18 +619,16 @@ class RandomScale:
             # Override the preset labels format.
             if self.image_validator is not None:
                 self.image_validator.labels_format = self.labels_format
-            self.scale.labels_format = self.labels_format
 
             for _ in range(max(1, self.n_trials_max)):
 
                 # Pick a scaling factor.
                 factor = np.random.uniform(self.min_factor, self.max_factor)
-                self.scale.factor = factor
 
                 # Adam
                 if (labels is None) or (self.image_validator is None):
                     # We either don't have any boxes or image_validator, we will accept any outcome as valid.
-                    return self.scale(image, labels)
+                    return (factor,)
                 else:
                     # Scale the bounding boxes accordingly.
                     # Transform two opposite corner points of the rectangular boxes using the rotation matrix `M`.
@@ -624,9 +648,16 @@ class RandomScale:
                     if self.image_validator(labels=new_labels,
                                             image_height=img_height,
                                             image_width=img_width):
-                        return self.scale(image, labels)
-            # If all attempts failed, return the unaltered input image.
-            return image, labels
+                        return (factor,)
+        # If all attempts failed, the input image remains unaltered.
+        return None
+
+    def __call__(self, image, labels=None):
+        parameters = record_or_replay(lambda: self._sample(image, labels))
+        if parameters is not None:
+            self.scale.factor = parameters[0]
+            self.scale.labels_format = self.labels_format
+            return self.scale(image, labels)
         return image, labels
 
 
@@ -742,11 +773,291 @@ class RandomRotate:
         self.labels_format = labels_format
         self.rotate = Rotate(angle=90, labels_format=self.labels_format)
 
-    def __call__(self, image, labels=None):
+    def _sample(self):
         p = np.random.uniform(0, 1)
         if p < self.prob:
             # Pick a rotation angle.
-            self.rotate.angle = random.choice(self.angles)
+            return (random.choice(self.angles),)
+        return None
+
+    def __call__(self, image, labels=None):
+        parameters = record_or_replay(self._sample)
+        if parameters is not None:
+            self.rotate.angle = int(parameters[0])
             self.rotate.labels_format = self.labels_format
             return self.rotate(image, labels)
         return image, labels
+
+
+class Affine:
+    """
+    Applies an affine transformation, composed of a rotation by an arbitrary angle, a shear and a scaling about the
+    image center, to images.
+
+    Bounding boxes are transformed by mapping all four of their corners and taking the enclosing axis-aligned box of
+    the results.
+    """
+
+    def __init__(self,
+                 angle=0,
+                 shear=(0, 0),
+                 scale=1.0,
+                 fit_image=True,
+                 interpolation_mode=cv2.INTER_LINEAR,
+                 clip_boxes=True,
+                 box_filter=None,
+                 background=(0, 0, 0),
+                 labels_format=('class_id', 'xmin', 'ymin', 'xmax', 'ymax')):
+        """
+        Arguments:
+            angle (float, optional): The angle in degrees by which to rotate the images counter-clockwise.
+            shear (list/tuple, optional): A 2-tuple `(shear_x, shear_y)` of angles in degrees by which to shear the
+                images along the horizontal and the vertical axis, respectively.
+            scale (float, optional): The factor by which to scale the images.
+            fit_image (bool, optional): If `True`, the output images are just large enough to contain the entire
+                transformed images, like the output images of `Rotate`. If `False`, the output images have the same
+                size as the input images and the transformed images are centered on them.
+            interpolation_mode (int, optional): An integer that denotes a valid OpenCV interpolation mode.
+            clip_boxes (bool, optional): Only relevant if ground truth bounding boxes are given.
+                If `True`, any ground truth bounding boxes will be clipped to lie entirely within the image after the
+                transformation.
+            box_filter (BoxFilter, optional): Only relevant if ground truth bounding boxes are given.
+                A `BoxFilter` object to filter out bounding boxes that don't meet the given criteria
+                after the transformation. Refer to the `BoxFilter` documentation for details. If `None`,
+                the validity of the bounding boxes is not checked.
+            background (list/tuple, optional): A 3-tuple specifying the RGB color value of the
+                background pixels of the transformed images.
+            labels_format (list or tuple, optional): A list or tuple that defines what in the last axis of the labels
+                of an image. The list or tuple contains at least the keywords 'xmin', 'ymin', 'xmax', and 'ymax'.
+        """
+        if not (isinstance(box_filter, BoxFilter) or box_filter is None):
+            raise ValueError("`box_filter` must be either `None` or a `BoxFilter` object.")
+        if len(shear) != 2:
+            raise ValueError("`shear` must be a 2-tuple `(shear_x, shear_y)`.")
+        self.angle = angle
+        self.shear = shear
+        self.scale = scale
+        self.fit_image = fit_image
+        self.interpolation_mode = interpolation_mode
+        self.clip_boxes = clip_boxes
+        self.box_filter = box_filter
+        self.background = background
+        self.labels_format = labels_format
+
+    def get_matrix(self, img_height, img_width):
+        """
+        Returns the `(2,3)` affine transformation matrix for an image of the given size along with the height and width
+        of the output image.
+        """
+        angle = np.deg2rad(self.angle)
+        cos_angle = np.cos(angle) * self.scale
+        sin_angle = np.sin(angle) * self.scale
+        # Like `cv2.getRotationMatrix2D()`, a positive angle rotates counter-clockwise in image coordinates.
+        rotation = np.array([[cos_angle, sin_angle],
+                             [-sin_angle, cos_angle]])
+        shear = np.array([[1.0, np.tan(np.deg2rad(self.shear[0]))],
+                          [np.tan(np.deg2rad(self.shear[1])), 1.0]])
+        linear = np.dot(rotation, shear)
+        if self.fit_image:
+            # Compute the size of the bounding box of the transformed image.
+            corners = np.array([[0, 0], [img_width, 0], [0, img_height], [img_width, img_height]], dtype=np.float64)
+            extent = np.ptp(np.dot(corners, linear.T), axis=0)
+            out_width = int(round(extent[0]))
+            out_height = int(round(extent[1]))
+        else:
+            out_width = img_width
+            out_height = img_height
+        # Map the center of the input image onto the center of the output image.
+        translation = np.array([out_width / 2, out_height / 2]) - np.dot(linear, [img_width / 2, img_height / 2])
+        return np.hstack([linear, translation[:, None]]), out_height, out_width
+
+    def transform_boxes(self, labels, matrix, offset=0):
+        """
+        Returns a copy of `labels` in which every box is replaced by the enclosing axis-aligned box of its four corners
+        transformed by `matrix`. `offset` is added to the column indices of the box coordinates.
+        """
+        xmin = self.labels_format.index('xmin') + offset
+        ymin = self.labels_format.index('ymin') + offset
+        xmax = self.labels_format.index('xmax') + offset
+        ymax = self.labels_format.index('ymax') + offset
+        labels = np.copy(labels)
+        # Transform the four corners of all boxes with one matrix multiplication, the result has shape `(m,4,2)`.
+        corners = labels[:, [xmin, ymin, xmax, ymin, xmin, ymax, xmax, ymax]].reshape(-1, 4, 2)
+        corners = np.dot(corners, matrix[:, :2].T) + matrix[:, 2]
+        labels[:, [xmin, ymin]] = np.round(np.min(corners, axis=1), decimals=0)
+        labels[:, [xmax, ymax]] = np.round(np.max(corners, axis=1), decimals=0)
+        return labels
+
+    def __call__(self, image, labels=None, return_inverter=False):
+        img_height, img_width = image.shape[:2]
+        matrix, out_height, out_width = self.get_matrix(img_height, img_width)
+        image = cv2.warpAffine(image,
+                               M=matrix,
+                               dsize=(out_width, out_height),
+                               flags=self.interpolation_mode,
+                               borderMode=cv2.BORDER_CONSTANT,
+                               borderValue=self.background)
+
+        if return_inverter:
+            inverse_matrix = cv2.invertAffineTransform(matrix)
+
+            def inverter(new_labels):
+                # The predictions contain a confidence after the class ID, hence the offset of 1.
+                return self.transform_boxes(new_labels, inverse_matrix, offset=1)
+        else:
+            inverter = None
+
+        if labels is not None:
+            xmin = self.labels_format.index('xmin')
+            ymin = self.labels_format.index('ymin')
+            xmax = self.labels_format.index('xmax')
+            ymax = self.labels_format.index('ymax')
+            labels = self.transform_boxes(labels, matrix)
+
+            # Compute all valid boxes for this image.
+            if self.box_filter is not None:
+                self.box_filter.labels_format = self.labels_format
+                labels = self.box_filter(labels=labels,
+                                         image_height=out_height,
+                                         image_width=out_width)
+
+            if self.clip_boxes:
+                labels[:, [ymin, ymax]] = np.clip(labels[:, [ymin, ymax]], a_min=0, a_max=out_height - 1)
+                labels[:, [xmin, xmax]] = np.clip(labels[:, [xmin, xmax]], a_min=0, a_max=out_width - 1)
+
+        if return_inverter:
+            return image, labels, inverter
+        else:
+            return image, labels
+
+
+class RandomAffine:
+    """
+    Randomly rotates, shears and scales images by amounts drawn from given ranges.
+    """
+
+    def __init__(self,
+                 angle_range=(-180, 180),
+                 shear_range=(0, 0),
+                 scale_range=(1.0, 1.0),
+                 prob=0.5,
+                 fit_image=True,
+                 interpolation_mode=cv2.INTER_LINEAR,
+                 clip_boxes=True,
+                 box_filter=None,
+                 image_validator=None,
+                 n_trials_max=3,
+                 background=(0, 0, 0),
+                 labels_format=('class_id', 'xmin', 'ymin', 'xmax', 'ymax')):
+        """
+        Arguments:
+            angle_range (list/tuple, optional): A 2-tuple `(min, max)` of angles in degrees from which the rotation
+                angle is drawn uniformly. Positive angles rotate counter-clockwise.
+            shear_range (list/tuple, optional): A 2-tuple `(min, max)` of angles in degrees from which the horizontal
+                and the vertical shear angles are drawn uniformly and independently.
+            scale_range (list/tuple, optional): A 2-tuple `(min, max)` of positive floats from which the scaling factor
+                is drawn uniformly.
+            prob (float, optional): `(1 - prob)` determines the probability with which the original, unaltered image is
+                returned.
+            fit_image (bool, optional): If `True`, the output images are just large enough to contain the entire
+                transformed images. If `False`, the output images have the same size as the input images.
+            interpolation_mode (int, optional): An integer that denotes a valid OpenCV interpolation mode.
+            clip_boxes (bool, optional): Only relevant if ground truth bounding boxes are given.
+                If `True`, any ground truth bounding boxes will be clipped to lie entirely within the image after the
+                transformation.
+            box_filter (BoxFilter, optional): Only relevant if ground truth bounding boxes are given.
+                A `BoxFilter` object to filter out bounding boxes that don't meet the given criteria
+                after the transformation. Refer to the `BoxFilter` documentation for details. If `None`,
+                the validity of the bounding boxes is not checked.
+            image_validator (ImageValidator, optional): Only relevant if ground truth bounding boxes are given.
+                An `ImageValidator` object to determine whether a transformed image is valid. If `None`,
+                any outcome is valid.
+            n_trials_max (int, optional): Only relevant if ground truth bounding boxes are given.
+                Determines the maximum number of trials to produce a valid image. If no valid image could
+                be produced in `n_trials_max` trials, returns the unaltered input image.
+            background (list/tuple, optional): A 3-tuple specifying the RGB color value of the
+                background pixels of the transformed images.
+            labels_format (list or tuple, optional): A list or tuple that defines what in the last axis of the labels
+                of an image. The list or tuple contains at least the keywords 'xmin', 'ymin', 'xmax', and 'ymax'.
+        """
+        for name, value_range in (('angle_range', angle_range), ('shear_range', shear_range),
+                                  ('scale_range', scale_range)):
+            if value_range[0] > value_range[1]:
+                raise ValueError("It must be `{0}[0] <= {0}[1]`.".format(name))
+        if scale_range[0] <= 0:
+            raise ValueError("It must be `scale_range[0] > 0`.")
+        if not (isinstance(image_validator, ImageValidator) or image_validator is None):
+            raise ValueError("`image_validator` must be either `None` or an `ImageValidator` object.")
+        self.angle_range = angle_range
+        self.shear_range = shear_range
+        self.scale_range = scale_range
+        self.prob = prob
+        self.fit_image = fit_image
+        self.interpolation_mode = interpolation_mode
+        self.clip_boxes = clip_boxes
+        self.box_filter = box_filter
+        self.image_validator = image_validator
+        self.n_trials_max = n_trials_max
+        self.background = background
+        self.labels_format = labels_format
+        self.affine = Affine(fit_image=self.fit_image,
+                             interpolation_mode=self.interpolation_mode,
+                             clip_boxes=self.clip_boxes,
+                             box_filter=self.box_filter,
+                             background=self.background,
+                             labels_format=self.labels_format)
+
+    def _sample(self, image, labels):
+        """
+        Returns the parameters `(angle, shear_x, shear_y, scale)` to apply, or `None` if the image is to be left
+        unaltered.
+        """
+        p = np.random.uniform(0, 1)
+        if p < self.prob:
+            img_height, img_width = image.shape[:2]
+
+            # Override the preset labels format.
+            if self.image_validator is not None:
+                self.image_validator.labels_format = self.labels_format
+            self.affine.labels_format = self.labels_format
+
+            for _ in range(max(1, self.n_trials_max)):
+                # Pick the parameters of the transformation.
+                self.affine.angle = np.random.uniform(self.angle_range[0], self.angle_range[1])
+                self.affine.shear = np.random.uniform(self.shear_range[0], self.shear_range[1], size=2)
+                self.affine.scale = np.random.uniform(self.scale_range[0], self.scale_range[1])
+                parameters = (self.affine.angle, self.affine.shear[0], self.affine.shear[1], self.affine.scale)
+
+                if (labels is None) or (self.image_validator is None):
+                    # We either don't have any boxes or we do but we have no image_validator,
+                    # we will accept any outcome as valid.
+                    return parameters
+                else:
+                    # Transform the boxes to the output image's coordinate system.
+                    matrix, out_height, out_width = self.affine.get_matrix(img_height, img_width)
+                    new_labels = self.affine.transform_boxes(labels, matrix)
+
+                    # Check if the transformed image is valid.
+                    if self.image_validator(labels=new_labels,
+                                            image_height=out_height,
+                                            image_width=out_width):
+                        return parameters
+        return None
+
+    def __call__(self, image, labels=None, return_inverter=False):
+        parameters = record_or_replay(lambda: self._sample(image, labels))
+        if parameters is not None:
+            angle, shear_x, shear_y, scale = parameters
+            self.affine.angle = angle
+            self.affine.shear = (shear_x, shear_y)
+            self.affine.scale = scale
+            self.affine.labels_format = self.labels_format
+            return self.affine(image, labels, return_inverter)
+
+        # If the transformation was not applied, return the unaltered input image.
+        if return_inverter:
+            def inverter(new_labels):
+                return new_labels
+            return image, labels, inverter
+        else:
+            return image, labels
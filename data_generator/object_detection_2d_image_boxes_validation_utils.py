@@ -23,8 +23,6 @@ limitations under the License.
 from __future__ import division
 import numpy as np
 
-from bounding_box_utils.bounding_box_utils import iou
-
 
 class BoundGenerator:
     """
@@ -157,9 +155,97 @@ class BoxFilter:
         self.check_overlap = check_overlap
         self.check_min_area = check_min_area
         self.check_degenerate = check_degenerate
+        self._labels_format = None
         self.labels_format = labels_format
         self.border_pixels = border_pixels
 
+    @property
+    def labels_format(self):
+        return self._labels_format
+
+    @labels_format.setter
+    def labels_format(self, labels_format):
+        # The transformations that own a box filter set its labels format on every call, so only resolve the column
+        # indices of the box coordinates when the format actually changes.
+        if labels_format != self._labels_format:
+            self._columns = [labels_format.index(key) for key in ('xmin', 'ymin', 'xmax', 'ymax')]
+            self._labels_format = labels_format
+
+    def _get_bounds(self):
+        if isinstance(self.overlap_bounds, BoundGenerator):
+            return self.overlap_bounds()
+        else:
+            return self.overlap_bounds
+
+    def _mask(self, labels, image_height, image_width, lower, upper):
+        """
+        Evaluates all enabled criteria in one pass. The image sizes and bounds can be scalars or arrays with one
+        element per box.
+        """
+        xmin, ymin, xmax, ymax = [labels[:, i] for i in self._columns]
+        # Record the boxes that pass all checks here.
+        requirements_met = np.ones(shape=labels.shape[0], dtype=bool)
+
+        if self.check_degenerate:
+            requirements_met &= (xmax > xmin) & (ymax > ymin)
+
+        if self.check_min_area:
+            requirements_met &= (xmax - xmin) * (ymax - ymin) >= self.min_area
+
+        if self.check_overlap:
+            d = {'half': 0, 'include': 1, 'exclude': -1}[self.border_pixels]
+            if self.overlap_criterion == 'center_point':
+                # Check which of the boxes have center points within the image.
+                cy = (ymin + ymax) / 2
+                cx = (xmin + xmax) / 2
+                requirements_met &= (cy >= 0.0) & (cy <= image_height - 1) & (cx >= 0.0) & (cx <= image_width - 1)
+                return requirements_met
+            box_areas = (xmax - xmin + d) * (ymax - ymin + d)
+            if self.overlap_criterion == 'iou':
+                # Compute the IoU between the image and all boxes like `iou()` does, which computes the intersection
+                # areas with the default border pixel handling.
+                side_x = np.maximum(0, np.minimum(xmax, image_width) - np.maximum(xmin, 0))
+                side_y = np.maximum(0, np.minimum(ymax, image_height) - np.maximum(ymin, 0))
+                intersection_areas = side_x * side_y
+                image_areas = (image_width + d) * (image_height + d)
+                overlap = intersection_areas / (image_areas + box_areas - intersection_areas)
+                lower_bound = lower
+                upper_bound = upper
+            else:
+                # Compute the quotient of the intersection area of every box with the image and its own area.
+                clipped_xmin = np.minimum(np.maximum(xmin, 0), image_width - 1)
+                clipped_xmax = np.minimum(np.maximum(xmax, 0), image_width - 1)
+                clipped_ymin = np.minimum(np.maximum(ymin, 0), image_height - 1)
+                clipped_ymax = np.minimum(np.maximum(ymax, 0), image_height - 1)
+                overlap = (clipped_xmax - clipped_xmin + d) * (clipped_ymax - clipped_ymin + d)
+                lower_bound = lower * box_areas
+                upper_bound = upper * box_areas
+            # If `lower == 0`, we want to make sure that boxes with area 0 don't count, hence the ">" sign instead of
+            # the ">=" sign. Especially for the case `lower == 1` we want the ">=" sign, otherwise no boxes would count
+            # at all.
+            if np.ndim(lower) == 0:
+                mask_lower = overlap > lower_bound if lower == 0.0 else overlap >= lower_bound
+            else:
+                mask_lower = np.where(lower == 0.0, overlap > lower_bound, overlap >= lower_bound)
+            requirements_met &= mask_lower & (overlap <= upper_bound)
+
+        return requirements_met
+
+    def mask(self,
+             labels,
+             image_height=None,
+             image_width=None):
+        """
+        Returns a boolean array of shape `(m,)` that indicates which of the `m` boxes in `labels` are valid.
+        The arguments are the same as for `__call__()`.
+        """
+        labels = np.asarray(labels)
+        if self.check_overlap and self.overlap_criterion != 'center_point':
+            lower, upper = self._get_bounds()
+        else:
+            lower, upper = None, None
+        return self._mask(labels, image_height, image_width, lower, upper)
+
     def __call__(self,
                  labels,
                  image_height=None,
@@ -178,92 +264,51 @@ class BoxFilter:
         Returns:
             An array containing the labels of all boxes that are valid.
         """
+        labels = np.asarray(labels)
+        # Boolean indexing returns a copy, so the input labels are never modified.
+        return labels[self.mask(labels, image_height, image_width)]
+
+    def filter_batch(self,
+                     labels,
+                     offsets,
+                     image_heights=None,
+                     image_widths=None):
+        """
+        Filters the boxes of several images at once.
 
-        labels = np.copy(labels)
-
-        xmin = self.labels_format.index('xmin')
-        ymin = self.labels_format.index('ymin')
-        xmax = self.labels_format.index('xmax')
-        ymax = self.labels_format.index('ymax')
-
-        # Record the boxes that pass all checks here.
-        # 用于标记是否通过检查
-        requirements_met = np.ones(shape=labels.shape[0], dtype=np.bool)
-
-        if self.check_degenerate:
-            non_degenerate = (labels[:, xmax] > labels[:, xmin]) * (labels[:, ymax] > labels[:, ymin])
-            requirements_met *= non_degenerate
+        The result is the same as calling the filter once per image, except that if `overlap_bounds` is a
+        `BoundGenerator`, the bounds of all images are sampled up front.
 
-        if self.check_min_area:
-            min_area_met = (labels[:, xmax] - labels[:, xmin]) * (labels[:, ymax] - labels[:, ymin]) >= self.min_area
-            requirements_met *= min_area_met
+        Arguments:
+            labels (np.array): The concatenated labels of all images, an array of shape `(m,n)`.
+            offsets (array-like): An array of `k+1` integers for `k` images, where the labels of the `i`-th image are
+                `labels[offsets[i]:offsets[i+1]]`, so `offsets[0]` is 0 and `offsets[k]` is `m`.
+            image_heights (array-like, optional): Only relevant if `check_overlap == True`. The heights of the `k`
+                images.
+            image_widths (array-like, optional): Only relevant if `check_overlap == True`. The widths of the `k`
+                images.
 
+        Returns:
+            The concatenated labels of all valid boxes and their offsets, in the same format as the inputs.
+        """
+        labels = np.asarray(labels)
+        offsets = np.asarray(offsets)
+        counts = np.diff(offsets)
+        lower, upper = None, None
         if self.check_overlap:
-            # Get the lower and upper bounds.
-            if isinstance(self.overlap_bounds, BoundGenerator):
-                lower, upper = self.overlap_bounds()
-            else:
-                lower, upper = self.overlap_bounds
-            # Compute which boxes are valid.
-            if self.overlap_criterion == 'iou':
-                # Compute the patch coordinates.
-                # UNCLEAR: why not np.array([0, 0, image_width - 1, image_height - 1])
-                image_coords = np.array([0, 0, image_width, image_height])
-                # Compute the IoU between the patch and all of the ground truth boxes.
-                # shape 为 (num_boxes, )
-                image_boxes_iou = iou(image_coords, labels[:, [xmin, ymin, xmax, ymax]],
-                                      coords='corners',
-                                      mode='element-wise',
-                                      border_pixels=self.border_pixels)
-                # Check which boxes meet the overlap requirements.
-                # If `self.lower == 0`, we want to make sure that boxes with area 0 don't count,
-                # hence the ">" sign instead of the ">=" sign.
-                if lower == 0.0:
-                    mask_lower = image_boxes_iou > lower
-                # Especially for the case `self.lower == 1` we want the ">=" sign,
-                # otherwise no boxes would count at all.
-                else:
-                    mask_lower = image_boxes_iou >= lower
-                mask_upper = image_boxes_iou <= upper
-                requirements_met *= mask_lower * mask_upper
-            elif self.overlap_criterion == 'area':
-                if self.border_pixels == 'half':
-                    d = 0
-                # If border pixels are supposed to belong to the bounding boxes, we have to
-                # add one pixel to any difference `x_max - x_min` or `y_max - y_min`.
-                elif self.border_pixels == 'include':
-                    d = 1
-                # If border pixels are not supposed to belong to the bounding boxes, we have to
-                # subtract one pixel from any difference `x_max - x_min` or `y_max - y_min`.
+            image_heights = np.repeat(np.asarray(image_heights), counts)
+            image_widths = np.repeat(np.asarray(image_widths), counts)
+            if self.overlap_criterion != 'center_point':
+                if isinstance(self.overlap_bounds, BoundGenerator):
+                    bounds = np.array([self.overlap_bounds() for _ in range(len(counts))], dtype=np.float64)
+                    lower = np.repeat(bounds[:, 0], counts)
+                    upper = np.repeat(bounds[:, 1], counts)
                 else:
-                    d = -1
-                # Compute the areas of the boxes.
-                box_areas = (labels[:, xmax] - labels[:, xmin] + d) * (labels[:, ymax] - labels[:, ymin] + d)
-                # Compute the intersection area between the patch and all of the ground truth boxes.
-                clipped_boxes = np.copy(labels)
-                clipped_boxes[:, [ymin, ymax]] = np.clip(labels[:, [ymin, ymax]], a_min=0, a_max=image_height - 1)
-                clipped_boxes[:, [xmin, xmax]] = np.clip(labels[:, [xmin, xmax]], a_min=0, a_max=image_width - 1)
-                intersection_areas = (clipped_boxes[:, xmax] - clipped_boxes[:, xmin] + d) * (
-                            clipped_boxes[:, ymax] - clipped_boxes[:, ymin] + d)
-                # Check which boxes meet the overlap requirements.
-                # If `self.lower == 0`, we want to make sure that boxes with area 0 don't count,
-                # hence the ">" sign instead of the ">=" sign.
-                if lower == 0.0:
-                    mask_lower = intersection_areas > lower * box_areas
-                # Especially for the case `self.lower == 1` we want the ">=" sign,
-                # otherwise no boxes would count at all.
-                else:
-                    mask_lower = intersection_areas >= lower * box_areas
-                mask_upper = intersection_areas <= upper * box_areas
-                requirements_met *= mask_lower * mask_upper
-            elif self.overlap_criterion == 'center_point':
-                # Compute the center points of the boxes.
-                cy = (labels[:, ymin] + labels[:, ymax]) / 2
-                cx = (labels[:, xmin] + labels[:, xmax]) / 2
-                # Check which of the boxes have center points within the cropped patch remove those that don't.
-                requirements_met *= (cy >= 0.0) * (cy <= image_height - 1) * (cx >= 0.0) * (cx <= image_width - 1)
-
-        return labels[requirements_met]
+                    lower, upper = self.overlap_bounds
+        mask = self._mask(labels, image_heights, image_widths, lower, upper)
+        # The number of valid boxes before every position gives the new offsets.
+        n_valid = np.concatenate([[0], np.cumsum(mask)])
+        return labels[mask], n_valid[offsets]
 
 
 class ImageValidator:
@@ -337,21 +382,21 @@ class ImageValidator:
         self.box_filter.overlap_bounds = self.overlap_bounds
         self.box_filter.labels_format = self.labels_format
 
-        # Get all boxes that meet the overlap requirements.
-        valid_labels = self.box_filter(labels=labels,
-                                       image_height=image_height,
-                                       image_width=image_width)
+        # Count the boxes that meet the overlap requirements.
+        n_valid = np.count_nonzero(self.box_filter.mask(labels=labels,
+                                                        image_height=image_height,
+                                                        image_width=image_width))
 
         # Check whether enough boxes meet the requirements.
         if isinstance(self.n_boxes_min, int):
             # The image is valid if at least `self.n_boxes_min` ground truth boxes meet the requirements.
-            if len(valid_labels) >= self.n_boxes_min:
+            if n_valid >= self.n_boxes_min:
                 return True
             else:
                 return False
         elif self.n_boxes_min == 'all':
             # The image is valid if all ground truth boxes meet the requirements.
-            if len(valid_labels) == len(labels):
+            if n_valid == len(labels):
                 return True
             else:
                 return False
@@ -0,0 +1,198 @@
+"""
+Batch transformations that compose several samples into one image.
+
+Copyright (C) 2018 Pierluigi Ferrari
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from __future__ import division
+import numpy as np
+import cv2
+
+from data_generator.object_detection_2d_geometric_ops import Resize
+from data_generator.object_detection_2d_patch_sampling_ops import CropPad
+from data_generator.object_detection_2d_image_boxes_validation_utils import BoxFilter
+
+
+class Mosaic:
+    """
+    Tiles 2 to 4 images into one image of the size of the original image and merges their labels.
+
+    With probability `prob`, every image of a batch is replaced by a mosaic of itself and `n_tiles - 1` additional
+    samples of the dataset. The mosaic is split at a random point into `n_tiles` rectangular tiles:
+    4 tiles are quadrants, 2 tiles are a left and right or a top and bottom half, and 3 tiles are a left tile over the
+    full height next to a top and a bottom tile. Every sample is scaled uniformly so that it covers its tile and a random
+    tile-sized patch of it is cropped out. The boxes of the samples are clipped to their tiles, filtered with
+    `box_filter`, and moved into the coordinate system of the mosaic.
+
+    This is a batch transformation, i.e. it is passed as one of the `batch_transformations` of
+    `DataGenerator.generate()`, which sets `sample_loader` to a function that provides the additional samples after the
+    per-image transformations have been applied to them. The images of a batch may have different sizes.
+    """
+
+    def __init__(self,
+                 n_tiles=4,
+                 prob=0.5,
+                 min_split=0.25,
+                 max_split=0.75,
+                 interpolation_mode=cv2.INTER_LINEAR,
+                 box_filter=None,
+                 background=(0, 0, 0),
+                 labels_format=('class_id', 'xmin', 'ymin', 'xmax', 'ymax')):
+        """
+        Arguments:
+            n_tiles (int, optional): The number of images that make up one mosaic. Must be 2, 3, or 4.
+            prob (float, optional): `(1 - prob)` determines the probability with which an image of the batch is left
+                unchanged.
+            min_split (float, optional): The lower bound of the split point(s) of the mosaic as a fraction of the image
+                height or width.
+            max_split (float, optional): The upper bound of the split point(s) of the mosaic as a fraction of the image
+                height or width.
+            interpolation_mode (int, optional): An integer that denotes a valid OpenCV interpolation mode used to scale
+                the samples.
+            box_filter (BoxFilter, optional): Only relevant if ground truth bounding boxes are given.
+                A `BoxFilter` object to filter out the bounding boxes of a sample that don't meet the given criteria
+                after it was cropped to its tile. Refer to the `BoxFilter` documentation for details. If `None`, boxes
+                that keep less than 30% of their area or less than 16 square pixels are removed.
+            background (list/tuple, optional): A 3-tuple specifying the RGB color value of pixels that no sample
+                covers. Since the samples cover their tiles entirely, this only matters for rounding at the tile borders.
+            labels_format (list/tuple, optional): A list/tuple that defines which index in the last axis of the labels
+                of an image. The list/tuple contains at least the keywords 'xmin', 'ymin', 'xmax', and 'ymax'.
+        """
+        if not n_tiles in {2, 3, 4}:
+            raise ValueError("`n_tiles` must be 2, 3, or 4.")
+        if not (0 < min_split <= max_split < 1):
+            raise ValueError("It must be `0 < min_split <= max_split < 1`.")
+        if not (isinstance(box_filter, BoxFilter) or box_filter is None):
+            raise ValueError("`box_filter` must be either `None` or a `BoxFilter` object.")
+        if box_filter is None:
+            box_filter = BoxFilter(check_overlap=True,
+                                   check_min_area=True,
+                                   check_degenerate=True,
+                                   overlap_criterion='area',
+                                   overlap_bounds=(0.3, 1.0),
+                                   min_area=16,
+                                   labels_format=labels_format)
+        self.n_tiles = n_tiles
+        self.prob = prob
+        self.min_split = min_split
+        self.max_split = max_split
+        self.interpolation_mode = interpolation_mode
+        self.box_filter = box_filter
+        self.background = background
+        self.labels_format = labels_format
+        # Set by `DataGenerator.generate()`.
+        self.sample_loader = None
+
+    def _split(self, length):
+        return int(round(np.random.uniform(self.min_split, self.max_split) * length))
+
+    def _tiles(self, img_height, img_width):
+        """
+        Returns the tiles of a mosaic of the given size as a list of `(ymin, xmin, height, width)` tuples.
+        """
+        y = self._split(img_height)
+        x = self._split(img_width)
+        if self.n_tiles == 4:
+            return [(0, 0, y, x),
+                    (0, x, y, img_width - x),
+                    (y, 0, img_height - y, x),
+                    (y, x, img_height - y, img_width - x)]
+        elif self.n_tiles == 3:
+            return [(0, 0, img_height, x),
+                    (0, x, y, img_width - x),
+                    (y, x, img_height - y, img_width - x)]
+        elif np.random.uniform(0, 1) < 0.5:
+            return [(0, 0, img_height, x),
+                    (0, x, img_height, img_width - x)]
+        else:
+            return [(0, 0, y, img_width),
+                    (y, 0, img_height - y, img_width)]
+
+    def _fill_tile(self, mosaic, tile, image, labels):
+        """
+        Scales `image` so that it covers `tile`, copies a random tile-sized patch of it into `mosaic`, and returns the
+        labels of the patch in the coordinate system of `mosaic`.
+        """
+        tile_ymin, tile_xmin, tile_height, tile_width = tile
+        img_height, img_width = image.shape[:2]
+        scale = max(tile_height / img_height, tile_width / img_width)
+        resize = Resize(height=max(tile_height, int(np.ceil(img_height * scale))),
+                        width=max(tile_width, int(np.ceil(img_width * scale))),
+                        interpolation_mode=self.interpolation_mode,
+                        labels_format=self.labels_format)
+        image, labels = resize(image, labels)
+
+        patch_ymin = np.random.randint(0, image.shape[0] - tile_height + 1)
+        patch_xmin = np.random.randint(0, image.shape[1] - tile_width + 1)
+        self.box_filter.labels_format = self.labels_format
+        crop = CropPad(patch_ymin=patch_ymin,
+                       patch_xmin=patch_xmin,
+                       patch_height=tile_height,
+                       patch_width=tile_width,
+                       clip_boxes=True,
+                       box_filter=self.box_filter,
+                       background=self.background,
+                       labels_format=self.labels_format)
+        image, labels = crop(image, labels)
+
+        if image.ndim == mosaic.ndim:
+            mosaic[tile_ymin:tile_ymin + tile_height, tile_xmin:tile_xmin + tile_width] = image
+        else:
+            mosaic[tile_ymin:tile_ymin + tile_height, tile_xmin:tile_xmin + tile_width] = image[..., None]
+
+        if labels is None:
+            return None
+        labels = np.copy(labels)
+        labels[:, [self.labels_format.index('ymin'), self.labels_format.index('ymax')]] += tile_ymin
+        labels[:, [self.labels_format.index('xmin'), self.labels_format.index('xmax')]] += tile_xmin
+        return labels
+
+    def _compose(self, image, labels, samples, sample_labels):
+        img_height, img_width = image.shape[:2]
+        mosaic = np.zeros_like(image)
+        mosaic[:] = self.background if image.ndim == 3 else self.background[0]
+        tiles = self._tiles(img_height, img_width)
+        images = [image] + samples
+        if labels is None:
+            label_list = [None] * len(images)
+        else:
+            label_list = [labels] + sample_labels
+        merged_labels = []
+        for i in np.random.permutation(len(tiles)):
+            tile_labels = self._fill_tile(mosaic, tiles[i], images[i], label_list[i])
+            if tile_labels is not None:
+                merged_labels.append(tile_labels.astype(labels.dtype))
+        if labels is None:
+            return mosaic, None
+        else:
+            return mosaic, np.concatenate(merged_labels, axis=0)
+
+    def __call__(self, batch_x, batch_y=None):
+        if self.sample_loader is None:
+            raise ValueError("`sample_loader` must be set. Pass this transformation as one of the "
+                             "`batch_transformations` of `DataGenerator.generate()`.")
+        out_x = list(batch_x)
+        out_y = None if batch_y is None else list(batch_y)
+        for i in range(len(out_x)):
+            if np.random.uniform(0, 1) >= self.prob:
+                continue
+            samples, sample_labels = self.sample_loader(self.n_tiles - 1)
+            if batch_y is None:
+                out_x[i], _ = self._compose(out_x[i], None, samples, None)
+            else:
+                out_x[i], out_y[i] = self._compose(out_x[i], np.asarray(out_y[i]), samples, sample_labels)
+        if isinstance(batch_x, np.ndarray):
+            out_x = np.array(out_x)
+        return out_x, out_y
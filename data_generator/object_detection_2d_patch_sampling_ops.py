@@ -20,6 +20,7 @@ from __future__ import division
 import numpy as np
 
 from data_generator.object_detection_2d_image_boxes_validation_utils import BoundGenerator, BoxFilter, ImageValidator
+from data_generator.object_detection_2d_augmentation_log import record_or_replay
 
 
 class PatchCoordinateGenerator:
@@ -551,7 +552,11 @@ class RandomPatch:
                                     background=self.background,
                                     labels_format=self.labels_format)
 
-    def __call__(self, image, labels=None, return_inverter=False):
+    def _sample(self, image, labels):
+        """
+        Returns the coordinates `(ymin, xmin, height, width)` of a valid patch, an empty tuple if no valid patch could
+        be sampled, or `None` if the image is to be left unaltered.
+        """
         p = np.random.uniform(0, 1)
         if p < self.prob:
             img_height, img_width = image.shape[:2]
@@ -564,18 +569,13 @@ class RandomPatch:
             # Override the preset labels format.
             if self.image_validator is not None:
                 self.image_validator.labels_format = self.labels_format
-            self.sample_patch.labels_format = self.labels_format
 
             for _ in range(max(1, self.n_trials_max)):
                 # Generate patch coordinates.
                 patch_ymin, patch_xmin, patch_height, patch_width = self.patch_coord_generator()
-                self.sample_patch.patch_ymin = patch_ymin
-                self.sample_patch.patch_xmin = patch_xmin
-                self.sample_patch.patch_height = patch_height
-                self.sample_patch.patch_width = patch_width
                 if (labels is None) or (self.image_validator is None):
                     # We either don't have any boxes or if we do, we will accept any outcome as valid.
-                    return self.sample_patch(image, labels, return_inverter)
+                    return patch_ymin, patch_xmin, patch_height, patch_width
                 else:
                     # Translate the box coordinates to the patch's coordinate system.
                     new_labels = np.copy(labels)
@@ -585,8 +585,21 @@ class RandomPatch:
                     if self.image_validator(labels=new_labels,
                                             image_height=patch_height,
                                             image_width=patch_width):
-                        return self.sample_patch(image, labels, return_inverter)
+                        return patch_ymin, patch_xmin, patch_height, patch_width
+            return ()
+        return None
 
+    def __call__(self, image, labels=None, return_inverter=False):
+        parameters = record_or_replay(lambda: self._sample(image, labels))
+        if parameters:
+            patch_ymin, patch_xmin, patch_height, patch_width = [int(value) for value in parameters]
+            self.sample_patch.patch_ymin = patch_ymin
+            self.sample_patch.patch_xmin = patch_xmin
+            self.sample_patch.patch_height = patch_height
+            self.sample_patch.patch_width = patch_width
+            self.sample_patch.labels_format = self.labels_format
+            return self.sample_patch(image, labels, return_inverter)
+        elif parameters is not None:
             # If we weren't able to sample a valid patch, return None
             if self.can_fail:
                 if return_inverter:
@@ -692,7 +705,11 @@ class RandomPatchInf:
                                     background=self.background,
                                     labels_format=self.labels_format)
 
-    def __call__(self, image, labels=None, return_inverter=False):
+    def _sample(self, image, labels):
+        """
+        Returns the coordinates `(ymin, xmin, height, width)` of a valid patch, or `None` if the image is to be left
+        unaltered.
+        """
         img_height, img_width = image.shape[:2]
         self.patch_coord_generator.img_height = img_height
         self.patch_coord_generator.img_width = img_width
@@ -703,7 +720,6 @@ class RandomPatchInf:
         # Override the preset labels format.
         if self.image_validator is not None:
             self.image_validator.labels_format = self.labels_format
-        self.sample_patch.labels_format = self.labels_format
 
         # Keep going until we either find a valid patch or return the original image.
         while True:
@@ -716,10 +732,6 @@ class RandomPatchInf:
                 for _ in range(max(1, self.n_trials_max)):
                     # Generate patch coordinates.
                     patch_ymin, patch_xmin, patch_height, patch_width = self.patch_coord_generator()
-                    self.sample_patch.patch_ymin = patch_ymin
-                    self.sample_patch.patch_xmin = patch_xmin
-                    self.sample_patch.patch_height = patch_height
-                    self.sample_patch.patch_width = patch_width
 
                     # Check if the resulting patch meets the aspect ratio requirements.
                     aspect_ratio = patch_width / patch_height
@@ -728,7 +740,7 @@ class RandomPatchInf:
                         continue
                     if (labels is None) or (self.image_validator is None):
                         # We either don't have any boxes or if we do, we will accept any outcome as valid.
-                        return self.sample_patch(image, labels, return_inverter)
+                        return patch_ymin, patch_xmin, patch_height, patch_width
                     else:
                         # Translate the box coordinates to the patch's coordinate system.
                         new_labels = np.copy(labels)
@@ -738,14 +750,27 @@ class RandomPatchInf:
                         if self.image_validator(labels=new_labels,
                                                 image_height=patch_height,
                                                 image_width=patch_width):
-                            return self.sample_patch(image, labels, return_inverter)
+                            return patch_ymin, patch_xmin, patch_height, patch_width
             else:
-                if return_inverter:
-                    def inverter(translated_labels):
-                        return translated_labels
-                    return image, labels, inverter
-                else:
-                    return image, labels
+                return None
+
+    def __call__(self, image, labels=None, return_inverter=False):
+        parameters = record_or_replay(lambda: self._sample(image, labels))
+        if parameters is not None:
+            patch_ymin, patch_xmin, patch_height, patch_width = [int(value) for value in parameters]
+            self.sample_patch.patch_ymin = patch_ymin
+            self.sample_patch.patch_xmin = patch_xmin
+            self.sample_patch.patch_height = patch_height
+            self.sample_patch.patch_width = patch_width
+            self.sample_patch.labels_format = self.labels_format
+            return self.sample_patch(image, labels, return_inverter)
+        else:
+            if return_inverter:
+                def inverter(translated_labels):
+                    return translated_labels
+                return image, labels, inverter
+            else:
+                return image, labels
 
 
 class RandomMaxCropFixedAR:
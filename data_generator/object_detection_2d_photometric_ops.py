@@ -20,6 +20,40 @@ from __future__ import division
 import numpy as np
 import cv2
 
+from data_generator.object_detection_2d_augmentation_log import record_or_replay
+
+
+class _LookupTable:
+    """
+    A 256-entry `uint8` lookup table for a point-wise intensity transformation, cached for the last parameter it was
+    built for.
+    """
+
+    def __init__(self, function, dtype=np.float32, rounding='round'):
+        """
+        Arguments:
+            function (callable): Takes the array of all 256 pixel values and the parameter of the transformation and
+                returns the transformed values. The result is clipped to [0, 255].
+            dtype (type, optional): The float data type that `function` is evaluated in. `np.float32` gives the same
+                results as applying the transformation to an image that was converted with `ConvertDataType`.
+            rounding (str, optional): 'round' rounds the transformed values like `ConvertDataType(to='uint8')`,
+                'truncate' truncates them like `astype(np.uint8)`.
+        """
+        self.function = function
+        self.values = np.arange(256, dtype=dtype)
+        self.rounding = rounding
+        self.parameter = None
+        self.table = None
+
+    def __call__(self, parameter):
+        if self.table is None or parameter != self.parameter:
+            table = np.clip(self.function(self.values, parameter), 0, 255)
+            if self.rounding == 'round':
+                table = np.round(table, decimals=0)
+            self.table = table.astype(np.uint8)
+            self.parameter = parameter
+        return self.table
+
 
 class ConvertColor:
     """
@@ -108,7 +142,9 @@ class Hue:
 
     Important:
         - Expects HSV input.
-        - Expects input array to be of `dtype` `float`.
+        - Expects input array to be of `dtype` `float` or `uint8`. `uint8` input, as produced by `ConvertColor`, is
+          modified in place through a modular lookup table on the H channel. This gives the same result as converting to float, applying the
+          transformation and converting back with `ConvertDataType(to='uint8')`.
     """
 
     def __init__(self, delta):
@@ -121,8 +157,12 @@ class Hue:
         if not (-180 <= delta <= 180):
             raise ValueError("`delta` must be in the closed interval `[-180, 180]`.")
         self.delta = delta
+        self.table = _LookupTable(lambda values, delta: (values + delta) % 180.0)
 
     def __call__(self, image, labels=None):
+        if image.dtype == np.uint8:
+            image[:, :, 0] = cv2.LUT(image[:, :, 0], self.table(self.delta))
+            return image, labels
         image[:, :, 0] = (image[:, :, 0] + self.delta) % 180.0
         return image, labels
 
@@ -133,7 +173,7 @@ class RandomHue:
 
     Important:
         - Expects HSV input.
-        - Expects input array to be of `dtype` `float`.
+        - Expects input array to be of `dtype` `float` or `uint8`. See `Hue` for the handling of `uint8` input.
     """
 
     def __init__(self, max_delta=18, prob=0.5):
@@ -150,10 +190,16 @@ class RandomHue:
         self.prob = prob
         self.change_hue = Hue(delta=0)
 
-    def __call__(self, image, labels=None):
+    def _sample(self):
         p = np.random.uniform(0, 1)
         if p < self.prob:
-            self.change_hue.delta = np.random.uniform(-self.max_delta, self.max_delta)
+            return (np.random.uniform(-self.max_delta, self.max_delta),)
+        return None
+
+    def __call__(self, image, labels=None):
+        parameters = record_or_replay(self._sample)
+        if parameters is not None:
+            self.change_hue.delta = parameters[0]
             return self.change_hue(image, labels)
         return image, labels
 
@@ -164,7 +210,9 @@ class Saturation:
 
     Important:
         - Expects HSV input.
-        - Expects input array to be of `dtype` `float`.
+        - Expects input array to be of `dtype` `float` or `uint8`. `uint8` input, as produced by `ConvertColor`, is
+          modified in place through a clipped lookup table on the S channel. This gives the same result as converting to float, applying the
+          transformation and converting back with `ConvertDataType(to='uint8')`.
     """
 
     def __init__(self, factor):
@@ -176,8 +224,12 @@ class Saturation:
         if factor <= 0.0:
             raise ValueError("It must be `factor > 0`.")
         self.factor = factor
+        self.table = _LookupTable(lambda values, factor: values * factor)
 
     def __call__(self, image, labels=None):
+        if image.dtype == np.uint8:
+            image[:, :, 1] = cv2.LUT(image[:, :, 1], self.table(self.factor))
+            return image, labels
         image[:, :, 1] = np.clip(image[:, :, 1] * self.factor, 0, 255)
         return image, labels
 
@@ -188,7 +240,7 @@ class RandomSaturation:
 
     Important:
         - Expects HSV input.
-        - Expects input array to be of `dtype` `float`.
+        - Expects input array to be of `dtype` `float` or `uint8`. See `Saturation` for the handling of `uint8` input.
     """
 
     def __init__(self, lower=0.3, upper=2.0, prob=0.5):
@@ -207,10 +259,16 @@ class RandomSaturation:
         self.prob = prob
         self.change_saturation = Saturation(factor=1.0)
 
-    def __call__(self, image, labels=None):
+    def _sample(self):
         p = np.random.uniform(0, 1)
         if p < self.prob:
-            self.change_saturation.factor = np.random.uniform(self.lower, self.upper)
+            return (np.random.uniform(self.lower, self.upper),)
+        return None
+
+    def __call__(self, image, labels=None):
+        parameters = record_or_replay(self._sample)
+        if parameters is not None:
+            self.change_saturation.factor = parameters[0]
             return self.change_saturation(image, labels)
         return image, labels
 
@@ -221,7 +279,9 @@ class Brightness:
 
     Important:
         - Expects RGB input.
-        - Expects input array to be of `dtype` `float`.
+        - Expects input array to be of `dtype` `float` or `uint8`. `uint8` input is transformed through a lookup table
+          and the output is `uint8`, too. This gives the same result as converting to float, applying the
+          transformation and converting back with `ConvertDataType(to='uint8')`.
     """
 
     def __init__(self, delta):
@@ -230,11 +290,14 @@ class Brightness:
             delta (float): An integer, the float to add to or subtract from the intensity of every pixel.
 
         Returns:
-            image (dtype float64), label(maybe)
+            image (dtype float64, or uint8 for uint8 input), label(maybe)
         """
         self.delta = delta
+        self.table = _LookupTable(lambda values, delta: values + delta)
 
     def __call__(self, image, labels=None):
+        if image.dtype == np.uint8:
+            return cv2.LUT(image, self.table(self.delta)), labels
         # 小于 0 取 0, 大于 255 取 255
         image = np.clip(image + self.delta, 0, 255)
         return image, labels
@@ -246,7 +309,7 @@ class RandomBrightness:
 
     Important:
         - Expects RGB input.
-        - Expects input array to be of `dtype` `float`.
+        - Expects input array to be of `dtype` `float` or `uint8`. See `Brightness` for the handling of `uint8` input.
     """
 
     def __init__(self, lower=-84, upper=84, prob=0.5):
@@ -266,10 +329,16 @@ class RandomBrightness:
         self.prob = prob
         self.change_brightness = Brightness(delta=0)
 
-    def __call__(self, image, labels=None):
+    def _sample(self):
         p = np.random.uniform(0, 1)
         if p < self.prob:
-            self.change_brightness.delta = np.random.uniform(self.lower, self.upper)
+            return (np.random.uniform(self.lower, self.upper),)
+        return None
+
+    def __call__(self, image, labels=None):
+        parameters = record_or_replay(self._sample)
+        if parameters is not None:
+            self.change_brightness.delta = parameters[0]
             return self.change_brightness(image, labels)
         return image, labels
 
@@ -280,7 +349,9 @@ class Contrast:
 
     Important:
         - Expects RGB input.
-        - Expects input array to be of `dtype` `float`.
+        - Expects input array to be of `dtype` `float` or `uint8`. `uint8` input is transformed through a lookup table
+          and the output is `uint8`, too. This gives the same result as converting to float, applying the
+          transformation and converting back with `ConvertDataType(to='uint8')`.
     """
 
     def __init__(self, factor):
@@ -292,8 +363,11 @@ class Contrast:
         if factor <= 0.0:
             raise ValueError("It must be `factor > 0`.")
         self.factor = factor
+        self.table = _LookupTable(lambda values, factor: 127.5 + factor * (values - 127.5))
 
     def __call__(self, image, labels=None):
+        if image.dtype == np.uint8:
+            return cv2.LUT(image, self.table(self.factor)), labels
         image = np.clip(127.5 + self.factor * (image - 127.5), 0, 255)
         return image, labels
 
@@ -304,7 +378,7 @@ class RandomContrast:
 
     Important:
         - Expects RGB input.
-        - Expects input array to be of `dtype` `float`.
+        - Expects input array to be of `dtype` `float` or `uint8`. See `Contrast` for the handling of `uint8` input.
     """
 
     def __init__(self, lower=0.5, upper=1.5, prob=0.5):
@@ -323,10 +397,16 @@ class RandomContrast:
         self.prob = prob
         self.change_contrast = Contrast(factor=1.0)
 
-    def __call__(self, image, labels=None):
+    def _sample(self):
         p = np.random.uniform(0, 1)
         if p < self.prob:
-            self.change_contrast.factor = np.random.uniform(self.lower, self.upper)
+            return (np.random.uniform(self.lower, self.upper),)
+        return None
+
+    def __call__(self, image, labels=None):
+        parameters = record_or_replay(self._sample)
+        if parameters is not None:
+            self.change_contrast.factor = parameters[0]
             return self.change_contrast(image, labels)
         return image, labels
 
@@ -346,13 +426,14 @@ class Gamma:
         if gamma <= 0.0:
             raise ValueError("It must be `gamma > 0`.")
         self.gamma = gamma
-        self.gamma_inv = 1.0 / gamma
-        # Build a lookup table mapping the pixel values [0, 255] to
-        # their adjusted gamma values.
-        self.table = np.array([((i / 255.0) ** self.gamma_inv) * 255 for i in np.arange(0, 256)]).astype("uint8")
+        # Lookup tables mapping the pixel values [0, 255] to their adjusted gamma values. The table is only rebuilt
+        # when `gamma` changes.
+        self.table = _LookupTable(lambda values, gamma: ((values / 255.0) ** (1.0 / gamma)) * 255,
+                                  dtype=np.float64,
+                                  rounding='truncate')
 
     def __call__(self, image, labels=None):
-        image = cv2.LUT(image, self.table)
+        image = cv2.LUT(image, self.table(self.gamma))
         return image, labels
 
 
@@ -377,13 +458,19 @@ class RandomGamma:
         self.lower = lower
         self.upper = upper
         self.prob = prob
+        self.change_gamma = Gamma(gamma=1.0)
 
-    def __call__(self, image, labels=None):
+    def _sample(self):
         p = np.random.uniform(0, 1)
         if p >= (1.0 - self.prob):
-            gamma = np.random.uniform(self.lower, self.upper)
-            change_gamma = Gamma(gamma=gamma)
-            return change_gamma(image, labels)
+            return (np.random.uniform(self.lower, self.upper),)
+        return None
+
+    def __call__(self, image, labels=None):
+        parameters = record_or_replay(self._sample)
+        if parameters is not None:
+            self.change_gamma.gamma = parameters[0]
+            return self.change_gamma(image, labels)
         return image, labels
 
 
@@ -419,9 +506,14 @@ class RandomHistogramEqualization:
         self.prob = prob
         self.equalize = HistogramEqualization()
 
-    def __call__(self, image, labels=None):
+    def _sample(self):
         p = np.random.uniform(0, 1)
         if p < self.prob:
+            return ()
+        return None
+
+    def __call__(self, image, labels=None):
+        if record_or_replay(self._sample) is not None:
             return self.equalize(image, labels)
         return image, labels
 
@@ -464,11 +556,16 @@ class RandomChannelSwap:
                              (2, 0, 1), (2, 1, 0))
         self.swap_channels = ChannelSwap(order=(0, 1, 2))
 
-    def __call__(self, image, labels=None):
+    def _sample(self):
         p = np.random.uniform(0, 1)
         if p < self.prob:
             # There are 6 possible permutations.
-            i = np.random.randint(5)
-            self.swap_channels.order = self.permutations[i]
+            return (np.random.randint(5),)
+        return None
+
+    def __call__(self, image, labels=None):
+        parameters = record_or_replay(self._sample)
+        if parameters is not None:
+            self.swap_channels.order = self.permutations[int(parameters[0])]
             return self.swap_channels(image, labels)
         return image, labels
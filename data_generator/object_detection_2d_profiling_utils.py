@@ -0,0 +1,196 @@
+"""
+Utilities to profile the transformations of a data generation pipeline.
+
+Copyright (C) 2018 Pierluigi Ferrari
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from __future__ import division
+import numpy as np
+from collections import OrderedDict
+import json
+import time
+import tracemalloc
+
+
+def _root(array):
+    while isinstance(array.base, np.ndarray):
+        array = array.base
+    return array
+
+
+class TransformProfiler:
+    """
+    Records the wall time, the number of calls, the output sizes and the allocated memory of every transformation
+    that is called through it.
+
+    Pass an instance as the `profiler` argument of `DataGenerator.generate()`. The generator then calls all
+    transformations (and the label encoder) through the profiler, and composite transformations that have a `profiler`
+    attribute (like `SSDDataAugmentation`) report their individual steps, too. Nested steps are recorded under their
+    path, e.g. 'SSDDataAugmentation/SSDExpand', so the time of a composite transformation includes the time of its
+    steps.
+
+    If the generator is called without a profiler, transformations are called directly, so profiling costs nothing
+    when it is disabled.
+    """
+
+    def __init__(self, trace_allocations=False):
+        """
+        Arguments:
+            trace_allocations (bool, optional): If `False`, the allocated memory of a transformation is the size of its
+                output image if that image does not share memory with the input image. This is cheap, but it does not
+                see temporary arrays. If `True`, the peak memory allocated during each call is measured with
+                `tracemalloc`, which accounts for all temporaries, but slows down the pipeline considerably.
+        """
+        if trace_allocations and not hasattr(tracemalloc, 'reset_peak'):
+            raise ValueError("`trace_allocations` requires Python 3.9 or later.")
+        self.trace_allocations = trace_allocations
+        self.stats = OrderedDict()
+        self._stack = []
+        # For `trace_allocations`: per active call, the traced memory at the start and the highest peak seen so far.
+        self._memory = []
+        self._started_tracing = False
+
+    def reset(self):
+        """
+        Discards all recorded statistics.
+        """
+        self.stats = OrderedDict()
+
+    def __call__(self, transform, *args, **kwargs):
+        """
+        Calls `transform(*args, **kwargs)`, records its statistics and returns its result.
+        """
+        self._stack.append(type(transform).__name__)
+        key = '/'.join(self._stack)
+        # Create the entry before calling the transformation so that parents are listed before their steps.
+        self._get_entry(key)
+        if self.trace_allocations:
+            self._enter_memory()
+        start = time.perf_counter()
+        try:
+            result = transform(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            self._stack.pop()
+            allocated = self._exit_memory() if self.trace_allocations else None
+
+        output = result[0] if isinstance(result, tuple) else result
+        if allocated is None:
+            allocated = 0
+            if isinstance(output, np.ndarray):
+                if not (args and isinstance(args[0], np.ndarray) and _root(output) is _root(args[0])):
+                    allocated = output.nbytes
+        self.record(key, elapsed, output, allocated)
+        return result
+
+    def _enter_memory(self):
+        if not self._memory:
+            self._started_tracing = not tracemalloc.is_tracing()
+            if self._started_tracing:
+                tracemalloc.start()
+        current, peak = tracemalloc.get_traced_memory()
+        if self._memory:
+            self._memory[-1][1] = max(self._memory[-1][1], peak)
+        tracemalloc.reset_peak()
+        self._memory.append([current, current])
+
+    def _exit_memory(self):
+        start, highest = self._memory.pop()
+        peak = max(highest, tracemalloc.get_traced_memory()[1])
+        if self._memory:
+            self._memory[-1][1] = max(self._memory[-1][1], peak)
+            tracemalloc.reset_peak()
+        elif self._started_tracing:
+            tracemalloc.stop()
+        return peak - start
+
+    def _get_entry(self, key):
+        entry = self.stats.get(key)
+        if entry is None:
+            entry = {'calls': 0,
+                     'total_time': 0.0,
+                     'min_time': float('inf'),
+                     'max_time': 0.0,
+                     'output_bytes': 0,
+                     'allocated_bytes': 0,
+                     'output_shape': None}
+            self.stats[key] = entry
+        return entry
+
+    def record(self, key, elapsed, output=None, allocated=0):
+        """
+        Adds one call to the statistics of `key`.
+
+        Arguments:
+            key (str): The name under which to record the call.
+            elapsed (float): The wall time of the call in seconds.
+            output (array, optional): The output of the call. If it is a Numpy array, its size is recorded.
+            allocated (int, optional): The number of bytes allocated by the call.
+        """
+        entry = self._get_entry(key)
+        entry['calls'] += 1
+        entry['total_time'] += elapsed
+        entry['min_time'] = min(entry['min_time'], elapsed)
+        entry['max_time'] = max(entry['max_time'], elapsed)
+        entry['allocated_bytes'] += int(allocated)
+        if isinstance(output, np.ndarray):
+            entry['output_bytes'] += output.nbytes
+            entry['output_shape'] = tuple(output.shape)
+
+    def to_dict(self):
+        """
+        Returns the recorded statistics as a dictionary that maps every key to a dictionary with the total, mean,
+        minimum and maximum wall time in seconds, the number of calls, the mean output size and the mean allocated
+        memory in bytes, and the shape of the last output.
+        """
+        result = OrderedDict()
+        for key, entry in self.stats.items():
+            calls = entry['calls']
+            if calls == 0:
+                continue
+            result[key] = {'calls': calls,
+                           'total_time': entry['total_time'],
+                           'mean_time': entry['total_time'] / calls,
+                           'min_time': entry['min_time'],
+                           'max_time': entry['max_time'],
+                           'mean_output_bytes': entry['output_bytes'] / calls,
+                           'mean_allocated_bytes': entry['allocated_bytes'] / calls,
+                           'last_output_shape': entry['output_shape']}
+        return result
+
+    def dump(self, filepath):
+        """
+        Writes the result of `to_dict()` to a JSON file.
+        """
+        with open(filepath, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def summary(self):
+        """
+        Returns the recorded statistics formatted as a table. Nested steps are indented below their parents and the
+        share of the time is relative to the total time of all top-level entries.
+        """
+        stats = self.to_dict()
+        top_level_time = sum(entry['total_time'] for key, entry in stats.items() if '/' not in key)
+        names = ['  ' * key.count('/') + key.rsplit('/', 1)[-1] for key in stats]
+        width = max([len(name) for name in names] + [9])
+        lines = ['{:<{w}}  {:>8}  {:>10}  {:>10}  {:>7}  {:>13}  {:>13}'.format(
+            'transform', 'calls', 'total [s]', 'mean [ms]', 'share', 'output [MB]', 'alloc. [MB]', w=width)]
+        for name, entry in zip(names, stats.values()):
+            share = entry['total_time'] / top_level_time if top_level_time > 0 else 0.0
+            lines.append('{:<{w}}  {:>8d}  {:>10.3f}  {:>10.3f}  {:>6.1f}%  {:>13.3f}  {:>13.3f}'.format(
+                name, entry['calls'], entry['total_time'], 1000 * entry['mean_time'], 100 * share,
+                entry['mean_output_bytes'] / 1e6, entry['mean_allocated_bytes'] / 1e6, w=width))
+        return '\n'.join(lines)
@@ -0,0 +1,1019 @@
+"""
+Data augmentation operations that run as TensorFlow operations on whole batches, as an alternative to the Numpy/OpenCV
+transformations that are applied to one image at a time.
+
+Copyright (C) 2018 Pierluigi Ferrari
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from __future__ import division
+import numpy as np
+import cv2
+import tensorflow as tf
+
+from data_generator.object_detection_2d_image_boxes_validation_utils import BoxFilter, ImageValidator, BoundGenerator
+from data_generator.object_detection_2d_patch_sampling_ops import PatchCoordinateGenerator
+
+# Inside the graph, a batch is represented by four tensors:
+#   images: A float32 tensor of shape `(batch_size, height, width, 3)` with integer values in [0, 255]. Images of
+#       different sizes are padded at the bottom and on the right, only the top left `image_sizes[i]` pixels of
+#       image `i` are valid.
+#   labels: A float64 tensor of shape `(batch_size, n_boxes, k)` that contains the labels in the given labels format,
+#       padded with arbitrary rows. `None` if there are no labels.
+#   mask: A boolean tensor of shape `(batch_size, n_boxes)` that is `True` for the rows of `labels` that are valid
+#       boxes. `None` if there are no labels.
+#   image_sizes: An int32 tensor of shape `(batch_size, 2)` that contains the height and width of every image.
+#
+# Every operation has a `parameters` attribute that lists the dtype and the shape of its per-image random parameters,
+# a `sample_parameters(img_height, img_width)` method that draws these parameters for one image on the host and
+# returns them together with the size of the transformed image, and an `apply()` method that transforms a batch in the
+# graph given the sampled parameters. The parameters are drawn with `np.random` in exactly the same order as the
+# equivalent Numpy transformations draw them, so a fixed Numpy seed produces the same augmentations with both
+# backends.
+
+_COEF_BITS = 11
+_COEF_SCALE = 1 << _COEF_BITS
+_HSV_SHIFT = 12
+
+
+def _hsv_division_tables():
+    values = np.arange(1, 256, dtype=np.float64)
+    sdiv = np.zeros(256, dtype=np.int32)
+    hdiv = np.zeros(256, dtype=np.int32)
+    sdiv[1:] = np.round((255 << _HSV_SHIFT) / values)
+    hdiv[1:] = np.round((180 << _HSV_SHIFT) / (6.0 * values))
+    return sdiv, hdiv
+
+
+# The reciprocal tables of OpenCV's 8-bit RGB to HSV conversion.
+_SDIV_TABLE, _HDIV_TABLE = _hsv_division_tables()
+# For each sector of the hue circle, the entries of the HSV to RGB lookup table that hold the blue, green and red value.
+_HSV_SECTORS = np.array([[1, 3, 0], [1, 0, 2], [3, 0, 1], [0, 2, 1], [0, 1, 3], [2, 1, 0]], dtype=np.int32)
+
+
+def _coordinate_indices(labels_format):
+    return [labels_format.index(key) for key in ('xmin', 'ymin', 'xmax', 'ymax')]
+
+
+def _per_image(values, ndims=4):
+    """
+    Reshapes a tensor of shape `(batch_size,)` so that it broadcasts against a tensor with `ndims` dimensions.
+    """
+    return tf.reshape(values, [-1] + [1] * (ndims - 1))
+
+
+def _replace_columns(labels, columns):
+    """
+    Returns `labels` with the columns whose indices are the keys of `columns` replaced by the respective values.
+    """
+    split = tf.unstack(labels, num=labels.get_shape()[-1].value, axis=-1)
+    for index, column in columns.items():
+        split[index] = column
+    return tf.stack(split, axis=-1)
+
+
+def _select_images(condition, new, old):
+    """
+    Selects whole batch items from `new` where `condition` is `True` and from `old` otherwise.
+    """
+    if new is None:
+        return None
+    return tf.where(condition, new, old)
+
+
+def _gather_pixels(images, rows, columns):
+    """
+    Gathers the pixels `images[i, rows[i, j], columns[i, k]]` of every image into a tensor of shape
+    `(batch_size, n_rows, n_columns, channels)`. `rows` and `columns` are integer tensors of shape `(batch_size, n)`.
+    """
+    shape = tf.shape(images)
+    pixels = tf.reshape(images, [-1, shape[3]])
+    batch_index = tf.reshape(tf.range(shape[0]), [-1, 1, 1])
+    indices = (batch_index * shape[1] + tf.expand_dims(rows, axis=2)) * shape[2] + tf.expand_dims(columns, axis=1)
+    return tf.gather(pixels, indices)
+
+
+def _check_filter(box_filter):
+    if box_filter is None:
+        return
+    if not isinstance(box_filter, (BoxFilter, ImageValidator)):
+        raise ValueError("`box_filter` must be either `None` or a `BoxFilter` object.")
+    if isinstance(box_filter.overlap_bounds, BoundGenerator):
+        raise ValueError("The TensorFlow operations only support fixed `overlap_bounds`, not a `BoundGenerator`.")
+
+
+def _overlap_mask(box_filter, labels, image_heights, image_widths):
+    """
+    Computes which boxes meet the overlap requirements of `box_filter` in the graph, with the same arithmetic as
+    `BoxFilter`. `image_heights` and `image_widths` are float64 tensors of shape `(batch_size, 1)`.
+    """
+    xmin, ymin, xmax, ymax = [labels[..., i] for i in _coordinate_indices(box_filter.labels_format)]
+    lower, upper = box_filter.overlap_bounds
+    if box_filter.overlap_criterion == 'center_point':
+        cy = (ymin + ymax) / 2
+        cx = (xmin + xmax) / 2
+        return tf.logical_and(tf.logical_and(cy >= 0.0, cy <= image_heights - 1),
+                              tf.logical_and(cx >= 0.0, cx <= image_widths - 1))
+    d = {'half': 0, 'include': 1, 'exclude': -1}[box_filter.border_pixels]
+    if box_filter.overlap_criterion == 'iou':
+        # Like `iou()`, which computes the intersection with the default border pixel handling.
+        side_x = tf.maximum(tf.minimum(xmax, image_widths) - tf.maximum(xmin, 0.0), 0.0)
+        side_y = tf.maximum(tf.minimum(ymax, image_heights) - tf.maximum(ymin, 0.0), 0.0)
+        intersection = side_x * side_y
+        image_areas = (image_widths + d) * (image_heights + d)
+        box_areas = (xmax - xmin + d) * (ymax - ymin + d)
+        overlap = intersection / (image_areas + box_areas - intersection)
+        upper_bound = upper
+    else:
+        box_areas = (xmax - xmin + d) * (ymax - ymin + d)
+        clipped_xmin = tf.clip_by_value(xmin, 0.0, image_widths - 1)
+        clipped_xmax = tf.clip_by_value(xmax, 0.0, image_widths - 1)
+        clipped_ymin = tf.clip_by_value(ymin, 0.0, image_heights - 1)
+        clipped_ymax = tf.clip_by_value(ymax, 0.0, image_heights - 1)
+        overlap = (clipped_xmax - clipped_xmin + d) * (clipped_ymax - clipped_ymin + d)
+        lower = lower * box_areas
+        upper_bound = upper * box_areas
+    mask_lower = overlap > lower if box_filter.overlap_bounds[0] == 0.0 else overlap >= lower
+    return tf.logical_and(mask_lower, overlap <= upper_bound)
+
+
+def _filter_boxes(box_filter, labels, mask, image_heights, image_widths):
+    """
+    Applies a `BoxFilter` in the graph by updating the mask of valid boxes.
+    """
+    if box_filter is None:
+        return mask
+    xmin, ymin, xmax, ymax = [labels[..., i] for i in _coordinate_indices(box_filter.labels_format)]
+    if box_filter.check_degenerate:
+        mask = tf.logical_and(mask, tf.logical_and(xmax > xmin, ymax > ymin))
+    if box_filter.check_min_area:
+        mask = tf.logical_and(mask, (xmax - xmin) * (ymax - ymin) >= box_filter.min_area)
+    if box_filter.check_overlap:
+        mask = tf.logical_and(mask, _overlap_mask(box_filter, labels, image_heights, image_widths))
+    return mask
+
+
+def _crop_pad(images, labels, mask, image_sizes, patches, background, clip_boxes, box_filter, labels_format):
+    """
+    Crops and/or pads every image to its own patch like `CropPad`. `patches` is an int32 tensor of shape
+    `(batch_size, 4)` that contains the top left corner, the height and the width of the patch of every image.
+    """
+    patch_ymin, patch_xmin, patch_heights, patch_widths = tf.unstack(patches, axis=1)
+    canvas_height = tf.reduce_max(patch_heights)
+    canvas_width = tf.reduce_max(patch_widths)
+    # The source pixel of every canvas pixel, and whether it lies within the image.
+    rows = tf.expand_dims(tf.range(canvas_height), axis=0) + tf.expand_dims(patch_ymin, axis=1)
+    columns = tf.expand_dims(tf.range(canvas_width), axis=0) + tf.expand_dims(patch_xmin, axis=1)
+    row_inside = tf.logical_and(rows >= 0, rows < tf.expand_dims(image_sizes[:, 0], axis=1))
+    column_inside = tf.logical_and(columns >= 0, columns < tf.expand_dims(image_sizes[:, 1], axis=1))
+    rows = tf.clip_by_value(rows, 0, tf.shape(images)[1] - 1)
+    columns = tf.clip_by_value(columns, 0, tf.shape(images)[2] - 1)
+    patch = _gather_pixels(images, rows, columns)
+    inside = tf.cast(tf.logical_and(tf.expand_dims(row_inside, axis=2), tf.expand_dims(column_inside, axis=1)),
+                     tf.float32)
+    inside = tf.expand_dims(inside, axis=3)
+    images = patch * inside + tf.constant(background, dtype=tf.float32) * (1.0 - inside)
+    image_sizes = tf.stack([patch_heights, patch_widths], axis=1)
+
+    if labels is not None:
+        xmin, ymin, xmax, ymax = _coordinate_indices(labels_format)
+        offset_y = tf.expand_dims(tf.cast(patch_ymin, tf.float64), axis=1)
+        offset_x = tf.expand_dims(tf.cast(patch_xmin, tf.float64), axis=1)
+        labels = _replace_columns(labels, {ymin: labels[..., ymin] - offset_y,
+                                           ymax: labels[..., ymax] - offset_y,
+                                           xmin: labels[..., xmin] - offset_x,
+                                           xmax: labels[..., xmax] - offset_x})
+        heights = tf.expand_dims(tf.cast(patch_heights, tf.float64), axis=1)
+        widths = tf.expand_dims(tf.cast(patch_widths, tf.float64), axis=1)
+        mask = _filter_boxes(box_filter, labels, mask, heights, widths)
+        if clip_boxes:
+            labels = _replace_columns(labels, {ymin: tf.clip_by_value(labels[..., ymin], 0.0, heights - 1),
+                                               ymax: tf.clip_by_value(labels[..., ymax], 0.0, heights - 1),
+                                               xmin: tf.clip_by_value(labels[..., xmin], 0.0, widths - 1),
+                                               xmax: tf.clip_by_value(labels[..., xmax], 0.0, widths - 1)})
+    return images, labels, mask, image_sizes
+
+
+class TFResize:
+    """
+    Resizes all images of a batch to a specified height and width in pixels, the TensorFlow equivalent of `Resize`.
+
+    Supports `cv2.INTER_LINEAR` and `cv2.INTER_NEAREST`. Bilinear interpolation reproduces the 11-bit fixed point
+    arithmetic of OpenCV, so the output is identical to that of `cv2.resize()`.
+    """
+
+    parameters = ()
+
+    def __init__(self,
+                 height,
+                 width,
+                 interpolation_mode=cv2.INTER_LINEAR,
+                 box_filter=None,
+                 labels_format=('class_id', 'xmin', 'ymin', 'xmax', 'ymax')):
+        """
+        Arguments:
+            height (int): The desired height of the output images in pixels.
+            width (int): The desired width of the output images in pixels.
+            interpolation_mode (int, optional): Either `cv2.INTER_LINEAR` or `cv2.INTER_NEAREST`.
+            box_filter (BoxFilter, optional): Only relevant if ground truth bounding boxes are given.
+                A `BoxFilter` object to filter out bounding boxes that don't meet the given criteria after the
+                transformation. Its `overlap_bounds` must be fixed. If `None`, the validity of the bounding boxes
+                is not checked.
+            labels_format (list or tuple, optional): A list or tuple that defines what in the last axis of the labels
+                of an image. The list or tuple contains at least the keywords 'xmin', 'ymin', 'xmax', and 'ymax'.
+        """
+        if interpolation_mode not in {cv2.INTER_LINEAR, cv2.INTER_NEAREST}:
+            raise ValueError("`interpolation_mode` must be either `cv2.INTER_LINEAR` or `cv2.INTER_NEAREST`.")
+        _check_filter(box_filter)
+        self.out_height = height
+        self.out_width = width
+        self.interpolation_mode = interpolation_mode
+        self.box_filter = box_filter
+        self.labels_format = labels_format
+
+    def sample_parameters(self, img_height, img_width):
+        return (), self.out_height, self.out_width
+
+    def _linear_coordinates(self, in_sizes, out_size, clamp):
+        # The source coordinates and the quantized interpolation coefficients exactly as `cv2.resize()` computes them.
+        scale = 1.0 / (out_size / tf.cast(in_sizes, tf.float64))
+        positions = tf.cast(tf.range(out_size), tf.float64) + 0.5
+        coordinates = tf.cast(tf.expand_dims(positions, axis=0) * tf.expand_dims(scale, axis=1) - 0.5, tf.float32)
+        start = tf.floor(coordinates)
+        fraction = coordinates - start
+        start = tf.cast(start, tf.int32)
+        last = tf.expand_dims(in_sizes - 1, axis=1)
+        if clamp:
+            outside = tf.logical_or(start < 0, start >= last)
+            fraction = tf.where(outside, tf.zeros_like(fraction), fraction)
+        first = tf.clip_by_value(start, 0, last)
+        second = tf.clip_by_value(start + 1, 0, last)
+        weight_second = tf.cast(tf.round(fraction * _COEF_SCALE), tf.int32)
+        weight_first = tf.cast(tf.round((1.0 - fraction) * _COEF_SCALE), tf.int32)
+        return first, second, weight_first, weight_second
+
+    def _resize_linear(self, images, image_sizes):
+        x0, x1, wx0, wx1 = self._linear_coordinates(image_sizes[:, 1], self.out_width, clamp=True)
+        y0, y1, wy0, wy1 = self._linear_coordinates(image_sizes[:, 0], self.out_height, clamp=False)
+        pixels = tf.cast(images, tf.int32)
+        wx0 = tf.reshape(wx0, [-1, 1, self.out_width, 1])
+        wx1 = tf.reshape(wx1, [-1, 1, self.out_width, 1])
+        wy0 = tf.reshape(wy0, [-1, self.out_height, 1, 1])
+        wy1 = tf.reshape(wy1, [-1, self.out_height, 1, 1])
+        # Horizontal pass on the two source rows of every output row, then the vertical pass.
+        top = _gather_pixels(pixels, y0, x0) * wx0 + _gather_pixels(pixels, y0, x1) * wx1
+        bottom = _gather_pixels(pixels, y1, x0) * wx0 + _gather_pixels(pixels, y1, x1) * wx1
+        resized = ((top // 16) * wy0 // 65536 + (bottom // 16) * wy1 // 65536 + 2) // 4
+        return tf.cast(tf.clip_by_value(resized, 0, 255), tf.float32)
+
+    def _resize_nearest(self, images, image_sizes):
+        def source(in_sizes, out_size):
+            scale = 1.0 / (out_size / tf.cast(in_sizes, tf.float64))
+            positions = tf.cast(tf.range(out_size), tf.float64)
+            indices = tf.cast(tf.floor(tf.expand_dims(positions, axis=0) * tf.expand_dims(scale, axis=1)), tf.int32)
+            return tf.minimum(indices, tf.expand_dims(in_sizes - 1, axis=1))
+        rows = source(image_sizes[:, 0], self.out_height)
+        columns = source(image_sizes[:, 1], self.out_width)
+        return _gather_pixels(images, rows, columns)
+
+    def apply(self, images, labels, mask, image_sizes, parameters):
+        if self.interpolation_mode == cv2.INTER_LINEAR:
+            resized = self._resize_linear(images, image_sizes)
+        else:
+            resized = self._resize_nearest(images, image_sizes)
+        if labels is not None:
+            xmin, ymin, xmax, ymax = _coordinate_indices(self.labels_format)
+            scale_y = tf.expand_dims(self.out_height / tf.cast(image_sizes[:, 0], tf.float64), axis=1)
+            scale_x = tf.expand_dims(self.out_width / tf.cast(image_sizes[:, 1], tf.float64), axis=1)
+            labels = _replace_columns(labels, {ymin: tf.round(labels[..., ymin] * scale_y),
+                                               ymax: tf.round(labels[..., ymax] * scale_y),
+                                               xmin: tf.round(labels[..., xmin] * scale_x),
+                                               xmax: tf.round(labels[..., xmax] * scale_x)})
+            if self.box_filter is not None:
+                self.box_filter.labels_format = self.labels_format
+                heights = tf.fill([tf.shape(labels)[0], 1], tf.constant(self.out_height, tf.float64))
+                widths = tf.fill([tf.shape(labels)[0], 1], tf.constant(self.out_width, tf.float64))
+                mask = _filter_boxes(self.box_filter, labels, mask, heights, widths)
+        image_sizes = tf.fill(tf.shape(image_sizes), 0) + tf.constant([self.out_height, self.out_width])
+        return resized, labels, mask, image_sizes
+
+
+class TFFlip:
+    """
+    Flips all images of a batch horizontally or vertically, the TensorFlow equivalent of `Flip`.
+    """
+
+    parameters = ()
+
+    def __init__(self,
+                 dim='horizontal',
+                 labels_format=('class_id', 'xmin', 'ymin', 'xmax', 'ymax')):
+        """
+        Arguments:
+            dim (str, optional): Can be either of 'horizontal' and 'vertical'.
+                If 'horizontal', images will be flipped horizontally, i.e. along the vertical axis.
+                If 'vertical', images will be flipped vertically, i.e. along the horizontal axis.
+            labels_format (list or tuple, optional): A list or tuple that defines what in the last axis of the labels
+                of an image. The list or tuple contains at least the keywords 'xmin', 'ymin', 'xmax', and 'ymax'.
+        """
+        if dim not in {'horizontal', 'vertical'}:
+            raise ValueError("`dim` can be one of 'horizontal' and 'vertical'.")
+        self.dim = dim
+        self.labels_format = labels_format
+
+    def sample_parameters(self, img_height, img_width):
+        return (), img_height, img_width
+
+    def flip(self, images, labels, image_sizes, flip):
+        """
+        Flips the batch items for which the boolean tensor `flip` of shape `(batch_size,)` is `True`.
+        """
+        xmin, ymin, xmax, ymax = _coordinate_indices(self.labels_format)
+        if self.dim == 'horizontal':
+            axis, lengths, low, high = 2, image_sizes[:, 1], xmin, xmax
+        else:
+            axis, lengths, low, high = 1, image_sizes[:, 0], ymin, ymax
+        # Only the valid part of every image is reversed, so the padding stays where it is.
+        lengths = tf.cast(tf.where(flip, lengths, tf.zeros_like(lengths)), tf.int64)
+        images = tf.reverse_sequence(images, lengths, seq_axis=axis, batch_axis=0)
+        if labels is not None:
+            extent = tf.expand_dims(tf.cast(image_sizes[:, axis - 1], tf.float64), axis=1) - 1
+            flipped = _replace_columns(labels, {low: extent - labels[..., high], high: extent - labels[..., low]})
+            labels = tf.where(flip, flipped, labels)
+        return images, labels
+
+    def apply(self, images, labels, mask, image_sizes, parameters):
+        flip = tf.fill([tf.shape(images)[0]], True)
+        images, labels = self.flip(images, labels, image_sizes, flip)
+        return images, labels, mask, image_sizes
+
+
+class TFRandomFlip:
+    """
+    Randomly flips the images of a batch horizontally or vertically, the TensorFlow equivalent of `RandomFlip`.
+    The randomness only refers to whether or not an image will be flipped.
+    """
+
+    parameters = ((tf.bool, ()),)
+
+    def __init__(self,
+                 dim='horizontal',
+                 prob=0.5,
+                 labels_format=('class_id', 'xmin', 'ymin', 'xmax', 'ymax')):
+        """
+        Arguments:
+            dim (str, optional): Can be either of 'horizontal' and 'vertical'.
+                If 'horizontal', images will be flipped horizontally, i.e. along the vertical axis.
+                If 'vertical', images will be flipped vertically, i.e. along the horizontal axis.
+            prob (float, optional): `(1 - prob)` determines the probability with which the original,
+                unaltered image is returned.
+            labels_format (list or tuple, optional): A list or tuple that defines what in the last axis of the labels
+                of an image. The list or tuple contains at least the keywords 'xmin', 'ymin', 'xmax', and 'ymax'.
+        """
+        self.dim = dim
+        self.prob = prob
+        self.labels_format = labels_format
+        self.flip = TFFlip(dim=self.dim, labels_format=self.labels_format)
+
+    def sample_parameters(self, img_height, img_width):
+        p = np.random.uniform(0, 1)
+        return (p < self.prob,), img_height, img_width
+
+    def apply(self, images, labels, mask, image_sizes, parameters):
+        self.flip.labels_format = self.labels_format
+        images, labels = self.flip.flip(images, labels, image_sizes, parameters[0])
+        return images, labels, mask, image_sizes
+
+
+class _TFPointwise:
+    """
+    Base class of the photometric operations. They transform the pixel values with the same float32 arithmetic as the
+    lookup tables of the Numpy versions, so their output is identical.
+    """
+
+    parameters = ()
+    # The channels that the operation changes, or `None` for all channels.
+    channel = None
+
+    def __init__(self, parameter):
+        self.parameter = parameter
+
+    def adjust(self, values, parameter):
+        raise NotImplementedError
+
+    def sample_parameters(self, img_height, img_width):
+        return (), img_height, img_width
+
+    def transform(self, images, parameter):
+        """
+        Applies the operation to all images with the per-image float32 parameters `parameter` of shape
+        `(batch_size,)`.
+        """
+        if self.channel is None:
+            values = images
+        else:
+            channels = tf.unstack(images, num=3, axis=-1)
+            values = channels[self.channel]
+        values = tf.round(tf.clip_by_value(self.adjust(values, _per_image(parameter, values.get_shape().ndims)),
+                                           0.0, 255.0))
+        if self.channel is None:
+            return values
+        channels[self.channel] = values
+        return tf.stack(channels, axis=-1)
+
+    def apply(self, images, labels, mask, image_sizes, parameters):
+        parameter = tf.fill([tf.shape(images)[0]], tf.constant(self.parameter, tf.float32))
+        return self.transform(images, parameter), labels, mask, image_sizes
+
+
+class _TFRandomPointwise:
+    """
+    Base class of the random photometric operations. Draws whether to apply the operation and its parameter like the
+    Numpy versions do.
+    """
+
+    parameters = ((tf.bool, ()), (tf.float32, ()))
+
+    def __init__(self, operation, lower, upper, prob):
+        self.operation = operation
+        self.lower = lower
+        self.upper = upper
+        self.prob = prob
+
+    def sample_parameters(self, img_height, img_width):
+        p = np.random.uniform(0, 1)
+        if p < self.prob:
+            return (True, np.random.uniform(self.lower, self.upper)), img_height, img_width
+        return (False, 0.0), img_height, img_width
+
+    def apply(self, images, labels, mask, image_sizes, parameters):
+        applied, parameter = parameters
+        return _select_images(applied, self.operation.transform(images, parameter), images), labels, mask, image_sizes
+
+
+class TFBrightness(_TFPointwise):
+    """
+    Changes the brightness of RGB images, the TensorFlow equivalent of `Brightness`.
+    """
+
+    def __init__(self, delta):
+        """
+        Arguments:
+            delta (float): The value to add to or subtract from the intensity of every pixel.
+        """
+        super(TFBrightness, self).__init__(delta)
+
+    def adjust(self, values, delta):
+        return values + delta
+
+
+class TFRandomBrightness(_TFRandomPointwise):
+    """
+    Randomly changes the brightness of RGB images, the TensorFlow equivalent of `RandomBrightness`.
+    """
+
+    def __init__(self, lower=-84, upper=84, prob=0.5):
+        """
+        Arguments:
+            lower (int, optional): An integer, the lower bound for the random brightness change.
+            upper (int, optional): An integer, the upper bound for the random brightness change.
+                Must be greater than `lower`.
+            prob (float, optional): `(1 - prob)` determines the probability with which the original,
+                unaltered image is returned.
+        """
+        if lower >= upper:
+            raise ValueError("`upper` must be greater than `lower`.")
+        super(TFRandomBrightness, self).__init__(TFBrightness(0), float(lower), float(upper), prob)
+
+
+class TFContrast(_TFPointwise):
+    """
+    Changes the contrast of RGB images, the TensorFlow equivalent of `Contrast`.
+    """
+
+    def __init__(self, factor):
+        """
+        Arguments:
+            factor (float): A float greater than zero that determines contrast change, where values less than one
+                result in less contrast and values greater than one result in more contrast.
+        """
+        if factor <= 0.0:
+            raise ValueError("It must be `factor > 0`.")
+        super(TFContrast, self).__init__(factor)
+
+    def adjust(self, values, factor):
+        return 127.5 + factor * (values - 127.5)
+
+
+class TFRandomContrast(_TFRandomPointwise):
+    """
+    Randomly changes the contrast of RGB images, the TensorFlow equivalent of `RandomContrast`.
+    """
+
+    def __init__(self, lower=0.5, upper=1.5, prob=0.5):
+        """
+        Arguments:
+            lower (float, optional): A float greater than zero, the lower bound for the random contrast change.
+            upper (float, optional): A float greater than zero, the upper bound for the random contrast change.
+                Must be greater than `lower`.
+            prob (float, optional): `(1 - prob)` determines the probability with which the original,
+                unaltered image is returned.
+        """
+        if lower >= upper:
+            raise ValueError("`upper` must be greater than `lower`.")
+        elif lower <= 0.0:
+            raise ValueError("`lower` must be greater than zero.")
+        super(TFRandomContrast, self).__init__(TFContrast(1.0), lower, upper, prob)
+
+
+class TFSaturation(_TFPointwise):
+    """
+    Changes the saturation of HSV images, the TensorFlow equivalent of `Saturation`.
+    """
+
+    channel = 1
+
+    def __init__(self, factor):
+        """
+        Arguments:
+            factor (float): A float greater than zero that determines saturation change, where values less than one
+                result in less saturation and values greater than one result in more saturation.
+        """
+        if factor <= 0.0:
+            raise ValueError("It must be `factor > 0`.")
+        super(TFSaturation, self).__init__(factor)
+
+    def adjust(self, values, factor):
+        return values * factor
+
+
+class TFRandomSaturation(_TFRandomPointwise):
+    """
+    Randomly changes the saturation of HSV images, the TensorFlow equivalent of `RandomSaturation`.
+    """
+
+    def __init__(self, lower=0.3, upper=2.0, prob=0.5):
+        """
+        Arguments:
+            lower (float, optional): A float greater than zero, the lower bound for the random saturation change.
+            upper (float, optional): A float greater than zero, the upper bound for the random saturation change.
+                Must be greater than `lower`.
+            prob (float, optional): `(1 - prob)` determines the probability with which the original,
+                unaltered image is returned.
+        """
+        if lower >= upper:
+            raise ValueError("`upper` must be greater than `lower`.")
+        super(TFRandomSaturation, self).__init__(TFSaturation(1.0), lower, upper, prob)
+
+
+class TFHue(_TFPointwise):
+    """
+    Changes the hue of HSV images, the TensorFlow equivalent of `Hue`.
+    """
+
+    channel = 0
+
+    def __init__(self, delta):
+        """
+        Arguments:
+            delta (int): An integer in the closed interval `[-180, 180]` that determines the hue change, where
+                a change by integer `delta` means a change by `2 * delta` degrees.
+        """
+        if not (-180 <= delta <= 180):
+            raise ValueError("`delta` must be in the closed interval `[-180, 180]`.")
+        super(TFHue, self).__init__(delta)
+
+    def adjust(self, values, delta):
+        return tf.floormod(values + delta, 180.0)
+
+
+class TFRandomHue(_TFRandomPointwise):
+    """
+    Randomly changes the hue of HSV images, the TensorFlow equivalent of `RandomHue`.
+    """
+
+    def __init__(self, max_delta=18, prob=0.5):
+        """
+        Arguments:
+            max_delta (int): An integer in the closed interval `[0, 180]` that determines the maximal absolute
+                hue change.
+            prob (float, optional): `(1 - prob)` determines the probability with which the original,
+                unaltered image is returned.
+        """
+        if not (0 <= max_delta <= 180):
+            raise ValueError("`max_delta` must be in the closed interval `[0, 180]`.")
+        super(TFRandomHue, self).__init__(TFHue(0), -max_delta, max_delta, prob)
+
+
+class TFConvertColor:
+    """
+    Converts images between RGB and HSV, the TensorFlow equivalent of `ConvertColor`. Uses the 8-bit HSV convention of
+    OpenCV, i.e. the hue is in [0, 180).
+
+    The RGB to HSV conversion reproduces the integer arithmetic of `cv2.cvtColor()` exactly. The HSV to RGB
+    conversion reproduces the float arithmetic of OpenCV 4's vectorized implementation, which computes
+    `1 - s * h` with fused multiply-adds and truncates the result. OpenCV converts the last few pixels of every image
+    row that don't fill a whole vector with scalar code that rounds instead, so these pixels may deviate by one
+    intensity level.
+    """
+
+    parameters = ()
+
+    def __init__(self, current='RGB', to='HSV'):
+        """
+        Arguments:
+            current (str, optional): The current color space of the images. Can be one of 'RGB' and 'HSV'.
+            to (str, optional): The target color space of the images. Can be one of 'RGB' and 'HSV'.
+        """
+        if {current, to} != {'RGB', 'HSV'}:
+            raise ValueError("The TensorFlow color conversion only converts from 'RGB' to 'HSV' and vice versa.")
+        self.current = current
+        self.to = to
+
+    def sample_parameters(self, img_height, img_width):
+        return (), img_height, img_width
+
+    def _rgb_to_hsv(self, images):
+        r, g, b = tf.unstack(tf.cast(images, tf.int32), num=3, axis=-1)
+        v = tf.maximum(tf.maximum(r, g), b)
+        diff = v - tf.minimum(tf.minimum(r, g), b)
+        half = 1 << (_HSV_SHIFT - 1)
+        s = (diff * tf.gather(_SDIV_TABLE, v) + half) // (1 << _HSV_SHIFT)
+        h = tf.where(tf.equal(v, r), g - b, tf.where(tf.equal(v, g), b - r + 2 * diff, r - g + 4 * diff))
+        h = (h * tf.gather(_HDIV_TABLE, diff) + half) // (1 << _HSV_SHIFT)
+        h = tf.where(h < 0, h + 180, h)
+        return tf.cast(tf.stack([h, s, v], axis=-1), tf.float32)
+
+    def _hsv_to_rgb(self, images):
+        h, s, v = tf.unstack(images, num=3, axis=-1)
+        s = s * np.float32(1 / 255.)
+        v = v * np.float32(1 / 255.)
+        h = h * np.float32(6. / 180)
+        sector = tf.floor(h)
+        h = h - sector
+        sector = tf.floormod(tf.cast(sector, tf.int32), 6)
+
+        def fused(a, b):
+            # `1 - a * b` rounded once, like a fused multiply-add.
+            return tf.cast(1.0 - tf.cast(a, tf.float64) * tf.cast(b, tf.float64), tf.float32)
+
+        table = [v, v * (1.0 - s), v * fused(s, h), v * fused(s, 1.0 - h)]
+        in_sector = [tf.equal(sector, i) for i in range(6)]
+        channels = []
+        for channel in (2, 1, 0):
+            # Start with the sectors that use the first entry of the table and overwrite the others.
+            value = table[0]
+            for i in range(6):
+                entry = _HSV_SECTORS[i, channel]
+                if entry != 0:
+                    value = tf.where(in_sector[i], table[entry], value)
+            channels.append(value)
+        return tf.clip_by_value(tf.floor(tf.stack(channels, axis=-1) * 255.0), 0.0, 255.0)
+
+    def apply(self, images, labels, mask, image_sizes, parameters):
+        if self.current == 'RGB':
+            return self._rgb_to_hsv(images), labels, mask, image_sizes
+        return self._hsv_to_rgb(images), labels, mask, image_sizes
+
+
+class TFCropPad:
+    """
+    Crops and/or pads all images of a batch deterministically, the TensorFlow equivalent of `CropPad`.
+    """
+
+    parameters = ()
+
+    def __init__(self,
+                 patch_ymin,
+                 patch_xmin,
+                 patch_height,
+                 patch_width,
+                 clip_boxes=True,
+                 box_filter=None,
+                 background=(0, 0, 0),
+                 labels_format=('class_id', 'xmin', 'ymin', 'xmax', 'ymax')):
+        """
+        Arguments:
+            patch_ymin (int): The vertical coordinate of the top left corner of the output patch relative to
+                the image coordinate system. Can be negative as long as the resulting patch still overlaps with the
+                image.
+            patch_xmin (int): The horizontal coordinate of the top left corner of the output patch relative to
+                the image coordinate system. Can be negative as long as the resulting patch still overlaps with the
+                image.
+            patch_height (int): The height of the patch to be sampled from the image. Can be greater than the
+                height of the input image.
+            patch_width (int): The width of the patch to be sampled from the image. Can be greater than the
+                width of the input image.
+            clip_boxes (bool, optional): Only relevant if ground truth bounding boxes are given.
+                If `True`, any ground truth bounding boxes will be clipped to lie entirely within the
+                sampled patch.
+            box_filter (BoxFilter, optional): Only relevant if ground truth bounding boxes are given.
+                A `BoxFilter` object to filter out bounding boxes that don't meet the given criteria after the
+                transformation. Its `overlap_bounds` must be fixed. If `None`, the validity of the bounding boxes
+                is not checked.
+            background (list/tuple, optional): A 3-tuple specifying the RGB color value of the potential background
+                pixels of the patches.
+            labels_format (list/tuple, optional): A list/tuple that defines which index in the last axis of the labels
+                of an image. The list/tuple contains at least the keywords 'xmin', 'ymin', 'xmax', and 'ymax'.
+        """
+        if (patch_height <= 0) or (patch_width <= 0):
+            raise ValueError("Patch height and width must both be positive.")
+        _check_filter(box_filter)
+        self.patch_ymin = patch_ymin
+        self.patch_xmin = patch_xmin
+        self.patch_height = patch_height
+        self.patch_width = patch_width
+        self.clip_boxes = clip_boxes
+        self.box_filter = box_filter
+        self.background = background
+        self.labels_format = labels_format
+
+    def sample_parameters(self, img_height, img_width):
+        if (img_height is not None) and ((self.patch_ymin > img_height) or (self.patch_xmin > img_width)):
+            raise ValueError("The given patch doesn't overlap with the input image.")
+        return (), self.patch_height, self.patch_width
+
+    def apply(self, images, labels, mask, image_sizes, parameters):
+        if self.box_filter is not None:
+            self.box_filter.labels_format = self.labels_format
+        patch = tf.constant([self.patch_ymin, self.patch_xmin, self.patch_height, self.patch_width], tf.int32)
+        patches = tf.tile(tf.expand_dims(patch, axis=0), [tf.shape(images)[0], 1])
+        return _crop_pad(images, labels, mask, image_sizes, patches, self.background, self.clip_boxes,
+                         self.box_filter, self.labels_format)
+
+
+class TFRandomPatch:
+    """
+    Randomly samples a patch from every image of a batch, the TensorFlow equivalent of `RandomPatch` with
+    `can_fail == False`.
+
+    The patch coordinates are drawn on the host by the given `PatchCoordinateGenerator`, the patches are validated,
+    cropped and padded in the graph. If an image validator is given, all `n_trials_max` candidate patches of an image
+    are drawn up front and the first valid one is used, so the random state then advances differently than with
+    `RandomPatch`, which stops drawing at the first valid patch. Without an image validator, or with
+    `n_trials_max == 1`, both draw exactly the same numbers.
+    """
+
+    def __init__(self,
+                 patch_coord_generator,
+                 box_filter=None,
+                 image_validator=None,
+                 n_trials_max=3,
+                 clip_boxes=True,
+                 prob=1.0,
+                 background=(0, 0, 0),
+                 labels_format=('class_id', 'xmin', 'ymin', 'xmax', 'ymax')):
+        """
+        Arguments:
+            patch_coord_generator (PatchCoordinateGenerator): A `PatchCoordinateGenerator` object to generate the
+                positions and sizes of the patches to be sampled from the input images.
+            box_filter (BoxFilter, optional): Only relevant if ground truth bounding boxes are given.
+                A `BoxFilter` object to filter out bounding boxes that don't meet the given criteria after the
+                transformation. Its `overlap_bounds` must be fixed. If `None`, the validity of the bounding boxes
+                is not checked.
+            image_validator (ImageValidator, optional): Only relevant if ground truth bounding boxes are given.
+                An `ImageValidator` object to determine whether a sampled patch is valid. Its `overlap_bounds` must be
+                fixed. If `None`, any outcome is valid.
+            n_trials_max (int, optional): Only relevant if ground truth bounding boxes are given.
+                Determines the maxmial number of trials to sample a valid patch. If no valid patch could be sampled in
+                `n_trials_max` trials, the unaltered image is returned.
+            clip_boxes (bool, optional): Only relevant if ground truth bounding boxes are given.
+                If `True`, any ground truth bounding boxes will be clipped to lie entirely within the sampled patch.
+            prob (float, optional): `(1 - prob)` determines the probability with which the original, unaltered image is
+                returned.
+            background (list/tuple, optional): A 3-tuple specifying the RGB color value of the potential background
+                pixels of the patches.
+            labels_format (list/tuple, optional): A list/tuple that defines which index in the last axis of the labels
+                of an image. The list/tuple contains at least the keywords 'xmin', 'ymin', 'xmax', and 'ymax'.
+        """
+        if not isinstance(patch_coord_generator, PatchCoordinateGenerator):
+            raise ValueError("`patch_coord_generator` must be an instance of `PatchCoordinateGenerator`.")
+        if not (isinstance(image_validator, ImageValidator) or image_validator is None):
+            raise ValueError("`image_validator` must be either `None` or an `ImageValidator` object.")
+        _check_filter(box_filter)
+        _check_filter(image_validator)
+        self.patch_coord_generator = patch_coord_generator
+        self.box_filter = box_filter
+        self.image_validator = image_validator
+        self.n_trials_max = n_trials_max
+        self.clip_boxes = clip_boxes
+        self.prob = prob
+        self.background = background
+        self.labels_format = labels_format
+        # The number of candidate patches that are drawn per image.
+        self.n_trials = 1 if image_validator is None else max(1, n_trials_max)
+        # Whether the patch is sampled and the candidate patches as `(ymin, xmin, height, width)`.
+        self.parameters = ((tf.bool, ()), (tf.int32, (self.n_trials, 4)))
+
+    def sample_parameters(self, img_height, img_width):
+        if img_height is None:
+            raise ValueError("`TFRandomPatch` needs to know the image size, so it cannot follow a `TFRandomPatch` "
+                             "with an image validator unless there is a `TFResize` in between.")
+        candidates = np.zeros((self.n_trials, 4), dtype=np.int32)
+        candidates[:, 2] = img_height
+        candidates[:, 3] = img_width
+        p = np.random.uniform(0, 1)
+        if p >= self.prob:
+            return (False, candidates), img_height, img_width
+        self.patch_coord_generator.img_height = img_height
+        self.patch_coord_generator.img_width = img_width
+        for trial in range(self.n_trials):
+            candidates[trial] = self.patch_coord_generator()
+        if self.image_validator is None:
+            return (True, candidates), candidates[0, 2], candidates[0, 3]
+        # The graph decides which candidate is valid, so the size of the patch is unknown on the host.
+        return (True, candidates), None, None
+
+    def apply(self, images, labels, mask, image_sizes, parameters):
+        sample, candidates = parameters
+        n_trials = self.n_trials
+        if (labels is None) or (self.image_validator is None):
+            valid = tf.concat([tf.ones_like(candidates[:, :1, 0], tf.bool),
+                               tf.zeros_like(candidates[:, 1:, 0], tf.bool)], axis=1)
+        else:
+            self.image_validator.labels_format = self.labels_format
+            self.image_validator.box_filter.overlap_bounds = self.image_validator.overlap_bounds
+            self.image_validator.box_filter.labels_format = self.labels_format
+            xmin, ymin, xmax, ymax = _coordinate_indices(self.labels_format)
+            # Evaluate all candidates at once: shape `(batch_size, n_trials, n_boxes, k)`.
+            tiled = tf.tile(tf.expand_dims(labels, axis=1), [1, n_trials, 1, 1])
+            offset_y = tf.expand_dims(tf.cast(candidates[:, :, 0], tf.float64), axis=2)
+            offset_x = tf.expand_dims(tf.cast(candidates[:, :, 1], tf.float64), axis=2)
+            translated = _replace_columns(tiled, {ymin: tiled[..., ymin] - offset_y,
+                                                  ymax: tiled[..., ymax] - offset_y,
+                                                  xmin: tiled[..., xmin] - offset_x,
+                                                  xmax: tiled[..., xmax] - offset_x})
+            heights = tf.expand_dims(tf.cast(candidates[:, :, 2], tf.float64), axis=2)
+            widths = tf.expand_dims(tf.cast(candidates[:, :, 3], tf.float64), axis=2)
+            box_mask = tf.tile(tf.expand_dims(mask, axis=1), [1, n_trials, 1])
+            passed = _filter_boxes(self.image_validator.box_filter, translated, box_mask, heights, widths)
+            n_passed = tf.reduce_sum(tf.cast(passed, tf.int32), axis=2)
+            if self.image_validator.n_boxes_min == 'all':
+                valid = tf.equal(n_passed, tf.reduce_sum(tf.cast(box_mask, tf.int32), axis=2))
+            else:
+                valid = n_passed >= self.image_validator.n_boxes_min
+        # Use the first valid candidate. Images without a valid candidate remain unaltered.
+        found = tf.logical_and(sample, tf.reduce_any(valid, axis=1))
+        first_valid = tf.argmax(tf.cast(valid, tf.int32), axis=1, output_type=tf.int32)
+        batch_index = tf.range(tf.shape(candidates)[0])
+        patches = tf.gather_nd(candidates, tf.stack([batch_index, first_valid], axis=1))
+        identity = tf.concat([tf.zeros_like(image_sizes), image_sizes], axis=1)
+        patches = tf.where(found, patches, identity)
+
+        if self.box_filter is not None:
+            self.box_filter.labels_format = self.labels_format
+        new_images, new_labels, new_mask, new_sizes = _crop_pad(images, labels, mask, image_sizes, patches,
+                                                                self.background, self.clip_boxes, self.box_filter,
+                                                                self.labels_format)
+        if labels is not None:
+            # Unaltered images keep their labels exactly as they were, without filtering or clipping.
+            new_labels = tf.where(found, new_labels, labels)
+            new_mask = tf.where(found, new_mask, mask)
+        return new_images, new_labels, new_mask, new_sizes
+
+
+class TFAugmentationPipeline:
+    """
+    Applies a sequence of TensorFlow augmentation operations to whole batches in a TensorFlow session, as an
+    alternative to applying the equivalent Numpy transformations to one image at a time.
+
+    The host only pads the images and labels of a batch to a common size and draws the random parameters of the
+    operations, which costs a few calls to `np.random` per image. All pixel and box computations run in the graph.
+    The graph is built once per labels format and runs in its own graph and session, so it does not interfere with the
+    model's session.
+
+    Instances can be passed to `DataGenerator.generate()` as one of its `batch_transformations`.
+    """
+
+    def __init__(self,
+                 transformations,
+                 labels_format=('class_id', 'xmin', 'ymin', 'xmax', 'ymax'),
+                 device=None,
+                 session_config=None):
+        """
+        Arguments:
+            transformations (list): The TensorFlow operations to apply in the given order, e.g. `TFRandomFlip`,
+                `TFResize` or `TFRandomBrightness` objects.
+            labels_format (list or tuple, optional): A list or tuple that defines what in the last axis of the labels
+                of an image. The list or tuple contains at least the keywords 'xmin', 'ymin', 'xmax', and 'ymax'.
+            device (str, optional): The TensorFlow device to place the operations on, e.g. '/cpu:0'. If `None`,
+                TensorFlow places them.
+            session_config (tf.ConfigProto, optional): The configuration of the session that runs the operations.
+        """
+        self.transformations = list(transformations)
+        self.labels_format = labels_format
+        self.device = device
+        self.session_config = session_config
+        self.graph = tf.Graph()
+        self.session = None
+        # The built graphs by the number of label columns and the labels format.
+        self._built = {}
+
+    def _build(self, n_columns):
+        key = (n_columns, tuple(self.labels_format) if n_columns else None)
+        if key in self._built:
+            return self._built[key]
+        with self.graph.as_default(), tf.device(self.device):
+            images = tf.placeholder(tf.uint8, shape=(None, None, None, 3))
+            image_sizes = tf.placeholder(tf.int32, shape=(None, 2))
+            if n_columns:
+                labels = tf.placeholder(tf.float64, shape=(None, None, n_columns))
+                mask = tf.placeholder(tf.bool, shape=(None, None))
+            else:
+                labels = mask = None
+            parameters = []
+            for transform in self.transformations:
+                parameters.append([tf.placeholder(dtype, shape=(None,) + shape)
+                                   for dtype, shape in transform.parameters])
+            outputs = (tf.cast(images, tf.float32), labels, mask, image_sizes)
+            for transform, transform_parameters in zip(self.transformations, parameters):
+                transform.labels_format = self.labels_format
+                outputs = transform.apply(*(outputs + (transform_parameters,)))
+            outputs = (tf.cast(outputs[0], tf.uint8),) + tuple(outputs[1:])
+        if self.session is None:
+            self.session = tf.Session(graph=self.graph, config=self.session_config)
+        self._built[key] = (images, labels, mask, image_sizes, parameters, outputs)
+        return self._built[key]
+
+    def __call__(self, images, labels=None):
+        """
+        Arguments:
+            images (list or array): The 3-channel `uint8` images of the batch. May have different sizes.
+            labels (list, optional): The labels of the batch, a list of arrays of shape `(n_boxes, k)`.
+
+        Returns:
+            The transformed images, as an array if they all have the same size and as a list otherwise, and the
+            transformed labels as a list of arrays, or `None` if no labels were given.
+        """
+        batch_size = len(images)
+        if any(image.ndim != 3 or image.shape[2] != 3 for image in images):
+            raise ValueError("The TensorFlow operations expect 3-channel images.")
+        sizes = np.array([image.shape[:2] for image in images], dtype=np.int32)
+        padded_images = np.zeros((batch_size,) + tuple(np.max(sizes, axis=0)) + (3,), dtype=np.uint8)
+        for i, image in enumerate(images):
+            padded_images[i, :image.shape[0], :image.shape[1]] = image
+
+        n_columns = 0
+        if labels is not None:
+            labels = [np.asarray(image_labels) for image_labels in labels]
+            n_columns = max(image_labels.shape[1] if image_labels.ndim == 2 else 0 for image_labels in labels)
+            if n_columns == 0:
+                n_columns = len(self.labels_format)
+        images_in, labels_in, mask_in, sizes_in, parameters_in, outputs = self._build(n_columns)
+        feed_dict = {images_in: padded_images, sizes_in: sizes}
+
+        if labels is not None:
+            n_boxes = max(1, max(len(image_labels) for image_labels in labels))
+            padded_labels = np.zeros((batch_size, n_boxes, n_columns), dtype=np.float64)
+            mask = np.zeros((batch_size, n_boxes), dtype=np.bool)
+            for i, image_labels in enumerate(labels):
+                if len(image_labels):
+                    padded_labels[i, :len(image_labels)] = image_labels
+                    mask[i, :len(image_labels)] = True
+            feed_dict[labels_in] = padded_labels
+            feed_dict[mask_in] = mask
+
+        # Draw the random parameters image by image, in the same order as the Numpy transformations would.
+        sampled = [[[] for _ in transform.parameters] for transform in self.transformations]
+        for i in range(batch_size):
+            img_height, img_width = sizes[i]
+            for transform, transform_sampled in zip(self.transformations, sampled):
+                values, img_height, img_width = transform.sample_parameters(img_height, img_width)
+                for value, parameter_sampled in zip(values, transform_sampled):
+                    parameter_sampled.append(value)
+        for transform_parameters, transform_sampled in zip(parameters_in, sampled):
+            for placeholder, values in zip(transform_parameters, transform_sampled):
+                feed_dict[placeholder] = np.array(values)
+
+        fetches = [tensor for tensor in outputs if tensor is not None]
+        results = self.session.run(fetches, feed_dict=feed_dict)
+        out_images, out_sizes = results[0], results[-1]
+        if len(set(map(tuple, out_sizes))) == 1:
+            batch_x = out_images[:, :out_sizes[0][0], :out_sizes[0][1]]
+        else:
+            batch_x = [out_images[i, :height, :width] for i, (height, width) in enumerate(out_sizes)]
+        if labels is None:
+            return batch_x, None
+        out_labels, out_mask = results[1], results[2]
+        batch_y = [out_labels[i][out_mask[i]].astype(labels[i].dtype) for i in range(batch_size)]
+        return batch_x, batch_y
+
+    def close(self):
+        """
+        Closes the TensorFlow session.
+        """
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+            self._built = {}
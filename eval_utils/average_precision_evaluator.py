@@ -95,6 +95,10 @@ class Evaluator:
         self.cumulative_recalls = None
         self.average_precisions = None
         self.mean_average_precision = None
+        # Only set if the raw predictions are decoded with a `decoding_pre_nms_top_k` and `report_pre_nms_top_k_impact`
+        # is `True`: the predictions and the mean average precision without this limit, to measure its effect.
+        self.prediction_results_without_pre_nms_top_k = None
+        self.mean_average_precision_without_pre_nms_top_k = None
 
     def __call__(self,
                  img_height,
@@ -116,7 +120,9 @@ class Evaluator:
                  decoding_iou_threshold=0.45,
                  decoding_top_k=200,
                  decoding_pred_coords='centroids',
-                 decoding_normalize_coords=True):
+                 decoding_normalize_coords=True,
+                 decoding_pre_nms_top_k=None,
+                 report_pre_nms_top_k_impact=False):
         """
         Computes the mean average precision of the given Keras SSD model on the given dataset.
 
@@ -198,6 +204,14 @@ class Evaluator:
             decoding_normalize_coords (bool, optional): Only relevant if the model is in 'training' mode. Set to `True`
                 if the model outputs relative coordinates. Do not set this to `True` if the model already outputs
                 absolute coordinates, as that would result in incorrect coordinates.
+            decoding_pre_nms_top_k (int, optional): Only relevant if the model is in 'training' mode. `None` or the
+                maximum number of boxes per class and image that go into the non-maximum suppression stage, see
+                `decode_detections()`.
+            report_pre_nms_top_k_impact (bool, optional): Only relevant if `decoding_pre_nms_top_k` is set. If `True`,
+                the predictions are also decoded without this limit and the mean average precision without it is
+                stored in `mean_average_precision_without_pre_nms_top_k` and printed along with the difference, so
+                that the effect of the limit can be checked. This decodes and evaluates every batch twice, so it is
+                off by default.
 
         Returns:
             A float, the mean average precision, plus any optional returns specified in the arguments.
@@ -217,6 +231,8 @@ class Evaluator:
                                 decoding_pred_coords=decoding_pred_coords,
                                 decoding_normalize_coords=decoding_normalize_coords,
                                 decoding_border_pixels=border_pixels,
+                                decoding_pre_nms_top_k=decoding_pre_nms_top_k,
+                                report_pre_nms_top_k_impact=report_pre_nms_top_k_impact,
                                 round_confidences=round_confidences,
                                 verbose=verbose,
                                 ret=False)
@@ -229,6 +245,28 @@ class Evaluator:
                                   verbose=False,
                                   ret=False)
 
+        #############################################################################################
+        # If the predictions were decoded with a pre-NMS limit, compute the mean average precision without it first.
+        #############################################################################################
+
+        self.mean_average_precision_without_pre_nms_top_k = None
+        if self.prediction_results_without_pre_nms_top_k is not None:
+            prediction_results = self.prediction_results
+            self.prediction_results = self.prediction_results_without_pre_nms_top_k
+            self.match_predictions(ignore_neutral_boxes=ignore_neutral_boxes,
+                                   matching_iou_threshold=matching_iou_threshold,
+                                   border_pixels=border_pixels,
+                                   sorting_algorithm=sorting_algorithm,
+                                   verbose=False,
+                                   ret=False)
+            self.compute_precision_recall(verbose=False, ret=False)
+            self.compute_average_precisions(mode=average_precision_mode,
+                                            num_recall_points=num_recall_points,
+                                            verbose=False,
+                                            ret=False)
+            self.mean_average_precision_without_pre_nms_top_k = self.compute_mean_average_precision(ret=True)
+            self.prediction_results = prediction_results
+
         #############################################################################################
         # Match predictions to ground truth boxes for all classes.
         #############################################################################################
@@ -261,6 +299,11 @@ class Evaluator:
 
         mean_average_precision = self.compute_mean_average_precision(ret=True)
 
+        if verbose and self.mean_average_precision_without_pre_nms_top_k is not None:
+            print("mAP with decoding_pre_nms_top_k={}: {:.4f}, without: {:.4f}, difference: {:+.4f}".format(
+                decoding_pre_nms_top_k, mean_average_precision, self.mean_average_precision_without_pre_nms_top_k,
+                mean_average_precision - self.mean_average_precision_without_pre_nms_top_k))
+
         #############################################################################################
 
         # Compile the returns.
@@ -287,6 +330,8 @@ class Evaluator:
                            decoding_pred_coords='centroids',
                            decoding_normalize_coords=True,
                            decoding_border_pixels='include',
+                           decoding_pre_nms_top_k=None,
+                           report_pre_nms_top_k_impact=False,
                            round_confidences=False,
                            verbose=True,
                            ret=False):
@@ -323,6 +368,11 @@ class Evaluator:
                 if the model outputs relative coordinates. Do not set this to `True` if the model already outputs
                 absolute coordinates, as that would result in incorrect coordinates.
             decoding_border_pixels (str, optinal): Only relevant if the model is in 'training' mode.
+            decoding_pre_nms_top_k (int, optional): Only relevant if the model is in 'training' mode. `None` or the
+                maximum number of boxes per class and image that go into the non-maximum suppression stage.
+            report_pre_nms_top_k_impact (bool, optional): Only relevant if `decoding_pre_nms_top_k` is set. If `True`,
+                the predictions are also decoded without this limit and stored in
+                `prediction_results_without_pre_nms_top_k`. Off by default, because it decodes every batch twice.
             round_confidences (int, optional): `False` or an integer that is the number of decimals that the prediction
                 confidences will be rounded to. If `False`, the confidences will not be rounded.
             verbose (bool, optional): If `True`, will print out the progress during runtime.
@@ -381,6 +431,33 @@ class Evaluator:
 
         # We have to generate a separate results list for each class.
         results = [list() for _ in range(self.n_classes + 1)]
+        # The predictions decoded without `decoding_pre_nms_top_k`, only if its impact is to be reported.
+        if self.model_mode == 'training' and decoding_pre_nms_top_k is not None and report_pre_nms_top_k_impact:
+            results_without_pre_nms_top_k = [list() for _ in range(self.n_classes + 1)]
+        else:
+            results_without_pre_nms_top_k = None
+
+        def add_predictions(results, y_pred, batch_image_ids, batch_inverse_transforms):
+            # Convert the predicted box coordinates for the original images.
+            y_pred = apply_inverse_transforms(y_pred, batch_inverse_transforms)
+
+            # Iterate over all batch items.
+            for k, batch_item in enumerate(y_pred):
+                image_id = batch_image_ids[k]
+                for box in batch_item:
+                    class_id = int(box[class_id_pred])
+                    # Round the box coordinates to reduce the required memory.
+                    if round_confidences:
+                        confidence = round(box[conf_pred], round_confidences)
+                    else:
+                        confidence = box[conf_pred]
+                    xmin = round(box[xmin_pred], 1)
+                    ymin = round(box[ymin_pred], 1)
+                    xmax = round(box[xmax_pred], 1)
+                    ymax = round(box[ymax_pred], 1)
+                    prediction = (image_id, confidence, xmin, ymin, xmax, ymax)
+                    # Append the predicted box to the results list for its class.
+                    results[class_id].append(prediction)
 
         # Compute the number of batches to iterate over the entire dataset.
         n_images = self.data_generator.get_dataset_size()
@@ -402,6 +479,19 @@ class Evaluator:
             # If the model was created in 'training' mode, the raw predictions need to
             # be decoded and filtered, otherwise that's already taken care of.
             if self.model_mode == 'training':
+                if results_without_pre_nms_top_k is not None:
+                    add_predictions(results_without_pre_nms_top_k,
+                                    decode_detections(y_pred,
+                                                      confidence_thresh=decoding_confidence_thresh,
+                                                      iou_threshold=decoding_iou_threshold,
+                                                      top_k=decoding_top_k,
+                                                      input_coords=decoding_pred_coords,
+                                                      normalize_coords=decoding_normalize_coords,
+                                                      img_height=img_height,
+                                                      img_width=img_width,
+                                                      border_pixels=decoding_border_pixels),
+                                    batch_image_ids,
+                                    batch_inverse_transforms)
                 # Decode.
                 # y_pred 是一个 list, 每一个元素表示每一个 batch_item 上的 predictions
                 y_pred = decode_detections(y_pred,
@@ -412,7 +502,8 @@ class Evaluator:
                                            normalize_coords=decoding_normalize_coords,
                                            img_height=img_height,
                                            img_width=img_width,
-                                           border_pixels=decoding_border_pixels)
+                                           border_pixels=decoding_border_pixels,
+                                           pre_nms_top_k=decoding_pre_nms_top_k)
             else:
                 # Filter out the all-zeros dummy elements of `y_pred`.
                 # UNCLEAR: 为什么要这么做? 之前并没有填充啊
@@ -420,28 +511,10 @@ class Evaluator:
                 for i in range(len(y_pred)):
                     y_pred_filtered.append(y_pred[i][y_pred[i, :, 0] != 0])
                 y_pred = y_pred_filtered
-            # Convert the predicted box coordinates for the original images.
-            y_pred = apply_inverse_transforms(y_pred, batch_inverse_transforms)
-
-            # Iterate over all batch items.
-            for k, batch_item in enumerate(y_pred):
-                image_id = batch_image_ids[k]
-                for box in batch_item:
-                    class_id = int(box[class_id_pred])
-                    # Round the box coordinates to reduce the required memory.
-                    if round_confidences:
-                        confidence = round(box[conf_pred], round_confidences)
-                    else:
-                        confidence = box[conf_pred]
-                    xmin = round(box[xmin_pred], 1)
-                    ymin = round(box[ymin_pred], 1)
-                    xmax = round(box[xmax_pred], 1)
-                    ymax = round(box[ymax_pred], 1)
-                    prediction = (image_id, confidence, xmin, ymin, xmax, ymax)
-                    # Append the predicted box to the results list for its class.
-                    results[class_id].append(prediction)
+            add_predictions(results, y_pred, batch_image_ids, batch_inverse_transforms)
 
         self.prediction_results = results
+        self.prediction_results_without_pre_nms_top_k = results_without_pre_nms_top_k
 
         if ret:
             return results
@@ -22,7 +22,7 @@ import keras.backend as K
 from keras.engine.topology import InputSpec
 from keras.engine.topology import Layer
 
-from bounding_box_utils.bounding_box_utils import convert_coordinates
+from ssd_encoder_decoder.anchor_boxes import generate_anchor_boxes_for_layer
 
 
 class AnchorBoxes(Layer):
@@ -34,8 +34,8 @@ class AnchorBoxes(Layer):
     of anchor boxes created per unit depends on the arguments `aspect_ratios` and `two_boxes_for_ar1`, in the default
     case it is 4. The boxes are parameterized by the coordinate tuple `(xmin, ymin, xmax, ymax)`.
 
-    The logic implemented by this layer is identical to the logic of function `generate_anchor_boxes_for_layer`
-    in the module `ssd_input_encoder.py`.
+    The anchor boxes are generated by the function `generate_anchor_boxes_for_layer` in the module `anchor_boxes.py`,
+    which `SSDInputEncoder` uses as well.
 
     The purpose of having this layer in the network is to make the model self-sufficient at inference time.
     Since the model is predicting offsets to the anchor boxes (rather than predicting absolute box coordinates directly)
@@ -196,8 +196,8 @@ class AnchorBoxes(Layer):
     def call(self, x, mask=None):
         """
         Return an anchor box tensor based on the shape of the input tensor.
-        The logic implemented here is identical to the logic of function `generate_anchor_boxes_for_layer` in the module
-        `ssd_box_encode_decode_utils.py`.
+        The anchor boxes are generated by the function `generate_anchor_boxes_for_layer` in the module
+        `anchor_boxes.py`, just like in `SSDInputEncoder`.
         Note that this tensor does not participate in any graph computations at runtime.
         It is being created as a constant once during graph creation and is just being output along with the rest of the
         model output during runtime.
@@ -213,28 +213,6 @@ class AnchorBoxes(Layer):
             mask:
         """
 
-        # Compute box width and height for each aspect ratio
-        # The shorter side of the image will be used to compute `w` and `h` using `scale` and `aspect_ratios`.
-        size = min(self.img_height, self.img_width)
-        # Compute the box widths and and heights for all aspect ratios
-        wh_list = []
-        for aspect_ratio in self.aspect_ratios:
-            if aspect_ratio == 1:
-                # Compute the regular anchor box for aspect ratio 1.
-                box_height = box_width = self.this_scale * size
-                wh_list.append((box_width, box_height))
-                if self.two_boxes_for_ar1:
-                    # Compute one slightly larger version using the geometric mean of this scale value and the next.
-                    # NOTE 几何平均数, 就是当 aspect_ratios 为 1 时取两个 boxes
-                    box_height = box_width = np.sqrt(self.this_scale * self.next_scale) * size
-                    wh_list.append((box_width, box_height))
-            else:
-                box_height = self.this_scale * size / np.sqrt(aspect_ratio)
-                box_width = self.this_scale * size * np.sqrt(aspect_ratio)
-                wh_list.append((box_width, box_height))
-        # shape 为 (n_boxes, 2)
-        wh_list = np.array(wh_list)
-
         # We need the shape of the input tensor
         if K.image_dim_ordering() == 'tf':
             # FIXME
@@ -246,102 +224,20 @@ class AnchorBoxes(Layer):
             batch_size, feature_map_height, feature_map_width, feature_map_channels = K.int_shape(x)
             # batch_size, feature_map_channels, feature_map_height, feature_map_width = x._keras_shape
 
-        ##################################################################################
-        # Compute the grid of box center points. They are identical for all aspect ratios.
-        ##################################################################################
-
-        # 1. Compute the step sizes,
-        # i.e. how far apart the anchor box center points will be vertically and horizontally.
-        if self.this_steps is None:
-            # 假设 box4, img_height,img_width=512, 那么 feature_map_height,feature_map_width=512 / 2 ^ 3 = 64
-            # 那么 step_height,step_width = 512 / 64 = 8
-            # 意思是 feature_map 是 64*64 的方格, 一个方格表示原图的 8*8 个像素, 每一个 step 移动一个方格
-            step_height = self.img_height / feature_map_height
-            step_width = self.img_width / feature_map_width
-        else:
-            if isinstance(self.this_steps, (list, tuple)):
-                step_height = self.this_steps[0]
-                step_width = self.this_steps[1]
-            # 相当于 elif isinstance(self.this_steps, (int, float)):
-            else:
-                step_height = self.this_steps
-                step_width = self.this_steps
-
-        # 2. Compute the offsets, i.e.
-        # at what pixel values the first anchor box center point will be from the top and from the left of the image.
-        if self.this_offsets is None:
-            offset_height = 0.5
-            offset_width = 0.5
-        else:
-            if isinstance(self.this_offsets, (list, tuple)):
-                offset_height = self.this_offsets[0]
-                offset_width = self.this_offsets[1]
-            # 相当于 elif isinstance(self.this_offsets, (int, float)):
-            else:
-                offset_height = self.this_offsets
-                offset_width = self.this_offsets
-
-        # 3. Now that we have the offsets and step sizes, compute the grid of anchor box center points.
-        # np.linspace 参见 https://docs.scipy.org/doc/numpy/reference/generated/numpy.linspace.html
-        # 第一个参数 start 表示区间开始, 第二个参数 stop 表示区间结尾, 第三个参数 num, 表示个数，默认包含 stop
-        # 如 box4, np.linspace(0.5 * 8, 63.5 * 8, 64), cy=np.array([4, 12,..., 500, 508])
-        cy = np.linspace(offset_height * step_height, (offset_height + feature_map_height - 1) * step_height,
-                         feature_map_height)
-        # 如 box4, np.linspace(0.5 * 8, 63.5 * 8, 64), cx=np.array([4, 12,..., 500, 508])
-        cx = np.linspace(offset_width * step_width, (offset_width + feature_map_width - 1) * step_width,
-                         feature_map_width)
-        # 如 box4, cx_grid=np.array([[4,12,...508],[4,12,...508],..., [4,12,...508]), shape 为 (64, 64)
-        # cy_grid=np.array([[4,4,...4],[12,12,...12],...,[508,508,...508]]), shape 为 (64, 64)
-        cx_grid, cy_grid = np.meshgrid(cx, cy)
-        # This is necessary for np.tile() to do what we want further down
-        # 如 box4, shape 变为 (64, 64, 1)
-        cx_grid = np.expand_dims(cx_grid, -1)
-        cy_grid = np.expand_dims(cy_grid, -1)
-
-        # Create a 4D tensor template of shape `(feature_map_height, feature_map_width, n_boxes, 4)`
-        # where the last dimension will contain `(cx, cy, w, h)`
-        boxes_tensor = np.zeros((feature_map_height, feature_map_width, self.n_boxes, 4))
-        # np.tile() 返回的数组的 shape 为 (feature_map_height, feature_map_width, n_boxes)
-        # Set cx
-        boxes_tensor[:, :, :, 0] = np.tile(cx_grid, (1, 1, self.n_boxes))
-        # Set cy
-        boxes_tensor[:, :, :, 1] = np.tile(cy_grid, (1, 1, self.n_boxes))
-        # Set w
-        boxes_tensor[:, :, :, 2] = wh_list[:, 0]
-        # Set h
-        boxes_tensor[:, :, :, 3] = wh_list[:, 1]
-
-        # Convert `(cx, cy, w, h)` to `(xmin, ymin, xmax, ymax)`
-        # 转换是为了做 clip
-        boxes_tensor = convert_coordinates(boxes_tensor, start_index=0, conversion='centroids2corners')
-
-        # If `clip_boxes` is enabled, clip the coordinates to lie within the image boundaries
-        if self.clip_boxes:
-            x_coords = boxes_tensor[:, :, :, [0, 2]]
-            x_coords[x_coords >= self.img_width] = self.img_width - 1
-            x_coords[x_coords < 0] = 0
-            # 记得 tf 是不能做这样的操作的
-            boxes_tensor[:, :, :, [0, 2]] = x_coords
-            y_coords = boxes_tensor[:, :, :, [1, 3]]
-            y_coords[y_coords >= self.img_height] = self.img_height - 1
-            y_coords[y_coords < 0] = 0
-            boxes_tensor[:, :, :, [1, 3]] = y_coords
-
-        # If `normalize_coords` is enabled, normalize the coordinates to be within [0,1]
-        if self.normalize_coords:
-            boxes_tensor[:, :, :, [0, 2]] /= self.img_width
-            boxes_tensor[:, :, :, [1, 3]] /= self.img_height
-
-        # TODO: Implement box limiting directly for `(cx, cy, w, h)`
-        #  so that we don't have to unnecessarily convert back and forth.
-        if self.coords == 'centroids':
-            # Convert `(xmin, ymin, xmax, ymax)` back to `(cx, cy, w, h)`.
-            boxes_tensor = convert_coordinates(boxes_tensor, start_index=0, conversion='corners2centroids',
-                                               border_pixels='half')
-        elif self.coords == 'minmax':
-            # Convert `(xmin, ymin, xmax, ymax)` to `(xmin, xmax, ymin, ymax).
-            boxes_tensor = convert_coordinates(boxes_tensor, start_index=0, conversion='corners2minmax',
-                                               border_pixels='half')
+        # Get the anchor boxes of shape `(feature_map_height, feature_map_width, n_boxes, 4)` from the same function
+        # as `SSDInputEncoder`, which computes them only once per configuration.
+        boxes_tensor = generate_anchor_boxes_for_layer(img_height=self.img_height,
+                                                       img_width=self.img_width,
+                                                       feature_map_size=(feature_map_height, feature_map_width),
+                                                       aspect_ratios=self.aspect_ratios,
+                                                       this_scale=self.this_scale,
+                                                       next_scale=self.next_scale,
+                                                       two_boxes_for_ar1=self.two_boxes_for_ar1,
+                                                       this_steps=self.this_steps,
+                                                       this_offsets=self.this_offsets,
+                                                       clip_boxes=self.clip_boxes,
+                                                       normalize_coords=self.normalize_coords,
+                                                       coords=self.coords)
 
         # Create a tensor to contain the variances and append it to `boxes_tensor`.
         # This tensor has the same shape as `boxes_tensor`
@@ -25,6 +25,86 @@ from keras.engine.topology import InputSpec
 from keras.engine.topology import Layer
 
 
+def _tf_ious(boxes1, boxes2):
+    """
+    Computes the IoUs of all boxes in `boxes1` of shape `(m, 4)` with all boxes in `boxes2` of shape `(n, 4)`, both in
+    the format `(xmin, ymin, xmax, ymax)`, as a tensor of shape `(m, n)`.
+    """
+    xmin1, ymin1, xmax1, ymax1 = [tf.expand_dims(coordinate, axis=1) for coordinate in tf.unstack(boxes1, axis=1)]
+    xmin2, ymin2, xmax2, ymax2 = [tf.expand_dims(coordinate, axis=0) for coordinate in tf.unstack(boxes2, axis=1)]
+    widths = tf.maximum(0.0, tf.minimum(xmax1, xmax2) - tf.maximum(xmin1, xmin2))
+    heights = tf.maximum(0.0, tf.minimum(ymax1, ymax2) - tf.maximum(ymin1, ymin2))
+    intersections = widths * heights
+    unions = (xmax1 - xmin1) * (ymax1 - ymin1) + (xmax2 - xmin2) * (ymax2 - ymin2) - intersections
+    # Degenerate boxes don't overlap with anything.
+    return tf.where(unions > 0.0, intersections / tf.maximum(unions, 1e-12), tf.zeros_like(intersections))
+
+
+def _tf_soft_nms(predictions, max_output_size, score_threshold, iou_threshold, method, sigma):
+    """
+    Soft-NMS for a non-empty tensor `predictions` of shape `(n, 6)` in the format
+    `[class_id, confidence, xmin, ymin, xmax, ymax]`, see `decode_detections()` for the decay functions.
+
+    Returns:
+        The selected predictions with their decayed confidences, at most `max_output_size` of them.
+    """
+    n = tf.shape(predictions)[0]
+    boxes = predictions[:, 2:]
+    max_output_size = tf.minimum(n, max_output_size)
+
+    def condition(i, scores, maxima):
+        return tf.logical_and(i < max_output_size, tf.reduce_max(scores) > score_threshold)
+
+    def select_maximum(i, scores, maxima):
+        index = tf.argmax(scores, output_type=tf.int32)
+        maxima = maxima.write(i, tf.concat([predictions[index, :1], scores[index:index + 1], boxes[index]], axis=0))
+        similarities = _tf_ious(boxes, boxes[index:index + 1])[:, 0]
+        if method == 'linear':
+            decay = tf.where(similarities > iou_threshold, 1.0 - similarities, tf.ones_like(similarities))
+        else:
+            decay = tf.exp(-tf.square(similarities) / sigma)
+        # The selected box itself gets a score of zero so that it isn't selected again.
+        scores = scores * decay * (1.0 - tf.one_hot(index, n))
+        return i + 1, scores, maxima
+
+    _, _, maxima = tf.while_loop(cond=condition,
+                                 body=select_maximum,
+                                 loop_vars=[tf.constant(0),
+                                            predictions[:, 1],
+                                            tf.TensorArray(dtype=tf.float32, size=0, dynamic_size=True,
+                                                           element_shape=tf.TensorShape([6]))],
+                                 back_prop=False,
+                                 name='soft_nms')
+    return maxima.stack()
+
+
+def _tf_matrix_nms(predictions, max_output_size, score_threshold, method, sigma):
+    """
+    Matrix NMS for a non-empty tensor `predictions` of shape `(n, 6)` in the format
+    `[class_id, confidence, xmin, ymin, xmax, ymax]`, see `decode_detections()` for the decay functions. Only the
+    `max_output_size` highest scoring predictions are considered.
+
+    Returns:
+        The predictions whose decayed confidences are greater than `score_threshold`, with these confidences.
+    """
+    top_k = tf.nn.top_k(predictions[:, 1], k=tf.minimum(tf.shape(predictions)[0], max_output_size), sorted=True)
+    predictions = tf.gather(params=predictions, indices=top_k.indices, axis=0)
+    # The IoUs of every box (column) with the boxes with higher scores (rows), i.e. the strict upper triangle.
+    similarities = _tf_ious(predictions[:, 2:], predictions[:, 2:])
+    similarities = tf.matrix_band_part(similarities, 0, -1) - tf.matrix_band_part(similarities, 0, 0)
+    # The compensation of every box (row) is its largest IoU with a box with a higher score.
+    compensations = tf.expand_dims(tf.reduce_max(similarities, axis=0), axis=1)
+    if method == 'linear':
+        decay = (1.0 - similarities) / (1.0 - compensations)
+    else:
+        decay = tf.exp(-(tf.square(similarities) - tf.square(compensations)) / sigma)
+    # A box that is a duplicate of a box with a higher score doesn't suppress its own duplicates once more.
+    decay = tf.where(tf.is_nan(decay), tf.ones_like(decay), decay)
+    scores = top_k.values * tf.minimum(tf.reduce_min(decay, axis=0), 1.0)
+    predictions = tf.concat([predictions[:, :1], tf.expand_dims(scores, axis=-1), predictions[:, 2:]], axis=-1)
+    return tf.boolean_mask(tensor=predictions, mask=scores > score_threshold)
+
+
 class DecodeDetections(Layer):
     """
     A Keras layer to decode the raw SSD prediction output.
@@ -45,6 +125,8 @@ class DecodeDetections(Layer):
                  normalize_coords=True,
                  img_height=None,
                  img_width=None,
+                 nms_mode='greedy',
+                 nms_sigma=0.5,
                  **kwargs):
         """
         All default argument values follow the Caffe implementation.
@@ -74,6 +156,11 @@ class DecodeDetections(Layer):
                 Requires `img_height` and `img_width` if set to `True`.
             img_height (int, optional): The height of the input images. Only needed if `normalize_coords` is `True`.
             img_width (int, optional): The width of the input images. Only needed if `normalize_coords` is `True`.
+            nms_mode (str, optional): The kind of non-maximum suppression, one of 'greedy', 'soft_linear',
+                'soft_gaussian', 'matrix_linear' and 'matrix_gaussian', see `decode_detections()`. For the Matrix NMS
+                modes, only the `nms_max_output_size` highest scoring boxes of a class are considered.
+            nms_sigma (float, optional): The parameter of the Gaussian decay of the 'soft_gaussian' and
+                'matrix_gaussian' modes.
         """
         if K.backend() != 'tensorflow':
             raise TypeError("This layer only supports TensorFlow at the moment, "
@@ -87,6 +174,10 @@ class DecodeDetections(Layer):
         if coords != 'centroids':
             raise ValueError("The DetectionOutput layer currently only supports the 'centroids' coordinate format.")
 
+        if nms_mode not in {'greedy', 'soft_linear', 'soft_gaussian', 'matrix_linear', 'matrix_gaussian'}:
+            raise ValueError("`nms_mode` must be one of 'greedy', 'soft_linear', 'soft_gaussian', 'matrix_linear' and "
+                             "'matrix_gaussian', but is '{}'.".format(nms_mode))
+
         # We need these members for the config.
         self.confidence_thresh = confidence_thresh
         self.iou_threshold = iou_threshold
@@ -96,6 +187,8 @@ class DecodeDetections(Layer):
         self.img_width = img_width
         self.coords = coords
         self.nms_max_output_size = nms_max_output_size
+        self.nms_mode = nms_mode
+        self.nms_sigma = nms_sigma
 
         # We need these members for TensorFlow.
         self.tf_confidence_thresh = tf.constant(self.confidence_thresh, name='confidence_thresh')
@@ -190,6 +283,19 @@ class DecodeDetections(Layer):
 
                 # If any boxes made the threshold, perform NMS.
                 def perform_nms():
+                    if self.nms_mode.startswith('soft'):
+                        return _tf_soft_nms(single_class,
+                                            max_output_size=self.tf_nms_max_output_size,
+                                            score_threshold=self.tf_confidence_thresh,
+                                            iou_threshold=self.iou_threshold,
+                                            method=self.nms_mode[len('soft_'):],
+                                            sigma=self.nms_sigma)
+                    if self.nms_mode.startswith('matrix'):
+                        return _tf_matrix_nms(single_class,
+                                              max_output_size=self.tf_nms_max_output_size,
+                                              score_threshold=self.tf_confidence_thresh,
+                                              method=self.nms_mode[len('matrix_'):],
+                                              sigma=self.nms_sigma)
                     scores = single_class[..., 1]
                     # Note `tf.image.non_max_suppression()` needs the box coordinates in the format
                     #  `(ymin, xmin, ymax, xmax)`.
@@ -285,6 +391,8 @@ class DecodeDetections(Layer):
             'normalize_coords': self.normalize_coords,
             'img_height': self.img_height,
             'img_width': self.img_width,
+            'nms_mode': self.nms_mode,
+            'nms_sigma': self.nms_sigma,
         }
         base_config = super(DecodeDetections, self).get_config()
         base_config.update(config)
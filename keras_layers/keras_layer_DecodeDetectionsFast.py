@@ -26,6 +26,8 @@ import keras.backend as K
 from keras.engine.topology import InputSpec
 from keras.engine.topology import Layer
 
+from keras_layers.keras_layer_DecodeDetections import _tf_soft_nms, _tf_matrix_nms
+
 class DecodeDetectionsFast(Layer):
     '''
     A Keras layer to decode the raw SSD prediction output.
@@ -46,6 +48,8 @@ class DecodeDetectionsFast(Layer):
                  normalize_coords=True,
                  img_height=None,
                  img_width=None,
+                 nms_mode='greedy',
+                 nms_sigma=0.5,
                  **kwargs):
         '''
         All default argument values follow the Caffe implementation.
@@ -73,6 +77,10 @@ class DecodeDetectionsFast(Layer):
                 coordinates. Requires `img_height` and `img_width` if set to `True`.
             img_height (int, optional): The height of the input images. Only needed if `normalize_coords` is `True`.
             img_width (int, optional): The width of the input images. Only needed if `normalize_coords` is `True`.
+            nms_mode (str, optional): The kind of non-maximum suppression, one of 'greedy', 'soft_linear', 'soft_gaussian',
+                'matrix_linear' and 'matrix_gaussian', see `decode_detections()`. For the Matrix NMS modes, only the
+                `nms_max_output_size` highest scoring boxes are considered.
+            nms_sigma (float, optional): The parameter of the Gaussian decay of the 'soft_gaussian' and 'matrix_gaussian' modes.
         '''
         if K.backend() != 'tensorflow':
             raise TypeError("This layer only supports TensorFlow at the moment, but you are using the {} backend.".format(K.backend()))
@@ -83,6 +91,9 @@ class DecodeDetectionsFast(Layer):
         if coords != 'centroids':
             raise ValueError("The DetectionOutput layer currently only supports the 'centroids' coordinate format.")
 
+        if nms_mode not in {'greedy', 'soft_linear', 'soft_gaussian', 'matrix_linear', 'matrix_gaussian'}:
+            raise ValueError("`nms_mode` must be one of 'greedy', 'soft_linear', 'soft_gaussian', 'matrix_linear' and 'matrix_gaussian', but is '{}'.".format(nms_mode))
+
         # We need these members for the config.
         self.confidence_thresh = confidence_thresh
         self.iou_threshold = iou_threshold
@@ -92,6 +103,8 @@ class DecodeDetectionsFast(Layer):
         self.img_width = img_width
         self.coords = coords
         self.nms_max_output_size = nms_max_output_size
+        self.nms_mode = nms_mode
+        self.nms_sigma = nms_sigma
 
         # We need these members for TensorFlow.
         self.tf_confidence_thresh = tf.constant(self.confidence_thresh, name='confidence_thresh')
@@ -187,6 +200,19 @@ class DecodeDetectionsFast(Layer):
             predictions_conf_thresh = tf.cond(tf.equal(tf.size(predictions), 0), no_positive_boxes, perform_confidence_thresholding)
 
             def perform_nms():
+                if self.nms_mode.startswith('soft'):
+                    return _tf_soft_nms(predictions_conf_thresh,
+                                        max_output_size=self.tf_nms_max_output_size,
+                                        score_threshold=self.tf_confidence_thresh,
+                                        iou_threshold=self.iou_threshold,
+                                        method=self.nms_mode[len('soft_'):],
+                                        sigma=self.nms_sigma)
+                if self.nms_mode.startswith('matrix'):
+                    return _tf_matrix_nms(predictions_conf_thresh,
+                                          max_output_size=self.tf_nms_max_output_size,
+                                          score_threshold=self.tf_confidence_thresh,
+                                          method=self.nms_mode[len('matrix_'):],
+                                          sigma=self.nms_sigma)
                 scores = predictions_conf_thresh[...,1]
 
                 # `tf.image.non_max_suppression()` needs the box coordinates in the format `(ymin, xmin, ymax, xmax)`.
@@ -261,6 +287,8 @@ class DecodeDetectionsFast(Layer):
             'normalize_coords': self.normalize_coords,
             'img_height': self.img_height,
             'img_width': self.img_width,
+            'nms_mode': self.nms_mode,
+            'nms_sigma': self.nms_sigma,
         }
         base_config = super(DecodeDetectionsFast, self).get_config()
         return dict(list(base_config.items()) + list(config.items()))
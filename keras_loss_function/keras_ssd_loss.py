@@ -123,16 +123,6 @@ class SSDLoss:
         Returns:
             A scalar, the total multitask loss for classification and localization.
         """
-        self.neg_pos_ratio = tf.constant(self.neg_pos_ratio)
-        self.n_neg_min = tf.constant(self.n_neg_min)
-        self.alpha = tf.constant(self.alpha)
-        # Output dtype: tf.int32
-        batch_size = tf.shape(y_pred)[0]
-        # Output dtype: tf.int32
-        # Note that `n_boxes` in this context denotes the total number of boxes per image,
-        #  not the number of boxes per cell.
-        n_boxes = tf.shape(y_pred)[1]
-
         # 1: Compute the losses for class and box predictions for every box.
         classification_loss = tf.to_float(
             # Output shape: (batch_size, n_boxes)
@@ -147,6 +137,66 @@ class SSDLoss:
         # Tensor of shape (batch_size, n_boxes)
         positives = tf.to_float(tf.reduce_max(y_true[:, :, 1:-12], axis=-1))
 
+        return self._combine_losses(classification_loss, localization_loss, positives, negatives, y_pred)
+
+    def compute_sparse_loss(self, y_true, y_pred):
+        """
+        The same as `compute_loss()`, but for the labels of an `SSDInputEncoder` with `output_mode='sparse'`.
+
+        The one-hot class vectors are built from the class IDs on the device, so only the class IDs and the box offsets
+        have to be fed to the model.
+
+        Arguments:
+            y_true (array): A Numpy array of shape `(batch_size, #boxes, 5)` that contains the class ID and the four
+                ground truth box coordinate offsets of every box. The background class must have the ID 0, and boxes
+                that you want the cost function to ignore need to have the class ID -1.
+            y_pred (Keras tensor): The model prediction of shape `(batch_size, #boxes, #classes + 12)`.
+
+        Returns:
+            A scalar, the total multitask loss for classification and localization.
+        """
+        class_ids = tf.to_int32(y_true[:, :, 0])
+        # The one-hot vector of the class ID -1 is all zeros, so neutral boxes are ignored like in `compute_loss()`.
+        classes_one_hot = tf.one_hot(class_ids, depth=tf.shape(y_pred)[2] - 12, dtype=y_pred.dtype)
+
+        # 1: Compute the losses for class and box predictions for every box.
+        classification_loss = tf.to_float(
+            # Output shape: (batch_size, n_boxes)
+            self.log_loss(classes_one_hot, y_pred[:, :, :-12]))
+        localization_loss = tf.to_float(
+            self.smooth_L1_loss(y_true[:, :, 1:5], y_pred[:, :, -12:-8]))  # Output shape: (batch_size, n_boxes)
+
+        # 2: Create masks for the positive and negative ground truth classes.
+        negatives = tf.to_float(tf.equal(class_ids, 0))
+        positives = tf.to_float(tf.greater(class_ids, 0))
+
+        return self._combine_losses(classification_loss, localization_loss, positives, negatives, y_pred)
+
+    def _combine_losses(self, classification_loss, localization_loss, positives, negatives, y_pred):
+        """
+        Combines the classification and localization losses of all boxes into the total loss, with hard negative
+        mining for the classification loss of the negative boxes.
+
+        Arguments:
+            classification_loss (tensor): The classification losses of shape `(batch_size, n_boxes)`.
+            localization_loss (tensor): The localization losses of shape `(batch_size, n_boxes)`.
+            positives (tensor): The mask of the positive boxes of shape `(batch_size, n_boxes)`.
+            negatives (tensor): The mask of the negative boxes of shape `(batch_size, n_boxes)`.
+            y_pred (tensor): The model prediction.
+
+        Returns:
+            A scalar, the total multitask loss for classification and localization.
+        """
+        self.neg_pos_ratio = tf.constant(self.neg_pos_ratio)
+        self.n_neg_min = tf.constant(self.n_neg_min)
+        self.alpha = tf.constant(self.alpha)
+        # Output dtype: tf.int32
+        batch_size = tf.shape(y_pred)[0]
+        # Output dtype: tf.int32
+        # Note that `n_boxes` in this context denotes the total number of boxes per image,
+        #  not the number of boxes per cell.
+        n_boxes = tf.shape(y_pred)[1]
+
         # Count the number of positive boxes (classes 1 to n) in y_true across the whole batch.
         n_positive = tf.reduce_sum(positives)
 
@@ -0,0 +1,287 @@
+'''
+Utilities to choose the anchor box configuration of an SSD model from the ground truth boxes of a dataset.
+
+Copyright (C) 2018 Pierluigi Ferrari
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+from __future__ import division
+import numpy as np
+import multiprocessing
+import sys
+from PIL import Image
+from tqdm import tqdm
+
+from ssd_encoder_decoder.anchor_boxes import generate_anchor_boxes
+
+# The ground truth boxes and the fixed part of the configuration in the worker processes. They are set once per worker
+# process by `_init_worker()`.
+_worker_args = None
+
+
+def load_gt_boxes(generator, img_height, img_width):
+    '''
+    Returns the ground truth boxes of all images of a dataset as one array, scaled from the size of their images to the
+    input size of the model, as if every image were resized to the input size.
+
+    Arguments:
+        generator (DataGenerator): The generator with the dataset.
+        img_height (int): The height of the input images of the model.
+        img_width (int): The width of the input images of the model.
+
+    Returns:
+        A Numpy array of shape `(n, 4)` with all ground truth boxes in the format `(xmin, ymin, xmax, ymax)`.
+    '''
+    if not generator.labels:
+        raise ValueError("The generator must have ground truth labels.")
+    labels_format = generator.labels_output_format
+    columns = [labels_format.index('xmin'), labels_format.index('ymin'),
+               labels_format.index('xmax'), labels_format.index('ymax')]
+
+    boxes = [np.zeros((0, 4))]
+    for position in range(generator.get_dataset_size()):
+        labels = np.asarray(generator.labels[position], dtype=np.float)
+        if labels.size == 0:
+            continue
+        # Only the size of the image is needed, which PIL reads without decoding the image.
+        dataset_index = generator.dataset_indices[position]
+        if generator.images:
+            height, width = generator.images[dataset_index].shape[:2]
+        elif generator.hdf5_dataset is not None:
+            height, width = generator.hdf5_dataset['image_shapes'][dataset_index][:2]
+        else:
+            with Image.open(generator.filenames[position]) as image:
+                width, height = image.size
+        boxes.append(labels[:, columns] * [img_width / width, img_height / height,
+                                           img_width / width, img_height / height])
+    return np.concatenate(boxes, axis=0)
+
+
+def kmeans_aspect_ratios(boxes, k, max_iterations=100):
+    '''
+    Clusters the shapes of boxes with k-means, using `1 - IoU` of two boxes with the same center as the distance, and
+    returns the aspect ratios of the cluster centers.
+
+    The shapes are scaled to the same area first, so that the clusters only depend on the aspect ratios, since the
+    sizes of the anchor boxes are given by the scales. The clusters are initialized with the boxes at `k` evenly spaced
+    quantiles of the aspect ratio, so the result is deterministic.
+
+    Arguments:
+        boxes (array): A Numpy array of shape `(n, 4)` with boxes in the format `(xmin, ymin, xmax, ymax)`.
+        k (int): The number of clusters.
+        max_iterations (int, optional): The maximal number of iterations.
+
+    Returns:
+        A sorted list of at most `k` unique aspect ratios `width / height`, rounded to two decimals. Aspect ratios
+        within 10% of 1 are set to 1, so that `two_boxes_for_ar1` applies to them.
+    '''
+    shapes = np.stack([boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]], axis=1)
+    shapes = shapes[np.all(shapes > 0, axis=1)]
+    if len(shapes) < k:
+        raise ValueError("Need at least {} non-degenerate boxes, but got {}.".format(k, len(shapes)))
+    shapes /= np.sqrt(shapes[:, :1] * shapes[:, 1:])
+    order = np.argsort(shapes[:, 0] / shapes[:, 1])
+    centers = shapes[order[((np.arange(k) + 0.5) * len(shapes) / k).astype(np.int)]]
+    areas = shapes[:, 0] * shapes[:, 1]
+
+    assignments = None
+    for _ in range(max_iterations):
+        # IoUs of all boxes with all cluster centers, shape 为 (n, k)
+        intersections = (np.minimum(shapes[:, np.newaxis, 0], centers[:, 0]) *
+                         np.minimum(shapes[:, np.newaxis, 1], centers[:, 1]))
+        ious = intersections / (areas[:, np.newaxis] + centers[:, 0] * centers[:, 1] - intersections)
+        new_assignments = np.argmax(ious, axis=1)
+        if assignments is not None and np.array_equal(new_assignments, assignments):
+            break
+        assignments = new_assignments
+        for i in range(k):
+            # Empty clusters keep their center.
+            if np.any(assignments == i):
+                centers[i] = np.mean(shapes[assignments == i], axis=0)
+
+    aspect_ratios = np.round(centers[:, 0] / centers[:, 1], 2)
+    aspect_ratios[np.abs(aspect_ratios - 1) < 0.1] = 1.0
+    return sorted(set(aspect_ratios.tolist()))
+
+
+def best_anchor_ious(boxes, img_height, img_width, predictor_sizes, scales, aspect_ratios_per_layer,
+                     two_boxes_for_ar1=True, steps=None, offsets=None):
+    '''
+    Computes the largest IoU of every box with any anchor box of an anchor box configuration.
+
+    The anchor boxes of one shape in one predictor layer lie on a grid, and their intersection with a box shrinks
+    with the horizontal and the vertical distance of the centers independently. The anchor box of that shape with the
+    largest IoU is therefore the one in the column and the row whose centers are closest to the center of the box.
+    This computes one IoU per box and anchor box shape instead of one per box and anchor box, so it is fast enough to
+    evaluate many configurations on all ground truth boxes of a dataset. The anchor boxes are not clipped.
+
+    Arguments:
+        boxes (array): A Numpy array of shape `(n, 4)` with boxes in the format `(xmin, ymin, xmax, ymax)` in the
+            coordinates of the input images.
+
+        All other arguments are the same as for `SSDInputEncoder`.
+
+    Returns:
+        A tuple `(best_ious, n_anchors)` with a Numpy array of length `n` with the largest IoU of every box, which is
+        zero for boxes that overlap with no anchor box, and the total number of anchor boxes.
+    '''
+    layers = generate_anchor_boxes(img_height=img_height,
+                                   img_width=img_width,
+                                   predictor_sizes=predictor_sizes,
+                                   aspect_ratios_per_layer=aspect_ratios_per_layer,
+                                   scales=scales,
+                                   two_boxes_for_ar1=two_boxes_for_ar1,
+                                   steps=steps,
+                                   offsets=offsets,
+                                   coords='centroids')
+    box_centers = np.stack([(boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2], axis=1)
+    box_areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+    best_ious = np.zeros(len(boxes))
+    n_anchors = 0
+    for anchor_boxes, (cy, cx), wh, _, _ in layers:
+        n_anchors += anchor_boxes.shape[0] * anchor_boxes.shape[1] * anchor_boxes.shape[2]
+        # The coordinates of the closest column and row center of every box, shape 为 (n, 1)
+        nearest = []
+        for grid, centers in ((cx, box_centers[:, 0]), (cy, box_centers[:, 1])):
+            i = np.minimum(np.searchsorted(grid, centers), len(grid) - 1)
+            # The center before the insertion point may be closer.
+            previous = np.maximum(i - 1, 0)
+            i = np.where(np.abs(centers - grid[previous]) <= np.abs(centers - grid[i]), previous, i)
+            nearest.append(grid[i][:, np.newaxis])
+        anchor_x, anchor_y = nearest
+        # The IoUs of every box with the closest anchor box of every shape, shape 为 (n, n_boxes)
+        intersections = np.maximum(0, np.minimum(boxes[:, 2:3], anchor_x + wh[:, 0] / 2) -
+                                   np.maximum(boxes[:, 0:1], anchor_x - wh[:, 0] / 2))
+        intersections *= np.maximum(0, np.minimum(boxes[:, 3:4], anchor_y + wh[:, 1] / 2) -
+                                    np.maximum(boxes[:, 1:2], anchor_y - wh[:, 1] / 2))
+        ious = intersections / (box_areas[:, np.newaxis] + wh[:, 0] * wh[:, 1] - intersections)
+        best_ious = np.maximum(best_ious, np.max(ious, axis=1))
+    return best_ious, n_anchors
+
+
+def _init_worker(boxes, img_height, img_width, predictor_sizes, steps, offsets, pos_iou_threshold):
+    global _worker_args
+    _worker_args = (boxes, img_height, img_width, predictor_sizes, steps, offsets, pos_iou_threshold)
+
+
+def _evaluate_config(config):
+    '''
+    Returns the recall and the number of anchor boxes of one candidate configuration.
+    '''
+    boxes, img_height, img_width, predictor_sizes, steps, offsets, pos_iou_threshold = _worker_args
+    best_ious, n_anchors = best_anchor_ious(boxes,
+                                            img_height=img_height,
+                                            img_width=img_width,
+                                            predictor_sizes=predictor_sizes,
+                                            scales=config['scales'],
+                                            aspect_ratios_per_layer=config['aspect_ratios_per_layer'],
+                                            two_boxes_for_ar1=config['two_boxes_for_ar1'],
+                                            steps=steps,
+                                            offsets=offsets)
+    return np.mean(best_ious >= pos_iou_threshold), n_anchors
+
+
+def optimize_anchor_config(boxes,
+                           img_height,
+                           img_width,
+                           predictor_sizes,
+                           pos_iou_threshold=0.5,
+                           k_values=(2, 3, 4, 5, 6),
+                           min_scales=(0.05, 0.1, 0.15, 0.2),
+                           max_scales=(0.8, 0.9, 1.0, 1.05),
+                           steps=None,
+                           offsets=None,
+                           recall_tolerance=0.0,
+                           processes=None,
+                           verbose=True):
+    '''
+    Searches for the anchor box configuration that matches the most ground truth boxes with the fewest anchor boxes.
+
+    The candidate aspect ratios are the ones that `kmeans_aspect_ratios()` finds for every `k` in `k_values`, which
+    every predictor layer uses. The candidate scales are linearly spaced between every `min_scale` in `min_scales` and
+    every `max_scale` in `max_scales`, as in `SSDInputEncoder`. Aspect ratio sets that contain 1 are tried with and
+    without `two_boxes_for_ar1`. The predictor sizes, steps and offsets are given by the model architecture and are not
+    searched.
+
+    Every candidate is scored by its recall, the fraction of the boxes whose largest IoU with any anchor box is at
+    least `pos_iou_threshold`. Of all candidates whose recall is at most `recall_tolerance` below the best recall, the
+    one with the fewest anchor boxes is chosen, since fewer anchor boxes make the encoding, the loss and the decoding
+    faster. The candidates are evaluated in a process pool.
+
+    Arguments:
+        boxes (array): A Numpy array of shape `(n, 4)` with the ground truth boxes in the format
+            `(xmin, ymin, xmax, ymax)` in the coordinates of the input images, e.g. from `load_gt_boxes()`.
+        img_height (int): The height of the input images of the model.
+        img_width (int): The width of the input images of the model.
+        predictor_sizes (list): The `(height, width)` of the feature map of every predictor layer.
+        pos_iou_threshold (float, optional): The IoU a box needs with an anchor box to count as matched, as for
+            `SSDInputEncoder`.
+        k_values (tuple, optional): The numbers of aspect ratios to try.
+        min_scales (tuple, optional): The scales of the first predictor layer to try.
+        max_scales (tuple, optional): The scales of the last predictor layer to try.
+        steps (list, optional): The steps of every predictor layer, as for `SSDInputEncoder`.
+        offsets (list, optional): The offsets of every predictor layer, as for `SSDInputEncoder`.
+        recall_tolerance (float, optional): How much recall may be traded for fewer anchor boxes.
+        processes (int, optional): The number of worker processes. If `None`, one per CPU is used.
+        verbose (bool, optional): If `True`, shows the progress.
+
+    Returns:
+        A tuple `(best, results)`. `results` contains one dictionary per candidate with the keys 'scales',
+        'aspect_ratios_per_layer' and 'two_boxes_for_ar1', which can be passed to `SSDInputEncoder` and the model
+        builders, and 'recall' and 'n_anchors', sorted by decreasing recall and then increasing number of anchor boxes.
+        `best` is the chosen candidate.
+    '''
+    boxes = np.asarray(boxes, dtype=np.float)
+    if len(boxes) == 0:
+        raise ValueError("`boxes` must not be empty.")
+    n_layers = len(predictor_sizes)
+
+    configs = []
+    aspect_ratio_sets = []
+    for k in k_values:
+        aspect_ratios = kmeans_aspect_ratios(boxes, k)
+        if aspect_ratios not in aspect_ratio_sets:
+            aspect_ratio_sets.append(aspect_ratios)
+    for aspect_ratios in aspect_ratio_sets:
+        for two_boxes_for_ar1 in ([True, False] if 1.0 in aspect_ratios else [False]):
+            for min_scale in min_scales:
+                for max_scale in max_scales:
+                    if max_scale <= min_scale:
+                        continue
+                    configs.append({'scales': np.linspace(min_scale, max_scale, n_layers + 1).tolist(),
+                                    'aspect_ratios_per_layer': [aspect_ratios] * n_layers,
+                                    'two_boxes_for_ar1': two_boxes_for_ar1})
+
+    initargs = (boxes, img_height, img_width, predictor_sizes, steps, offsets, pos_iou_threshold)
+    pool = multiprocessing.Pool(processes=processes, initializer=_init_worker, initargs=initargs)
+    try:
+        scores = pool.imap(_evaluate_config, configs)
+        if verbose:
+            scores = tqdm(scores, total=len(configs), desc='Evaluating anchor configurations', file=sys.stdout)
+        for config, (recall, n_anchors) in zip(configs, scores):
+            config['recall'] = recall
+            config['n_anchors'] = n_anchors
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    results = sorted(configs, key=lambda config: (-config['recall'], config['n_anchors']))
+    best_recall = results[0]['recall']
+    best = min([config for config in results if config['recall'] >= best_recall - recall_tolerance],
+               key=lambda config: (config['n_anchors'], -config['recall']))
+    return best, results
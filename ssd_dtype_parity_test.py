@@ -0,0 +1,143 @@
+"""
+Checks that encoding and decoding in float32 agree with float64.
+
+`SSDInputEncoder`, `decode_detections()` and `decode_detections_fast()` compute in float32 by default. Apart from the
+precision of the numbers, float32 can make the bipartite matching of the encoder resolve a near tie between two anchor
+boxes differently, so a few anchor boxes get other labels than in float64. This script encodes random ground truth
+boxes for the SSD300 anchor boxes in both dtypes, with and without the anchor index, and decodes random predictions
+in both dtypes, and asserts that the differences stay within the tolerated bounds below.
+"""
+
+from __future__ import division
+import numpy as np
+
+from ssd_encoder_decoder.ssd_input_encoder import SSDInputEncoder
+from ssd_encoder_decoder.ssd_output_decoder import decode_detections, decode_detections_fast
+
+img_height = 300
+img_width = 300
+n_classes = 20
+predictor_sizes = [(38, 38), (19, 19), (10, 10), (5, 5), (3, 3), (1, 1)]
+scales = [0.1, 0.2, 0.37, 0.54, 0.71, 0.88, 1.05]
+aspect_ratios = [[1.0, 2.0, 0.5],
+                 [1.0, 2.0, 0.5, 3.0, 1.0 / 3.0],
+                 [1.0, 2.0, 0.5, 3.0, 1.0 / 3.0],
+                 [1.0, 2.0, 0.5, 3.0, 1.0 / 3.0],
+                 [1.0, 2.0, 0.5],
+                 [1.0, 2.0, 0.5]]
+steps = [8, 16, 32, 64, 100, 300]
+offsets = [0.5, 0.5, 0.5, 0.5, 0.5, 0.5]
+variances = [0.1, 0.1, 0.2, 0.2]
+n_batches = 20
+batch_size = 8
+
+# The largest tolerated fraction of anchor boxes whose class label differs between float32 and float64.
+max_relabeled_fraction = 1e-3
+# The largest tolerated difference of the offsets, and of the decoded confidences and coordinates, of the anchor boxes
+# and predictions that agree otherwise.
+max_offset_difference = 1e-3
+max_coordinate_difference = 1e-2
+# The largest tolerated fraction of images whose decoded predictions differ in number or class between float32 and
+# float64.
+max_mismatched_image_fraction = 0.05
+
+
+def random_labels(rng, batch_size):
+    labels = []
+    for _ in range(batch_size):
+        n_boxes = rng.randint(1, 12)
+        xmin = rng.randint(0, img_width - 10, n_boxes)
+        ymin = rng.randint(0, img_height - 10, n_boxes)
+        xmax = np.minimum(xmin + rng.randint(5, 200, n_boxes), img_width)
+        ymax = np.minimum(ymin + rng.randint(5, 200, n_boxes), img_height)
+        labels.append(np.stack([rng.randint(1, n_classes + 1, n_boxes), xmin, ymin, xmax, ymax], axis=1))
+    return labels
+
+
+def make_encoder(**kwargs):
+    return SSDInputEncoder(img_height=img_height,
+                           img_width=img_width,
+                           n_classes=n_classes,
+                           predictor_sizes=predictor_sizes,
+                           scales=scales,
+                           aspect_ratios_per_layer=aspect_ratios,
+                           steps=steps,
+                           offsets=offsets,
+                           variances=variances,
+                           **kwargs)
+
+
+def check_encoder(coords, matching_type):
+    rng = np.random.RandomState(0)
+    encoders = {}
+    for dtype in (np.float32, np.float64):
+        for use_anchor_index in (True, False):
+            encoders[dtype, use_anchor_index] = make_encoder(coords=coords,
+                                                             matching_type=matching_type,
+                                                             use_anchor_index=use_anchor_index,
+                                                             dtype=dtype)
+    n_anchors = 0
+    n_relabeled = 0
+    max_difference = 0
+    for _ in range(n_batches):
+        labels = random_labels(rng, batch_size)
+        y = dict((key, encoder(labels)) for key, encoder in encoders.items())
+        # The anchor index doesn't change the labels in either dtype.
+        assert np.array_equal(y[np.float32, True], y[np.float32, False])
+        assert np.array_equal(y[np.float64, True], y[np.float64, False])
+        y_32 = y[np.float32, True]
+        y_64 = y[np.float64, True]
+        assert y_32.dtype == np.float32 and y_64.dtype == np.float64
+        relabeled = np.any(y_32[:, :, :-12] != y_64[:, :, :-12], axis=2)
+        n_anchors += relabeled.size
+        n_relabeled += np.count_nonzero(relabeled)
+        max_difference = max(max_difference, np.max(np.abs(y_32[~relabeled][:, -12:] - y_64[~relabeled][:, -12:])))
+    print("Encoder, coords '{}', matching type '{}': {} of {} anchor boxes relabeled, "
+          "max. offset difference of the others {:.2e}".format(coords, matching_type, n_relabeled, n_anchors,
+                                                               max_difference))
+    assert n_relabeled <= max_relabeled_fraction * n_anchors
+    assert max_difference <= max_offset_difference
+
+
+def check_decoder(decode):
+    rng = np.random.RandomState(1)
+    encoder = make_encoder(dtype=np.float64)
+    n_images = 0
+    n_mismatched = 0
+    max_difference = 0
+    for _ in range(n_batches):
+        # Random predictions: peaked class confidences and small offsets from the anchor boxes.
+        y_pred = encoder(random_labels(rng, batch_size))
+        y_pred[:, :, :-12] = rng.dirichlet(np.full(n_classes + 1, 0.05), size=y_pred.shape[:2])
+        y_pred[:, :, -12:-8] = rng.randn(batch_size, y_pred.shape[1], 4) * 0.1
+        decoded_32 = decode(y_pred.astype(np.float32),
+                            confidence_thresh=0.3,
+                            img_height=img_height,
+                            img_width=img_width)
+        decoded_64 = decode(y_pred,
+                            confidence_thresh=0.3,
+                            img_height=img_height,
+                            img_width=img_width)
+        for boxes_32, boxes_64 in zip(decoded_32, decoded_64):
+            assert boxes_32.dtype == np.float32 and boxes_64.dtype == np.float64
+            n_images += 1
+            # The order of predictions with (nearly) equal confidences can differ, so compare the classes as sorted
+            # lists and every float64 box with the closest float32 box of the same class.
+            if boxes_32.shape != boxes_64.shape or np.any(np.sort(boxes_32[:, 0]) != np.sort(boxes_64[:, 0])):
+                n_mismatched += 1
+                continue
+            for box in boxes_64:
+                same_class = boxes_32[boxes_32[:, 0] == box[0]]
+                max_difference = max(max_difference, np.min(np.max(np.abs(same_class[:, 1:] - box[1:]), axis=1)))
+    print("{}: {} of {} images mismatched, max. coordinate and confidence difference of the others {:.2e}".format(
+        decode.__name__, n_mismatched, n_images, max_difference))
+    assert n_mismatched <= max_mismatched_image_fraction * n_images
+    assert max_difference <= max_coordinate_difference
+
+
+for coords in ('centroids', 'minmax', 'corners'):
+    for matching_type in ('multi', 'bipartite'):
+        check_encoder(coords, matching_type)
+check_decoder(decode_detections)
+check_decoder(decode_detections_fast)
+print("float32 and float64 agree within the tolerated differences.")
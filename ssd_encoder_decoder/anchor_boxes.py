@@ -0,0 +1,321 @@
+"""
+The generation of the anchor boxes of an SSD model, shared by `SSDInputEncoder`, the `AnchorBoxes` layer and the
+decoders, so that they always use the same anchor boxes.
+
+The anchor boxes only depend on the model configuration. They are computed once per configuration and process, and
+`generate_anchor_boxes()` can also cache them on disk.
+
+Copyright (C) 2018 Pierluigi Ferrari
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from __future__ import division
+import hashlib
+import json
+import os
+import numpy as np
+
+from bounding_box_utils.bounding_box_utils import convert_coordinates
+
+# Maps the configuration of a predictor layer to its anchor boxes and their diagnostic information.
+_layer_cache = {}
+
+
+def _config_value(value):
+    """
+    Converts a configuration value, which may contain Numpy scalars and arrays, into a hashable value that can also
+    be serialized to JSON.
+    """
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return tuple(_config_value(element) for element in value)
+    elif isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    elif isinstance(value, (int, np.integer)):
+        return int(value)
+    elif isinstance(value, (float, np.floating)):
+        return float(value)
+    return value
+
+
+def _compute_anchor_boxes_for_layer(img_height, img_width, feature_map_size, aspect_ratios, this_scale, next_scale,
+                                    two_boxes_for_ar1, this_steps, this_offsets, clip_boxes, normalize_coords, coords):
+    """
+    Computes the anchor boxes of one predictor layer, see `generate_anchor_boxes_for_layer()`.
+    """
+    # The shorter side of the image will be used to compute `w` and `h` using `scale` and `aspect_ratios`.
+    size = min(img_height, img_width)
+    # Compute the box widths and and heights for all aspect ratios
+    wh_list = []
+    for aspect_ratio in aspect_ratios:
+        if aspect_ratio == 1:
+            # Compute the regular anchor box for aspect ratio 1.
+            box_height = box_width = this_scale * size
+            wh_list.append((box_width, box_height))
+            if two_boxes_for_ar1:
+                # Compute one slightly larger version using the geometric mean of this scale value and the next.
+                box_height = box_width = np.sqrt(this_scale * next_scale) * size
+                wh_list.append((box_width, box_height))
+        else:
+            # aspect_ratio = box_width / box_height
+            box_width = this_scale * size * np.sqrt(aspect_ratio)
+            box_height = this_scale * size / np.sqrt(aspect_ratio)
+            wh_list.append((box_width, box_height))
+    # shape 为 (n_boxes, 2)
+    wh_array = np.array(wh_list)
+    n_boxes = len(wh_array)
+
+    ##################################################################################
+    # Compute the grid of box center points. They are identical for all aspect ratios.
+    ##################################################################################
+
+    # 1. Compute the step sizes
+    # i.e. how far apart the anchor box center points will be vertically and horizontally.
+    if this_steps is None:
+        step_height = img_height / feature_map_size[0]
+        step_width = img_width / feature_map_size[1]
+    elif isinstance(this_steps, (list, tuple)) and (len(this_steps) == 2):
+        step_height = this_steps[0]
+        step_width = this_steps[1]
+    elif isinstance(this_steps, (int, float)):
+        step_height = this_steps
+        step_width = this_steps
+    else:
+        raise ValueError('`this_steps` must be one of 2-int list, 2-int tuple and int')
+
+    # 2. Compute the offsets, i.e.
+    # at what pixel values the first anchor box center point will be from the top and from the left of the image.
+    if this_offsets is None:
+        offset_height = 0.5
+        offset_width = 0.5
+    elif isinstance(this_offsets, (list, tuple)) and (len(this_offsets) == 2):
+        offset_height = this_offsets[0]
+        offset_width = this_offsets[1]
+    elif isinstance(this_offsets, (int, float)):
+        offset_height = this_offsets
+        offset_width = this_offsets
+    else:
+        raise ValueError('`this_offsets` must be one of 2-float list, 2-float tuple and float')
+
+    # 3. Now that we have the offsets and step sizes, compute the grid of anchor box center points.
+    # (feature_map_size[0], )
+    cy = np.linspace(offset_height * step_height,
+                     offset_height * step_height + (feature_map_size[0] - 1) * step_height,
+                     feature_map_size[0])
+    # (feature_map_size[1], )
+    cx = np.linspace(offset_width * step_width,
+                     offset_width * step_width + (feature_map_size[1] - 1) * step_width,
+                     feature_map_size[1])
+    # shape 为 (feature_map_size[0], feature_map_size[1])
+    cx_grid, cy_grid = np.meshgrid(cx, cy)
+    # This is necessary for np.tile() to do what we want further down
+    cx_grid = np.expand_dims(cx_grid, -1)
+    cy_grid = np.expand_dims(cy_grid, -1)
+
+    # Create a 4D tensor template of shape `(feature_map_height, feature_map_width, n_boxes, 4)`
+    # where the last dimension will contain `(cx, cy, w, h)`
+    boxes_tensor = np.zeros((feature_map_size[0], feature_map_size[1], n_boxes, 4))
+    # Set cx
+    boxes_tensor[:, :, :, 0] = np.tile(cx_grid, (1, 1, n_boxes))
+    # Set cy
+    boxes_tensor[:, :, :, 1] = np.tile(cy_grid, (1, 1, n_boxes))
+    # Set w
+    boxes_tensor[:, :, :, 2] = wh_array[:, 0]
+    # Set h
+    boxes_tensor[:, :, :, 3] = wh_array[:, 1]
+
+    # Convert `(cx, cy, w, h)` to `(x_min, y_min, x_max, y_max)`
+    boxes_tensor = convert_coordinates(boxes_tensor, start_index=0, conversion='centroids2corners')
+
+    # If `clip_boxes` is enabled, clip the coordinates to lie within the image boundaries
+    if clip_boxes:
+        x_coords = boxes_tensor[:, :, :, [0, 2]]
+        x_coords[x_coords >= img_width] = img_width - 1
+        x_coords[x_coords < 0] = 0
+        boxes_tensor[:, :, :, [0, 2]] = x_coords
+        y_coords = boxes_tensor[:, :, :, [1, 3]]
+        y_coords[y_coords >= img_height] = img_height - 1
+        y_coords[y_coords < 0] = 0
+        boxes_tensor[:, :, :, [1, 3]] = y_coords
+
+    # If `normalize_coords` is enabled, normalize the coordinates to be within [0,1]
+    if normalize_coords:
+        boxes_tensor[:, :, :, [0, 2]] /= img_width
+        boxes_tensor[:, :, :, [1, 3]] /= img_height
+
+    # TODO: Implement box limiting directly for `(cx, cy, w, h)` so that we don't have to unnecessarily convert back
+    #  and forth.
+    if coords == 'centroids':
+        # Convert `(x_min, y_min, x_max, y_max)` back to `(cx, cy, w, h)`.
+        boxes_tensor = convert_coordinates(boxes_tensor,
+                                           start_index=0,
+                                           conversion='corners2centroids',
+                                           border_pixels='half')
+    elif coords == 'minmax':
+        # Convert `(x_min, y_min, x_max, y_max)` to `(x_min, x_max, y_min, y_max).
+        boxes_tensor = convert_coordinates(boxes_tensor,
+                                           start_index=0,
+                                           conversion='corners2minmax',
+                                           border_pixels='half')
+
+    return boxes_tensor, (cy, cx), wh_array, (step_height, step_width), (offset_height, offset_width)
+
+
+def _freeze(layer):
+    """
+    Makes the arrays of a cached layer read-only, so that no caller can change the cache by accident.
+    """
+    boxes, (cy, cx), wh_array, steps, offsets = layer
+    for array in (boxes, cy, cx, wh_array):
+        array.flags.writeable = False
+    return layer
+
+
+def generate_anchor_boxes_for_layer(img_height,
+                                    img_width,
+                                    feature_map_size,
+                                    aspect_ratios,
+                                    this_scale,
+                                    next_scale,
+                                    two_boxes_for_ar1=True,
+                                    this_steps=None,
+                                    this_offsets=None,
+                                    clip_boxes=False,
+                                    normalize_coords=False,
+                                    coords='centroids',
+                                    diagnostics=False):
+    """
+    Computes an array of the spatial positions and sizes of the anchor boxes for one predictor layer of size
+    `feature_map_size == [feature_map_height, feature_map_width]`.
+
+    The result is computed only once per configuration and process. The returned arrays are shared between all
+    callers with the same configuration and are therefore read-only.
+
+    Arguments:
+        img_height (int): The height of the input images.
+        img_width (int): The width of the input images.
+        feature_map_size (list/tuple): A list or tuple `[feature_map_height, feature_map_width]` with the spatial
+            dimensions of the feature map for which to generate the anchor boxes.
+        aspect_ratios (list): A list of floats, the aspect ratios for which anchor boxes are to be generated.
+            All list elements must be unique.
+        this_scale (float): A float in [0, 1], the scaling factor for the size of the generate anchor boxes
+            as a fraction of the shorter side of the input image.
+        next_scale (float): A float in [0, 1], the next larger scaling factor. Only relevant if
+            `two_boxes_for_ar1 == True`.
+        two_boxes_for_ar1 (bool, optional): Only relevant if `aspect_ratios` contains 1. If `True`, two anchor boxes
+            will be generated for aspect ratio 1, the second one using the geometric mean of `this_scale` and
+            `next_scale`.
+        this_steps (int or 2-int tuple, optional): anchor 中心点右移一个位置和下移一个位置的距离. If `None`, the
+            image size divided by the feature map size.
+        this_offsets (float or 2-float tuple, optional): 最左上方的 anchor 的中心点的相对于 feature_map 左上方点的偏移量,
+            as a fraction of the step size. If `None`, 0.5.
+        clip_boxes (bool, optional): If `True`, clips the anchor box coordinates to stay within image boundaries.
+        normalize_coords (bool, optional): If `True`, the coordinates are relative to the image size.
+        coords (str, optional): The box coordinate format of the anchor boxes, 'centroids', 'minmax' or 'corners'.
+        diagnostics (bool, optional): If true, the following additional outputs will be returned:
+            1) A tuple `(cy, cx)` with the center point `y` and `x` coordinates of the rows and columns.
+            2) An array containing `(width, height)` for each box aspect ratio.
+            3) A tuple containing `(step_height, step_width)`
+            4) A tuple containing `(offset_height, offset_width)`
+
+    Returns:
+        A 4D Numpy tensor of shape `(feature_map_height, feature_map_width, n_boxes_per_cell, 4)` where the
+        last dimension is determined by `coords`.
+    """
+    config = _config_value((img_height, img_width, feature_map_size, aspect_ratios, this_scale, next_scale,
+                            two_boxes_for_ar1, this_steps, this_offsets, clip_boxes, normalize_coords, coords))
+    if config not in _layer_cache:
+        _layer_cache[config] = _freeze(_compute_anchor_boxes_for_layer(*config))
+    layer = _layer_cache[config]
+    if diagnostics:
+        return layer
+    else:
+        return layer[0]
+
+
+def generate_anchor_boxes(img_height,
+                          img_width,
+                          predictor_sizes,
+                          aspect_ratios_per_layer,
+                          scales,
+                          two_boxes_for_ar1=True,
+                          steps=None,
+                          offsets=None,
+                          clip_boxes=False,
+                          normalize_coords=False,
+                          coords='centroids',
+                          cache_dir=None):
+    """
+    Computes the anchor boxes of all predictor layers of a model with `generate_anchor_boxes_for_layer()`.
+
+    Arguments:
+        predictor_sizes (list): A list of 2-int tuples of the format `(height, width)` containing the output heights
+            and widths of the convolutional predictor layers.
+        aspect_ratios_per_layer (list): A list with the aspect ratios of every predictor layer.
+        scales (list): A list of floats with one more element than `predictor_sizes`, the scaling factor of every
+            predictor layer followed by the one that is only used for the second box for aspect ratio 1 of the last
+            layer.
+        steps (list, optional): `None` or a list with the steps of every predictor layer.
+        offsets (list, optional): `None` or a list with the offsets of every predictor layer.
+        cache_dir (str, optional): `None` or a directory in which the anchor boxes are cached, in a `.npz` file that
+            is named after a hash of the configuration. If the file exists, the anchor boxes are loaded from it instead
+            of being computed.
+
+        All other arguments are the same as for `generate_anchor_boxes_for_layer()`.
+
+    Returns:
+        A list with one tuple `(boxes, (cy, cx), wh, steps, offsets)` per predictor layer, which are the outputs of
+        `generate_anchor_boxes_for_layer()` with `diagnostics=True`.
+    """
+    n_layers = len(predictor_sizes)
+    if steps is None:
+        steps = [None] * n_layers
+    if offsets is None:
+        offsets = [None] * n_layers
+    configs = [_config_value((img_height, img_width, predictor_sizes[i], aspect_ratios_per_layer[i], scales[i],
+                              scales[i + 1], two_boxes_for_ar1, steps[i], offsets[i], clip_boxes, normalize_coords,
+                              coords))
+               for i in range(n_layers)]
+
+    filepath = None
+    if cache_dir is not None:
+        config_hash = hashlib.sha1(json.dumps(configs).encode('utf-8')).hexdigest()
+        filepath = os.path.join(cache_dir, 'anchor_boxes_{}.npz'.format(config_hash))
+        if os.path.exists(filepath) and any(config not in _layer_cache for config in configs):
+            with np.load(filepath) as data:
+                for i, config in enumerate(configs):
+                    _layer_cache[config] = _freeze((data['boxes_{}'.format(i)],
+                                                    (data['cy_{}'.format(i)], data['cx_{}'.format(i)]),
+                                                    data['wh_{}'.format(i)],
+                                                    tuple(data['steps_{}'.format(i)].tolist()),
+                                                    tuple(data['offsets_{}'.format(i)].tolist())))
+
+    layers = [generate_anchor_boxes_for_layer(*config, diagnostics=True) for config in configs]
+
+    if filepath is not None and not os.path.exists(filepath):
+        arrays = {}
+        for i, (boxes, (cy, cx), wh_array, layer_steps, layer_offsets) in enumerate(layers):
+            arrays['boxes_{}'.format(i)] = boxes
+            arrays['cy_{}'.format(i)] = cy
+            arrays['cx_{}'.format(i)] = cx
+            arrays['wh_{}'.format(i)] = wh_array
+            arrays['steps_{}'.format(i)] = np.array(layer_steps)
+            arrays['offsets_{}'.format(i)] = np.array(layer_offsets)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        # Write to a temporary file first, so that concurrent processes never read an incomplete file.
+        temporary_filepath = '{}.{}.npz'.format(filepath[:-len('.npz')], os.getpid())
+        np.savez(temporary_filepath, **arrays)
+        os.replace(temporary_filepath, filepath)
+
+    return layers
@@ -0,0 +1,101 @@
+"""
+A spatial index over the anchor boxes of an SSD model to find the anchor boxes that overlap with given boxes.
+
+Copyright (C) 2018 Pierluigi Ferrari
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from __future__ import division
+import numpy as np
+
+
+class AnchorIndex:
+    """
+    Finds the anchor boxes that overlap with given boxes without comparing every box with every anchor box.
+
+    The anchor boxes of a predictor layer lie on a grid: the x-coordinates of an anchor box only depend on its column
+    and its box index within the cell, and the y-coordinates only depend on its row and its box index. An anchor box
+    overlaps with a box exactly if its column overlaps with the box horizontally and its row overlaps with the box
+    vertically. The index therefore only compares the boxes with the columns and rows of every predictor layer and
+    box index, which takes time proportional to the number of boxes times the side lengths of the feature maps,
+    plus the number of overlapping anchor boxes.
+    """
+
+    def __init__(self, boxes_per_layer):
+        """
+        Arguments:
+            boxes_per_layer (list): A list with one Numpy array of shape `(feature_map_height, feature_map_width,
+                n_boxes, 4)` per predictor layer that contains the anchor boxes of the layer in the format
+                `(xmin, ymin, xmax, ymax)`, as in `SSDInputEncoder.boxes_per_layer` after a conversion to this format.
+                The anchor boxes are numbered in the order of the flattened arrays of all layers.
+        """
+        self.layers = []
+        offset = 0
+        for boxes in boxes_per_layer:
+            height, width, n_boxes = boxes.shape[:3]
+            # shape 为 (n_boxes, feature_map_width) 和 (n_boxes, feature_map_height)
+            xmin = boxes[0, :, :, 0].T
+            xmax = boxes[0, :, :, 2].T
+            ymin = boxes[:, 0, :, 1].T
+            ymax = boxes[:, 0, :, 3].T
+            if not (np.all(boxes[:, :, :, [0, 2]] == boxes[:1, :, :, [0, 2]]) and
+                    np.all(boxes[:, :, :, [1, 3]] == boxes[:, :1, :, [1, 3]])):
+                raise ValueError("The anchor boxes of every predictor layer must lie on a grid.")
+            self.layers.append((offset, height, width, n_boxes, xmin, ymin, xmax, ymax))
+            offset += height * width * n_boxes
+        self.n_anchors = offset
+
+    def query(self, boxes):
+        """
+        Returns all pairs of boxes and anchor boxes that overlap, i.e. whose intersection has a positive width and
+        height.
+
+        Arguments:
+            boxes (np.array): A 2D Numpy array of shape `(m, 4)` with boxes in the format `(xmin, ymin, xmax, ymax)`.
+
+        Returns:
+            Two 1D Numpy arrays of equal length, the indices of the boxes and the indices of the anchor boxes of all
+            overlapping pairs.
+        """
+        m = len(boxes)
+        box_indices = []
+        anchor_indices = []
+        for offset, height, width, n_boxes, xmin, ymin, xmax, ymax in self.layers:
+            # The columns and rows of every box index that overlap with every box,
+            # shape 为 (m, n_boxes, feature_map_width) 和 (m, n_boxes, feature_map_height)
+            column_overlaps = ((xmin < boxes[:, 2, np.newaxis, np.newaxis]) &
+                               (xmax > boxes[:, 0, np.newaxis, np.newaxis]))
+            row_overlaps = ((ymin < boxes[:, 3, np.newaxis, np.newaxis]) &
+                            (ymax > boxes[:, 1, np.newaxis, np.newaxis]))
+            # Both are numbered by `key = box_index * n_boxes + k`.
+            column_keys, columns = np.nonzero(column_overlaps.reshape(m * n_boxes, width))
+            row_keys, rows = np.nonzero(row_overlaps.reshape(m * n_boxes, height))
+
+            # Combine every overlapping row with all overlapping columns of the same key.
+            n_columns = np.bincount(column_keys, minlength=m * n_boxes)
+            column_starts = np.cumsum(n_columns) - n_columns
+            counts = n_columns[row_keys]
+            total = np.sum(counts)
+            if total == 0:
+                continue
+            positions = (np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts) +
+                         np.repeat(column_starts[row_keys], counts))
+            keys = np.repeat(row_keys, counts)
+            box_indices.append(keys // n_boxes)
+            anchor_indices.append(offset + (np.repeat(rows, counts) * width + columns[positions]) * n_boxes +
+                                  keys % n_boxes)
+
+        if not box_indices:
+            return np.zeros((0,), dtype=np.int), np.zeros((0,), dtype=np.int)
+        return np.concatenate(box_indices), np.concatenate(anchor_indices)
@@ -0,0 +1,157 @@
+"""
+Statistics about how the ground truth boxes of a dataset are matched to the anchor boxes of an SSD model.
+
+Copyright (C) 2018 Pierluigi Ferrari
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from __future__ import division
+import numpy as np
+
+
+class MatchStatistics:
+    """
+    Collects statistics about the matching of an `SSDInputEncoder` batch by batch, e.g. to tune `scales` and
+    `aspect_ratios_per_layer` for a new dataset.
+
+    The statistics are counts that are updated with every encoded batch, so collecting them costs little time and
+    memory and doesn't need the `y_matched_anchors` copy of `diagnostics=True`. They are:
+
+    * The number of positive anchor boxes of every image.
+    * The fraction of neutral anchor boxes.
+    * For every predictor layer and every box of a cell (i.e. every aspect ratio), the number of ground truth boxes
+      whose bipartite match is an anchor box of that kind, how many of these match with an IoU below
+      `pos_iou_threshold`, and their mean IoU. A ground truth box with a low IoU gets only its bipartite match as a
+      positive anchor box, so many such boxes for one layer and aspect ratio mean that the anchor boxes around it
+      don't fit the dataset.
+    * The number of ground truth boxes that don't overlap with any anchor box, i.e. whose bipartite match has an IoU
+      of zero. They are not attributed to any layer.
+
+    Create the encoder with `collect_statistics=True` to get an instance as `SSDInputEncoder.statistics`. Note that
+    encoders in the worker processes of `DataGenerator.generate()` collect their statistics in the workers.
+    """
+
+    def __init__(self, predictor_sizes, n_boxes, aspect_ratios, two_boxes_for_ar1, whs_per_layer, pos_iou_threshold):
+        """
+        Arguments:
+            predictor_sizes (array): The `(height, width)` of the feature map of every predictor layer.
+            n_boxes (list): The number of boxes per cell of every predictor layer.
+            aspect_ratios (list): The aspect ratios of every predictor layer.
+            two_boxes_for_ar1 (bool): Whether every layer has a second box for the aspect ratio 1.
+            whs_per_layer (list): The widths and heights of the boxes of a cell of every predictor layer, as in
+                `SSDInputEncoder.whs_per_layer`.
+            pos_iou_threshold (float): The IoU below which a bipartite match counts as a low IoU match.
+        """
+        self.n_layers = len(n_boxes)
+        self.max_n_boxes = max(n_boxes)
+        self.pos_iou_threshold = pos_iou_threshold
+
+        # The layer and the box index within the cell of every anchor box, in the order of the encoded labels.
+        self.anchor_layers = np.concatenate([np.full(height * width * n, i, dtype=np.int)
+                                             for i, ((height, width), n) in enumerate(zip(predictor_sizes, n_boxes))])
+        self.anchor_box_indices = np.concatenate([np.tile(np.arange(n), height * width)
+                                                  for (height, width), n in zip(predictor_sizes, n_boxes)])
+
+        # The aspect ratio and the size of every box of a cell of every layer. With `two_boxes_for_ar1`, the second box
+        # for aspect ratio 1 follows the first one.
+        self.box_aspect_ratios = []
+        for layer_aspect_ratios in aspect_ratios:
+            ratios = []
+            for aspect_ratio in layer_aspect_ratios:
+                ratios.append(aspect_ratio)
+                if aspect_ratio == 1 and two_boxes_for_ar1:
+                    ratios.append(aspect_ratio)
+            self.box_aspect_ratios.append(ratios)
+        self.box_sizes = [np.array(whs) for whs in whs_per_layer]
+
+        self.reset()
+
+    def reset(self):
+        """
+        Discards all collected statistics.
+        """
+        self.n_images = 0
+        self.n_anchors = 0
+        self.n_neutral = 0
+        self.n_gt_boxes = 0
+        self.n_unmatched = 0
+        self._positives_per_image = []
+        # shape 为 (n_layers, max_n_boxes), 按 bipartite match 的 anchor_box 所在的 layer 和 box index 统计
+        self.gt_boxes_per_box = np.zeros((self.n_layers, self.max_n_boxes), dtype=np.int)
+        self.low_iou_per_box = np.zeros((self.n_layers, self.max_n_boxes), dtype=np.int)
+        self.iou_sum_per_box = np.zeros((self.n_layers, self.max_n_boxes))
+
+    def update(self, n_positives, n_neutral, anchor_indices, ious):
+        """
+        Adds the matching results of one batch. `SSDInputEncoder` calls this for every batch it encodes.
+
+        Arguments:
+            n_positives (array): The number of positive anchor boxes of every image of the batch.
+            n_neutral (int): The number of neutral anchor boxes in the batch.
+            anchor_indices (array): The index of the anchor box that every ground truth box of the batch is matched to
+                in the bipartite matching.
+            ious (array): The IoU of the bipartite match of every ground truth box of the batch.
+        """
+        self.n_images += len(n_positives)
+        self.n_anchors += len(n_positives) * len(self.anchor_layers)
+        self.n_neutral += n_neutral
+        self._positives_per_image.append(np.asarray(n_positives, dtype=np.int))
+
+        self.n_gt_boxes += len(anchor_indices)
+        unmatched = ious <= 0
+        self.n_unmatched += np.count_nonzero(unmatched)
+        layers = self.anchor_layers[anchor_indices[~unmatched]]
+        box_indices = self.anchor_box_indices[anchor_indices[~unmatched]]
+        ious = ious[~unmatched]
+        np.add.at(self.gt_boxes_per_box, (layers, box_indices), 1)
+        np.add.at(self.low_iou_per_box, (layers, box_indices), ious < self.pos_iou_threshold)
+        np.add.at(self.iou_sum_per_box, (layers, box_indices), ious)
+
+    @property
+    def positives_per_image(self):
+        """
+        The number of positive anchor boxes of every image encoded so far.
+        """
+        if len(self._positives_per_image) > 1:
+            self._positives_per_image = [np.concatenate(self._positives_per_image)]
+        return self._positives_per_image[0] if self._positives_per_image else np.zeros((0,), dtype=np.int)
+
+    def summary(self):
+        """
+        Returns the statistics collected so far as a dictionary.
+
+        The entry 'boxes' contains one dictionary per predictor layer and box of a cell with the layer, the aspect
+        ratio, the width and height of the anchor boxes, the number of ground truth boxes that are matched to anchor
+        boxes of this kind, the fraction of these with a low IoU, and their mean IoU.
+        """
+        positives = self.positives_per_image
+        boxes = []
+        for layer in range(self.n_layers):
+            for k, aspect_ratio in enumerate(self.box_aspect_ratios[layer]):
+                n = self.gt_boxes_per_box[layer, k]
+                boxes.append({'layer': layer,
+                              'aspect_ratio': aspect_ratio,
+                              'size': tuple(self.box_sizes[layer][k]),
+                              'n_gt_boxes': int(n),
+                              'low_iou_fraction': self.low_iou_per_box[layer, k] / n if n > 0 else 0.0,
+                              'mean_iou': self.iou_sum_per_box[layer, k] / n if n > 0 else 0.0})
+        return {'n_images': self.n_images,
+                'mean_positives_per_image': np.mean(positives) if len(positives) > 0 else 0.0,
+                'min_positives_per_image': int(np.min(positives)) if len(positives) > 0 else 0,
+                'neutral_fraction': self.n_neutral / self.n_anchors if self.n_anchors > 0 else 0.0,
+                'n_gt_boxes': self.n_gt_boxes,
+                'unmatched_fraction': self.n_unmatched / self.n_gt_boxes if self.n_gt_boxes > 0 else 0.0,
+                'low_iou_fraction': ((self.n_unmatched + np.sum(self.low_iou_per_box)) / self.n_gt_boxes
+                                     if self.n_gt_boxes > 0 else 0.0),
+                'boxes': boxes}
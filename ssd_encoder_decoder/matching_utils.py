@@ -17,6 +17,7 @@ limitations under the License.
 """
 
 from __future__ import division
+import heapq
 import numpy as np
 
 
@@ -38,10 +39,13 @@ def match_bipartite_greedy(weight_matrix):
 
     That is, the ground truth boxes will be matched in descending order by maximum similarity with any of the
     respectively remaining anchor boxes.
-    The runtime complexity is O(m^2 * n), where `m` is the number of ground truth boxes and `n` is the number of
-    anchor boxes.
-    # 找一行中的最大 iou, O(n), 那么 m 行最大 iou 的时间复杂度就是 O(m * n)
-    # 然后再在 m 个 最大 iou 中找到最最大的 iou, O(m^2 * n)
+
+    The best anchor box of every ground truth box is computed only once and the ground truth boxes are kept in a heap
+    ordered by the weight of their best anchor box. Only when the best anchor box of a ground truth box has already been
+    matched when it comes out of the heap, its best anchor box among the remaining ones is computed again. This gives
+    the same matches as doing all of the above reductions in every iteration, including the ties, which are broken in
+    favor of the smaller index on both axes. The runtime complexity is O(m * n) plus O(n) for every recomputed ground
+    truth box instead of O(m^2 * n), where `m` is the number of ground truth boxes and `n` is the number of anchor boxes.
 
     Arguments:
         weight_matrix (np.array): A 2D Numpy array that represents the weight matrix for the matching process.
@@ -54,43 +58,97 @@ def match_bipartite_greedy(weight_matrix):
         the matched index along the second axis of `weight_matrix` for each index along the first axis.
         就是为每个 gt_box 找一个匹配的 anchor_box, 返回 array 的 shape 为 (m, )
     """
-    # We'll modify this array.
-    weight_matrix = np.copy(weight_matrix)
+    weight_matrix = np.asarray(weight_matrix)
     num_gt_boxes = weight_matrix.shape[0]
     # Only relevant for fancy-indexing below.
     all_gt_indices = list(range(num_gt_boxes))
 
     # This 1D array will contain for each ground truth box the index of the matched anchor box.
     matches = np.zeros(num_gt_boxes, dtype=np.int)
+    if num_gt_boxes == 0:
+        return matches
+
+    # The best anchor box of every ground truth box, (-weight, gt_index, anchor_index) in a heap, so the greatest
+    # weight and among equal weights the smallest ground truth index comes first.
+    anchor_indices = np.argmax(weight_matrix, axis=1)
+    overlaps = weight_matrix[all_gt_indices, anchor_indices]
+    heap = [(-overlap, gt_index, anchor_index)
+            for gt_index, (anchor_index, overlap) in enumerate(zip(anchor_indices, overlaps)) if overlap > 0]
+    heapq.heapify(heap)
+    matched_gt_indices = []
+    matched_anchors = np.zeros(weight_matrix.shape[1], dtype=np.bool)
 
-    # In each iteration of the loop below, exactly one ground truth box will be matched to one anchor box.
-    for _ in range(num_gt_boxes):
-        # Find the maximal anchor-ground truth pair in two steps:
-        # First, reduce over the anchor boxes and then reduce over the ground truth boxes.
-        # Reduce along the anchor box axis.
-        # 先为每个 gt_box 找到最大 iou 的 anchor_box
-        anchor_indices = np.argmax(weight_matrix, axis=1)
-        # shape 为 (num_gt_boxes, )
-        overlaps = weight_matrix[all_gt_indices, anchor_indices]
-        # Reduce along the ground truth box axis.
-        # 然后再在这 num_gt_boxes 个 iou 中找到最大的
-        # gt_index 表示这个最大 iou 对应的 gt_box 的 index
-        gt_index = np.argmax(overlaps)
-        # anchor_index 表示这个最大 iou 对应的 anchor_box 的 index
-        anchor_index = anchor_indices[gt_index]
-        # Set the match.
+    # Matching only lowers weights to zero, so the weight of the best remaining anchor box of a ground truth box can
+    # only decrease as long as it is positive, and the heap is only ever out of date for ground truth boxes whose best
+    # anchor box has been matched.
+    while heap:
+        _, gt_index, anchor_index = heapq.heappop(heap)
+        if matched_anchors[anchor_index]:
+            weights = np.where(matched_anchors, 0, weight_matrix[gt_index])
+            anchor_index = np.argmax(weights)
+            if weights[anchor_index] > 0:
+                heapq.heappush(heap, (-weights[anchor_index], gt_index, anchor_index))
+            continue
         matches[gt_index] = anchor_index
+        matched_gt_indices.append(gt_index)
+        matched_anchors[anchor_index] = True
 
-        # Set the row of the matched ground truth box to all zeros, because it has found the matched anchor_box
-        # Set the column of the matched anchor box to all zeros, because they will never be the best matches
-        # for any other boxes.
-        # 最后设置该 gt_box 和其他所有的 anchor_boxes 的 iou 为 0, 设置该 anchor_box 和其他所有的 gt_boxes 的 iou 为 0.
-        weight_matrix[gt_index] = 0
-        weight_matrix[:, anchor_index] = 0
+    # The remaining ground truth boxes have no positive weights left. Match them exactly like the original algorithm,
+    # which also selects already matched ground truth boxes again at this point, on the weight matrix with the rows and
+    # columns of all matches so far set to zero. This doesn't happen for IoUs unless a ground truth box doesn't overlap
+    # with any anchor box.
+    if len(matched_gt_indices) < num_gt_boxes:
+        # We'll modify this array.
+        weight_matrix = np.copy(weight_matrix)
+        weight_matrix[matched_gt_indices] = 0
+        weight_matrix[:, matched_anchors] = 0
+        # In each iteration of the loop below, exactly one ground truth box will be matched to one anchor box.
+        for _ in range(num_gt_boxes - len(matched_gt_indices)):
+            # Find the maximal anchor-ground truth pair in two steps:
+            # First, reduce over the anchor boxes and then reduce over the ground truth boxes.
+            anchor_indices = np.argmax(weight_matrix, axis=1)
+            overlaps = weight_matrix[all_gt_indices, anchor_indices]
+            gt_index = np.argmax(overlaps)
+            anchor_index = anchor_indices[gt_index]
+            # Set the match.
+            matches[gt_index] = anchor_index
+            # Set the row of the matched ground truth box and the column of the matched anchor box to all zeros.
+            weight_matrix[gt_index] = 0
+            weight_matrix[:, anchor_index] = 0
 
     return matches
 
 
+def match_bipartite_optimal(weight_matrix):
+    """
+    Returns the bipartite matching that maximizes the sum of the weights of all matches, i.e. the solution of the
+    assignment problem, which is computed with the Hungarian method of SciPy.
+
+    Unlike `match_bipartite_greedy()`, a ground truth box can get an anchor box that is not its best one if that
+    leaves a better anchor box to another ground truth box. `SSDInputEncoder` uses it with
+    `bipartite_matching='optimal'`, to compare the two. Requires SciPy.
+
+    Arguments:
+        weight_matrix (np.array): A 2D Numpy array that represents the weight matrix for the matching process.
+            If `(m,n)` is the shape of the weight matrix, it must be `m <= n`.
+
+    Returns:
+        A 1D Numpy array of length `weight_matrix.shape[0]` that represents
+        the matched index along the second axis of `weight_matrix` for each index along the first axis.
+    """
+    try:
+        from scipy.optimize import linear_sum_assignment
+    except ImportError:
+        raise ImportError("Optimal bipartite matching requires SciPy. "
+                          "Either install it or use `match_bipartite_greedy()`.")
+    weight_matrix = np.asarray(weight_matrix)
+    # `linear_sum_assignment()` minimizes the sum of the costs.
+    gt_indices, anchor_indices = linear_sum_assignment(-weight_matrix)
+    matches = np.zeros(weight_matrix.shape[0], dtype=np.int)
+    matches[gt_indices] = anchor_indices
+    return matches
+
+
 def match_multi(weight_matrix, threshold):
     """
     Matches all elements along the second axis of `weight_matrix` to their best matches along the first axis subject to
@@ -136,3 +194,243 @@ def match_multi(weight_matrix, threshold):
     gt_indices_thresh_met = gt_indices[anchor_indices_thresh_met]
 
     return gt_indices_thresh_met, anchor_indices_thresh_met
+
+
+def match_bipartite_greedy_batch(weight_tensor, n_valid):
+    """
+    Performs `match_bipartite_greedy()` for all items of a batch at once and returns identical matches.
+
+    Each item of the batch has its own weight matrix, padded to the largest number of ground truth boxes in the batch.
+    Instead of reducing over the whole weight matrix in every iteration, the best anchor box of every ground truth box
+    is computed once and only recomputed for the rows whose best anchor box was just matched, since zeroing a column
+    doesn't change the maximum of any other row. One iteration matches one ground truth box for every batch item that
+    still has unmatched ones.
+
+    Arguments:
+        weight_tensor (np.array): A 3D Numpy array of shape `(batch_size, m, n)` with the weight matrix of every batch
+            item. The weights must be non-negative. Only the first `n_valid[i]` rows of item `i` are used.
+        n_valid (np.array): A 1D Numpy array of length `batch_size` with the number of ground truth boxes of every
+            batch item.
+
+    Returns:
+        A 2D Numpy array of shape `(batch_size, m)` that contains for every ground truth box the index of the matched
+        anchor box, and -1 for the padding rows.
+    """
+    batch_size, m, n = weight_tensor.shape
+    valid = np.arange(m) < np.expand_dims(n_valid, axis=1)
+    # The best anchor box and its weight for every ground truth box, given the columns and rows zeroed so far.
+    row_argmax = np.argmax(weight_tensor, axis=2)
+    row_max = np.take_along_axis(weight_tensor, np.expand_dims(row_argmax, axis=2), axis=2)[:, :, 0]
+    row_max[~valid] = -np.inf
+    matched_rows = np.zeros((batch_size, m), dtype=np.bool)
+    # The anchor boxes that were matched so far for every batch item, i.e. the columns that are zero now.
+    zeroed_columns = [[] for _ in range(batch_size)]
+    # Like in `match_bipartite_greedy()`, a ground truth box that is never selected keeps the anchor box 0. This can
+    # only happen if it doesn't overlap with any anchor box.
+    matches = np.where(valid, 0, -1)
+
+    for iteration in range(int(np.max(n_valid, initial=0))):
+        active = np.nonzero(n_valid > iteration)[0]
+        gt_indices = np.argmax(row_max[active], axis=1)
+        anchor_indices = row_argmax[active, gt_indices]
+        matches[active, gt_indices] = anchor_indices
+
+        # The row of the matched ground truth box is all zeros now, so its maximum is the first element.
+        row_max[active, gt_indices] = 0
+        row_argmax[active, gt_indices] = 0
+        matched_rows[active, gt_indices] = True
+        for i, anchor_index in zip(active, anchor_indices):
+            zeroed_columns[i].append(anchor_index)
+
+        # Only the rows whose best anchor box was just matched need to be reduced again.
+        stale = (row_argmax[active] == np.expand_dims(anchor_indices, axis=1)) & valid[active] & ~matched_rows[active]
+        for k, gt_index in zip(*np.nonzero(stale)):
+            i = active[k]
+            weights = np.copy(weight_tensor[i, gt_index])
+            weights[zeroed_columns[i]] = 0
+            row_argmax[i, gt_index] = np.argmax(weights)
+            row_max[i, gt_index] = weights[row_argmax[i, gt_index]]
+
+    return matches
+
+
+def match_multi_batch(weight_tensor, threshold):
+    """
+    Performs `match_multi()` for all items of a batch at once.
+
+    Arguments:
+        weight_tensor (np.array): A 3D Numpy array of shape `(batch_size, m, n)` with the weight matrix of every batch
+            item. Padding rows must have weights below `threshold`.
+        threshold (float): A float that represents the threshold (i.e. lower bound) that must be met by a pair of
+            elements to produce a match.
+
+    Returns:
+        Three 1D Numpy arrays of equal length that represent the matched indices: the batch indices, the indices
+        along the second axis of `weight_tensor`, and the indices along the third axis.
+    """
+    gt_indices = np.argmax(weight_tensor, axis=1)
+    overlaps = np.take_along_axis(weight_tensor, np.expand_dims(gt_indices, axis=1), axis=1)[:, 0]
+    batch_indices, anchor_indices = np.nonzero(overlaps >= threshold)
+    return batch_indices, gt_indices[batch_indices, anchor_indices], anchor_indices
+
+
+def match_bipartite_greedy_sparse(rows, columns, weights, n_valid, m):
+    """
+    Performs `match_bipartite_greedy_batch()` on sparse weight matrices and returns identical matches.
+
+    The weight matrices contain only the given non-zero weights, all other weights are zero. This can be used if only
+    few weights are non-zero, e.g. the IoUs of the ground truth boxes with the anchor boxes, so that the time of the
+    matching depends on the number of non-zero weights rather than on the number of anchor boxes.
+
+    Arguments:
+        rows (np.array): A 1D Numpy array with the row of every weight as `batch_index * m + row_index`.
+        columns (np.array): A 1D Numpy array with the column of every weight. The weights must be sorted by row and
+            column.
+        weights (np.array): A 1D Numpy array with the non-negative weights.
+        n_valid (np.array): A 1D Numpy array of length `batch_size` with the number of rows of every batch item.
+        m (int): The number of rows of the padded weight matrices.
+
+    Returns:
+        A 2D Numpy array of shape `(batch_size, m)` that contains for every row the matched column, and -1 for the
+        padding rows.
+    """
+    batch_size = len(n_valid)
+    valid = np.arange(m) < np.expand_dims(n_valid, axis=1)
+    # The slice of the weights of every row.
+    row_starts = np.searchsorted(rows, np.arange(batch_size * m + 1))
+
+    def reduce_row(i, j, zeroed_columns):
+        # Returns the best column and weight of a row. A row without positive weights is all zeros, so its best column
+        # is the first one.
+        row_columns = columns[row_starts[i * m + j]:row_starts[i * m + j + 1]]
+        row_weights = weights[row_starts[i * m + j]:row_starts[i * m + j + 1]]
+        if zeroed_columns:
+            row_weights = np.where(np.isin(row_columns, zeroed_columns), 0, row_weights)
+        if len(row_weights) == 0:
+            return 0, 0
+        k = np.argmax(row_weights)
+        if row_weights[k] <= 0:
+            return 0, 0
+        return row_columns[k], row_weights[k]
+
+    # The best column and its weight for every row, given the columns and rows zeroed so far.
+    row_argmax = np.zeros((batch_size, m), dtype=np.int)
+    row_max = np.zeros((batch_size, m))
+    non_empty = np.nonzero(row_starts[1:] > row_starts[:-1])[0]
+    if len(non_empty) > 0:
+        starts = row_starts[non_empty]
+        maxima = np.maximum.reduceat(weights, starts)
+        # The first position of the maximum in every row, which is the smallest column since the columns are sorted.
+        is_max = weights == np.repeat(maxima, row_starts[non_empty + 1] - starts)
+        positions = np.minimum.reduceat(np.where(is_max, np.arange(len(weights)), len(weights)), starts)
+        positive = maxima > 0
+        row_argmax.flat[non_empty[positive]] = columns[positions[positive]]
+        row_max.flat[non_empty[positive]] = maxima[positive]
+    row_max[~valid] = -np.inf
+    matched_rows = np.zeros((batch_size, m), dtype=np.bool)
+    zeroed_columns = [[] for _ in range(batch_size)]
+    # Like in `match_bipartite_greedy()`, a row that is never selected keeps the column 0.
+    matches = np.where(valid, 0, -1)
+
+    for iteration in range(int(np.max(n_valid, initial=0))):
+        active = np.nonzero(n_valid > iteration)[0]
+        row_indices = np.argmax(row_max[active], axis=1)
+        column_indices = row_argmax[active, row_indices]
+        matches[active, row_indices] = column_indices
+
+        row_max[active, row_indices] = 0
+        row_argmax[active, row_indices] = 0
+        matched_rows[active, row_indices] = True
+        for i, column_index in zip(active, column_indices):
+            zeroed_columns[i].append(column_index)
+
+        # Only the rows whose best column was just matched need to be reduced again.
+        stale = (row_argmax[active] == np.expand_dims(column_indices, axis=1)) & valid[active] & ~matched_rows[active]
+        for k, j in zip(*np.nonzero(stale)):
+            i = active[k]
+            row_argmax[i, j], row_max[i, j] = reduce_row(i, j, zeroed_columns[i])
+
+    return matches
+
+
+def match_bipartite_optimal_batch(weight_tensor, n_valid):
+    """
+    Performs `match_bipartite_optimal()` for every item of a batch.
+
+    Arguments:
+        weight_tensor (np.array): A 3D Numpy array of shape `(batch_size, m, n)` with the weight matrix of every batch
+            item. Only the first `n_valid[i]` rows of item `i` are used.
+        n_valid (np.array): A 1D Numpy array of length `batch_size` with the number of ground truth boxes of every
+            batch item.
+
+    Returns:
+        A 2D Numpy array of shape `(batch_size, m)` that contains for every ground truth box the index of the matched
+        anchor box, and -1 for the padding rows.
+    """
+    batch_size, m = weight_tensor.shape[:2]
+    matches = np.full((batch_size, m), -1, dtype=np.int)
+    for i in range(batch_size):
+        matches[i, :n_valid[i]] = match_bipartite_optimal(weight_tensor[i, :n_valid[i]])
+    return matches
+
+
+def match_bipartite_optimal_sparse(rows, columns, weights, n_valid, m, n):
+    """
+    Performs `match_bipartite_optimal()` for every item of a batch, given the non-zero weights in the same format as
+    `match_bipartite_greedy_sparse()`. The weight matrix of every batch item is filled in densely, since the assignment
+    problem has to be solved on the whole matrix anyway.
+
+    Arguments:
+        rows (np.array): A 1D Numpy array with the row of every weight as `batch_index * m + row_index`.
+        columns (np.array): A 1D Numpy array with the column of every weight.
+        weights (np.array): A 1D Numpy array with the non-negative weights.
+        n_valid (np.array): A 1D Numpy array of length `batch_size` with the number of rows of every batch item.
+        m (int): The number of rows of the padded weight matrices.
+        n (int): The number of columns of the weight matrices.
+
+    Returns:
+        A 2D Numpy array of shape `(batch_size, m)` that contains for every row the matched column, and -1 for the
+        padding rows.
+    """
+    batch_size = len(n_valid)
+    matches = np.full((batch_size, m), -1, dtype=np.int)
+    batch_indices, row_indices = np.divmod(rows, m)
+    for i in range(batch_size):
+        in_item = batch_indices == i
+        weight_matrix = np.zeros((n_valid[i], n), dtype=weights.dtype)
+        weight_matrix[row_indices[in_item], columns[in_item]] = weights[in_item]
+        matches[i, :n_valid[i]] = match_bipartite_optimal(weight_matrix)
+    return matches
+
+
+def match_multi_sparse(batch_indices, row_indices, columns, weights, threshold):
+    """
+    Performs `match_multi_batch()` on sparse weight matrices, i.e. every column is matched to the row with the largest
+    weight in it, the first one in case of a tie, if that weight is at least `threshold`.
+
+    Arguments:
+        batch_indices (np.array): A 1D Numpy array with the batch item of every weight.
+        row_indices (np.array): A 1D Numpy array with the row of every weight.
+        columns (np.array): A 1D Numpy array with the column of every weight.
+        weights (np.array): A 1D Numpy array with the weights. All other weights are zero, so `threshold` must be
+            positive.
+        threshold (float): A float that represents the threshold (i.e. lower bound) that must be met by a pair of
+            elements to produce a match.
+
+    Returns:
+        Three 1D Numpy arrays of equal length that represent the matched indices: the batch indices, the row indices,
+        and the columns.
+    """
+    # Only weights that meet the threshold can produce a match.
+    candidates = np.nonzero(weights >= threshold)[0]
+    batch_indices = batch_indices[candidates]
+    row_indices = row_indices[candidates]
+    columns = columns[candidates]
+    weights = weights[candidates]
+    # Sort by batch item, column, descending weight and row, so the match of every column comes first.
+    order = np.lexsort((row_indices, -weights, columns, batch_indices))
+    batch_indices = batch_indices[order]
+    columns = columns[order]
+    first = np.ones(len(order), dtype=np.bool)
+    first[1:] = (batch_indices[1:] != batch_indices[:-1]) | (columns[1:] != columns[:-1])
+    return batch_indices[first], row_indices[order][first], columns[first]
@@ -19,8 +19,12 @@ limitations under the License.
 from __future__ import division
 import numpy as np
 
-from bounding_box_utils.bounding_box_utils import iou, convert_coordinates
-from ssd_encoder_decoder.matching_utils import match_bipartite_greedy, match_multi
+from bounding_box_utils.bounding_box_utils import convert_coordinates
+from ssd_encoder_decoder.matching_utils import match_bipartite_greedy_batch, match_multi_batch, \
+    match_bipartite_greedy_sparse, match_multi_sparse, match_bipartite_optimal_batch, match_bipartite_optimal_sparse
+from ssd_encoder_decoder.anchor_boxes import generate_anchor_boxes, generate_anchor_boxes_for_layer
+from ssd_encoder_decoder.anchor_index import AnchorIndex
+from ssd_encoder_decoder.match_statistics import MatchStatistics
 
 
 class SSDInputEncoder:
@@ -48,12 +52,19 @@ class SSDInputEncoder:
                  clip_boxes=False,
                  variances=(0.1, 0.1, 0.2, 0.2),
                  matching_type='multi',
+                 bipartite_matching='greedy',
                  pos_iou_threshold=0.5,
                  neg_iou_limit=0.3,
                  border_pixels='half',
                  coords='centroids',
                  normalize_coords=True,
-                 background_id=0):
+                 background_id=0,
+                 reuse_buffer=False,
+                 output_mode='dense',
+                 use_anchor_index=True,
+                 dtype=np.float32,
+                 anchor_cache_dir=None,
+                 collect_statistics=False):
         """
         Arguments:
             img_height (int): The height of the input images.
@@ -121,6 +132,12 @@ class SSDInputEncoder:
                 In 'multi' mode, in addition to the aforementioned(上述提及的) bipartite matching, all anchor boxes with
                 an IoU overlap greater than or equal to the `pos_iou_threshold` will be matched to a given ground truth
                 box.
+            bipartite_matching (str, optional): Can be either 'greedy' or 'optimal'.
+                In 'greedy' mode, the ground truth boxes are matched in descending order of their highest IoU with any
+                of the remaining anchor boxes, see `match_bipartite_greedy()`.
+                In 'optimal' mode, the bipartite matching maximizes the sum of the IoUs of all matches, see
+                `match_bipartite_optimal()`. This solves an assignment problem for every batch item, is slower, and
+                requires SciPy. It is meant to compare the two matchings.
             pos_iou_threshold (float, optional): The intersection-over-union similarity threshold that must be met in
                 order to match a given ground truth box to a given anchor box.
             neg_iou_limit (float, optional): The maximum allowed intersection-over-union similarity of an anchor box
@@ -142,6 +159,39 @@ class SSDInputEncoder:
                 within [0,1].
                 This way learning becomes independent of the input image size.
             background_id (int, optional): Determines which class ID is for the background class.
+            reuse_buffer (bool, optional): If `True`, the encoder writes every batch into the same array as long as
+                the batch size doesn't change, and returns that array, so it doesn't allocate a new label tensor for
+                every batch. The returned labels are then only valid until the next call, so only use this if every
+                batch is consumed before the next one is encoded, i.e. not with a queue of prefetched batches.
+            output_mode (str, optional): Can be either 'dense' or 'sparse'.
+                In 'dense' mode, the encoded labels have the same shape as the model output, i.e.
+                `(batch_size, #boxes, #classes + 12)`, with one-hot class vectors, the box offsets, and the anchor boxes
+                and variances, which are the same for every batch.
+                In 'sparse' mode, the encoded labels are an array of shape `(batch_size, #boxes, 5)` that
+                contains the class ID and the four box offsets of every anchor box. Negative boxes have the class ID
+                `background_id` and neutral boxes the class ID -1, the positive boxes are all others. This is an order
+                of magnitude less data per batch. Train with `SSDLoss.compute_sparse_loss()` in this mode.
+            use_anchor_index (bool, optional): If `True`, an `AnchorIndex` finds the anchor boxes that overlap with
+                each ground truth box and only their IoUs are computed, instead of the IoUs of every ground truth box
+                with every anchor box. The encoded labels are exactly the same. The index is only used if
+                `border_pixels` is not 'exclude' and both `pos_iou_threshold` and `neg_iou_limit` are positive,
+                since otherwise anchor boxes that don't overlap with a ground truth box can affect the matching.
+            dtype (optional): The floating point type of the encoded labels and of all intermediate arrays of the
+                encoding, including the anchor boxes. Keras trains on float32 labels anyway, so the default float32
+                avoids converting the labels and moves half as much memory as float64. Set it to `np.float64` to
+                encode in double precision.
+                Note that float32 doesn't only change the precision of the offsets: if two anchor boxes have nearly the
+                same IoU with a ground truth box, rounding the IoUs to float32 can make the bipartite matching pick the
+                other one, so a few anchor boxes get different labels than in float64. Use `np.float64` if the labels
+                have to be identical to the original float64 implementation. `ssd_dtype_parity_test.py` checks how
+                much the two differ.
+            anchor_cache_dir (str, optional): `None` or a directory in which to cache the anchor boxes on disk, see
+                `generate_anchor_boxes()`. Within a process, the anchor boxes of a configuration are always computed
+                only once.
+            collect_statistics (bool, optional): If `True`, the encoder updates a `MatchStatistics` object, available
+                as `self.statistics`, with every batch it encodes: the positive anchor boxes per image, the fraction of
+                neutral anchor boxes, and the ground truth boxes with low IoU matches per layer and aspect ratio.
+                Otherwise `self.statistics` is `None`.
         """
 
         ##################################################################################
@@ -300,6 +350,11 @@ class SSDInputEncoder:
         else:
             self.matching_type = matching_type
 
+        if bipartite_matching not in ('greedy', 'optimal'):
+            raise ValueError("Unexpected value for `bipartite_matching`. Supported values are 'greedy', 'optimal'.")
+        else:
+            self.bipartite_matching = bipartite_matching
+
         if not isinstance(pos_iou_threshold, float):
             raise ValueError('`pos_iou_threshold` must be float')
         else:
@@ -331,6 +386,19 @@ class SSDInputEncoder:
         else:
             self.background_id = background_id
 
+        if output_mode not in ('dense', 'sparse'):
+            raise ValueError("Unexpected value for `output_mode`. Supported values are 'dense' and 'sparse'.")
+        else:
+            self.output_mode = output_mode
+
+        if not np.issubdtype(dtype, np.floating):
+            raise ValueError("`dtype` must be a floating point type, but got {}.".format(dtype))
+        else:
+            self.dtype = np.dtype(dtype)
+
+        self.reuse_buffer = reuse_buffer
+        self._buffer = None
+
         ##################################################################################
         # Compute the anchor boxes for each predictor layer.
         ##################################################################################
@@ -355,40 +423,76 @@ class SSDInputEncoder:
         # Offsets for each predictor layer
         self.offsets_per_layer = []
 
-        # Iterate over all predictor layers and compute the anchor boxes for each one.
-        for i in range(len(self.predictor_sizes)):
-            # boxes 为 np.array, shape 为 (predictor_sizes[i][0], predictor_sizes[i][1], self.n_boxes[i], 4)
-            # center 为 tuple, 有两个 np.array 类型的元素, (cx, cy) cx 的 shape 为 (predictor_sizes[i][1], )
-            #   cy 的 shape 为 (predictor_sizes[i][1], )
-            # wh 为 np.array, shape 为 (self.n_boxes, 2), 最后一维第一个元素表示 anchor 的 width, 第二个元素表示 anchor 的 height
-            # step 为 tuple, 有两个 int/float 类型的元素, 第一个元素表示是竖直方向上两个 anchor 的中心点的距离, 第二个元素表示水平方向
-            #   上两个 anchor 中心点的距离
-            # offset 为 tuple, 有两个 float 类型的元素, 第一个元素表示最左上方的 anchor 的中心点 y 坐标(以 step[0] 的 fraction 表示),
-            # 第二个元素表示 anchor 中心点 x 坐标(以 step[1] 的 fraction 表示)
-            boxes, centers, whs, steps, offsets = self.generate_anchor_boxes_for_layer(
-                feature_map_size=self.predictor_sizes[i],
-                aspect_ratios=self.aspect_ratios[i],
-                this_scale=self.scales[i],
-                next_scale=self.scales[i + 1],
-                this_steps=self.steps[i],
-                this_offsets=self.offsets[i],
-                n_boxes=self.n_boxes[i],
-                diagnostics=True)
+        # Compute the anchor boxes for all predictor layers, or get them from the cache.
+        # boxes 为 np.array, shape 为 (predictor_sizes[i][0], predictor_sizes[i][1], self.n_boxes[i], 4)
+        # center 为 tuple, 有两个 np.array 类型的元素, (cy, cx) cy 的 shape 为 (predictor_sizes[i][0], )
+        #   cx 的 shape 为 (predictor_sizes[i][1], )
+        # wh 为 np.array, shape 为 (self.n_boxes, 2), 最后一维第一个元素表示 anchor 的 width, 第二个元素表示 anchor 的 height
+        # step 为 tuple, 有两个 int/float 类型的元素, 第一个元素表示是竖直方向上两个 anchor 的中心点的距离, 第二个元素表示水平方向
+        #   上两个 anchor 中心点的距离
+        # offset 为 tuple, 有两个 float 类型的元素, 第一个元素表示最左上方的 anchor 的中心点 y 坐标(以 step[0] 的 fraction 表示),
+        # 第二个元素表示 anchor 中心点 x 坐标(以 step[1] 的 fraction 表示)
+        layers = generate_anchor_boxes(img_height=self.img_height,
+                                       img_width=self.img_width,
+                                       predictor_sizes=self.predictor_sizes,
+                                       aspect_ratios_per_layer=self.aspect_ratios,
+                                       scales=self.scales,
+                                       two_boxes_for_ar1=self.two_boxes_for_ar1,
+                                       steps=self.steps,
+                                       offsets=self.offsets,
+                                       clip_boxes=self.clip_boxes,
+                                       normalize_coords=self.normalize_coords,
+                                       coords=self.coords,
+                                       cache_dir=anchor_cache_dir)
+        for i, (boxes, centers, whs, steps, offsets) in enumerate(layers):
+            assert boxes.shape[2] == self.n_boxes[i], \
+                'incorrect number of anchor boxes, {} and n_boxes={}'.format(boxes.shape[2], self.n_boxes[i])
             self.boxes_per_layer.append(boxes)
             self.centers_per_layer.append(centers)
             self.whs_per_layer.append(whs)
             self.steps_per_layer.append(steps)
             self.offsets_per_layer.append(offsets)
 
+        # The anchor boxes of all predictor layers in the order of the model output, shape `(#boxes, 4)`.
+        # This is the same for every image, so the part of the encoding template that holds the anchor boxes and the
+        # variances is built only once here instead of for every batch.
+        # Both are converted to `self.dtype` here, so the encoding doesn't promote any arrays to float64.
+        self.anchor_boxes = np.concatenate([np.reshape(boxes, (-1, 4)) for boxes in self.boxes_per_layer],
+                                           axis=0).astype(self.dtype)
+        self._variances = self.variances.astype(self.dtype)
+        self.anchors_template = np.concatenate(
+            (self.anchor_boxes, self.anchor_boxes, np.tile(self._variances, (len(self.anchor_boxes), 1))), axis=1)
+        # The anchor boxes in the 'corners' format and their areas, as they are needed to compute IoUs.
+        self._anchor_corners = self._to_corners(self.anchor_boxes)
+        self._anchor_areas = self._areas(self._anchor_corners)
+        if use_anchor_index and border_pixels != 'exclude' and pos_iou_threshold > 0 and neg_iou_limit > 0:
+            self._anchor_index = AnchorIndex([self._to_corners(boxes.astype(self.dtype))
+                                              for boxes in self.boxes_per_layer])
+        else:
+            self._anchor_index = None
+        # The shape of the encoded labels of one image.
+        self.encoded_shape = (len(self.anchor_boxes), self.n_classes + 12 if self.output_mode == 'dense' else 5)
+
+        if collect_statistics:
+            self.statistics = MatchStatistics(predictor_sizes=self.predictor_sizes,
+                                              n_boxes=self.n_boxes,
+                                              aspect_ratios=self.aspect_ratios,
+                                              two_boxes_for_ar1=self.two_boxes_for_ar1,
+                                              whs_per_layer=self.whs_per_layer,
+                                              pos_iou_threshold=self.pos_iou_threshold)
+        else:
+            self.statistics = None
+
     def __call__(self, ground_truth_labels,
                  labels_format=('class_id', 'xmin', 'ymin', 'xmax', 'ymax'),
-                 diagnostics=False):
+                 diagnostics=False,
+                 out=None):
         """
         Converts ground truth bounding box data into a suitable format to train an SSD model.
 
-        通过 generate_encoding_template 创建 y_encode, (batch_size, num_anchor_boxes, num_classes + 12)
-        遍历一个 batch 的 ground_truth_labels
-            计算当前 batch_item 的 gt_boxes 和 y_encode 中 anchor_boxes 的 iou
+        创建 y_encode, (batch_size, num_anchor_boxes, num_classes + 12)
+        把一个 batch 的 ground_truth_labels 补齐到最多的 gt_boxes 数, 同时处理所有 batch_items
+            计算每个 batch_item 的 gt_boxes 和所有 anchor_boxes 的 iou
             先为每个 gt_box 找到和其有最大 iou 的 anchor_box, 认为该 anchor_box 是 positive 的
                 在 y_encode 中 anchor_box 的相应位置设置 gt_box 的坐标和 class_id
             然后剩余的 anchor_boxes 中, 找和其有最大 iou 的 gt_box,
@@ -412,6 +516,9 @@ class SSDInputEncoder:
                 but also a copy of it with anchor box coordinates in place of the ground truth coordinates.
                 This can be very useful if you want to visualize which anchor boxes got matched to which ground truth
                 boxes.
+            out (array, optional): `None` or a Numpy array of shape `(batch_size,) + self.encoded_shape` and dtype
+                `self.dtype` that the encoded labels are written into instead of a new array, e.g. a shared memory
+                buffer. It is returned as `y_encoded`.
 
         Returns:
             `y_encoded`, a 3D numpy array of shape `(batch_size, #boxes, #classes + 4 + 4 + 4)` that serves as the
@@ -419,6 +526,8 @@ class SSDInputEncoder:
             model per image, and the classes are one-hot-encoded. The four elements after the class vectors in
             the last axis are the box coordinates, the next four elements after that are just dummy elements, and
             the last four elements are the variances.
+            If `output_mode` is 'sparse', `y_encoded` has the shape `(batch_size, #boxes, 5)` and contains the
+            class ID and the four box offsets of every anchor box instead.
         """
 
         # Mapping to define which indices represent which coordinates in the ground truth.
@@ -430,18 +539,12 @@ class SSDInputEncoder:
         # Note 这里的 `ground_truth_labels` 是一个 list, 在 generate() 调用时传递的 batch_y
         # 每一个元素是一个 np.array, 表示一个 batch_item 的 gt_boxes 的坐标和 class_id
         batch_size = len(ground_truth_labels)
+        n_boxes = len(self.anchor_boxes)
 
         # Adam for diagnostics
         # 用来表示每个 batch_item 的 gt_boxes 和与其有最大 iou 的 anchor_box 的最大 iou 的平均值, 也就是 bipartite_match 的结果
         batch_avg_iou = np.zeros(batch_size)
 
-        ##################################################################################
-        # Generate the template for y_encoded.
-        ##################################################################################
-
-        # shape 为 (batch_size, total_num_boxes, num_classes + 12)
-        y_encoded = self.generate_encoding_template(batch_size=batch_size, diagnostics=False)
-
         ##################################################################################
         # Match ground truth boxes to anchor boxes.
         ##################################################################################
@@ -449,31 +552,42 @@ class SSDInputEncoder:
         # Every anchor box that does not have a ground truth match and for which the maximal IoU overlap with any ground
         # truth box is less than or equal to `neg_iou_limit` will be a negative (background) box.
 
+        # The class ID of every anchor box, which is `self.background_id` for negative boxes and -1 for neutral boxes.
         # All boxes are background boxes by default.
-        y_encoded[:, :, self.background_id] = 1
-        # An identity matrix that we'll use as one-hot class vectors
-        # 等确定了 anchor_box match 的 gt_box 的 class_id, 就从中去相应的一行, 覆盖掉 y_encoded[:, :, :num_classes] 中相应行的值
-        # 比较巧妙
-        class_vectors = np.eye(self.n_classes)
-
-        # For each batch item...
-        for i in range(batch_size):
-            # If there is no ground truth for this batch item, there is nothing to match.
-            # 这种情况应该只发生在 generator.keep_images_without_gt == True
-            if ground_truth_labels[i].size == 0:
-                continue
-            # The labels for this batch item, shape 为 (num_gt_boxes, 5)
-            labels = ground_truth_labels[i].astype(np.float)
+        # shape 为 (batch_size, total_num_boxes)
+        class_ids = np.full((batch_size, n_boxes), self.background_id, dtype=np.int)
+        # The index of the ground truth box that every anchor box is matched to, or -1 if it isn't matched.
+        matched_gt_indices = np.full((batch_size, n_boxes), -1, dtype=np.int)
+        # The anchor box of the bipartite match of every ground truth box and its IoU.
+        bipartite_anchor_indices = np.zeros((0,), dtype=np.int)
+        matched_similarities = np.zeros((0,))
+
+        # The number of ground truth boxes of every batch item. Items without ground truth have nothing to match.
+        # 这种情况应该只发生在 generator.keep_images_without_gt == True
+        n_gt_boxes = np.array([len(labels) if labels.size > 0 else 0 for labels in ground_truth_labels], dtype=np.int)
+        # The coordinates of the ground truth boxes of all batch items, padded to the largest number of boxes.
+        # shape 为 (batch_size, max_num_gt_boxes, 4)
+        gt_boxes = np.zeros((batch_size, np.max(n_gt_boxes, initial=0), 4), dtype=self.dtype)
+        if np.any(n_gt_boxes > 0):
+            # The labels of all batch items in one array, shape 为 (total_num_gt_boxes, 5)
+            labels = np.concatenate([labels for labels in ground_truth_labels if labels.size > 0]).astype(self.dtype)
 
             # Check for degenerate ground truth bounding boxes before attempting any computations.
-            if np.any(labels[:, [xmax]] - labels[:, [xmin]] <= 0) or np.any(labels[:, [ymax]] - labels[:, [ymin]] <= 0):
+            degenerate = (labels[:, xmax] - labels[:, xmin] <= 0) | (labels[:, ymax] - labels[:, ymin] <= 0)
+            if np.any(degenerate):
                 # 这种情况应该只发生在 generator.degenerate_box_handling == 'warn'
+                i = np.repeat(np.arange(batch_size), n_gt_boxes)[np.argmax(degenerate)]
                 raise DegenerateBoxError(
                     "SSDInputEncoder detected degenerate ground truth bounding boxes "
-                    "for batch item {} with bounding boxes {}, ".format(i, labels) +
+                    "for batch item {} with bounding boxes {}, ".format(i, ground_truth_labels[i].astype(np.float)) +
                     "i.e. bounding boxes where x_max <= x_min and/or y_max <= y_min. "
                     "Degenerate ground truth bounding boxes will lead to NaN errors during the training.")
 
+            gt_class_ids = labels[:, class_id].astype(np.int)
+            if np.any(gt_class_ids < 0) or np.any(gt_class_ids >= self.n_classes):
+                raise ValueError("The class IDs of the ground truth boxes must be in [0, {}], but got {}.".format(
+                    self.n_classes - 1, np.unique(gt_class_ids)))
+
             # Maybe normalize the box coordinates.
             if self.normalize_coords:
                 # Normalize y_min and y_max relative to the image height
@@ -492,106 +606,116 @@ class SSDInputEncoder:
                                              start_index=xmin,
                                              conversion='corners2minmax')
 
-            # The one-hot class IDs for the ground truth boxes of this batch item
-            # class_vectors 的 shape 为 (num_classes, num_classes)
-            # labels[:, class_id] 的 shape 为 (num_gt_boxes, )
-            # classes_one_hot 的 shape 为 (num_gt_boxes, num_classes)
-            classes_one_hot = class_vectors[labels[:, class_id].astype(np.int)]
-            # The one-hot version of the labels for this batch item
-            # shape 为 (num_gt_boxes, num_classes + 4)
-            labels_one_hot = np.concatenate([classes_one_hot, labels[:, [xmin, ymin, xmax, ymax]]], axis=-1)
+            # The position of every ground truth box in the padded array.
+            batch_indices = np.repeat(np.arange(batch_size), n_gt_boxes)
+            gt_indices = np.arange(len(labels)) - np.repeat(np.cumsum(n_gt_boxes) - n_gt_boxes, n_gt_boxes)
+            gt_boxes[batch_indices, gt_indices] = labels[:, [xmin, ymin, xmax, ymax]]
+            padded_class_ids = np.zeros(gt_boxes.shape[:2], dtype=np.int)
+            padded_class_ids[batch_indices, gt_indices] = gt_class_ids
 
             ##################################################################################
             # Match anchors and gt_boxes
             ##################################################################################
 
-            # 1. Compute the IoU similarities between all anchor boxes and all ground truth boxes for this batch item.
-            # labels[: [xmin, ymin, xmax, ymax]] 的 shape 为 (num_gt_boxes, 4)
-            # y_encoded[i, :, -12:-8] 的 shape 为 (num_anchor_boxes, 4)
-            # similarities 的 shape 为 (num_gt_boxes, num_anchor_boxes)
-            similarities = iou(labels[:, [xmin, ymin, xmax, ymax]], y_encoded[i, :, -12:-8],
-                               coords=self.coords,
-                               mode='outer_product',
-                               border_pixels=self.border_pixels)
-
-            # 2: Do bipartite matching, i.e. match each ground truth box to the one anchor box with the highest IoU.
-            #   This ensures that each ground truth box will have at least one good match.
-            # For each ground truth box, get the anchor box to match with it.
-            # shape 为 (num_gt_boxes,), 每个元素表示与该 gt_box 有最大 iou 的 anchor_box 的 id
-            bipartite_matches = match_bipartite_greedy(weight_matrix=similarities)
-
-            # Write the ground truth data to the matched anchor boxes.
-            # 在每个对应的 anchor_box 上设置 label 值
-            y_encoded[i, bipartite_matches, :-8] = labels_one_hot
+            if self._anchor_index is None:
+                matched_gt_indices, neutral_boxes, bipartite_anchor_indices, matched_similarities = \
+                    self._match_dense(gt_boxes, n_gt_boxes)
+            else:
+                matched_gt_indices, neutral_boxes, bipartite_anchor_indices, matched_similarities = \
+                    self._match_sparse(gt_boxes, n_gt_boxes)
 
             # Adam for diagnostics
-            batch_avg_iou[i] = np.mean(similarities[list(range(len(bipartite_matches))), bipartite_matches])
-
-            # Set the columns of the matched anchor boxes to zero to indicate that they were matched.
-            # 在已经 match 过的 anchor_box 的列上设置 0
-            similarities[:, bipartite_matches] = 0
-
-            # 3: Maybe do 'multi' matching, where each remaining anchor box will be matched to its most similar
-            #   ground truth box with an IoU of at least `pos_iou_threshold`, or not matched if there is no
-            #   such ground truth box.
-
-            if self.matching_type == 'multi':
-                # Get all matches that satisfy the IoU threshold.
-                # matches[0] 表示所有 positive_anchor_box 对应的 gt_box 的 id
-                # matches[1] 表示所有 positive_anchor_box 的 id
-                matches = match_multi(weight_matrix=similarities, threshold=self.pos_iou_threshold)
-                # Write the ground truth data to the matched anchor boxes.
-                y_encoded[i, matches[1], :-8] = labels_one_hot[matches[0]]
-                # Set the columns of the matched anchor boxes to zero to indicate that they were matched.
-                similarities[:, matches[1]] = 0
-
-            # 4: Now after the matching is done, all negative (background) anchor boxes that have
-            #   an IoU of `neg_iou_limit` or more with any ground truth box will be set to neutral,
-            #   i.e. they will no longer be background boxes. These anchors are "too close" to a
-            #   ground truth box to be valid background boxes.
-
-            # (num_anchor_boxes, )
-            max_background_similarities = np.amax(similarities, axis=0)
-            neutral_boxes_indices = np.nonzero(max_background_similarities >= self.neg_iou_limit)[0]
+            for i in np.nonzero(n_gt_boxes)[0]:
+                batch_avg_iou[i] = np.mean(matched_similarities[batch_indices == i])
             # 那么 neutral_boxes 的 class_one_hot 全为 0, 不属于任何 class
             # 这样设置的话, 如果某个 anchor_box 和所有 gt_boxes 的最大 overlap 小于 threshold, 且这个值是该 gt_box 和所有
             # anchor_boxes 的最大 overlap, 那么该 anchor_box 仍然被认为是 positive, 但是我认为不算合理, 因为这是 anchor 没取好
-            y_encoded[i, neutral_boxes_indices, self.background_id] = 0
+            class_ids[neutral_boxes] = -1
+
+        # The positive anchor boxes, i.e. the ones that were matched, get the class of their ground truth box.
+        positives = np.nonzero(matched_gt_indices >= 0)
+        if len(positives[0]) > 0:
+            class_ids[positives] = padded_class_ids[positives[0], matched_gt_indices[positives]]
+
+        if self.statistics is not None:
+            self.statistics.update(n_positives=np.bincount(positives[0], minlength=batch_size),
+                                   n_neutral=np.count_nonzero(class_ids == -1),
+                                   anchor_indices=bipartite_anchor_indices,
+                                   ious=matched_similarities)
 
         ##################################################################################
         # Convert box coordinates to anchor box offsets.
         ##################################################################################
 
-        # 经过下面的运算所有 neutral_anchor_boxes 和 negative_anchor_boxes 的 [-12:-8] 都是 0
+        # The offsets of all negative and neutral anchor boxes are 0, so only the matched anchor boxes are converted.
+        offsets = gt_boxes[positives[0], matched_gt_indices[positives]]
+        anchor_boxes = self.anchor_boxes[positives[1]]
         if self.coords == 'centroids':
             # cx(gt) - cx(anchor), cy(gt) - cy(anchor)
-            y_encoded[:, :, [-12, -11]] -= y_encoded[:, :, [-8, -7]]
+            offsets[:, [0, 1]] -= anchor_boxes[:, [0, 1]]
             # (cx(gt) - cx(anchor)) / w(anchor) / cx_variance, (cy(gt) - cy(anchor)) / h(anchor) / cy_variance
-            y_encoded[:, :, [-12, -11]] /= y_encoded[:, :, [-6, -5]] * y_encoded[:, :, [-4, -3]]
+            offsets[:, [0, 1]] /= anchor_boxes[:, [2, 3]] * self._variances[[0, 1]]
             # w(gt) / w(anchor), h(gt) / h(anchor)
-            y_encoded[:, :, [-10, -9]] /= y_encoded[:, :, [-6, -5]]
+            offsets[:, [2, 3]] /= anchor_boxes[:, [2, 3]]
             # ln(w(gt) / w(anchor)) / w_variance, ln(h(gt) / h(anchor)) / h_variance (ln == natural logarithm)
-            y_encoded[:, :, [-10, -9]] = np.log(y_encoded[:, :, [-10, -9]]) / y_encoded[:, :, [-2, -1]]
+            offsets[:, [2, 3]] = np.log(offsets[:, [2, 3]]) / self._variances[[2, 3]]
         elif self.coords == 'corners':
             # (gt - anchor) for all four coordinates
-            y_encoded[:, :, -12:-8] -= y_encoded[:, :, -8:-4]
+            offsets -= anchor_boxes
             # (xmin(gt) - xmin(anchor)) / w(anchor), (xmax(gt) - xmax(anchor)) / w(anchor)
-            y_encoded[:, :, [-12, -10]] /= np.expand_dims(y_encoded[:, :, -6] - y_encoded[:, :, -8], axis=-1)
+            offsets[:, [0, 2]] /= np.expand_dims(anchor_boxes[:, 2] - anchor_boxes[:, 0], axis=-1)
             # (ymin(gt) - ymin(anchor)) / h(anchor), (ymax(gt) - ymax(anchor)) / h(anchor)
-            y_encoded[:, :, [-11, -9]] /= np.expand_dims(y_encoded[:, :, -5] - y_encoded[:, :, -7], axis=-1)
+            offsets[:, [1, 3]] /= np.expand_dims(anchor_boxes[:, 3] - anchor_boxes[:, 1], axis=-1)
             # (gt - anchor) / size(anchor) / variance for all four coordinates,
             # where 'size' refers to w and h respectively
-            y_encoded[:, :, -12:-8] /= y_encoded[:, :, -4:]
+            offsets /= self._variances
         elif self.coords == 'minmax':
             # (gt - anchor) for all four coordinates
-            y_encoded[:, :, -12:-8] -= y_encoded[:, :, -8:-4]
+            offsets -= anchor_boxes
             # (xmin(gt) - xmin(anchor)) / w(anchor), (xmax(gt) - xmax(anchor)) / w(anchor)
-            y_encoded[:, :, [-12, -11]] /= np.expand_dims(y_encoded[:, :, -7] - y_encoded[:, :, -8], axis=-1)
+            offsets[:, [0, 1]] /= np.expand_dims(anchor_boxes[:, 1] - anchor_boxes[:, 0], axis=-1)
             # (ymin(gt) - ymin(anchor)) / h(anchor), (ymax(gt) - ymax(anchor)) / h(anchor)
-            y_encoded[:, :, [-10, -9]] /= np.expand_dims(y_encoded[:, :, -5] - y_encoded[:, :, -6], axis=-1)
+            offsets[:, [2, 3]] /= np.expand_dims(anchor_boxes[:, 3] - anchor_boxes[:, 2], axis=-1)
             # (gt - anchor) / size(anchor) / variance for all four coordinates,
             # where 'size' refers to w and h respectively
-            y_encoded[:, :, -12:-8] /= y_encoded[:, :, -4:]
+            offsets /= self._variances
+
+        ##################################################################################
+        # Write the output tensor.
+        ##################################################################################
+
+        if self.output_mode == 'dense':
+            offset_columns = slice(-12, -8)
+        else:
+            offset_columns = slice(1, 5)
+        # Only the class and ground truth columns change from batch to batch. In the dense format, the anchor boxes and
+        # variances are copied from the cached template, or are already in place if the buffer is reused.
+        if out is not None:
+            if out.shape != (batch_size,) + self.encoded_shape:
+                raise ValueError("`out` must have the shape {}, but has the shape {}.".format(
+                    (batch_size,) + self.encoded_shape, out.shape))
+            y_encoded = out
+            if self.output_mode == 'dense':
+                y_encoded[:, :, -12:] = self.anchors_template
+        elif self.reuse_buffer and self._buffer is not None and len(self._buffer) == batch_size:
+            y_encoded = self._buffer
+        else:
+            y_encoded = np.empty((batch_size,) + self.encoded_shape, dtype=self.dtype)
+            if self.output_mode == 'dense':
+                y_encoded[:, :, -12:] = self.anchors_template
+            if self.reuse_buffer:
+                self._buffer = y_encoded
+
+        if self.output_mode == 'dense':
+            # shape 为 (batch_size, total_num_boxes, num_classes + 12)
+            y_encoded[:, :, :-8] = 0
+            y_encoded[:, :, self.background_id] = class_ids == self.background_id
+            y_encoded[positives[0], positives[1], class_ids[positives]] = 1
+        else:
+            # shape 为 (batch_size, total_num_boxes, 5)
+            y_encoded[:, :, 0] = class_ids
+            y_encoded[:, :, 1:] = 0
+        y_encoded[positives[0], positives[1], offset_columns] = offsets
 
         if diagnostics:
             # Here we'll save the matched anchor boxes (i.e. anchor boxes that were matched to a ground truth box,
@@ -600,11 +724,228 @@ class SSDInputEncoder:
             # Keeping the anchor box coordinates means setting the offsets to zero.
             # 因为 y_encoded[:, :, -12:-8] 现在表示的都是 delta 值
             # UNCLEAR: 有什么用啊?
-            y_matched_anchors[:, :, -12:-8] = 0
+            y_matched_anchors[:, :, offset_columns] = 0
             return y_encoded, y_matched_anchors, np.mean(batch_avg_iou)
         else:
             return y_encoded
 
+    def encode_sample(self, labels, labels_format=('class_id', 'xmin', 'ymin', 'xmax', 'ymax'), out=None):
+        """
+        Encodes the ground truth labels of a single image, so that the encoding can run right after the augmentation
+        of the image, e.g. in the worker processes of `DataGenerator.generate()`.
+
+        Arguments:
+            labels (array): A Numpy array with the ground truth boxes of the image in the format of one element of
+                `ground_truth_labels` in `__call__()`.
+            labels_format (list or tuple, optional): See `__call__()`.
+            out (array, optional): `None` or a Numpy array of shape `self.encoded_shape` and dtype `self.dtype` that the
+                encoded labels are written into instead of a new array.
+
+        Returns:
+            The encoded labels of the image, a Numpy array of shape `self.encoded_shape`.
+        """
+        return self([labels], labels_format=labels_format, out=None if out is None else out[np.newaxis])[0]
+
+    def _match_dense(self, gt_boxes, n_gt_boxes):
+        """
+        Matches the ground truth boxes of all batch items to the anchor boxes by computing the IoUs of all ground truth
+        boxes with all anchor boxes.
+
+        Arguments:
+            gt_boxes (array): A Numpy array of shape `(batch_size, m, 4)` with the ground truth boxes of every batch
+                item in the format given by `self.coords`, padded to the largest number of boxes.
+            n_gt_boxes (array): A Numpy array of length `batch_size` with the number of ground truth boxes of every
+                batch item.
+
+        Returns:
+            A tuple `(matched_gt_indices, neutral_boxes, anchor_indices, matched_similarities)`. `matched_gt_indices`
+            is an array of shape `(batch_size, #boxes)` with the index of the ground truth box that every anchor box is
+            matched to, or -1. `neutral_boxes` contains the batch indices and the indices of the anchor boxes that are
+            neither matched nor negative. `anchor_indices` and `matched_similarities` contain the anchor box of the
+            bipartite match of every ground truth box of all batch items and its IoU.
+        """
+        batch_size = len(gt_boxes)
+        batch_indices = np.repeat(np.arange(batch_size), n_gt_boxes)
+        gt_indices = np.arange(len(batch_indices)) - np.repeat(np.cumsum(n_gt_boxes) - n_gt_boxes, n_gt_boxes)
+        matched_gt_indices = np.full((batch_size, len(self.anchor_boxes)), -1, dtype=np.int)
+
+        # 1. Compute the IoU similarities between all anchor boxes and all ground truth boxes of all batch items.
+        # similarities 的 shape 为 (batch_size, max_num_gt_boxes, num_anchor_boxes)
+        # The padding rows get a similarity of -1, so they never match and never make an anchor box neutral.
+        similarities = self._batch_iou(gt_boxes)
+        similarities[np.arange(gt_boxes.shape[1]) >= np.expand_dims(n_gt_boxes, axis=1)] = -1
+
+        # 2: Do bipartite matching, i.e. match each ground truth box to the one anchor box with the highest IoU.
+        #   This ensures that each ground truth box will have at least one good match.
+        # For each ground truth box, get the anchor box to match with it.
+        # shape 为 (batch_size, max_num_gt_boxes), 每个元素表示与该 gt_box 有最大 iou 的 anchor_box 的 id
+        if self.bipartite_matching == 'optimal':
+            bipartite_matches = match_bipartite_optimal_batch(weight_tensor=similarities, n_valid=n_gt_boxes)
+        else:
+            bipartite_matches = match_bipartite_greedy_batch(weight_tensor=similarities, n_valid=n_gt_boxes)
+        anchor_indices = bipartite_matches[batch_indices, gt_indices]
+        matched_gt_indices[batch_indices, anchor_indices] = gt_indices
+
+        matched_similarities = similarities[batch_indices, gt_indices, anchor_indices]
+
+        # Set the columns of the matched anchor boxes to zero to indicate that they were matched.
+        # 在已经 match 过的 anchor_box 的列上设置 0
+        similarities[batch_indices, :, anchor_indices] = 0
+
+        # 3: Maybe do 'multi' matching, where each remaining anchor box will be matched to its most similar
+        #   ground truth box with an IoU of at least `pos_iou_threshold`, or not matched if there is no
+        #   such ground truth box.
+
+        if self.matching_type == 'multi':
+            # Get all matches that satisfy the IoU threshold.
+            # matches[0] 表示所有 positive_anchor_box 所在的 batch item
+            # matches[1] 表示所有 positive_anchor_box 对应的 gt_box 的 id
+            # matches[2] 表示所有 positive_anchor_box 的 id
+            matches = match_multi_batch(weight_tensor=similarities, threshold=self.pos_iou_threshold)
+            matched_gt_indices[matches[0], matches[2]] = matches[1]
+            # Set the columns of the matched anchor boxes to zero to indicate that they were matched.
+            similarities[matches[0], :, matches[2]] = 0
+
+        # 4: Now after the matching is done, all negative (background) anchor boxes that have
+        #   an IoU of `neg_iou_limit` or more with any ground truth box will be set to neutral,
+        #   i.e. they will no longer be background boxes. These anchors are "too close" to a
+        #   ground truth box to be valid background boxes.
+
+        # (batch_size, num_anchor_boxes)
+        max_background_similarities = np.amax(similarities, axis=1)
+        neutral_boxes = np.nonzero(max_background_similarities >= self.neg_iou_limit)
+        return matched_gt_indices, neutral_boxes, anchor_indices, matched_similarities
+
+    def _match_sparse(self, gt_boxes, n_gt_boxes):
+        """
+        Does the same as `_match_dense()` with identical results, but computes only the IoUs of the pairs of ground
+        truth boxes and anchor boxes that overlap, which `self._anchor_index` provides. All other IoUs are zero and
+        don't affect the matching as long as `pos_iou_threshold` and `neg_iou_limit` are positive and the union of
+        two boxes can't have a non-positive area, i.e. for `border_pixels` other than 'exclude'.
+        """
+        batch_size, max_n_gt_boxes = gt_boxes.shape[:2]
+        batch_indices = np.repeat(np.arange(batch_size), n_gt_boxes)
+        gt_indices = np.arange(len(batch_indices)) - np.repeat(np.cumsum(n_gt_boxes) - n_gt_boxes, n_gt_boxes)
+        matched_gt_indices = np.full((batch_size, len(self.anchor_boxes)), -1, dtype=np.int)
+
+        # 1. Compute the IoU similarities of all overlapping pairs of ground truth boxes and anchor boxes in the same
+        #   way as `_batch_iou()`.
+        gt_corners = self._to_corners(gt_boxes[batch_indices, gt_indices])
+        pair_gt_boxes, pair_anchor_indices = self._anchor_index.query(gt_corners)
+        boxes = gt_corners[pair_gt_boxes]
+        anchor_boxes = self._anchor_corners[pair_anchor_indices]
+        intersection_areas = np.maximum(0, np.minimum(boxes[:, 2], anchor_boxes[:, 2]) -
+                                        np.maximum(boxes[:, 0], anchor_boxes[:, 0]))
+        intersection_areas *= np.maximum(0, np.minimum(boxes[:, 3], anchor_boxes[:, 3]) -
+                                         np.maximum(boxes[:, 1], anchor_boxes[:, 1]))
+        union_areas = self._areas(boxes) + self._anchor_areas[pair_anchor_indices] - intersection_areas
+        similarities = intersection_areas / union_areas
+
+        # Sort the pairs by batch item, ground truth box and anchor box.
+        rows = batch_indices[pair_gt_boxes] * max_n_gt_boxes + gt_indices[pair_gt_boxes]
+        keys = rows * len(self.anchor_boxes) + pair_anchor_indices
+        order = np.argsort(keys)
+        keys = keys[order]
+        rows = rows[order]
+        pair_batch_indices = batch_indices[pair_gt_boxes][order]
+        pair_gt_indices = gt_indices[pair_gt_boxes][order]
+        pair_anchor_indices = pair_anchor_indices[order]
+        similarities = similarities[order]
+
+        # 2: Do bipartite matching, i.e. match each ground truth box to the one anchor box with the highest IoU.
+        if self.bipartite_matching == 'optimal':
+            bipartite_matches = match_bipartite_optimal_sparse(rows=rows,
+                                                               columns=pair_anchor_indices,
+                                                               weights=similarities,
+                                                               n_valid=n_gt_boxes,
+                                                               m=max_n_gt_boxes,
+                                                               n=len(self.anchor_boxes))
+        else:
+            bipartite_matches = match_bipartite_greedy_sparse(rows=rows,
+                                                              columns=pair_anchor_indices,
+                                                              weights=similarities,
+                                                              n_valid=n_gt_boxes,
+                                                              m=max_n_gt_boxes)
+        anchor_indices = bipartite_matches[batch_indices, gt_indices]
+        matched_gt_indices[batch_indices, anchor_indices] = gt_indices
+
+        # The IoU of a bipartite match is zero if the pair doesn't overlap.
+        match_keys = (batch_indices * max_n_gt_boxes + gt_indices) * len(self.anchor_boxes) + anchor_indices
+        matched_similarities = np.zeros(len(match_keys))
+        if len(keys) > 0:
+            positions = np.minimum(np.searchsorted(keys, match_keys), len(keys) - 1)
+            found = keys[positions] == match_keys
+            matched_similarities[found] = similarities[positions[found]]
+
+        # Leave out the pairs of the matched anchor boxes.
+        matched = np.zeros(matched_gt_indices.shape, dtype=np.bool)
+        matched[batch_indices, anchor_indices] = True
+        unmatched = ~matched[pair_batch_indices, pair_anchor_indices]
+
+        # 3: Maybe do 'multi' matching.
+        if self.matching_type == 'multi':
+            matches = match_multi_sparse(batch_indices=pair_batch_indices[unmatched],
+                                         row_indices=pair_gt_indices[unmatched],
+                                         columns=pair_anchor_indices[unmatched],
+                                         weights=similarities[unmatched],
+                                         threshold=self.pos_iou_threshold)
+            matched_gt_indices[matches[0], matches[2]] = matches[1]
+            matched[matches[0], matches[2]] = True
+            unmatched = ~matched[pair_batch_indices, pair_anchor_indices]
+
+        # 4: All unmatched anchor boxes with an IoU of `neg_iou_limit` or more with any ground truth box are neutral.
+        neutral = unmatched & (similarities >= self.neg_iou_limit)
+        neutral_boxes = (pair_batch_indices[neutral], pair_anchor_indices[neutral])
+        return matched_gt_indices, neutral_boxes, anchor_indices, matched_similarities
+
+    def _to_corners(self, boxes):
+        """
+        Converts boxes in the format given by `self.coords` into the format `(xmin, ymin, xmax, ymax)` in the same way
+        as `iou()` does.
+        """
+        if self.coords == 'centroids':
+            return convert_coordinates(boxes, start_index=0, conversion='centroids2corners')
+        elif self.coords == 'minmax':
+            return boxes[..., [0, 2, 1, 3]]
+        else:
+            return boxes
+
+    def _areas(self, boxes):
+        """
+        Computes the areas of boxes in the 'corners' format with respect to `self.border_pixels`.
+        """
+        if self.border_pixels == 'half':
+            d = 0
+        elif self.border_pixels == 'include':
+            d = 1
+        else:
+            d = -1
+        return (boxes[..., 2] - boxes[..., 0] + d) * (boxes[..., 3] - boxes[..., 1] + d)
+
+    def _batch_iou(self, gt_boxes):
+        """
+        Computes the IoUs of the ground truth boxes of all batch items with all anchor boxes.
+
+        The result is identical to calling `iou()` in 'outer_product' mode for every batch item, which computes the
+        intersection areas with `border_pixels='half'` regardless of `self.border_pixels`.
+
+        Arguments:
+            gt_boxes (array): A Numpy array of shape `(batch_size, m, 4)` with the ground truth boxes of every batch
+                item in the format given by `self.coords`.
+
+        Returns:
+            A Numpy array of shape `(batch_size, m, #boxes)` with the IoUs.
+        """
+        gt_boxes = np.expand_dims(self._to_corners(gt_boxes), axis=2)
+        anchor_boxes = self._anchor_corners
+        # Computing the side lengths of the intersections one after the other keeps the temporary arrays small.
+        intersection_areas = np.maximum(0, np.minimum(gt_boxes[..., 2], anchor_boxes[:, 2]) -
+                                        np.maximum(gt_boxes[..., 0], anchor_boxes[:, 0]))
+        intersection_areas *= np.maximum(0, np.minimum(gt_boxes[..., 3], anchor_boxes[:, 3]) -
+                                         np.maximum(gt_boxes[..., 1], anchor_boxes[:, 1]))
+        union_areas = self._areas(gt_boxes) + self._anchor_areas - intersection_areas
+        return intersection_areas / union_areas
+
     def generate_anchor_boxes_for_layer(self,
                                         feature_map_size,
                                         aspect_ratios,
@@ -618,6 +959,9 @@ class SSDInputEncoder:
         Computes an array of the spatial positions and sizes of the anchor boxes for one predictor layer of size
         `feature_map_size == [feature_map_height, feature_map_width]`.
 
+        The anchor boxes are generated by `generate_anchor_boxes_for_layer()` in `anchor_boxes.py` with the
+        configuration of this encoder, which the `AnchorBoxes` layer uses as well. The returned arrays are read-only.
+
         # 先算出 self.image_width, self.image_height 的较小值
         # 然后根据 this_scale 和 next_scale 算出各种 ap 的 anchor_boxes 的 width, height
         # 根据 this_steps 和 this_offsets 算出最左上方的 anchor_box 的中心点的 x, y 坐标
@@ -650,133 +994,25 @@ class SSDInputEncoder:
             A 4D Numpy tensor of shape `(feature_map_height, feature_map_width, n_boxes_per_cell, 4)` where the
             last dimension is determined by self.coords.
         """
-        # Compute box width and height for each aspect ratio.
-
-        # The shorter side of the image will be used to compute `w` and `h` using `scale` and `aspect_ratios`.
-        size = min(self.img_height, self.img_width)
-        # Compute the box widths and and heights for all aspect ratios
-        wh_list = []
-        for aspect_ratio in aspect_ratios:
-            if aspect_ratio == 1:
-                # Compute the regular anchor box for aspect ratio 1.
-                box_height = box_width = this_scale * size
-                wh_list.append((box_width, box_height))
-                if self.two_boxes_for_ar1:
-                    # Compute one slightly larger version using the geometric mean of this scale value and the next.
-                    box_height = box_width = np.sqrt(this_scale * next_scale) * size
-                    wh_list.append((box_width, box_height))
-            else:
-                # aspect_ratio = box_width / box_height
-                box_width = this_scale * size * np.sqrt(aspect_ratio)
-                box_height = this_scale * size / np.sqrt(aspect_ratio)
-                wh_list.append((box_width, box_height))
-        wh_array = np.array(wh_list)
+        boxes_tensor, centers, wh_array, steps, offsets = generate_anchor_boxes_for_layer(
+            img_height=self.img_height,
+            img_width=self.img_width,
+            feature_map_size=feature_map_size,
+            aspect_ratios=aspect_ratios,
+            this_scale=this_scale,
+            next_scale=next_scale,
+            two_boxes_for_ar1=self.two_boxes_for_ar1,
+            this_steps=this_steps,
+            this_offsets=this_offsets,
+            clip_boxes=self.clip_boxes,
+            normalize_coords=self.normalize_coords,
+            coords=self.coords,
+            diagnostics=True)
         assert len(wh_array) == n_boxes, \
             'incorrect number of anchor boxes, len(wh_array)={} and n_boxes={}'.format(wh_array, n_boxes)
 
-        ##################################################################################
-        # Compute the grid of box center points. They are identical for all aspect ratios.
-        ##################################################################################
-
-        # 1. Compute the step sizes
-        # i.e. how far apart the anchor box center points will be vertically and horizontally.
-        if this_steps is None:
-            step_height = self.img_height / feature_map_size[0]
-            step_width = self.img_width / feature_map_size[1]
-        else:
-            if isinstance(this_steps, (list, tuple)) and (len(this_steps) == 2):
-                step_height = this_steps[0]
-                step_width = this_steps[1]
-            elif isinstance(this_steps, (int, float)):
-                step_height = this_steps
-                step_width = this_steps
-            else:
-                raise ValueError('`this_steps` must be one of 2-int list, 2-int tuple and int')
-
-        # 2. Compute the offsets, i.e.
-        # at what pixel values the first anchor box center point will be from the top and from the left of the image.
-        if this_offsets is None:
-            offset_height = 0.5
-            offset_width = 0.5
-        else:
-            if isinstance(this_offsets, (list, tuple)) and (len(this_offsets) == 2):
-                offset_height = this_offsets[0]
-                offset_width = this_offsets[1]
-            elif isinstance(this_offsets, float):
-                offset_height = this_offsets
-                offset_width = this_offsets
-            else:
-                raise ValueError('`this_offsets` must be one of 2-float list, 2-float tuple and float')
-
-        # 3. Now that we have the offsets and step sizes, compute the grid of anchor box center points.
-        # 第一个 anchor 的中心点往下移动 (feature_map_size[0] - 1) 个位置, 这样一共就有 feature_map_size[0] 个 位置
-        # (feature_map_size[0], )
-        cy = np.linspace(offset_height * step_height,
-                         offset_height * step_height + (feature_map_size[0] - 1) * step_height,
-                         feature_map_size[0])
-        # 第一个 anchor 的中心点往右移动 (feature_map_size[1] - 1) 个位置, 这样一共就有 feature_map_size[1] 个 位置
-        # (feature_map_size[1], )
-        cx = np.linspace(offset_width * step_width,
-                         offset_width * step_width + (feature_map_size[1] - 1) * step_width,
-                         feature_map_size[1])
-        # shape 为 (feature_map_size[1], feature_map_size[0])
-        # meshgrid 的操作, cx_grid 相当于把 cx 作为一行复制 len(cy) 次, cy_grid 相当于把 cy 作为一列复制 len(cx) 次
-        cx_grid, cy_grid = np.meshgrid(cx, cy)
-        # This is necessary for np.tile() to do what we want further down
-        # shape 为 (feature_map_size[1], feature_map_size[0], 1)
-        cx_grid = np.expand_dims(cx_grid, -1)
-        # This is necessary for np.tile() to do what we want further down
-        cy_grid = np.expand_dims(cy_grid, -1)
-
-        # Create a 4D tensor template of shape `(feature_map_height, feature_map_width, n_boxes, 4)`
-        # where the last dimension will contain `(cx, cy, w, h)`
-        boxes_tensor = np.zeros((feature_map_size[0], feature_map_size[1], n_boxes, 4))
-        # Set cx
-        # np.tile() 之后 shape 为 (feature_map_size[1], feature_map_size[0], n_boxes)
-        boxes_tensor[:, :, :, 0] = np.tile(cx_grid, (1, 1, n_boxes))
-        # Set cy
-        boxes_tensor[:, :, :, 1] = np.tile(cy_grid, (1, 1, n_boxes))
-        # Set w
-        boxes_tensor[:, :, :, 2] = wh_array[:, 0]
-        # Set h
-        boxes_tensor[:, :, :, 3] = wh_array[:, 1]
-
-        # Convert `(cx, cy, w, h)` to `(x_min, y_min, x_max, y_max)`
-        boxes_tensor = convert_coordinates(boxes_tensor, start_index=0, conversion='centroids2corners')
-
-        # If `clip_boxes` is enabled, clip the coordinates to lie within the image boundaries
-        if self.clip_boxes:
-            x_coords = boxes_tensor[:, :, :, [0, 2]]
-            x_coords[x_coords >= self.img_width] = self.img_width - 1
-            x_coords[x_coords < 0] = 0
-            boxes_tensor[:, :, :, [0, 2]] = x_coords
-            y_coords = boxes_tensor[:, :, :, [1, 3]]
-            y_coords[y_coords >= self.img_height] = self.img_height - 1
-            y_coords[y_coords < 0] = 0
-            boxes_tensor[:, :, :, [1, 3]] = y_coords
-
-        # `normalize_coords` is enabled, normalize the coordinates to be within [0,1]
-        if self.normalize_coords:
-            boxes_tensor[:, :, :, [0, 2]] /= self.img_width
-            boxes_tensor[:, :, :, [1, 3]] /= self.img_height
-
-        # TODO: Implement box limiting directly for `(cx, cy, w, h)` so that we don't have to unnecessarily convert back
-        #  and forth.
-        if self.coords == 'centroids':
-            # Convert `(x_min, y_min, x_max, y_max)` back to `(cx, cy, w, h)`.
-            boxes_tensor = convert_coordinates(boxes_tensor,
-                                               start_index=0,
-                                               conversion='corners2centroids',
-                                               border_pixels='half')
-        elif self.coords == 'minmax':
-            # Convert `(x_min, y_min, x_max, y_max)` to `(x_min, x_max, y_min, y_max).
-            boxes_tensor = convert_coordinates(boxes_tensor,
-                                               start_index=0,
-                                               conversion='corners2minmax',
-                                               border_pixels='half')
-
         if diagnostics:
-            return boxes_tensor, (cy, cx), wh_array, (step_height, step_width), (offset_height, offset_width)
+            return boxes_tensor, centers, wh_array, steps, offsets
         else:
             return boxes_tensor
 
@@ -812,47 +1048,11 @@ class SSDInputEncoder:
             output contains not only the 4 predicted box coordinate offsets, but also the 4 coordinates for
             the anchor boxes and the 4 variance values.
         """
-        # Tile the anchor boxes for each predictor layer across all batch items.
-        batch_boxes = []
-        # boxes_per_layer 是一个 list
-        # 每一个元素是一个 np.array, shape 为 (feature_map_height, feature_map_width, n_boxes, 4)
-        # 表示一个 feature_map 上的所有的 anchor_box 的坐标(具体的值取决于 self.coords)
-        for boxes in self.boxes_per_layer:
-            # Prepend one dimension to `self.boxes_per_layer` to account for the batch size and tile it along.
-            # The result will be a 5D tensor of shape `(batch_size, feature_map_height, feature_map_width, n_boxes, 4)`
-            boxes = np.expand_dims(boxes, axis=0)
-            boxes = np.tile(boxes, (batch_size, 1, 1, 1, 1))
-
-            # Now reshape the 5D tensor above into a 3D tensor of shape
-            # `(batch, feature_map_height * feature_map_width * n_boxes, 4)`.
-            # Note the resulting order of the tensor content will be identical to the order obtained from the reshaping
-            #  operation in our Keras model (we're using the Tensorflow backend, and tf.reshape() and np.reshape() use
-            #  the same default index order, which is C-like index ordering)
-            boxes = np.reshape(boxes, (batch_size, -1, 4))
-            batch_boxes.append(boxes)
-
-        # Concatenate the anchor tensors from the individual prediction layers to one.
-        # shape 为 (batch_size, total_num_boxes, 4)
-        boxes_tensor = np.concatenate(batch_boxes, axis=1)
-
-        # Create a template tensor to hold the one-hot class encodings of shape
-        # `(batch_size, total_num_boxes, num_classes)`
-        # It will contain all zeros for now, the classes will be set in the matching process that follows
+        # The anchor boxes and variances are the same for all batch items and were computed once in the constructor.
+        # The class columns are all zeros for now, the classes will be set in the matching process.
         # 这里的 self.n_classes 是包含 background 的
-        classes_tensor = np.zeros((batch_size, boxes_tensor.shape[1], self.n_classes))
-
-        # Create a tensor to contain the variances. This tensor has the same shape as `boxes_tensor` and simply
-        # contains the same 4 variance values for every position in the last axis.
-        variances_tensor = np.zeros_like(boxes_tensor)
-        # Long live broadcasting
-        variances_tensor += self.variances
-
-        # Concatenate the classes, boxes and variances tensors to get our final template for y_encoded.
-        # We also need another tensor of the shape of `boxes_tensor` as a space filler so that `y_encoding_template`
-        # has the same shape as the SSD model output tensor.
-        # The content of this tensor is irrelevant, we'll just use `boxes_tensor` a second time.
-        # shape 为 (batch_size, total_num_boxes, num_classes + 4 + 4 + 4)
-        y_encoding_template = np.concatenate((classes_tensor, boxes_tensor, boxes_tensor, variances_tensor), axis=2)
+        y_encoding_template = np.zeros((batch_size, len(self.anchor_boxes), self.n_classes + 12), dtype=self.dtype)
+        y_encoding_template[:, :, -12:] = self.anchors_template
 
         if diagnostics:
             return (y_encoding_template, self.centers_per_layer, self.whs_per_layer, self.steps_per_layer,
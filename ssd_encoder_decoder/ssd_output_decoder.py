@@ -22,7 +22,306 @@ limitations under the License.
 from __future__ import division
 import numpy as np
 
-from bounding_box_utils.bounding_box_utils import iou, convert_coordinates
+from bounding_box_utils.bounding_box_utils import convert_coordinates
+
+
+def _sort_candidates(scores, groups=None, pre_nms_top_k=None):
+    """
+    Sorts the candidates of an NMS by group and by decreasing score, and optionally keeps only the `pre_nms_top_k`
+    highest scoring candidates of every group. Ties are resolved in favor of the candidate that comes first.
+
+    Returns:
+        The indices of the candidates in sorted order, the sorted group IDs (`None` if `groups` is `None`), and for
+        every sorted candidate the position of the first candidate of its group.
+    """
+    if groups is None:
+        order = np.argsort(-scores, kind='stable')
+        # 所有的 boxes 属于同一个 group, group_starts[i] 为第 i 个 box 所在的 group 的第一个 box 的下标
+        group_starts = np.zeros(len(scores), dtype=np.int)
+    else:
+        # `np.lexsort()` is stable, too, and sorts by the last key first.
+        order = np.lexsort((-scores, groups))
+        groups = groups[order]
+        group_starts = np.searchsorted(groups, groups, side='left')
+    if pre_nms_top_k is not None:
+        if pre_nms_top_k < 1:
+            raise ValueError("`pre_nms_top_k` must be `None` or a positive integer, but is {}.".format(pre_nms_top_k))
+        # The rank of every box within its group, 0 for the box with the highest score.
+        top = np.arange(len(order)) - group_starts < pre_nms_top_k
+        order = order[top]
+        if groups is None:
+            group_starts = group_starts[top]
+        else:
+            groups = groups[top]
+            group_starts = np.searchsorted(groups, groups, side='left')
+    return order, groups, group_starts
+
+
+def _nms_boxes(boxes, coords='corners', border_pixels='half'):
+    """
+    Returns the columns `xmin`, `ymin`, `xmax` and `ymax` of `boxes` and the areas of the boxes, as `iou()` computes
+    them for the given `coords` and `border_pixels`, for use with `_nms_ious()`.
+    """
+    if coords == 'centroids':
+        boxes = convert_coordinates(boxes, start_index=0, conversion='centroids2corners')
+        xmin, ymin, xmax, ymax = 0, 1, 2, 3
+    elif coords == 'corners':
+        xmin, ymin, xmax, ymax = 0, 1, 2, 3
+    elif coords == 'minmax':
+        xmin, xmax, ymin, ymax = 0, 1, 2, 3
+    else:
+        raise ValueError("Unexpected value for `coords`. Supported values are 'minmax', 'corners' and 'centroids'.")
+    if border_pixels == 'half':
+        d = 0
+    elif border_pixels == 'include':
+        d = 1
+    elif border_pixels == 'exclude':
+        d = -1
+    else:
+        raise ValueError('`border_pixels` must be one of half, include and exclude')
+
+    x1, y1, x2, y2 = (np.ascontiguousarray(boxes[:, i]) for i in (xmin, ymin, xmax, ymax))
+    areas = (x2 - x1 + d) * (y2 - y1 + d)
+    return x1, y1, x2, y2, areas
+
+
+def _nms_ious(boxes, earlier, later):
+    """
+    Computes the IoUs of the boxes with the indices `earlier` and `later` in the same way as `iou()` in 'element-wise'
+    mode, where `boxes` is the output of `_nms_boxes()`. The indices are broadcast against each other.
+    """
+    x1, y1, x2, y2, areas = boxes
+    # `iou()` always computes the intersection areas with `border_pixels='half'`.
+    widths = np.maximum(0, np.minimum(x2[later], x2[earlier]) - np.maximum(x1[later], x1[earlier]))
+    heights = np.maximum(0, np.minimum(y2[later], y2[earlier]) - np.maximum(y1[later], y1[earlier]))
+    intersections = widths * heights
+    return intersections / (areas[later] + areas[earlier] - intersections)
+
+
+def _greedy_nms_indices(scores, boxes, iou_threshold=0.45, coords='corners', border_pixels='half', groups=None,
+                        pre_nms_top_k=None, block_size=128):
+    """
+    The greedy non-maximum suppression engine behind all NMS functions in this module.
+
+    The boxes are sorted by score once. The IoUs of the boxes are then computed block by block: every block of
+    `block_size` boxes is first compared with the boxes that were kept in the blocks before it, and then with itself,
+    only in the upper triangle, i.e. only every box with the boxes that come before it. Within a block, the boxes
+    that survive are found with a vectorized sweep: starting from all remaining boxes, a box is kept if no kept box
+    before it overlaps it too much, which is repeated until nothing changes. Since the box with the highest score in a
+    block is settled after the first sweep, the one after it after the second one and so on, this converges to exactly
+    the boxes that the sequential greedy algorithm keeps, typically after very few sweeps.
+
+    The IoUs are computed in the same way as `iou()` in 'element-wise' mode, so the result is identical to
+    repeatedly taking the box with the highest score (the first one in case of ties) and removing all remaining boxes
+    whose IoU with it is not less than or equal to `iou_threshold`.
+
+    With `groups`, the boxes of every group, e.g. of every class of every image, are suppressed independently of the
+    other groups in the same pass. This gives the same result as shifting the boxes of every group so far apart that
+    they can't overlap, but doesn't change any coordinates, and the boxes are only compared with the boxes of the
+    same group.
+
+    Arguments:
+        scores (array): A 1D Numpy array of length `n` with the scores of the boxes.
+        boxes (array): A 2D Numpy array of shape `(n, 4)` with the boxes in the format given by `coords`.
+        iou_threshold (float, optional): See `greedy_nms()`.
+        coords (str, optional): The coordinate format of `boxes`, as for `iou()`.
+        border_pixels (str, optional): See `greedy_nms()`.
+        groups (array, optional): A 1D Numpy array of length `n` with a non-negative integer group ID for every box.
+            Boxes of different groups never suppress each other.
+        pre_nms_top_k (int, optional): If not `None`, only the `pre_nms_top_k` highest scoring boxes of every group
+            (of all boxes if `groups` is `None`) are considered, all other boxes are dropped before the suppression.
+            In case of ties, the boxes that come first are kept.
+        block_size (int, optional): The number of boxes whose IoUs are computed at once.
+
+    Returns:
+        The indices of the boxes that are kept, in the order in which the greedy algorithm selects them, i.e. by
+        decreasing score. With `groups`, the indices are sorted by group ID first.
+    """
+    order, groups, group_starts = _sort_candidates(scores, groups, pre_nms_top_k)
+    boxes = _nms_boxes(boxes[order], coords, border_pixels)
+
+    def suppressed(earlier, later):
+        """
+        Returns a matrix that tells for the boxes with the indices `earlier` and `later` whether the later box is
+        removed by the earlier one, shape 为 (len(earlier), len(later)).
+        """
+        similarities = _nms_ious(boxes, earlier[:, np.newaxis], later)
+        # A box with an IoU of NaN is removed as well.
+        removed = ~(similarities <= iou_threshold)
+        if groups is not None:
+            removed &= groups[later] == groups[earlier, np.newaxis]
+        return removed
+
+    keep = np.zeros(len(order), dtype=np.bool)
+    for start in range(0, len(order), block_size):
+        candidates = np.arange(start, min(start + block_size, len(order)))
+        # Remove the boxes of this block that overlap too much with a box that was kept before this block. Only the
+        # boxes of the groups of this block can do that.
+        kept = np.nonzero(keep[group_starts[start]:start])[0] + group_starts[start]
+        if len(kept) > 0:
+            candidates = candidates[~np.any(suppressed(kept, candidates), axis=0)]
+            if len(candidates) == 0:
+                continue
+        # Among the remaining boxes of the block, a box can only be removed by the boxes before it.
+        overlaps = np.triu(suppressed(candidates, candidates), k=1)
+        block_keep = np.ones(len(candidates), dtype=np.bool)
+        while True:
+            new_block_keep = ~np.any(overlaps & block_keep[:, np.newaxis], axis=0)
+            if np.array_equal(new_block_keep, block_keep):
+                break
+            block_keep = new_block_keep
+        keep[candidates[block_keep]] = True
+
+    return order[keep]
+
+
+def _soft_nms_indices(scores, boxes, score_threshold, iou_threshold=0.45, method='linear', sigma=0.5,
+                      border_pixels='half', groups=None, pre_nms_top_k=None):
+    """
+    Soft-NMS (Bodla et al., 2017) for boxes in the 'corners' format.
+
+    Like greedy NMS, Soft-NMS repeatedly takes the remaining box with the highest score, but instead of removing the
+    boxes that overlap with it, it decays their scores depending on their IoU with it. Boxes whose score drops to
+    `score_threshold` or below are removed. The selection is inherently sequential, but every step is vectorized over
+    all groups, so the number of steps is the largest number of boxes that are kept in one group.
+
+    Arguments:
+        scores (array): A 1D Numpy array of length `n` with the scores of the boxes.
+        boxes (array): A 2D Numpy array of shape `(n, 4)` with the boxes in the format `(xmin, ymin, xmax, ymax)`.
+        score_threshold (float): Boxes whose decayed score is not greater than this are removed.
+        iou_threshold (float, optional): Only relevant for the 'linear' method. The scores of boxes with an IoU greater
+            than `iou_threshold` with the selected box are multiplied by `1 - IoU`, all others are left as they are.
+        method (str, optional): 'linear' or 'gaussian'. For 'gaussian', the scores of all boxes are multiplied by
+            `exp(-IoU^2 / sigma)`.
+        sigma (float, optional): Only relevant for the 'gaussian' method.
+        border_pixels (str, optional): See `greedy_nms()`.
+        groups (array, optional): See `_greedy_nms_indices()`.
+        pre_nms_top_k (int, optional): See `_greedy_nms_indices()`.
+
+    Returns:
+        The indices of the boxes that are kept, sorted by group ID and then in the order in which they are selected,
+        and their decayed scores.
+    """
+    if method not in {'linear', 'gaussian'}:
+        raise ValueError("`method` must be one of 'linear' and 'gaussian', but is '{}'.".format(method))
+    order, _, group_starts = _sort_candidates(scores, groups, pre_nms_top_k)
+    boxes = _nms_boxes(boxes[order], border_pixels=border_pixels)
+    scores = scores[order]
+
+    alive = scores > score_threshold
+    selected = []
+    while True:
+        candidates = np.nonzero(alive)[0]
+        if len(candidates) == 0:
+            break
+        # The remaining boxes of every group are contiguous, so the box with the highest score of every group is found
+        # with one reduction over all groups.
+        candidate_groups = group_starts[candidates]
+        new_group = np.concatenate([[True], candidate_groups[1:] != candidate_groups[:-1]])
+        segment_ids = np.cumsum(new_group) - 1
+        segment_maxima = np.maximum.reduceat(scores[candidates], np.nonzero(new_group)[0])
+        maxima = np.nonzero(scores[candidates] == segment_maxima[segment_ids])[0]
+        # In case of ties, take the first box of every group.
+        maxima = maxima[np.concatenate([[True], segment_ids[maxima[1:]] != segment_ids[maxima[:-1]]])]
+        selected.append(candidates[maxima])
+        alive[candidates[maxima]] = False
+
+        # Decay the scores of the remaining boxes depending on their IoU with the box selected in their group.
+        rest = np.ones(len(candidates), dtype=np.bool)
+        rest[maxima] = False
+        others = candidates[rest]
+        if len(others) == 0:
+            break
+        with np.errstate(invalid='ignore'):
+            similarities = _nms_ious(boxes, candidates[maxima][segment_ids[rest]], others)
+        if method == 'linear':
+            decay = np.where(similarities > iou_threshold, 1 - similarities, 1)
+        else:
+            decay = np.exp(-np.square(similarities) / sigma)
+        scores[others] *= decay
+        alive[others] = scores[others] > score_threshold
+
+    if len(selected) == 0:
+        return order[:0], scores[:0]
+    selected = np.concatenate(selected)
+    # `selected` is in selection order, so a stable sort by group keeps that order within every group.
+    selected = selected[np.argsort(group_starts[selected], kind='stable')]
+    return order[selected], scores[selected]
+
+
+def _matrix_nms_indices(scores, boxes, score_threshold, method='gaussian', sigma=0.5, border_pixels='half',
+                        groups=None, pre_nms_top_k=None, max_pairs=2**22):
+    """
+    Matrix NMS (Wang et al., SOLOv2, 2020) for boxes in the 'corners' format.
+
+    Matrix NMS decays the score of every box by how much it overlaps with the boxes with higher scores, compensated by
+    how much these boxes are suppressed themselves. For a box `j`, the decay factor is the minimum over all boxes `i`
+    with a higher score of `f(IoU(i, j)) / f(max_k IoU(k, i))`, where `k` are the boxes with a higher score than `i`,
+    and `f(x) = 1 - x` for the 'linear' method and `f(x) = exp(-x^2 / sigma)` for the 'gaussian' method. Unlike
+    greedy NMS and Soft-NMS, the result doesn't depend on any sequential selection, so all decay factors are computed
+    at once with maximum and minimum reductions over the pairwise IoUs of the boxes of every group. Boxes whose decayed
+    score is not greater than `score_threshold` are removed.
+
+    Arguments:
+        scores (array): A 1D Numpy array of length `n` with the scores of the boxes.
+        boxes (array): A 2D Numpy array of shape `(n, 4)` with the boxes in the format `(xmin, ymin, xmax, ymax)`.
+        score_threshold (float): Boxes whose decayed score is not greater than this are removed.
+        method (str, optional): 'linear' or 'gaussian'.
+        sigma (float, optional): Only relevant for the 'gaussian' method.
+        border_pixels (str, optional): See `greedy_nms()`.
+        groups (array, optional): See `_greedy_nms_indices()`.
+        pre_nms_top_k (int, optional): See `_greedy_nms_indices()`. Matrix NMS compares all pairs of boxes of a group,
+            so this bounds both its time and its memory.
+        max_pairs (int, optional): The maximum number of pairs of boxes whose IoUs are held in memory at once.
+
+    Returns:
+        The indices of the boxes that are kept, sorted by group ID and then by decreasing decayed score, and their
+        decayed scores.
+    """
+    if method not in {'linear', 'gaussian'}:
+        raise ValueError("`method` must be one of 'linear' and 'gaussian', but is '{}'.".format(method))
+    order, _, group_starts = _sort_candidates(scores, groups, pre_nms_top_k)
+    boxes = _nms_boxes(boxes[order], border_pixels=border_pixels)
+    scores = scores[order]
+
+    def f(similarities):
+        if method == 'linear':
+            return 1 - similarities
+        return np.exp(-np.square(similarities) / sigma)
+
+    # Every box `j` is paired with the boxes `group_starts[j], ..., j - 1`, i.e. the boxes of its group with a higher
+    # score. The pairs are ordered by `j`, so the reductions over `i` are reductions over contiguous segments.
+    n_pairs = np.arange(len(order)) - group_starts
+    pair_ends = np.cumsum(n_pairs)
+    # The compensation of every box, i.e. its largest IoU with a box with a higher score, and its decay factor.
+    compensation = np.zeros(len(order), dtype=np.float)
+    decay = np.ones(len(order), dtype=np.float)
+    start = 0
+    while start < len(order):
+        # The boxes `start, ..., end - 1` whose pairs fit into `max_pairs`, but at least one box.
+        pairs_before = pair_ends[start] - n_pairs[start]
+        end = max(np.searchsorted(pair_ends, pairs_before + max_pairs, side='right'), start + 1)
+        later = np.repeat(np.arange(start, end), n_pairs[start:end])
+        if len(later) > 0:
+            earlier = group_starts[later] + np.arange(len(later)) - (pair_ends[later] - n_pairs[later] - pairs_before)
+            with np.errstate(invalid='ignore'):
+                similarities = _nms_ious(boxes, earlier, later)
+            has_pairs = np.nonzero(n_pairs[start:end])[0] + start
+            segment_starts = pair_ends[has_pairs] - n_pairs[has_pairs] - pairs_before
+            compensation[has_pairs] = np.maximum.reduceat(similarities, segment_starts)
+            # All boxes `earlier` come before the boxes `later` of their pair, so their compensation is known already.
+            with np.errstate(divide='ignore', invalid='ignore'):
+                decay_factors = f(similarities) / f(compensation[earlier])
+            # A box that is a duplicate of a box with a higher score doesn't suppress its own duplicates once more.
+            decay_factors[np.isnan(decay_factors)] = 1
+            decay[has_pairs] = np.minimum(np.minimum.reduceat(decay_factors, segment_starts), 1)
+        start = end
+
+    scores = scores * decay
+    kept = np.nonzero(scores > score_threshold)[0]
+    # Sort the kept boxes of every group by their decayed scores.
+    kept = kept[np.lexsort((-scores[kept], group_starts[kept]))]
+    return order[kept], scores[kept]
 
 
 def greedy_nms(y_pred_decoded, iou_threshold=0.45, coords='corners', border_pixels='half'):
@@ -61,30 +360,14 @@ def greedy_nms(y_pred_decoded, iou_threshold=0.45, coords='corners', border_pixe
     y_pred_decoded_nms = []
     # For the labels of each batch item
     for batch_item in y_pred_decoded:
-        # This is where we store the boxes that make it through the non-maximum suppression
-        boxes_left = np.copy(batch_item)
-        maxima = []
-        # While there are still boxes left to compare
-        while boxes_left.shape[0] > 0:
-            # get the index of the next box with the highest confidence...
-            maximum_index = np.argmax(boxes_left[:, 1])
-            # copy that box
-            maximum_box = np.copy(boxes_left[maximum_index])
-            # append it to `maxima` because we'll definitely keep it
-            maxima.append(maximum_box)
-            # Now remove the maximum box from `boxes_left`
-            boxes_left = np.delete(boxes_left, maximum_index, axis=0)
-            # If there are no boxes left after this step, break.
-            if boxes_left.shape[0] == 0:
-                break
-            # Otherwise compare (IoU) the other left over boxes to the maximum box
-            similarities = iou(boxes_left[:, 2:], maximum_box[2:],
-                               coords=coords,
-                               mode='element-wise',
-                               border_pixels=border_pixels)
-            # so that we can remove the ones that overlap too much with the maximum box
-            boxes_left = boxes_left[similarities <= iou_threshold]
-        y_pred_decoded_nms.append(np.array(maxima))
+        if len(batch_item) == 0:
+            y_pred_decoded_nms.append(np.array([]))
+            continue
+        maxima = _greedy_nms_indices(batch_item[:, 1], batch_item[:, 2:6],
+                                     iou_threshold=iou_threshold,
+                                     coords=coords,
+                                     border_pixels=border_pixels)
+        y_pred_decoded_nms.append(batch_item[maxima])
 
     return y_pred_decoded_nms
 
@@ -98,61 +381,26 @@ def _greedy_nms(predictions, iou_threshold=0.45, coords='corners', border_pixels
         predictions: (np.array) 某个 batch_item 的 某个 class 的所有 confident prediction(大于阈值的所有 prediction).
             shape 为 (num_conf_prediction, 5), 最后一维度的元素表示 confidence, xmin, ymin, xmax, ymax
     """
-    boxes_left = np.copy(predictions)
-    # This is where we store the boxes that make it through the non-maximum suppression
-    maxima = []
-    # While there are still boxes left to compare
-    while boxes_left.shape[0] > 0:
-        # get the index of the next box with the highest confidence...
-        maximum_index = np.argmax(boxes_left[:, 0])
-        # copy that box
-        maximum_box = np.copy(boxes_left[maximum_index])
-        # append it to `maxima` because we'll definitely keep it
-        maxima.append(maximum_box)
-        # Now remove the maximum box from `boxes_left`
-        boxes_left = np.delete(boxes_left, maximum_index, axis=0)
-        # If there are no boxes left after this step, break.
-        if boxes_left.shape[0] == 0:
-            break
-        similarities = iou(boxes_left[:, 1:], maximum_box[1:],
-                           coords=coords,
-                           mode='element-wise',
-                           border_pixels=border_pixels)
-        # Otherwise compare (IoU) the other left over boxes to the maximum box...
-        # so that we can remove the ones that overlap too much with the maximum box
-        boxes_left = boxes_left[similarities <= iou_threshold]
-    return np.array(maxima)
+    if len(predictions) == 0:
+        return np.array([])
+    return predictions[_greedy_nms_indices(predictions[:, 0], predictions[:, 1:5],
+                                           iou_threshold=iou_threshold,
+                                           coords=coords,
+                                           border_pixels=border_pixels)]
 
 
-def _greedy_nms2(predictions, iou_threshold=0.45, coords='corners', border_pixels='half'):
+def _greedy_nms2(predictions, iou_threshold=0.45, coords='corners', border_pixels='half', pre_nms_top_k=None):
     """
     The same greedy non-maximum suppression algorithm as above, but slightly modified for use as an internal
     function in `decode_detections_fast()`.
     """
-    boxes_left = np.copy(predictions)
-    # This is where we store the boxes that make it through the non-maximum suppression
-    maxima = []
-    # While there are still boxes left to compare...
-    while boxes_left.shape[0] > 0:
-        # get the index of the next box with the highest confidence
-        maximum_index = np.argmax(boxes_left[:, 1])
-        # copy that box
-        maximum_box = np.copy(boxes_left[maximum_index])
-        # append it to `maxima` because we'll definitely keep it
-        maxima.append(maximum_box)
-        # Now remove the maximum box from `boxes_left`
-        boxes_left = np.delete(boxes_left, maximum_index, axis=0)
-        # If there are no boxes left after this step, break. Otherwise...
-        if boxes_left.shape[0] == 0:
-            break
-        # compare (IoU) the other left over boxes to the maximum box
-        similarities = iou(boxes_left[:, 2:], maximum_box[2:],
-                           coords=coords,
-                           mode='element-wise',
-                           border_pixels=border_pixels)
-        # so that we can remove the ones that overlap too much with the maximum box
-        boxes_left = boxes_left[similarities <= iou_threshold]
-    return np.array(maxima)
+    if len(predictions) == 0:
+        return np.array([])
+    return predictions[_greedy_nms_indices(predictions[:, 1], predictions[:, 2:6],
+                                           iou_threshold=iou_threshold,
+                                           coords=coords,
+                                           border_pixels=border_pixels,
+                                           pre_nms_top_k=pre_nms_top_k)]
 
 
 def decode_detections(y_pred,
@@ -163,7 +411,12 @@ def decode_detections(y_pred,
                       normalize_coords=True,
                       img_height=None,
                       img_width=None,
-                      border_pixels='half'):
+                      border_pixels='half',
+                      dtype=None,
+                      anchors=None,
+                      pre_nms_top_k=None,
+                      nms_mode='greedy',
+                      nms_sigma=0.5):
     """
     Convert model prediction output back to a format that contains only the positive box predictions
     (i.e. the same format that `SSDInputEncoder` takes as input).
@@ -172,6 +425,8 @@ def decode_detections(y_pred,
     First confidence thresholding, then greedy non-maximum suppression. The filtering results for all classes are
     concatenated and the `top_k` overall highest confidence results constitute the final predictions for a given batch
     item. This procedure follows the original Caffe implementation.
+    Both stages are performed for all images and classes of the batch at once, and only the boxes that make the
+    confidence threshold are decoded.
     For a slightly different and more efficient alternative to decode raw model output that performs non-maximum
     suppression globally instead of per class, see `decode_detections_fast()` below.
 
@@ -207,6 +462,29 @@ def decode_detections(y_pred,
             If 'exclude', the border pixels do not belong to the boxes.
             If 'half', then one of each of the two horizontal and vertical borders belong to the boxes, but not the
             other.
+        dtype (optional): The floating point type in which to decode the predictions. If `None`, the dtype of `y_pred`
+            is used, i.e. the float32 output of the model is decoded in float32 without any conversion.
+        anchors (array, optional): `None` or a Numpy array of shape `(#boxes, 8)` with the 4 anchor box coordinates and
+            the 4 variances of every box, e.g. `SSDInputEncoder.anchors_template[:, -8:]`. If given, `y_pred` contains
+            only the class confidences and the 4 predicted coordinate offsets, i.e. it has the shape
+            `(batch_size, #boxes, #classes + 4)`, so the anchor boxes don't have to be part of every model output.
+        pre_nms_top_k (int, optional): `None` or the maximum number of boxes per class and image that go into the
+            non-maximum suppression stage. If more boxes of a class make the confidence threshold, only the
+            `pre_nms_top_k` highest scoring ones are kept. This puts an upper bound on the time the non-maximum
+            suppression takes, usually with a negligible effect on the mean average precision. The evaluator
+            reports this effect if it is called with `report_pre_nms_top_k_impact=True`.
+        nms_mode (str, optional): The kind of non-maximum suppression. Can be one of:
+            'greedy': The greedy NMS of the Caffe implementation.
+            'soft_linear', 'soft_gaussian': Soft-NMS, which decays the scores of the boxes that overlap with a
+                selected box instead of removing them, by `1 - IoU` for the boxes with an IoU greater than
+                `iou_threshold`, or by `exp(-IoU^2 / nms_sigma)` for all boxes, respectively.
+            'matrix_linear', 'matrix_gaussian': Matrix NMS, which decays the scores of all boxes at once, with the
+                same decay functions, but without `iou_threshold`. It compares all pairs of boxes of a class, so
+                it should be combined with `pre_nms_top_k`.
+            For the soft and matrix modes, the confidences of the predictions are the decayed scores, and boxes whose
+            decayed score drops to `confidence_thresh` or below are removed.
+        nms_sigma (float, optional): The parameter of the Gaussian decay of the 'soft_gaussian' and 'matrix_gaussian'
+            modes.
 
     Returns:
         A python list of length `batch_size` where each list element represents the predicted boxes
@@ -218,105 +496,131 @@ def decode_detections(y_pred,
                          "the decoder needs the image size in order to decode the predictions, "
                          "but `img_height == {}` and `img_width == {}`".format(img_height, img_width))
 
-    # 1: Convert the box coordinates from the predicted anchor box offsets to predicted absolute coordinates
-    # Slice out the classes and the four offsets, throw away the anchor coordinates and variances,
-    # resulting in a tensor of shape `[batch, n_boxes, n_classes + 4 coordinates]`
-    y_pred_decoded_raw = np.copy(y_pred[:, :, :-8])
+    if nms_mode not in {'greedy', 'soft_linear', 'soft_gaussian', 'matrix_linear', 'matrix_gaussian'}:
+        raise ValueError("`nms_mode` must be one of 'greedy', 'soft_linear', 'soft_gaussian', 'matrix_linear' and "
+                         "'matrix_gaussian', but is '{}'.".format(nms_mode))
+
+    if anchors is None:
+        # The anchor boxes and the variances are the last eight columns of `y_pred`.
+        anchors = y_pred[:, :, -8:]
+        y_pred = y_pred[:, :, :-8]
+    if dtype is not None:
+        y_pred = np.asarray(y_pred, dtype=dtype)
+        anchors = np.asarray(anchors, dtype=dtype)
+
+    # 1: Apply confidence thresholding for all images and classes except the background class (which has class ID 0)
+    # at once. Every `(image, box, class)` triple that made the threshold is one candidate for the NMS.
+    # The number of classes is the length of the last axis minus the four box coordinates
+    n_classes = y_pred.shape[-1] - 4
+    image_ids, box_ids, class_ids = np.nonzero(y_pred[:, :, 1:n_classes] > confidence_thresh)
+    class_ids += 1
+    scores = y_pred[image_ids, box_ids, class_ids]
+
+    # 2: Convert the box coordinates of the candidates from the predicted anchor box offsets to predicted absolute
+    # coordinates. Only these boxes are decoded, not all boxes of the batch.
+    # Copy the four offsets, resulting in a tensor of shape `[n_candidates, 4 coordinates]`
+    y_pred_decoded_raw = y_pred[image_ids, box_ids, -4:]
+    anchors = anchors[box_ids] if anchors.ndim == 2 else anchors[image_ids, box_ids]
 
     if input_coords == 'centroids':
-        # y_pred_decoded_raw[:, :, [-2, -1]] 的值为 ln(w(gt) / w(anchor)) / w_variance, ln(h(pred)/h(anchor)) / h_variance
-        # y_pred[:, :, [-2, -1]] 的值为 w_variance, h_variance
+        # y_pred_decoded_raw[:, [-2, -1]] 的值为 ln(w(gt) / w(anchor)) / w_variance, ln(h(pred)/h(anchor)) / h_variance
+        # anchors[..., [6, 7]] 的值为 w_variance, h_variance
         # exp(ln(w(pred)/w(anchor)) / w_variance * w_variance) == w(pred) / w(anchor),
         # exp(ln(h(pred)/h(anchor)) / h_variance * h_variance) == h(pred) / h(anchor)
-        y_pred_decoded_raw[:, :, [-2, -1]] = np.exp(y_pred_decoded_raw[:, :, [-2, -1]] * y_pred[:, :, [-2, -1]])
-        # y_pred[[:, :, [-6, -5]] 的值为 w(anchor) 和 h(anchor)
+        y_pred_decoded_raw[:, [-2, -1]] = np.exp(y_pred_decoded_raw[:, [-2, -1]] * anchors[..., [6, 7]])
+        # anchors[..., [2, 3]] 的值为 w(anchor) 和 h(anchor)
         # (w(pred) / w(anchor)) * w(anchor) == w(pred)
         # (h(pred) / h(anchor)) * h(anchor) == h(pred)
-        y_pred_decoded_raw[:, :, [-2, -1]] *= y_pred[:, :, [-6, -5]]
+        y_pred_decoded_raw[:, [-2, -1]] *= anchors[..., [2, 3]]
         # (delta_cx(pred) / w(anchor) / cx_variance) * cx_variance * w(anchor) == delta_cx(pred),
         # (delta_cy(pred) / h(anchor) / cy_variance) * cy_variance * h(anchor) == delta_cy(pred)
-        y_pred_decoded_raw[:, :, [-4, -3]] *= y_pred[:, :, [-4, -3]] * y_pred[:, :, [-6, -5]]
+        y_pred_decoded_raw[:, [-4, -3]] *= anchors[..., [4, 5]] * anchors[..., [2, 3]]
         # delta_cx(pred) + cx(anchor) == cx(pred)
         # delta_cy(pred) + cy(anchor) == cy(pred)
-        y_pred_decoded_raw[:, :, [-4, -3]] += y_pred[:, :, [-8, -7]]
+        y_pred_decoded_raw[:, [-4, -3]] += anchors[..., [0, 1]]
         y_pred_decoded_raw = convert_coordinates(y_pred_decoded_raw, start_index=-4, conversion='centroids2corners')
     elif input_coords == 'minmax':
         # delta(pred) / size(anchor) / variance * variance == delta(pred) / size(anchor) for all four coordinates,
         # where 'size' refers to w or h, respectively.
-        y_pred_decoded_raw[:, :, -4:] *= y_pred[:, :, -4:]
+        y_pred_decoded_raw[:, -4:] *= anchors[..., 4:]
         # delta_xmin(pred) / w(anchor) * w(anchor) == delta_xmin(pred)
         # delta_xmax(pred) / w(anchor) * w(anchor) == delta_xmax(pred)
-        y_pred_decoded_raw[:, :, [-4, -3]] *= np.expand_dims(y_pred[:, :, -7] - y_pred[:, :, -8], axis=-1)
+        y_pred_decoded_raw[:, [-4, -3]] *= np.expand_dims(anchors[..., 1] - anchors[..., 0], axis=-1)
         # delta_ymin(pred) / h(anchor) * h(anchor) == delta_ymin(pred),
         # delta_ymax(pred) / h(anchor) * h(anchor) == delta_ymax(pred)
-        y_pred_decoded_raw[:, :, [-2, -1]] *= np.expand_dims(y_pred[:, :, -5] - y_pred[:, :, -6], axis=-1)
+        y_pred_decoded_raw[:, [-2, -1]] *= np.expand_dims(anchors[..., 3] - anchors[..., 2], axis=-1)
         # delta(pred) + anchor == pred for all four coordinates
-        y_pred_decoded_raw[:, :, -4:] += y_pred[:, :, -8:-4]
+        y_pred_decoded_raw[:, -4:] += anchors[..., :4]
         y_pred_decoded_raw = convert_coordinates(y_pred_decoded_raw, start_index=-4, conversion='minmax2corners')
     elif input_coords == 'corners':
         # delta(pred) / size(anchor) / variance * variance == delta(pred) / size(anchor) for all four coordinates,
         # where 'size' refers to w or h, respectively
-        y_pred_decoded_raw[:, :, -4:] *= y_pred[:, :, -4:]
+        y_pred_decoded_raw[:, -4:] *= anchors[..., 4:]
         # delta_xmin(pred) / w(anchor) * w(anchor) == delta_xmin(pred)
         # delta_xmax(pred) / w(anchor) * w(anchor) == delta_xmax(pred)
-        y_pred_decoded_raw[:, :, [-4, -2]] *= np.expand_dims(y_pred[:, :, -6] - y_pred[:, :, -8], axis=-1)
+        y_pred_decoded_raw[:, [-4, -2]] *= np.expand_dims(anchors[..., 2] - anchors[..., 0], axis=-1)
         # delta_ymin(pred) / h(anchor) * h(anchor) == delta_ymin(pred)
         # delta_ymax(pred) / h(anchor) * h(anchor) == delta_ymax(pred)
-        y_pred_decoded_raw[:, :, [-3, -1]] *= np.expand_dims(y_pred[:, :, -5] - y_pred[:, :, -7], axis=-1)
+        y_pred_decoded_raw[:, [-3, -1]] *= np.expand_dims(anchors[..., 3] - anchors[..., 1], axis=-1)
         # delta(pred) + anchor == pred for all four coordinates
-        y_pred_decoded_raw[:, :, -4:] += y_pred[:, :, -8:-4]
+        y_pred_decoded_raw[:, -4:] += anchors[..., :4]
     else:
         raise ValueError("Unexpected value for `input_coords`. "
                          "Supported input coordinate formats are 'minmax', 'corners' and 'centroids'.")
 
-    # 2: If the model predicts normalized box coordinates and they are supposed to be converted back to absolute
+    # 3: If the model predicts normalized box coordinates and they are supposed to be converted back to absolute
     # coordinates, do that
     # normalize decode 之前已经转成了 corner coordinate
     if normalize_coords:
         # Convert xmin, xmax back to absolute coordinates
-        y_pred_decoded_raw[:, :, [-4, -2]] *= img_width
+        y_pred_decoded_raw[:, [-4, -2]] *= img_width
         # Convert ymin, ymax back to absolute coordinates
-        y_pred_decoded_raw[:, :, [-3, -1]] *= img_height
+        y_pred_decoded_raw[:, [-3, -1]] *= img_height
 
-    # 3: Apply confidence thresholding and non-maximum suppression per class
-    # The number of classes is the length of the last axis minus the four box coordinates
-    n_classes = y_pred_decoded_raw.shape[-1] - 4
+    # 4: Perform NMS on all candidates in one pass, separately for every class of every image.
+    groups = image_ids * n_classes + class_ids
+    if nms_mode == 'greedy':
+        maxima = _greedy_nms_indices(scores, y_pred_decoded_raw,
+                                     iou_threshold=iou_threshold,
+                                     coords='corners',
+                                     border_pixels=border_pixels,
+                                     groups=groups,
+                                     pre_nms_top_k=pre_nms_top_k)
+        maxima_scores = scores[maxima]
+    elif nms_mode.startswith('soft'):
+        maxima, maxima_scores = _soft_nms_indices(scores, y_pred_decoded_raw,
+                                                  score_threshold=confidence_thresh,
+                                                  iou_threshold=iou_threshold,
+                                                  method=nms_mode[len('soft_'):],
+                                                  sigma=nms_sigma,
+                                                  border_pixels=border_pixels,
+                                                  groups=groups,
+                                                  pre_nms_top_k=pre_nms_top_k)
+    else:
+        maxima, maxima_scores = _matrix_nms_indices(scores, y_pred_decoded_raw,
+                                                    score_threshold=confidence_thresh,
+                                                    method=nms_mode[len('matrix_'):],
+                                                    sigma=nms_sigma,
+                                                    border_pixels=border_pixels,
+                                                    groups=groups,
+                                                    pre_nms_top_k=pre_nms_top_k)
+    # The maxima are sorted by image, then by class and then by decreasing confidence.
+    # This is an array of shape `[n_maxima, 6]` in the format `[class_id, confidence, xmin, ymin, xmax, ymax]`
+    maxima_output = np.zeros((len(maxima), 6), dtype=y_pred_decoded_raw.dtype)
+    maxima_output[:, 0] = class_ids[maxima]
+    maxima_output[:, 1] = maxima_scores
+    maxima_output[:, 2:] = y_pred_decoded_raw[maxima]
+    image_starts = np.searchsorted(image_ids[maxima], np.arange(y_pred.shape[0] + 1))
 
     # Store the final predictions in this list
     # y_pred_decoded 的每一个元素表示一个 batch_item 上所有经过极大值抑制过滤后的所有类的 predictions, 最多不超过 top_k 个
     y_pred_decoded = []
-    # `batch_item` has shape `[n_boxes, n_classes + 4 coords]`
-    for batch_item in y_pred_decoded_raw:
-        # Store the final predictions for this batch item here
-        # pred 的每一个元素表示当前 batch_item 属于某个 class 的所有经过极大值抑制过滤后的 predictions
-        pred = []
-        # For each class except the background class (which has class ID 0)...
-        for class_id in range(1, n_classes):
-            # keep only the confidences for that class, making this an array of shape `[n_boxes, 5]` and...
-            single_class = batch_item[:, [class_id, -4, -3, -2, -1]]
-            # keep only those boxes with a confidence above the set threshold.
-            threshold_met = single_class[single_class[:, 0] > confidence_thresh]
-            # If any boxes made the threshold
-            if threshold_met.shape[0] > 0:
-                # perform NMS on them.
-                maxima = _greedy_nms(threshold_met,
-                                     iou_threshold=iou_threshold,
-                                     coords='corners',
-                                     border_pixels=border_pixels)
-                # Expand the last dimension by one element to have room for the class ID.
-                # This is now an array of shape `[n_boxes, 6]`
-                maxima_output = np.zeros((maxima.shape[0], maxima.shape[1] + 1))
-                # Write the class ID to the first column
-                maxima_output[:, 0] = class_id
-                # and write the maxima to the other columns
-                maxima_output[:, 1:] = maxima
-                # and append the maxima for this class to the list of maxima for this batch item
-                pred.append(maxima_output)
-        # Once we're through with all classes, keep only the `top_k` maxima with the highest scores
+    for i in range(y_pred.shape[0]):
+        # shape 为 (num_boxes, 6)
+        pred = maxima_output[image_starts[i]:image_starts[i + 1]]
+        # Keep only the `top_k` maxima with the highest scores
         # If there are any predictions left after confidence-thresholding
-        if pred:
-            # shape 为 (num_boxes, 6)
-            pred = np.concatenate(pred, axis=0)
+        if pred.shape[0] > 0:
             # If we have more than `top_k` results left at this point, otherwise there is nothing to filter
             if top_k != 'all' and pred.shape[0] > top_k:
                 # get the indices of the `top_k` highest-score maxima
@@ -328,7 +632,7 @@ def decode_detections(y_pred,
                 pred = pred[top_k_indices]
         else:
             # Even if empty, `pred` must become a Numpy array.
-            pred = np.array(pred)
+            pred = np.array([])
         # and now that we're done, append the array of final predictions for this batch item to the output list
         y_pred_decoded.append(pred)
 
@@ -343,7 +647,10 @@ def decode_detections_fast(y_pred,
                            normalize_coords=True,
                            img_height=None,
                            img_width=None,
-                           border_pixels='half'):
+                           border_pixels='half',
+                           dtype=None,
+                           anchors=None,
+                           pre_nms_top_k=None):
     """
     Convert model prediction output back to a format that contains only the positive box predictions (i.e. the same
     format that `enconde_y()` takes as input).
@@ -389,6 +696,15 @@ def decode_detections_fast(y_pred,
             to the boxes. If 'exclude', the border pixels do not belong to the boxes.
             If 'half', then one of each of the two horizontal and vertical borders belong
             to the boxex, but not the other.
+        dtype (optional): The floating point type in which to decode the predictions. If `None`, the dtype of `y_pred`
+            is used, i.e. the float32 output of the model is decoded in float32 without any conversion.
+        anchors (array, optional): `None` or a Numpy array of shape `(#boxes, 8)` with the 4 anchor box coordinates and
+            the 4 variances of every box, e.g. `SSDInputEncoder.anchors_template[:, -8:]`. If given, `y_pred` contains
+            only the class confidences and the 4 predicted coordinate offsets, i.e. it has the shape
+            `(batch_size, #boxes, #classes + 4)`, so the anchor boxes don't have to be part of every model output.
+        pre_nms_top_k (int, optional): `None` or the maximum number of boxes per image that go into the non-maximum
+            suppression stage. If more boxes make the confidence threshold, only the `pre_nms_top_k` highest scoring
+            ones are kept. This puts an upper bound on the time the non-maximum suppression takes.
 
     Returns:
         A python list of length `batch_size` where each list element represents the predicted boxes
@@ -398,29 +714,37 @@ def decode_detections_fast(y_pred,
     if normalize_coords and ((img_height is None) or (img_width is None)):
         raise ValueError("If relative box coordinates are supposed to be converted to absolute coordinates, the decoder needs the image size in order to decode the predictions, but `img_height == {}` and `img_width == {}`".format(img_height, img_width))
 
+    if anchors is None:
+        # The anchor boxes and the variances are the last eight columns of `y_pred`.
+        anchors = y_pred[:, :, -8:]
+        y_pred = y_pred[:, :, :-8]
+    if dtype is not None:
+        y_pred = np.asarray(y_pred, dtype=dtype)
+        anchors = np.asarray(anchors, dtype=dtype)
+
     # 1: Convert the classes from one-hot encoding to their class ID
-    y_pred_converted = np.copy(y_pred[:,:,-14:-8]) # Slice out the four offset predictions plus two elements whereto we'll write the class IDs and confidences in the next step
-    y_pred_converted[:,:,0] = np.argmax(y_pred[:,:,:-12], axis=-1) # The indices of the highest confidence values in the one-hot class vectors are the class ID
-    y_pred_converted[:,:,1] = np.amax(y_pred[:,:,:-12], axis=-1) # Store the confidence values themselves, too
+    y_pred_converted = np.copy(y_pred[:,:,-6:]) # Slice out the four offset predictions plus two elements whereto we'll write the class IDs and confidences in the next step
+    y_pred_converted[:,:,0] = np.argmax(y_pred[:,:,:-4], axis=-1) # The indices of the highest confidence values in the one-hot class vectors are the class ID
+    y_pred_converted[:,:,1] = np.amax(y_pred[:,:,:-4], axis=-1) # Store the confidence values themselves, too
 
     # 2: Convert the box coordinates from the predicted anchor box offsets to predicted absolute coordinates
     if input_coords == 'centroids':
-        y_pred_converted[:,:,[4,5]] = np.exp(y_pred_converted[:,:,[4,5]] * y_pred[:,:,[-2,-1]]) # exp(ln(w(pred)/w(anchor)) / w_variance * w_variance) == w(pred) / w(anchor), exp(ln(h(pred)/h(anchor)) / h_variance * h_variance) == h(pred) / h(anchor)
-        y_pred_converted[:,:,[4,5]] *= y_pred[:,:,[-6,-5]] # (w(pred) / w(anchor)) * w(anchor) == w(pred), (h(pred) / h(anchor)) * h(anchor) == h(pred)
-        y_pred_converted[:,:,[2,3]] *= y_pred[:,:,[-4,-3]] * y_pred[:,:,[-6,-5]] # (delta_cx(pred) / w(anchor) / cx_variance) * cx_variance * w(anchor) == delta_cx(pred), (delta_cy(pred) / h(anchor) / cy_variance) * cy_variance * h(anchor) == delta_cy(pred)
-        y_pred_converted[:,:,[2,3]] += y_pred[:,:,[-8,-7]] # delta_cx(pred) + cx(anchor) == cx(pred), delta_cy(pred) + cy(anchor) == cy(pred)
+        y_pred_converted[:,:,[4,5]] = np.exp(y_pred_converted[:,:,[4,5]] * anchors[...,[6,7]]) # exp(ln(w(pred)/w(anchor)) / w_variance * w_variance) == w(pred) / w(anchor), exp(ln(h(pred)/h(anchor)) / h_variance * h_variance) == h(pred) / h(anchor)
+        y_pred_converted[:,:,[4,5]] *= anchors[...,[2,3]] # (w(pred) / w(anchor)) * w(anchor) == w(pred), (h(pred) / h(anchor)) * h(anchor) == h(pred)
+        y_pred_converted[:,:,[2,3]] *= anchors[...,[4,5]] * anchors[...,[2,3]] # (delta_cx(pred) / w(anchor) / cx_variance) * cx_variance * w(anchor) == delta_cx(pred), (delta_cy(pred) / h(anchor) / cy_variance) * cy_variance * h(anchor) == delta_cy(pred)
+        y_pred_converted[:,:,[2,3]] += anchors[...,[0,1]] # delta_cx(pred) + cx(anchor) == cx(pred), delta_cy(pred) + cy(anchor) == cy(pred)
         y_pred_converted = convert_coordinates(y_pred_converted, start_index=-4, conversion='centroids2corners')
     elif input_coords == 'minmax':
-        y_pred_converted[:,:,2:] *= y_pred[:,:,-4:] # delta(pred) / size(anchor) / variance * variance == delta(pred) / size(anchor) for all four coordinates, where 'size' refers to w or h, respectively
-        y_pred_converted[:,:,[2,3]] *= np.expand_dims(y_pred[:,:,-7] - y_pred[:,:,-8], axis=-1) # delta_xmin(pred) / w(anchor) * w(anchor) == delta_xmin(pred), delta_xmax(pred) / w(anchor) * w(anchor) == delta_xmax(pred)
-        y_pred_converted[:,:,[4,5]] *= np.expand_dims(y_pred[:,:,-5] - y_pred[:,:,-6], axis=-1) # delta_ymin(pred) / h(anchor) * h(anchor) == delta_ymin(pred), delta_ymax(pred) / h(anchor) * h(anchor) == delta_ymax(pred)
-        y_pred_converted[:,:,2:] += y_pred[:,:,-8:-4] # delta(pred) + anchor == pred for all four coordinates
+        y_pred_converted[:,:,2:] *= anchors[...,4:] # delta(pred) / size(anchor) / variance * variance == delta(pred) / size(anchor) for all four coordinates, where 'size' refers to w or h, respectively
+        y_pred_converted[:,:,[2,3]] *= np.expand_dims(anchors[...,1] - anchors[...,0], axis=-1) # delta_xmin(pred) / w(anchor) * w(anchor) == delta_xmin(pred), delta_xmax(pred) / w(anchor) * w(anchor) == delta_xmax(pred)
+        y_pred_converted[:,:,[4,5]] *= np.expand_dims(anchors[...,3] - anchors[...,2], axis=-1) # delta_ymin(pred) / h(anchor) * h(anchor) == delta_ymin(pred), delta_ymax(pred) / h(anchor) * h(anchor) == delta_ymax(pred)
+        y_pred_converted[:,:,2:] += anchors[...,:4] # delta(pred) + anchor == pred for all four coordinates
         y_pred_converted = convert_coordinates(y_pred_converted, start_index=-4, conversion='minmax2corners')
     elif input_coords == 'corners':
-        y_pred_converted[:,:,2:] *= y_pred[:,:,-4:] # delta(pred) / size(anchor) / variance * variance == delta(pred) / size(anchor) for all four coordinates, where 'size' refers to w or h, respectively
-        y_pred_converted[:,:,[2,4]] *= np.expand_dims(y_pred[:,:,-6] - y_pred[:,:,-8], axis=-1) # delta_xmin(pred) / w(anchor) * w(anchor) == delta_xmin(pred), delta_xmax(pred) / w(anchor) * w(anchor) == delta_xmax(pred)
-        y_pred_converted[:,:,[3,5]] *= np.expand_dims(y_pred[:,:,-5] - y_pred[:,:,-7], axis=-1) # delta_ymin(pred) / h(anchor) * h(anchor) == delta_ymin(pred), delta_ymax(pred) / h(anchor) * h(anchor) == delta_ymax(pred)
-        y_pred_converted[:,:,2:] += y_pred[:,:,-8:-4] # delta(pred) + anchor == pred for all four coordinates
+        y_pred_converted[:,:,2:] *= anchors[...,4:] # delta(pred) / size(anchor) / variance * variance == delta(pred) / size(anchor) for all four coordinates, where 'size' refers to w or h, respectively
+        y_pred_converted[:,:,[2,4]] *= np.expand_dims(anchors[...,2] - anchors[...,0], axis=-1) # delta_xmin(pred) / w(anchor) * w(anchor) == delta_xmin(pred), delta_xmax(pred) / w(anchor) * w(anchor) == delta_xmax(pred)
+        y_pred_converted[:,:,[3,5]] *= np.expand_dims(anchors[...,3] - anchors[...,1], axis=-1) # delta_ymin(pred) / h(anchor) * h(anchor) == delta_ymin(pred), delta_ymax(pred) / h(anchor) * h(anchor) == delta_ymax(pred)
+        y_pred_converted[:,:,2:] += anchors[...,:4] # delta(pred) + anchor == pred for all four coordinates
     else:
         raise ValueError("Unexpected value for `coords`. Supported values are 'minmax', 'corners' and 'centroids'.")
 
@@ -435,7 +759,7 @@ def decode_detections_fast(y_pred,
         boxes = batch_item[np.nonzero(batch_item[:,0])] # ...get all boxes that don't belong to the background class,...
         boxes = boxes[boxes[:,1] >= confidence_thresh] # ...then filter out those positive boxes for which the prediction confidence is too low and after that...
         if iou_threshold: # ...if an IoU threshold is set...
-            boxes = _greedy_nms2(boxes, iou_threshold=iou_threshold, coords='corners', border_pixels=border_pixels) # ...perform NMS on the remaining boxes.
+            boxes = _greedy_nms2(boxes, iou_threshold=iou_threshold, coords='corners', border_pixels=border_pixels, pre_nms_top_k=pre_nms_top_k) # ...perform NMS on the remaining boxes.
         if top_k != 'all' and boxes.shape[0] > top_k: # If we have more than `top_k` results left at this point...
             top_k_indices = np.argpartition(boxes[:,1], kth=boxes.shape[0]-top_k, axis=0)[boxes.shape[0]-top_k:] # ...get the indices of the `top_k` highest-scoring boxes...
             boxes = boxes[top_k_indices] # ...and keep only those boxes...
@@ -585,17 +909,12 @@ def _greedy_nms_debug(predictions, iou_threshold=0.45, coords='corners', border_
     left-over boxes for each batch item, which allows you to know which predictor layer predicted a given output
     box and is thus useful for debugging.
     """
-    boxes_left = np.copy(predictions)
-    maxima = [] # This is where we store the boxes that make it through the non-maximum suppression
-    while boxes_left.shape[0] > 0: # While there are still boxes left to compare...
-        maximum_index = np.argmax(boxes_left[:,1]) # ...get the index of the next box with the highest confidence...
-        maximum_box = np.copy(boxes_left[maximum_index]) # ...copy that box and...
-        maxima.append(maximum_box) # ...append it to `maxima` because we'll definitely keep it
-        boxes_left = np.delete(boxes_left, maximum_index, axis=0) # Now remove the maximum box from `boxes_left`
-        if boxes_left.shape[0] == 0: break # If there are no boxes left after this step, break. Otherwise...
-        similarities = iou(boxes_left[:,2:], maximum_box[2:], coords=coords, mode='element-wise', border_pixels=border_pixels) # ...compare (IoU) the other left over boxes to the maximum box...
-        boxes_left = boxes_left[similarities <= iou_threshold] # ...so that we can remove the ones that overlap too much with the maximum box
-    return np.array(maxima)
+    if len(predictions) == 0:
+        return np.array([])
+    return predictions[_greedy_nms_indices(predictions[:, 1], predictions[:, 2:6],
+                                           iou_threshold=iou_threshold,
+                                           coords=coords,
+                                           border_pixels=border_pixels)]
 
 
 def get_num_boxes_per_pred_layer(predictor_sizes, aspect_ratios, two_boxes_for_ar1):
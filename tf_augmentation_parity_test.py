@@ -0,0 +1,149 @@
+"""
+Checks that the TensorFlow augmentation operations of `object_detection_2d_tf_augmentation_ops` produce the same images
+and boxes as the equivalent Numpy transformations on a fixed Numpy seed.
+
+Every check seeds `np.random`, transforms a batch of random images of different sizes with the Numpy transformations
+one image at a time, seeds `np.random` again and transforms the same batch with a `TFAugmentationPipeline`, which pads
+the batch and runs the TensorFlow operations on it. Images and boxes must be equal. The only tolerated difference is
+one intensity level in the HSV to RGB conversion, and only in the trailing pixels of every image row that OpenCV
+converts with scalar code instead of its vectorized code (see `TFConvertColor`).
+
+The TensorFlow operations use the TensorFlow 1.x graph API (`tf.placeholder`, `tf.Session`), so this script runs on
+TensorFlow 1.x as is. On TensorFlow 2.x it runs them through `tf.compat.v1` with the v2 behavior disabled. It only
+needs a CPU.
+"""
+
+from __future__ import division
+import sys
+import numpy as np
+import cv2
+import tensorflow as tf
+
+if not tf.__version__.startswith('1.'):
+    # TensorFlow 2.x: let the TensorFlow 1.x code of the operations run through `tf.compat.v1`.
+    tf.compat.v1.disable_v2_behavior()
+    sys.modules['tensorflow'] = tf.compat.v1
+    print("Running on TensorFlow {} through tf.compat.v1.".format(tf.__version__))
+else:
+    print("Running on TensorFlow {}.".format(tf.__version__))
+
+from data_generator.object_detection_2d_tf_augmentation_ops import TFAugmentationPipeline, TFFlip, TFRandomFlip, \
+    TFResize, TFBrightness, TFRandomBrightness, TFContrast, TFRandomContrast, TFSaturation, TFRandomSaturation, TFHue, \
+    TFRandomHue, TFConvertColor, TFCropPad, TFRandomPatch
+from data_generator.object_detection_2d_geometric_ops import Flip, RandomFlip, Resize
+from data_generator.object_detection_2d_photometric_ops import ConvertColor, Brightness, RandomBrightness, Contrast, \
+    RandomContrast, Saturation, RandomSaturation, Hue, RandomHue
+from data_generator.object_detection_2d_patch_sampling_ops import CropPad, RandomPatch, PatchCoordinateGenerator
+from data_generator.object_detection_2d_image_boxes_validation_utils import BoxFilter, ImageValidator
+
+# The number of pixels that OpenCV's vectorized HSV to RGB conversion converts at once. Only the last
+# `width % hsv_vector_width` pixels of every row may differ by one intensity level.
+hsv_vector_width = 32
+
+rng = np.random.RandomState(1)
+
+
+def random_batch(batch_size, img_height=None, img_width=None):
+    images = []
+    labels = []
+    for _ in range(batch_size):
+        height = img_height or rng.randint(100, 400)
+        width = img_width or rng.randint(100, 400)
+        images.append(rng.randint(0, 256, (height, width, 3)).astype(np.uint8))
+        n_boxes = rng.randint(0, 6)
+        xmin = rng.randint(0, width - 10, n_boxes)
+        ymin = rng.randint(0, height - 10, n_boxes)
+        xmax = xmin + rng.randint(1, 120, n_boxes)
+        ymax = ymin + rng.randint(1, 120, n_boxes)
+        labels.append(np.stack([rng.randint(1, 5, n_boxes), xmin, ymin, xmax, ymax], axis=1).reshape(-1, 5))
+    return images, labels
+
+
+def check(name, transformations, tf_transformations, batch_size=8, img_height=None, img_width=None,
+          hsv_to_rgb_tail=False, seed=3):
+    images, labels = random_batch(batch_size, img_height, img_width)
+
+    np.random.seed(seed)
+    expected_images = []
+    expected_labels = []
+    for image, image_labels in zip(images, labels):
+        image = np.copy(image)
+        image_labels = np.copy(image_labels)
+        for transform in transformations:
+            image, image_labels = transform(image, image_labels)
+        expected_images.append(image)
+        expected_labels.append(image_labels)
+
+    np.random.seed(seed)
+    pipeline = TFAugmentationPipeline(tf_transformations)
+    tf_images, tf_labels = pipeline(images, labels)
+    pipeline.close()
+
+    max_difference = 0
+    for image, tf_image, image_labels, tf_image_labels in zip(expected_images, tf_images, expected_labels, tf_labels):
+        assert image.shape == tf_image.shape, (name, image.shape, tf_image.shape)
+        assert image_labels.dtype == tf_image_labels.dtype, (name, image_labels.dtype, tf_image_labels.dtype)
+        assert image_labels.shape == tf_image_labels.shape and np.array_equal(image_labels, tf_image_labels), name
+        difference = np.max(np.abs(image.astype(np.int) - tf_image), axis=2)
+        if hsv_to_rgb_tail:
+            width = image.shape[1]
+            assert np.all(difference[:, :width - width % hsv_vector_width] == 0), name
+            assert np.all(difference <= 1), name
+        else:
+            assert np.all(difference == 0), name
+        max_difference = max(max_difference, np.max(difference))
+    print("{:<34} boxes equal, max. pixel difference {}".format(name, max_difference))
+
+
+box_filter = BoxFilter(check_overlap=True, overlap_criterion='center_point', min_area=16)
+
+check('Flip', [Flip()], [TFFlip()])
+check('Flip vertical', [Flip('vertical')], [TFFlip('vertical')])
+check('RandomFlip', [RandomFlip()], [TFRandomFlip()])
+check('Resize bilinear', [Resize(300, 300, box_filter=box_filter)], [TFResize(300, 300, box_filter=box_filter)])
+check('Resize nearest', [Resize(300, 300, cv2.INTER_NEAREST)], [TFResize(300, 300, cv2.INTER_NEAREST)])
+check('Resize downscale', [Resize(120, 160)], [TFResize(120, 160)], img_height=240, img_width=320)
+check('Brightness', [Brightness(37.3)], [TFBrightness(37.3)])
+check('RandomBrightness', [RandomBrightness()], [TFRandomBrightness()])
+check('Contrast', [Contrast(1.3)], [TFContrast(1.3)])
+check('RandomContrast', [RandomContrast()], [TFRandomContrast()])
+check('ConvertColor RGB to HSV', [ConvertColor('RGB', 'HSV')], [TFConvertColor('RGB', 'HSV')])
+check('ConvertColor RGB to HSV to RGB',
+      [ConvertColor('RGB', 'HSV'), ConvertColor('HSV', 'RGB')],
+      [TFConvertColor('RGB', 'HSV'), TFConvertColor('HSV', 'RGB')],
+      hsv_to_rgb_tail=True)
+check('Saturation, Hue',
+      [ConvertColor('RGB', 'HSV'), Saturation(1.4), Hue(12), ConvertColor('HSV', 'RGB')],
+      [TFConvertColor('RGB', 'HSV'), TFSaturation(1.4), TFHue(12), TFConvertColor('HSV', 'RGB')],
+      hsv_to_rgb_tail=True)
+check('RandomSaturation, RandomHue',
+      [ConvertColor('RGB', 'HSV'), RandomSaturation(), RandomHue(), ConvertColor('HSV', 'RGB')],
+      [TFConvertColor('RGB', 'HSV'), TFRandomSaturation(), TFRandomHue(), TFConvertColor('HSV', 'RGB')],
+      batch_size=16,
+      hsv_to_rgb_tail=True)
+check('CropPad', [CropPad(-20, 30, 200, 250, box_filter=box_filter)],
+      [TFCropPad(-20, 30, 200, 250, box_filter=box_filter)])
+for overlap_criterion in ('center_point', 'area', 'iou'):
+    patch_coord_generator = PatchCoordinateGenerator(must_match='h_w', min_scale=0.3, max_scale=1.6)
+    patch_box_filter = BoxFilter(overlap_criterion=overlap_criterion, overlap_bounds=(0.3, 1.0), min_area=16)
+    check('RandomPatch ' + overlap_criterion,
+          [RandomPatch(patch_coord_generator, box_filter=patch_box_filter, prob=0.7)],
+          [TFRandomPatch(patch_coord_generator, box_filter=patch_box_filter, prob=0.7)],
+          batch_size=12)
+    # With more than one trial, `TFRandomPatch` draws all candidates up front, so the random stream differs.
+    image_validator = ImageValidator(overlap_criterion=overlap_criterion, overlap_bounds=(0.3, 1.0), n_boxes_min=1)
+    check('RandomPatch ' + overlap_criterion + ' validated',
+          [RandomPatch(patch_coord_generator, box_filter=patch_box_filter, image_validator=image_validator,
+                       n_trials_max=1)],
+          [TFRandomPatch(patch_coord_generator, box_filter=patch_box_filter, image_validator=image_validator,
+                         n_trials_max=1)],
+          batch_size=12)
+check('Chain',
+      [RandomBrightness(), RandomContrast(),
+       RandomPatch(PatchCoordinateGenerator(min_scale=0.5, max_scale=1.5), box_filter=box_filter),
+       RandomFlip(), Resize(300, 300, box_filter=box_filter)],
+      [TFRandomBrightness(), TFRandomContrast(),
+       TFRandomPatch(PatchCoordinateGenerator(min_scale=0.5, max_scale=1.5), box_filter=box_filter),
+       TFRandomFlip(), TFResize(300, 300, box_filter=box_filter)],
+      batch_size=16)
+print("The TensorFlow operations match the Numpy transformations.")